@@ -2,15 +2,25 @@
 # This profile script is part of immutablue
 # - https://gitlab.com/immutablue/immutablue
 
+# Resolve every setting this profile needs with a single lookup
+_ulimit_nofile=""
+_enable_sourcing_fzf_git=""
+_enable_brew_bash_completions=""
+_enable_starship=""
+eval "$(immutablue-settings --shell \
+    _ulimit_nofile=.immutablue.profile.ulimit_nofile \
+    _enable_sourcing_fzf_git=.immutablue.profile.enable_sourcing_fzf_git \
+    _enable_brew_bash_completions=.immutablue.profile.enable_brew_bash_completions \
+    _enable_starship=.immutablue.profile.enable_starship \
+    2>/dev/null)"
+
 # Set ulimits
 if [[ "$(whoami)" != "root" ]]
 then
-    _ulimit_nofile="$(immutablue-settings .immutablue.profile.ulimit_nofile 2>/dev/null)"
     if [[ -z "${_ulimit_nofile}" ]] || [[ "${_ulimit_nofile}" == "null" ]]; then
         _ulimit_nofile=524288
     fi
     ulimit -n "${_ulimit_nofile}"
-    unset _ulimit_nofile
 fi
 
 
@@ -18,12 +28,12 @@ fi
 if [[ "${BASH_VERSION-}" != "" ]]
 then
 
-    if [[ -f /usr/bin/fzf-git ]] && [[ "$(immutablue-settings .immutablue.profile.enable_sourcing_fzf_git)" == "true" ]]
+    if [[ -f /usr/bin/fzf-git ]] && [[ "${_enable_sourcing_fzf_git}" == "true" ]]
     then 
         source /usr/bin/fzf-git
     fi
     
-    if [[ -d /home/linuxbrew/.linuxbrew/etc/bash_completion.d/ ]] && [[ "$(immutablue-settings .immutablue.profile.enable_brew_bash_completions)" == "true" ]]
+    if [[ -d /home/linuxbrew/.linuxbrew/etc/bash_completion.d/ ]] && [[ "${_enable_brew_bash_completions}" == "true" ]]
     then
         for f in /home/linuxbrew/.linuxbrew/etc/bash_completion.d/*
         do
@@ -47,7 +57,7 @@ then
     type starship &>/dev/null
     if [[ $? -eq 0 ]]
     then
-        if [[ "$(immutablue-settings .immutablue.profile.enable_starship)" == "true" ]]
+        if [[ "${_enable_starship}" == "true" ]]
         then
             eval "$(starship init bash)"
         fi
@@ -58,3 +68,5 @@ then
     export IMMUTABLUE_BASH_COMPLETION
 fi
 
+unset _ulimit_nofile _enable_sourcing_fzf_git _enable_brew_bash_completions _enable_starship
+
@@ -8,12 +8,13 @@
 #
 # This is the central utility script that provides common functionality
 # for all Immutablue scripts. It includes functions to:
-# - Query information about the current Immutablue image
+# - Query information about the current Immutablue image (resolved once and
+#   cached per process and per boot, see immutablue_identity_load)
 # - Check if certain build options were enabled
 # - Check for internet connectivity
 # - Interact with system services
 # - Find appropriate terminal commands
-# - Retry operations that might fail due to timing issues
+# - Retry operations that might fail due to timing issues (with backoff)
 
 # C style defs for boolean returns
 # Using these constants makes the code more readable and consistent
@@ -21,36 +22,138 @@ TRUE=1
 FALSE=0
 
 
-# Extract the full image name from the current deployment
-# Format example: quay.io/immutablue/immutablue:41-lts
-# returns: immutablue:41-lts
-immutablue_get_image_full() {
+# Where the image identity is cached for the rest of the boot. /run is a tmpfs,
+# so the cache never outlives the boot it describes. Users who cannot write
+# /run/immutablue keep their own copy in their runtime directory.
+IMMUTABLUE_IDENTITY_FILE="/run/immutablue/identity"
+IMMUTABLUE_USER_IDENTITY_FILE="${XDG_RUNTIME_DIR:-/run/user/${UID}}/immutablue/identity"
+
+# The build options of the running image, written by build/10-copy.sh
+IMMUTABLUE_BUILD_OPTIONS_FILE="/usr/immutablue/build_options"
+
+# Package index shipped with the image (see build/90-post.sh) and the ones
+# rebuilt at runtime when packages are layered on top of the image
+IMMUTABLUE_PACKAGE_INDEX="/usr/immutablue/packages.index"
+IMMUTABLUE_RUNTIME_PACKAGE_INDEX="/run/immutablue/packages.index"
+IMMUTABLUE_USER_PACKAGE_INDEX="${XDG_RUNTIME_DIR:-/run/user/${UID}}/immutablue/packages.index"
+IMMUTABLUE_RPMDB="/usr/lib/sysimage/rpm/rpmdb.sqlite"
+# The rpmdb fingerprint computed this boot (see _immutablue_rpmdb_stamp)
+IMMUTABLUE_RPMDB_STAMP="/run/immutablue/rpmdb.stamp"
+IMMUTABLUE_USER_RPMDB_STAMP="${XDG_RUNTIME_DIR:-/run/user/${UID}}/immutablue/rpmdb.stamp"
+
+# Last immutablue_has_internet verdict ("<epoch seconds> <TRUE|FALSE>")
+IMMUTABLUE_INTERNET_CACHE="/run/immutablue/internet"
+IMMUTABLUE_USER_INTERNET_CACHE="${XDG_RUNTIME_DIR:-/run/user/${UID}}/immutablue/internet"
+
+
+# Check whether a cached identity file is still valid
+# Staging or finalizing a deployment touches one of these paths, so an identity
+# written before that may describe the wrong image
+# Arg 1 is the identity file
+_immutablue_identity_is_current() {
+    local file="$1"
+    local stamp
+
+    [[ -r "${file}" ]] || return 1
+    for stamp in /run/ostree/staged-deployment /ostree/deploy/*/deploy
+    do
+        [[ "${stamp}" -nt "${file}" ]] && return 1
+    done
+    return 0
+}
+
+# Read a cached identity file into this process
+# Arg 1 is the identity file
+_immutablue_identity_read() {
+    local file="$1"
+    local key
+    local value
+
+    _immutablue_identity_is_current "${file}" || return 1
+    while IFS='=' read -r key value
+    do
+        [[ "${key}" == "image_full" ]] && _IMMUTABLUE_IMAGE_FULL="${value}"
+    done < "${file}"
+    return 0
+}
+
+# Write the identity of this boot for later processes (best effort)
+_immutablue_identity_write() {
+    local file="${IMMUTABLUE_USER_IDENTITY_FILE}"
+    [[ ${EUID} -eq 0 ]] && file="${IMMUTABLUE_IDENTITY_FILE}"
+
+    mkdir -p "$(dirname "${file}")" 2>/dev/null || return 0
+    # Write and rename so a concurrent reader never sees half a file
+    printf 'image_full=%s\n' "${_IMMUTABLUE_IMAGE_FULL}" > "${file}.$$" 2>/dev/null \
+        && mv -f "${file}.$$" "${file}" 2>/dev/null
+    return 0
+}
+
+# Resolve the image identity (full name, base, tag and version) once
+# The first call runs `rpm-ostree status` and caches the result in
+# /run/immutablue/identity for the rest of the boot, later calls in the same
+# process return immediately. Scripts that call the immutablue_get_image_*
+# helpers from $(...) should call this first, so every subshell inherits the
+# already resolved identity instead of reading the cache again.
+# Arg 1 is optional `rpm-ostree status` output the caller already has, it is
+# used instead of the cache or another rpm-ostree call
+immutablue_identity_load() {
+    local status="${1:-}"
+    [[ -n "${_IMMUTABLUE_IDENTITY_LOADED:-}" ]] && return 0
+
+    _IMMUTABLUE_IMAGE_FULL=""
     # Check if we're running during the build process or on an installed system
     # If IMMUTABLUE_BUILD is set, we're in the build process (see Containerfile)
-    if [[ -z "${IMMUTABLUE_BUILD}" ]]
-    then 
-        # We're on an installed system, extract the image from rpm-ostree status
-        rpm-ostree status | grep -i quay | head -n 1 | awk -F/ '{ printf "%s\n", $3 }'
-    else
+    if [[ -n "${IMMUTABLUE_BUILD:-}" ]]
+    then
         # We're in the build process, use the IMAGE_TAG environment variable
-        echo "${IMAGE_TAG}"
+        _IMMUTABLUE_IMAGE_FULL="${IMAGE_TAG:-}"
+    elif [[ -n "${status}" ]] || \
+         { ! _immutablue_identity_read "${IMMUTABLUE_IDENTITY_FILE}" && \
+           ! _immutablue_identity_read "${IMMUTABLUE_USER_IDENTITY_FILE}"; }
+    then
+        # We're on an installed system, extract the image from rpm-ostree status
+        [[ -n "${status}" ]] || status="$(rpm-ostree status)" || true
+        _IMMUTABLUE_IMAGE_FULL="$(grep -i quay <<< "${status}" | head -n 1 | awk -F/ '{ printf "%s\n", $3 }')" || true
+        # Do not pin a failed lookup for the rest of the boot
+        [[ -n "${_IMMUTABLUE_IMAGE_FULL}" ]] && _immutablue_identity_write
     fi
+
+    # Split name:tag and take the version from the tag (e.g., "43" from "43-lts")
+    # the same way the awk/cut pipelines used to
+    _IMMUTABLUE_IMAGE_BASE="${_IMMUTABLUE_IMAGE_FULL%%:*}"
+    _IMMUTABLUE_IMAGE_TAG=""
+    if [[ "${_IMMUTABLUE_IMAGE_FULL}" == *:* ]]
+    then
+        _IMMUTABLUE_IMAGE_TAG="${_IMMUTABLUE_IMAGE_FULL#*:}"
+        _IMMUTABLUE_IMAGE_TAG="${_IMMUTABLUE_IMAGE_TAG%%:*}"
+    fi
+    _IMMUTABLUE_IMAGE_VERSION="${_IMMUTABLUE_IMAGE_TAG%%-*}"
+    _IMMUTABLUE_IDENTITY_LOADED=1
+}
+
+# Extract the full image name from the current deployment
+# Format example: quay.io/immutablue/immutablue:41-lts
+# returns: immutablue:41-lts
+immutablue_get_image_full() {
+    immutablue_identity_load
+    echo "${_IMMUTABLUE_IMAGE_FULL}"
 }
 
 # Extract just the tag portion of the image
 # Format example: quay.io/immutablue/immutablue:41-lts
 # returns: 41-lts
 immutablue_get_image_tag() {
-    # Use awk to split the output of immutablue_get_image_full on the colon and take the second part
-    immutablue_get_image_full | awk -F: '{printf "%s\n", $2 }'
+    immutablue_identity_load
+    echo "${_IMMUTABLUE_IMAGE_TAG}"
 }
 
 # Extract just the base image name (without tag)
 # Format example: quay.io/immutablue/immutablue:41-lts
 # returns: immutablue
 immutablue_get_image_base() {
-    # Use awk to split the output of immutablue_get_image_full on the colon and take the first part
-    immutablue_get_image_full | awk -F: '{printf "%s\n", $1 }'
+    immutablue_identity_load
+    echo "${_IMMUTABLUE_IMAGE_BASE}"
 }
 
 # Extract just the Fedora version number from the image tag
@@ -58,20 +161,33 @@ immutablue_get_image_base() {
 # Format example: quay.io/immutablue/immutablue:43-lts
 # returns: 43
 immutablue_get_image_version() {
-    # Get the tag (e.g., "43-lts" or "43") and extract the version number
-    # The version is always the first segment before any hyphen
-    immutablue_get_image_tag | cut -d'-' -f1
+    immutablue_identity_load
+    echo "${_IMMUTABLUE_IMAGE_VERSION}"
 }
 
 
+# Read the build options file once per process
+# The header calls this when it is sourced, so every helper below (and every
+# subshell they run in) works from the same in-memory list
+_immutablue_build_options_load() {
+    [[ -n "${_IMMUTABLUE_BUILD_OPTIONS_LOADED:-}" ]] && return 0
+    _IMMUTABLUE_BUILD_OPTIONS=()
+    if [[ -r "${IMMUTABLUE_BUILD_OPTIONS_FILE}" ]]
+    then
+        # Read the build options from the file, splitting on commas
+        IFS=',' read -ra _IMMUTABLUE_BUILD_OPTIONS < "${IMMUTABLUE_BUILD_OPTIONS_FILE}"
+    fi
+    _IMMUTABLUE_BUILD_OPTIONS_LOADED=1
+}
+
 # Parse and output all build options from the build_options file
 # This provides a list of all the options that were enabled during the build
 # Used to determine what features are available in the current image
 get_immutablue_build_options() {
-    # Read the build options from the file, splitting on commas
-    IFS=',' read -ra entry_array < "/usr/immutablue/build_options"
+    local entry
+    _immutablue_build_options_load
     # Output each option on a separate line
-    for entry in "${entry_array[@]}"
+    for entry in "${_IMMUTABLUE_BUILD_OPTIONS[@]}"
     do
         echo -e "${entry}"
     done 
@@ -82,10 +198,10 @@ get_immutablue_build_options() {
 # returns: TRUE if the option was enabled, FALSE otherwise
 immutablue_is_option_in_build_options() {
     local option="$1"
-    # Read the build options from the file, splitting on commas
-    IFS=',' read -ra entry_array < "/usr/immutablue/build_options"
+    local entry
+    _immutablue_build_options_load
     # Check each option to see if it matches the requested option
-    for entry in "${entry_array[@]}"
+    for entry in "${_IMMUTABLUE_BUILD_OPTIONS[@]}"
     do
         if [[ "${option}" == "${entry}" ]]
         then 
@@ -98,6 +214,9 @@ immutablue_is_option_in_build_options() {
     echo "${FALSE}"
 }
 
+# Load the build options into the sourcing shell so subshells inherit them
+_immutablue_build_options_load
+
 immutablue_build_is_gui() {
     immutablue_is_option_in_build_options gui
 }
@@ -147,13 +266,95 @@ immutablue_build_is_asahi() {
 }
 
 
+# Write a package index: the rpmdb fingerprint on the first line, then the
+# `rpm -qa` output (one name-version-release.arch per line, sorted)
+# build/90-post.sh ships one with the image, so the has_package helpers do
+# not have to walk the rpmdb on every call
+# Arg 1 is the index file to write
+immutablue_package_index_write() {
+    local file="$1"
+    local stamp
+
+    stamp="$(_immutablue_rpmdb_stamp)"
+    [[ -n "${stamp}" ]] || return 1
+    mkdir -p "$(dirname "${file}")" 2>/dev/null || return 1
+    # Write and rename so a concurrent reader never sees half a file
+    { echo "# rpmdb ${stamp}"; rpm -qa | sort; } > "${file}.$$" 2>/dev/null \
+        && mv -f "${file}.$$" "${file}" 2>/dev/null
+}
+
+# Fingerprint of the rpmdb an index was built from: the sha256 of the
+# database. Its size is no fingerprint, SQLite grows in pages and rarely
+# shrinks, and ostree resets file times on deployment.
+# The hash is kept in /run for the rest of the boot, keyed by the device,
+# inode, size and time of the database. A new deployment or an apply-live
+# checkout replaces the file, so a changed package set is always hashed anew.
+_immutablue_rpmdb_stamp() {
+    local cache="${IMMUTABLUE_USER_RPMDB_STAMP}"
+    local key
+    local line
+    local stamp
+
+    key="$(stat -L -c '%d:%i:%s:%Y' "${IMMUTABLUE_RPMDB}" 2>/dev/null)" || return 1
+    [[ ${EUID} -eq 0 ]] && cache="${IMMUTABLUE_RPMDB_STAMP}"
+    if [[ -r "${cache}" ]] && IFS= read -r line < "${cache}" && [[ "${line%% *}" == "${key}" ]]
+    then
+        echo "${line#* }"
+        return 0
+    fi
+
+    stamp="$(sha256sum "${IMMUTABLUE_RPMDB}" 2>/dev/null)" || return 1
+    stamp="${stamp%% *}"
+    # Best effort, an unwritable cache only means hashing again next time
+    mkdir -p "$(dirname "${cache}")" 2>/dev/null \
+        && echo "${key} ${stamp}" > "${cache}.$$" 2>/dev/null \
+        && mv -f "${cache}.$$" "${cache}" 2>/dev/null
+    echo "${stamp}"
+}
+
+# Print the path of a package index that matches the current rpmdb
+# The index shipped with the image is used until the deployment's package set
+# changes (e.g. `rpm-ostree install`), then one is rebuilt in /run once per boot
+_immutablue_package_index() {
+    local stamp
+    local file
+    local line
+    local runtime="${IMMUTABLUE_USER_PACKAGE_INDEX}"
+
+    stamp="$(_immutablue_rpmdb_stamp)"
+    [[ -n "${stamp}" ]] || return 1
+    for file in "${IMMUTABLUE_PACKAGE_INDEX}" "${IMMUTABLUE_RUNTIME_PACKAGE_INDEX}" "${IMMUTABLUE_USER_PACKAGE_INDEX}"
+    do
+        [[ -r "${file}" ]] || continue
+        IFS= read -r line < "${file}" || continue
+        if [[ "${line}" == "# rpmdb ${stamp}" ]]
+        then
+            echo "${file}"
+            return 0
+        fi
+    done
+
+    [[ ${EUID} -eq 0 ]] && runtime="${IMMUTABLUE_RUNTIME_PACKAGE_INDEX}"
+    immutablue_package_index_write "${runtime}" || return 1
+    echo "${runtime}"
+}
+
 # takes two args:
 # arg1: regex of package 
 # arg2: exclude package regex (if not needed pass "null")
 immutablue_build_has_package() {
     local pkg_search="$1"
     local pkg_exclude="$2"
-    pkg=$(rpm -qa | grep -P "${pkg_search}" | grep -vP "${pkg_exclude}")
+    local index
+    local pkg
+
+    if index="$(_immutablue_package_index)"
+    then
+        # Skip the fingerprint line, the rest matches `rpm -qa` line for line
+        pkg=$(tail -n +2 "${index}" | grep -P "${pkg_search}" | grep -vP "${pkg_exclude}" || true)
+    else
+        pkg=$(rpm -qa | grep -P "${pkg_search}" | grep -vP "${pkg_exclude}" || true)
+    fi
     if [[ "$pkg" != "" ]]
     then 
         echo ${TRUE}
@@ -190,18 +391,21 @@ immutablue_build_has_working_tailscale() {
 # This tests connectivity by pinging a configured IPv4 host
 # returns: TRUE if connected, FALSE otherwise
 immutablue_has_internet_v4() {
+    # Resolve the override flag and the test host with a single settings lookup
+    local force_v4=""
+    local test_host=""
+    eval "$(immutablue-settings --shell \
+        force_v4=.immutablue.header.force_always_has_internet_v4 \
+        test_host=.immutablue.header.has_internet_host_v4)"
+
     # Check if internet check is overridden in settings
     # This is useful for testing or development environments
-    if [[ "$(immutablue-settings .immutablue.header.force_always_has_internet_v4)" == "true" ]]
+    if [[ "${force_v4}" == "true" ]]
     then 
         echo "${TRUE}"
         return 0
     fi
     
-    # Get the configured test host from settings
-    local test_host
-    test_host="$(immutablue-settings .immutablue.header.has_internet_host_v4)"
-    
     # Ping the test host with a short timeout
     # Redirect output to avoid clutter
     ping -c1 -W2 "${test_host}" >/dev/null 2>/dev/null
@@ -221,16 +425,19 @@ immutablue_has_internet_v4() {
 # This tests connectivity by pinging a configured IPv6 host
 # returns: TRUE if connected, FALSE otherwise
 immutablue_has_internet_v6() {
+    # Resolve the override flag and the IPv6 test host with a single settings lookup
+    local force_v6=""
+    local test_host=""
+    eval "$(immutablue-settings --shell \
+        force_v6=.immutablue.header.force_always_has_internet_v6 \
+        test_host=.immutablue.header.has_internet_host_v6)"
+
     # Check if internet check is overridden in settings
-    if [[ "$(immutablue-settings .immutablue.header.force_always_has_internet_v6)" == "true" ]]
+    if [[ "${force_v6}" == "true" ]]
     then 
         echo "${TRUE}"
         return 0
     fi
-
-    # Get the configured IPv6 test host from settings
-    local test_host
-    test_host="$(immutablue-settings .immutablue.header.has_internet_host_v6)"
     
     # Ping the IPv6 test host with a short timeout
     ping -c1 -W2 "${test_host}" >/dev/null 2>/dev/null
@@ -246,32 +453,135 @@ immutablue_has_internet_v6() {
     fi
 }
 
+# Race connectivity probes against each other
+# Every probe that is configured starts at once and the first one to succeed
+# wins, so a missing IPv4 (or IPv6) route no longer costs a full timeout first
+# Arg 1 is the timeout in seconds, arg 2 the IPv4 host, arg 3 the IPv6 host,
+# arg 4 an optional URL that has to answer over HTTPS (empty to skip)
+# returns: TRUE if any probe succeeded, FALSE otherwise
+_immutablue_internet_race() {
+    local timeout="$1"
+    local host_v4="$2"
+    local host_v6="$3"
+    local url="$4"
+    local pids=()
+    local verdict="${FALSE}"
+    local pid
+
+    if [[ -n "${host_v4}" ]]
+    then
+        ping -c1 -W"${timeout}" "${host_v4}" >/dev/null 2>&1 &
+        pids+=($!)
+    fi
+    if [[ -n "${host_v6}" ]]
+    then
+        ping -c1 -W"${timeout}" "${host_v6}" >/dev/null 2>&1 &
+        pids+=($!)
+    fi
+    if [[ -n "${url}" ]]
+    then
+        curl -fsS -o /dev/null --max-time "${timeout}" "${url}" >/dev/null 2>&1 &
+        pids+=($!)
+    fi
+    if [[ ${#pids[@]} -eq 0 ]]
+    then
+        echo "${FALSE}"
+        return 0
+    fi
+
+    for pid in "${pids[@]}"
+    do
+        # Returns as soon as any remaining probe finishes
+        if wait -n "${pids[@]}" 2>/dev/null
+        then
+            verdict="${TRUE}"
+            break
+        fi
+    done
+
+    # Stop the probes that are still running
+    kill "${pids[@]}" 2>/dev/null
+    wait "${pids[@]}" 2>/dev/null
+    echo "${verdict}"
+}
+
+# Read a cached connectivity verdict
+# Arg 1 is the cache file, arg 2 the maximum age in seconds
+# returns: the cached TRUE/FALSE, nothing if there is no fresh verdict
+_immutablue_internet_cache_read() {
+    local file="$1"
+    local ttl="$2"
+    local stamp
+    local verdict
+
+    [[ -r "${file}" ]] || return 1
+    read -r stamp verdict < "${file}" || return 1
+    [[ "${stamp}" =~ ^[0-9]+$ ]] || return 1
+    [[ $(( EPOCHSECONDS - stamp )) -lt ${ttl} ]] || return 1
+    echo "${verdict}"
+}
+
 # Check if the system has internet connectivity (either IPv4 or IPv6)
+# IPv4, IPv6 and (if .immutablue.header.has_internet_url is set) an HTTPS
+# request race each other, and the verdict is cached in /run for
+# .immutablue.header.has_internet_cache_ttl seconds so scripts that gate on
+# internet one after another do not each pay for the probes
+# Arg 1 is optional, pass "fresh" to ignore the cached verdict
 # returns: TRUE if connected via either IPv4 or IPv6, FALSE otherwise
 immutablue_has_internet() {
-    # Check if internet check is globally overridden in settings
-    if [[ "$(immutablue-settings .immutablue.header.force_always_has_internet)" == "true" ]]
+    local fresh="${1:-}"
+    local force=""
+    local force_v4=""
+    local force_v6=""
+    local host_v4=""
+    local host_v6=""
+    local url=""
+    local timeout=""
+    local ttl=""
+    local verdict=""
+    local cache="${IMMUTABLUE_USER_INTERNET_CACHE}"
+
+    eval "$(immutablue-settings --shell \
+        force=.immutablue.header.force_always_has_internet \
+        force_v4=.immutablue.header.force_always_has_internet_v4 \
+        force_v6=.immutablue.header.force_always_has_internet_v6 \
+        host_v4=.immutablue.header.has_internet_host_v4 \
+        host_v6=.immutablue.header.has_internet_host_v6 \
+        url=.immutablue.header.has_internet_url \
+        timeout=.immutablue.header.has_internet_timeout \
+        ttl=.immutablue.header.has_internet_cache_ttl)"
+    [[ "${url}" == "null" ]] && url=""
+    [[ "${timeout}" =~ ^[0-9]+$ ]] && [[ ${timeout} -gt 0 ]] || timeout=2
+    [[ "${ttl}" =~ ^[0-9]+$ ]] || ttl=30
+
+    # Check if internet check is overridden in settings
+    if [[ "${force}" == "true" ]] || [[ "${force_v4}" == "true" ]] || [[ "${force_v6}" == "true" ]]
     then 
         echo "${TRUE}"
         return 0
     fi
 
-    # First check IPv4 connectivity
-    if [[ "$(immutablue_has_internet_v4)" == "${FALSE}" ]]
+    if [[ "${fresh}" != "fresh" ]] && [[ ${ttl} -gt 0 ]]
     then
-        # No IPv4 connectivity, check IPv6
-        if [[ "$(immutablue_has_internet_v6)" == "${FALSE}" ]]
+        verdict="$(_immutablue_internet_cache_read "${IMMUTABLUE_INTERNET_CACHE}" "${ttl}" || \
+                   _immutablue_internet_cache_read "${IMMUTABLUE_USER_INTERNET_CACHE}" "${ttl}")"
+        if [[ -n "${verdict}" ]]
         then
-            # Neither IPv4 nor IPv6 connectivity
-            echo "${FALSE}"
-        else
-            # IPv6 connectivity but no IPv4
-            echo "${TRUE}"
+            echo "${verdict}"
+            return 0
         fi
-    else 
-        # IPv4 connectivity
-        echo "${TRUE}"
     fi
+
+    verdict="$(_immutablue_internet_race "${timeout}" "${host_v4}" "${host_v6}" "${url}")"
+
+    # Share the verdict with the next scripts (best effort)
+    [[ ${EUID} -eq 0 ]] && cache="${IMMUTABLUE_INTERNET_CACHE}"
+    if mkdir -p "$(dirname "${cache}")" 2>/dev/null
+    then
+        echo "${EPOCHSECONDS} ${verdict}" > "${cache}.$$" 2>/dev/null \
+            && mv -f "${cache}.$$" "${cache}" 2>/dev/null
+    fi
+    echo "${verdict}"
 }
 
 
@@ -381,52 +691,118 @@ immutablue_services_force_setup_to_run_now() {
 }
 
 
-# Try running a command, and if it fails, wait and try again
+# Sleep between two immutablue_retry attempts
+# With wake_online the sleep ends early when NetworkManager reports the
+# network online (what network-online.target waits for), so a command waiting
+# for the network runs again as soon as it comes up
+# Arg 1 is the delay in milliseconds, arg 2 is "true" to wake on network online
+_immutablue_retry_sleep() {
+    local ms="$1"
+    local wake_online="$2"
+
+    # Only wait for a change: if the network is already online, nothing will wake us
+    if [[ "${wake_online}" == "true" ]] && command -v nm-online &>/dev/null && ! nm-online -q -t 0 &>/dev/null
+    then
+        if nm-online -q -t $(( (ms + 999) / 1000 )) &>/dev/null
+        then
+            return 0
+        fi
+        # nm-online gave up early (e.g. NetworkManager is not running)
+    fi
+    sleep "$(( ms / 1000 )).$(printf '%03d' $(( ms % 1000 )))"
+}
+
+# Run a command until it succeeds, backing off exponentially between attempts
+# The delay doubles from --initial up to --max-delay, each one randomized to
+# between half and all of it so many machines retrying at once spread out,
+# and no attempt starts after --deadline seconds have passed
+#
+# Usage: immutablue_retry [--deadline SECONDS] [--initial SECONDS]
+#                         [--max-delay SECONDS] [--wait-online] COMMAND [ARGS...]
+#
+# --wait-online ends each delay early when the network comes online.
+# A command fails when it exits non-zero or prints FALSE, like the
+# immutablue_has_* helpers. The output of the last attempt is printed.
+#
+# immutablue_retry.py implements the same policy for Python callers.
+# Returns: 0 once the command succeeded, 1 if it still failed at the deadline
+immutablue_retry() {
+    local deadline=300
+    local initial=1
+    local max_delay=30
+    local wake_online="false"
+    local output=""
+    local ret_code=0
+    local now
+    local delay_ms
+    local sleep_ms
+    local stop_at
+
+    while [[ $# -gt 0 ]]
+    do
+        case "$1" in
+            --deadline) deadline="$2"; shift 2 ;;
+            --initial) initial="$2"; shift 2 ;;
+            --max-delay) max_delay="$2"; shift 2 ;;
+            --wait-online) wake_online="true"; shift ;;
+            --) shift; break ;;
+            *) break ;;
+        esac
+    done
+
+    now="${EPOCHREALTIME//[!0-9]/}"
+    stop_at=$(( now / 1000 + deadline * 1000 ))
+    delay_ms=$(( initial * 1000 ))
+
+    while true
+    do
+        output="$("$@")"
+        ret_code=$?
+        if [[ ${ret_code} -eq 0 ]] && [[ "${output}" != "${FALSE}" ]]
+        then
+            [[ -n "${output}" ]] && echo "${output}"
+            return 0
+        fi
+
+        now="${EPOCHREALTIME//[!0-9]/}"
+        now=$(( now / 1000 ))
+        if [[ ${now} -ge ${stop_at} ]]
+        then
+            [[ -n "${output}" ]] && echo "${output}"
+            return 1
+        fi
+
+        # Equal jitter: half the delay plus a random part of the other half
+        sleep_ms=$(( delay_ms / 2 + (RANDOM * 32768 + RANDOM) % (delay_ms / 2 + 1) ))
+        [[ $(( now + sleep_ms )) -gt ${stop_at} ]] && sleep_ms=$(( stop_at - now ))
+        _immutablue_retry_sleep "${sleep_ms}" "${wake_online}"
+
+        delay_ms=$(( delay_ms * 2 ))
+        [[ ${delay_ms} -gt $(( max_delay * 1000 )) ]] && delay_ms=$(( max_delay * 1000 ))
+    done
+}
+
+# Try running a command, and if it fails, keep trying for a while
 # This is useful for commands that might fail due to timing issues
 # or temporary conditions (like network connectivity)
+# Kept for existing callers, new code should use immutablue_retry directly
 #
 # Parameters:
-# arg1: delay - Number of seconds to wait before trying again
+# arg1: delay - Number of seconds to keep trying for
 # arg2: command - The command to execute
 # arg3+: args_to_command - Any additional arguments to pass to the command
 #
-# Returns: TRUE if the command eventually succeeds, FALSE if it fails twice
+# Returns: TRUE if the command eventually succeeds, FALSE if it still fails after delay seconds
 immutablue_try_command_and_try_again_on_delay() {
-    # Store the delay time for retry
     local delay="$1"
-    # Variables to store command output and return code
-    local output=""
-    local ret_code=0
-    
-    # Remove the delay parameter, leaving just the command and its arguments
     shift
 
     # Echo the command for debugging purposes
     echo "$@"
-    # Execute the command and capture its output and return code
-    output="$("$@")"
-    ret_code=$?
-    
-    # Check if the command failed (either returned FALSE or a non-zero exit code)
-    if [[ "${output}" == "${FALSE}" ]] || [[ $ret_code -ne 0 ]]
+    if ! immutablue_retry --deadline "${delay}" "$@" >/dev/null
     then
-        # Wait before trying again
-        sleep ${delay}
-
-        # Try the command again
-        echo "$@"
-        output="$("$@")"
-        ret_code=$?
-
-        # Check if the command failed again
-        if [[ "${output}" == "${FALSE}" ]] || [[ $ret_code -ne 0 ]]
-        then 
-            # If it failed twice, return FALSE
-            echo "${FALSE}"
-            return 1
-        fi
+        echo "${FALSE}"
+        return 1
     fi
-    
-    # If we get here, either the first or second attempt succeeded
     echo "${TRUE}"
 }
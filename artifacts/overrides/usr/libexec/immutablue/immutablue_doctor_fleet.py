@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+# immutablue_doctor_fleet.py
+#
+# Fleet rollup of `immutablue-doctor --json` reports.
+#
+# Usage:
+#   immutablue_doctor_fleet.py aggregate [--previous FILE] [--save FILE]
+#                                        [--sample N] [--json] [INPUT...]
+#
+# INPUT is a report file, a directory of *.json reports or `-` for stdin (the
+# default). A file or stream may hold any number of concatenated reports, so
+# `ssh host immutablue-doctor --json` output from many hosts can be piped in
+# as it arrives. Anything else in a stream (an ssh error, say) is counted as
+# an invalid report and skipped up to the next line starting with `{`.
+#
+# Reports are read and folded into the rollup one at a time, memory only grows
+# with the number of distinct hosts and checks, never with the number or size
+# of the reports. For every failing or warning check (failures first, most
+# hosts first) the rollup holds the number of hosts reporting it and a few of
+# their names. A host that appears
+# more than once is only counted the first time.
+#
+# --save writes the rollup as JSON, and passing an earlier saved rollup as
+# --previous adds trends: the change in hosts per check and the checks that no
+# longer fire at all.
+
+import os
+import sys
+import json
+import glob
+import tempfile
+from datetime import datetime, timezone
+
+# Newest immutablue-doctor report layout this understands (REPORT_SCHEMA_VERSION)
+REPORT_SCHEMA_VERSION = 1
+
+# Version of the rollup written by --save and --json
+ROLLUP_SCHEMA_VERSION = 1
+
+STATUSES = ('pass', 'fail', 'warn')
+
+# Host names kept per check
+DEFAULT_SAMPLE = 5
+
+# Read size and the largest single report accepted from a stream
+CHUNK_SIZE = 64 * 1024
+MAX_REPORT_BYTES = 4 * 1024 * 1024
+
+
+def iter_documents(stream, max_bytes=MAX_REPORT_BYTES):
+    """Yield (document, error) for each JSON document in a text stream.
+
+    Documents may be concatenated with or without whitespace between them.
+    Only one document is buffered at a time. Garbage, or a document larger than
+    `max_bytes`, yields one (None, error) and is skipped up to the next line
+    starting with `{`, where reading resumes. Nested objects of a report are
+    always indented, so such a line starts a new report.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    eof = False
+    skipping = False
+    while True:
+        if skipping:
+            start = buf.find('\n{')
+            if start != -1:
+                buf = buf[start + 1:]
+                skipping = False
+            else:
+                # Keep a trailing newline, the { may be in the next chunk
+                buf = buf[-1:]
+        if not skipping:
+            buf = buf.lstrip()
+            if buf:
+                try:
+                    document, end = decoder.raw_decode(buf)
+                except ValueError as e:
+                    # Garbage, or a document that has not been read completely
+                    if eof or buf.find('\n{') != -1:
+                        yield None, f"invalid JSON: {e}"
+                        skipping = True
+                        continue
+                    if len(buf) > max_bytes:
+                        yield None, f"report larger than {max_bytes} bytes"
+                        skipping = True
+                        continue
+                else:
+                    buf = buf[end:]
+                    yield document, None
+                    continue
+        if eof:
+            return
+
+        chunk = stream.read(CHUNK_SIZE)
+        if chunk:
+            buf += chunk
+        else:
+            eof = True
+
+
+def validate_report(document):
+    """Return why a document is not a doctor report, or None if it is one."""
+    if not isinstance(document, dict):
+        return "not a JSON object"
+    schema = document.get('schema_version', 0)
+    if not isinstance(schema, int) or schema > REPORT_SCHEMA_VERSION:
+        return f"unsupported schema_version {schema!r}"
+    results = document.get('results')
+    if not isinstance(results, list):
+        return "missing results"
+    for result in results:
+        if not isinstance(result, dict) or not isinstance(result.get('check'), str) \
+                or result.get('status') not in STATUSES:
+            return "malformed result"
+    return None
+
+
+class Rollup:
+    """Fleet-level counters folded from one report at a time."""
+
+    def __init__(self, sample=DEFAULT_SAMPLE):
+        self.sample = sample
+        self.reports = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.hosts = set()
+        self.hosts_failing = 0
+        self.hosts_warning = 0
+        self.summary = {'passed': 0, 'failed': 0, 'warnings': 0}
+        self.images = {}
+        self.checks = {}
+        self.errors = []
+
+    def add_error(self, source, error):
+        """Count an unreadable report, keeping the first few messages."""
+        self.invalid += 1
+        if len(self.errors) < 20:
+            self.errors.append(f"{source}: {error}")
+
+    def add(self, report, source):
+        """Fold one report into the rollup.
+
+        Args:
+            report: A parsed doctor report
+            source: Where it came from, used for reports without a hostname
+        """
+        error = validate_report(report)
+        if error:
+            self.add_error(source, error)
+            return
+
+        self.reports += 1
+        host = report.get('hostname') or source
+        if host in self.hosts:
+            self.duplicates += 1
+            return
+        self.hosts.add(host)
+
+        image = report.get('image') or 'unknown'
+        self.images[image] = self.images.get(image, 0) + 1
+
+        summary = report.get('summary') or {}
+        for key in self.summary:
+            if isinstance(summary.get(key), int):
+                self.summary[key] += summary[key]
+
+        seen = set()
+        for result in report['results']:
+            if result['status'] == 'pass':
+                continue
+            key = (result.get('section') or '', result['check'], result['status'])
+            if key in seen:
+                continue
+            seen.add(key)
+            entry = self.checks.setdefault(key, {'hosts': 0, 'sample_hosts': []})
+            entry['hosts'] += 1
+            if len(entry['sample_hosts']) < self.sample:
+                entry['sample_hosts'].append(host)
+
+        statuses = {key[2] for key in seen}
+        if 'fail' in statuses:
+            self.hosts_failing += 1
+        if 'warn' in statuses:
+            self.hosts_warning += 1
+
+    def to_dict(self, previous=None):
+        """Return the rollup, with trends against a previous rollup if given."""
+        before = {}
+        if previous:
+            for entry in previous.get('checks', []):
+                before[(entry.get('section', ''), entry.get('check'), entry.get('status'))] = entry.get('hosts', 0)
+
+        checks = []
+        for (section, check, status), entry in self.checks.items():
+            row = {
+                'section': section,
+                'check': check,
+                'status': status,
+                'hosts': entry['hosts'],
+                'sample_hosts': entry['sample_hosts'],
+            }
+            if previous is not None:
+                row['previous'] = before.get((section, check, status), 0)
+                row['delta'] = entry['hosts'] - row['previous']
+            checks.append(row)
+        checks.sort(key=lambda row: (row['status'] != 'fail', -row['hosts'], row['section'], row['check']))
+
+        rollup = {
+            'schema_version': ROLLUP_SCHEMA_VERSION,
+            'generated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'reports': self.reports,
+            'hosts': len(self.hosts),
+            'invalid': self.invalid,
+            'duplicates': self.duplicates,
+            'hosts_failing': self.hosts_failing,
+            'hosts_warning': self.hosts_warning,
+            'summary': self.summary,
+            'images': dict(sorted(self.images.items(), key=lambda item: (-item[1], item[0]))),
+            'checks': checks,
+        }
+        if previous is not None:
+            rollup['previous_generated'] = previous.get('generated')
+            rollup['resolved'] = [
+                {'section': section, 'check': check, 'status': status, 'previous': hosts}
+                for (section, check, status), hosts in sorted(before.items(), key=lambda item: -item[1])
+                if (section, check, status) not in self.checks
+            ]
+        return rollup
+
+
+def expand_inputs(inputs):
+    """Yield the report sources named on the command line, `-` is stdin."""
+    for name in inputs or ['-']:
+        if name != '-' and os.path.isdir(name):
+            yield from sorted(glob.glob(os.path.join(name, '*.json')))
+        else:
+            yield name
+
+
+def aggregate(inputs, sample=DEFAULT_SAMPLE):
+    """Build a Rollup from report files, directories or stdin."""
+    rollup = Rollup(sample)
+    for source in expand_inputs(inputs):
+        label = '<stdin>' if source == '-' else source
+        try:
+            stream = sys.stdin if source == '-' else open(source, 'r', errors='replace')
+        except OSError as e:
+            rollup.add_error(label, e.strerror or str(e))
+            continue
+        try:
+            for document, error in iter_documents(stream):
+                if error:
+                    rollup.add_error(label, error)
+                else:
+                    rollup.add(document, label)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+    return rollup
+
+
+def write_json(path, data):
+    """Atomically write `data` as JSON to `path`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.rollup-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def print_rollup(rollup, out):
+    """Print a rollup as plain text."""
+    out.write(f"Reports: {rollup['reports']} from {rollup['hosts']} hosts"
+              f" ({rollup['invalid']} invalid, {rollup['duplicates']} duplicates)\n")
+    out.write(f"Hosts with failures: {rollup['hosts_failing']}, with warnings: {rollup['hosts_warning']}\n")
+    for image, count in rollup['images'].items():
+        out.write(f"  {count:>6}  {image}\n")
+
+    trends = 'resolved' in rollup
+    out.write('\n')
+    if not rollup['checks']:
+        out.write("No failing or warning checks\n")
+    for row in rollup['checks']:
+        delta = f"{row['delta']:+d}".rjust(6) if trends else ''
+        name = f"{row['section']} / {row['check']}" if row['section'] else row['check']
+        out.write(f"  {row['status']:<4}  {row['hosts']:>6}{delta}  {name}  ({', '.join(row['sample_hosts'])})\n")
+
+    if trends and rollup['resolved']:
+        out.write("\nResolved since the previous rollup:\n")
+        for row in rollup['resolved']:
+            name = f"{row['section']} / {row['check']}" if row['section'] else row['check']
+            out.write(f"  {row['status']:<4}  {row['previous']:>6}  {name}\n")
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: immutablue_doctor_fleet.py aggregate [OPTIONS] [INPUT...]")
+    print("\nRoll up `immutablue-doctor --json` reports from many hosts.")
+    print("INPUT is a report file, a directory of *.json reports or - for stdin (default).")
+    print("\nOptions:")
+    print("  --previous FILE  Compare against a rollup saved earlier with --save")
+    print("  --save FILE      Save this rollup as JSON")
+    print(f"  --sample N       Host names listed per check (default {DEFAULT_SAMPLE})")
+    print("  --json           Print the rollup as JSON")
+
+
+def main(argv):
+    """Command line entry point."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0 if argv else 1
+
+    if argv[0] != 'aggregate':
+        print(f"Unknown command: {argv[0]}", file=sys.stderr)
+        print_usage()
+        return 1
+
+    previous_file = None
+    save_file = None
+    sample = DEFAULT_SAMPLE
+    as_json = False
+    inputs = []
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg in ('--previous', '--save', '--sample') and args:
+            value = args.pop(0)
+            if arg == '--previous':
+                previous_file = value
+            elif arg == '--save':
+                save_file = value
+            else:
+                try:
+                    sample = max(0, int(value))
+                except ValueError:
+                    print(f"Error: invalid sample size: {value}", file=sys.stderr)
+                    return 1
+        elif arg == '--json':
+            as_json = True
+        elif arg.startswith('--'):
+            print(f"Unknown option: {arg}", file=sys.stderr)
+            print_usage()
+            return 1
+        else:
+            inputs.append(arg)
+
+    previous = None
+    if previous_file:
+        try:
+            with open(previous_file, 'r') as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot read previous rollup {previous_file}: {e}", file=sys.stderr)
+            return 1
+
+    folded = aggregate(inputs, sample)
+    for error in folded.errors:
+        print(f"Warning: skipped {error}", file=sys.stderr)
+    rollup = folded.to_dict(previous)
+
+    if save_file:
+        try:
+            write_json(save_file, rollup)
+        except OSError as e:
+            print(f"Error: cannot save rollup {save_file}: {e.strerror or e}", file=sys.stderr)
+            return 1
+    if as_json:
+        json.dump(rollup, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_rollup(rollup, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,543 @@
+#!/usr/bin/python3
+# immutablue_hardware.py
+#
+# Versioned hardware inventory kept in /var/lib/immutablue/hardware.json.
+#
+# The inventory holds the form factor (laptop, desktop, server, vm), the CPU
+# (model, cores, threads, flags), memory, GPUs and USB devices with their IDs,
+# disks and NICs, all read from /proc and /sys. First-boot setup writes it from its hardware detection step, the
+# on_boot hook keeps it current and the doctor, `immutablue sysinfo` and the
+# hardware override recipes read it instead of probing again.
+#
+# Every section has a cheap stamp (e.g. the list of PCI IDs or disk sizes)
+# saved next to it. A refresh recomputes the stamps and only collects the
+# sections whose stamp changed, everything is collected again when the booted
+# deployment or kernel changes. A refresh that changes nothing does not write.
+#
+# Usage:
+#   immutablue_hardware.py show [--json]
+#   immutablue_hardware.py summary
+#   immutablue_hardware.py refresh [--force]
+#   immutablue_hardware.py get KEY          (e.g. cpu.model, memory.total_bytes)
+#   immutablue_hardware.py has-gpu VENDOR[:DEVICE]
+#   immutablue_hardware.py has-usb VENDOR[:PRODUCT]
+#
+# Readers that cannot write the inventory (it is owned by root) still get a
+# current one, it is just not saved.
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from datetime import datetime, timezone
+
+# Version of the inventory layout, bump on incompatible changes
+SCHEMA_VERSION = 1
+
+INVENTORY_FILE = '/var/lib/immutablue/hardware.json'
+
+PROC_CMDLINE = '/proc/cmdline'
+PROC_CPUINFO = '/proc/cpuinfo'
+PROC_MEMINFO = '/proc/meminfo'
+SYS_CPU = '/sys/devices/system/cpu'
+SYS_BUS_PCI = '/sys/bus/pci/devices'
+SYS_BUS_USB = '/sys/bus/usb/devices'
+SYS_BLOCK = '/sys/block'
+SYS_CLASS_NET = '/sys/class/net'
+SYS_DMI = '/sys/class/dmi/id'
+SYS_POWER_SUPPLY = '/sys/class/power_supply'
+SYS_HYPERVISOR_TYPE = '/sys/hypervisor/type'
+
+# pci.ids from hwdata, used to name PCI devices (the raw IDs are kept without it)
+PCI_IDS_FILES = ('/usr/share/hwdata/pci.ids', '/usr/share/misc/pci.ids')
+
+SECTIONS = ('system', 'cpu', 'memory', 'gpus', 'disks', 'nics', 'usb')
+
+# SMBIOS chassis types (/sys/class/dmi/id/chassis_type) by form factor
+CHASSIS_TYPES = {
+    'laptop': {8, 9, 10, 11, 14, 30, 31, 32},
+    'desktop': {3, 4, 5, 6, 7, 13, 15, 16, 24, 35, 36},
+    'server': {17, 23, 25, 28, 29},
+}
+
+
+def _read(path, default=None):
+    """Return the stripped contents of a small file, or `default`."""
+    try:
+        with open(path, 'r', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _driver(device_dir):
+    """Name of the kernel driver bound to a sysfs device, or None."""
+    link = os.path.join(device_dir, 'driver')
+    return os.path.basename(os.readlink(link)) if os.path.islink(link) else None
+
+
+def _is_virtual(sys_path):
+    """Whether a /sys/block or /sys/class/net entry has no backing device."""
+    return '/virtual/' in os.path.realpath(sys_path)
+
+
+def _listdir(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+def format_bytes(size):
+    """Format a byte count in binary units, e.g. 15.5 GiB."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024 or unit == 'TiB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def pci_names(ids):
+    """Look up vendor and device names for a set of (vendor, device) IDs.
+
+    Args:
+        ids: Iterable of (vendor, device) pairs as 4-digit lowercase hex strings
+
+    Returns:
+        A dict mapping each pair found in pci.ids to (vendor name, device name)
+    """
+    wanted = set(ids)
+    vendors = {vendor for vendor, _ in wanted}
+    names = {}
+    path = next((p for p in PCI_IDS_FILES if os.path.exists(p)), None)
+    if not path or not wanted:
+        return names
+
+    vendor, vendor_name = None, None
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            if line.startswith('C '):
+                # Device classes follow the vendor list
+                break
+            if not line.startswith('\t'):
+                vendor, _, vendor_name = line.rstrip('\n').partition('  ')
+                if vendor not in vendors:
+                    vendor = None
+            elif vendor and not line.startswith('\t\t'):
+                device, _, device_name = line.strip().partition('  ')
+                if (vendor, device) in wanted:
+                    names[(vendor, device)] = (vendor_name, device_name)
+                    if len(names) == len(wanted):
+                        break
+    return names
+
+
+def collect_system():
+    """Form factor (laptop, desktop, server, vm or unknown), vendor and battery."""
+    batteries = [name for name in _listdir(SYS_POWER_SUPPLY)
+                 if _read(os.path.join(SYS_POWER_SUPPLY, name, 'type')) == 'Battery']
+    virtual = os.path.exists(SYS_HYPERVISOR_TYPE)
+    if not virtual:
+        try:
+            with open(PROC_CPUINFO, 'r') as f:
+                virtual = any(line.startswith('flags') and ' hypervisor' in line for line in f)
+        except OSError:
+            pass
+
+    chassis_type = _read(os.path.join(SYS_DMI, 'chassis_type'), '')
+    chassis = 'unknown'
+    if virtual:
+        chassis = 'vm'
+    elif chassis_type.isdigit():
+        chassis = next((name for name, types in CHASSIS_TYPES.items() if int(chassis_type) in types), 'unknown')
+    if chassis == 'unknown' and batteries:
+        chassis = 'laptop'
+    return {
+        'chassis': chassis,
+        'vendor': _read(os.path.join(SYS_DMI, 'sys_vendor')),
+        'product': _read(os.path.join(SYS_DMI, 'product_name')),
+        'virtual': virtual,
+        'battery': bool(batteries),
+    }
+
+
+def collect_cpu():
+    """CPU model, vendor, core and thread counts and flags from /proc/cpuinfo."""
+    cpu = {'model': None, 'vendor': None, 'cores': 0, 'threads': 0, 'flags': []}
+    cores = set()
+    physical = core = None
+    with open(PROC_CPUINFO, 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            key, value = key.strip(), value.strip()
+            if key == 'processor':
+                cpu['threads'] += 1
+                physical = core = None
+            elif key in ('model name', 'Model', 'cpu model', 'Hardware') and cpu['model'] is None:
+                cpu['model'] = value
+            elif key in ('vendor_id', 'CPU implementer') and cpu['vendor'] is None:
+                cpu['vendor'] = value
+            elif key in ('flags', 'Features') and not cpu['flags']:
+                cpu['flags'] = sorted(value.split())
+            elif key == 'physical id':
+                physical = value
+            elif key == 'core id':
+                core = value
+            if physical is not None and core is not None:
+                cores.add((physical, core))
+    cpu['threads'] = cpu['threads'] or os.cpu_count() or 1
+    cpu['cores'] = len(cores) or cpu['threads']
+    cpu['model'] = cpu['model'] or os.uname().machine
+    return cpu
+
+
+def _meminfo():
+    meminfo = {}
+    with open(PROC_MEMINFO, 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields = value.split()
+            if fields:
+                meminfo[key] = int(fields[0]) * 1024
+    return meminfo
+
+
+def collect_memory():
+    """Installed memory from /proc/meminfo."""
+    return {'total_bytes': _meminfo()['MemTotal']}
+
+
+def _pci_devices():
+    """Yield (slot, class, vendor, device) for every PCI device."""
+    for slot in _listdir(SYS_BUS_PCI):
+        base = os.path.join(SYS_BUS_PCI, slot)
+        yield (slot,
+               _read(os.path.join(base, 'class'), ''),
+               _read(os.path.join(base, 'vendor'), '')[2:],
+               _read(os.path.join(base, 'device'), '')[2:])
+
+
+def collect_gpus():
+    """Display controllers (PCI class 0x03) with IDs, names and drivers."""
+    devices = [(slot, vendor, device) for slot, pci_class, vendor, device in _pci_devices()
+               if pci_class.startswith('0x03')]
+    names = pci_names((vendor, device) for _, vendor, device in devices)
+    gpus = []
+    for slot, vendor, device in devices:
+        vendor_name, device_name = names.get((vendor, device), (None, None))
+        gpus.append({
+            'slot': slot,
+            'vendor_id': vendor,
+            'device_id': device,
+            'vendor': vendor_name,
+            'name': device_name,
+            'driver': _driver(os.path.join(SYS_BUS_PCI, slot)),
+        })
+    return gpus
+
+
+def collect_disks():
+    """Physical block devices from /sys/block."""
+    disks = []
+    for name in _listdir(SYS_BLOCK):
+        base = os.path.join(SYS_BLOCK, name)
+        if _is_virtual(base):
+            continue
+        real = os.path.realpath(base)
+        if name.startswith('nvme'):
+            transport = 'nvme'
+        elif '/usb' in real:
+            transport = 'usb'
+        elif name.startswith('mmcblk'):
+            transport = 'mmc'
+        elif name.startswith('vd'):
+            transport = 'virtio'
+        else:
+            transport = 'ata'
+        disks.append({
+            'name': name,
+            'model': _read(os.path.join(base, 'device', 'model')),
+            'size_bytes': int(_read(os.path.join(base, 'size'), '0') or 0) * 512,
+            'rotational': _read(os.path.join(base, 'queue', 'rotational')) == '1',
+            'removable': _read(os.path.join(base, 'removable')) == '1',
+            'transport': transport,
+        })
+    return disks
+
+
+def collect_nics():
+    """Physical network interfaces from /sys/class/net."""
+    nics = []
+    for name in _listdir(SYS_CLASS_NET):
+        base = os.path.join(SYS_CLASS_NET, name)
+        if name == 'lo' or _is_virtual(base):
+            continue
+        nics.append({
+            'name': name,
+            'mac': _read(os.path.join(base, 'address')),
+            'driver': _driver(os.path.join(base, 'device')),
+            'wireless': os.path.exists(os.path.join(base, 'wireless'))
+                        or os.path.exists(os.path.join(base, 'phy80211')),
+        })
+    return nics
+
+
+def collect_usb():
+    """USB devices (not interfaces) with their IDs."""
+    devices = []
+    for name in _listdir(SYS_BUS_USB):
+        base = os.path.join(SYS_BUS_USB, name)
+        vendor = _read(os.path.join(base, 'idVendor'))
+        if not vendor:
+            continue
+        devices.append({
+            'bus_id': name,
+            'vendor_id': vendor,
+            'product_id': _read(os.path.join(base, 'idProduct')),
+            'name': _read(os.path.join(base, 'product')),
+        })
+    return devices
+
+
+COLLECTORS = {
+    'system': collect_system,
+    'cpu': collect_cpu,
+    'memory': collect_memory,
+    'gpus': collect_gpus,
+    'disks': collect_disks,
+    'nics': collect_nics,
+    'usb': collect_usb,
+}
+
+
+def _digest(parts):
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()[:16]
+
+
+def deployment():
+    """The booted ostree deployment (from the kernel command line) and kernel."""
+    ostree = next((arg.partition('=')[2] for arg in _read(PROC_CMDLINE, '').split()
+                   if arg.startswith('ostree=')), '')
+    return f"{ostree} {os.uname().release}".strip()
+
+
+def stamps():
+    """Cheap fingerprints of the deployment and of every section."""
+    pci = [f"{slot} {pci_class} {vendor}:{device}" for slot, pci_class, vendor, device in _pci_devices()]
+    blocks = [f"{name} {_read(os.path.join(SYS_BLOCK, name, 'size'), '')}" for name in _listdir(SYS_BLOCK)]
+    nets = [f"{name} {_read(os.path.join(SYS_CLASS_NET, name, 'address'), '')}" for name in _listdir(SYS_CLASS_NET)]
+    usb = [f"{name} {_read(os.path.join(SYS_BUS_USB, name, 'idVendor'), '')}:"
+           f"{_read(os.path.join(SYS_BUS_USB, name, 'idProduct'), '')}" for name in _listdir(SYS_BUS_USB)]
+    return {
+        'deployment': _digest([deployment()]),
+        'cpu': _digest([_read(os.path.join(SYS_CPU, 'present'), '')]),
+        'memory': _digest([str(_meminfo().get('MemTotal', ''))]),
+        'gpus': _digest(pci),
+        'disks': _digest(blocks),
+        'nics': _digest(nets),
+        'usb': _digest(usb),
+        'system': _digest([_read(os.path.join(SYS_DMI, name), '') for name in ('chassis_type', 'sys_vendor', 'product_name')]
+                          + _listdir(SYS_POWER_SUPPLY)),
+    }
+
+
+def load(path=None):
+    """Return the saved inventory, or None if missing, unreadable or of another schema."""
+    try:
+        with open(path or INVENTORY_FILE, 'r') as f:
+            inventory = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(inventory, dict) or inventory.get('schema_version') != SCHEMA_VERSION:
+        return None
+    return inventory
+
+
+def save(inventory, path=None):
+    """Atomically write the inventory, raises OSError if it cannot."""
+    path = path or INVENTORY_FILE
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.hardware-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(inventory, f, indent=2)
+            f.write('\n')
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def refresh(path=None, force=False, collected=None, write=True):
+    """Return a current inventory, collecting only the sections that changed.
+
+    Args:
+        path: The saved inventory, INVENTORY_FILE by default
+        force: Collect every section again
+        collected: Sections the caller already collected (e.g. first-boot
+            detection), used as they are
+        write: Save the inventory if anything changed (errors are ignored)
+    """
+    cached = None if force else load(path)
+    current = stamps()
+    previous = cached.get('stamps', {}) if cached else {}
+    same_deployment = previous.get('deployment') == current['deployment']
+
+    inventory = {
+        'schema_version': SCHEMA_VERSION,
+        'generated': None,
+        'deployment': deployment(),
+        'stamps': current,
+    }
+    changed = []
+    for section in SECTIONS:
+        if collected and section in collected:
+            value = collected[section]
+        elif cached and section in cached and same_deployment and previous.get(section) == current[section]:
+            value = cached[section]
+        else:
+            value = COLLECTORS[section]()
+        if not cached or cached.get(section) != value:
+            changed.append(section)
+        inventory[section] = value
+
+    if cached and not changed and previous == current:
+        return cached
+
+    inventory['generated'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    inventory['changed'] = changed
+    if write:
+        try:
+            save(inventory, path)
+        except OSError:
+            pass
+    return inventory
+
+
+def get(inventory, key):
+    """Look up a dotted key such as `cpu.model` or `gpus.0.vendor_id`."""
+    value = inventory
+    for part in key.split('.'):
+        if isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        elif isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            raise KeyError(key)
+    return value
+
+
+def has_device(devices, ids, id_key):
+    """Whether a device matches VENDOR or VENDOR:DEVICE (hex, case-insensitive)."""
+    vendor, _, device = ids.lower().partition(':')
+    return any(entry.get('vendor_id') == vendor and (not device or entry.get(id_key) == device)
+               for entry in devices)
+
+
+def summary(inventory):
+    """One line describing the machine."""
+    cpu = inventory['cpu']
+    parts = [f"{cpu['model']} ({cpu['cores']} cores, {cpu['threads']} threads)",
+             format_bytes(inventory['memory']['total_bytes'])]
+    for gpu in inventory['gpus']:
+        parts.append(' '.join(filter(None, (gpu['vendor'], gpu['name']))) or f"GPU {gpu['vendor_id']}:{gpu['device_id']}")
+    parts.append(f"{len(inventory['disks'])} disk(s), {len(inventory['nics'])} NIC(s)")
+    return ', '.join(parts)
+
+
+def print_inventory(inventory, out):
+    """Print an inventory as plain text."""
+    cpu = inventory['cpu']
+    system = inventory['system']
+    out.write(f"System:  {system['chassis']} {' '.join(filter(None, (system['vendor'], system['product'])))}".rstrip() + "\n")
+    out.write(f"CPU:     {cpu['model']} ({cpu['cores']} cores, {cpu['threads']} threads)\n")
+    out.write(f"Memory:  {format_bytes(inventory['memory']['total_bytes'])}\n")
+    for gpu in inventory['gpus']:
+        name = ' '.join(filter(None, (gpu['vendor'], gpu['name']))) or 'Display controller'
+        out.write(f"GPU:     {name} [{gpu['vendor_id']}:{gpu['device_id']}] driver={gpu['driver'] or 'none'}\n")
+    for disk in inventory['disks']:
+        kind = 'HDD' if disk['rotational'] else 'SSD'
+        out.write(f"Disk:    {disk['name']} {format_bytes(disk['size_bytes'])} {disk['transport']} {kind}"
+                  f"{' removable' if disk['removable'] else ''} {disk['model'] or ''}".rstrip() + "\n")
+    for nic in inventory['nics']:
+        out.write(f"NIC:     {nic['name']} {nic['mac'] or ''} driver={nic['driver'] or 'none'}"
+                  f"{' wireless' if nic['wireless'] else ''}\n")
+    out.write(f"Updated: {inventory['generated']}\n")
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: immutablue_hardware.py COMMAND [ARGS]")
+    print(f"\nHardware inventory cached in {INVENTORY_FILE}")
+    print("\nCommands:")
+    print("  show [--json]             Print the inventory")
+    print("  summary                   Print a one-line summary")
+    print("  refresh [--force]         Update the saved inventory if the hardware changed")
+    print("  get KEY                   Print one value, e.g. cpu.model or gpus.0.driver")
+    print("  has-gpu VENDOR[:DEVICE]   Exit 0 if a matching GPU is present (hex PCI IDs)")
+    print("  has-usb VENDOR[:PRODUCT]  Exit 0 if a matching USB device is present")
+
+
+def main(argv):
+    """Command line entry point."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0 if argv else 1
+
+    command, args = argv[0], argv[1:]
+    if command == 'refresh':
+        unknown = [arg for arg in args if arg != '--force']
+        if unknown:
+            print(f"Unknown option: {unknown[0]}", file=sys.stderr)
+            return 1
+        cached = load()
+        inventory = refresh(force='--force' in args, write=False)
+        if inventory == cached:
+            print(f"{INVENTORY_FILE} is up to date")
+            return 0
+        try:
+            save(inventory)
+        except OSError as e:
+            print(f"Error: cannot write {INVENTORY_FILE}: {e.strerror or e}", file=sys.stderr)
+            return 1
+        print(f"Updated {INVENTORY_FILE}: {', '.join(inventory['changed']) or 'deployment changed'}")
+        return 0
+
+    if command not in ('show', 'summary', 'get', 'has-gpu', 'has-usb'):
+        print(f"Unknown command: {command}", file=sys.stderr)
+        print_usage()
+        return 1
+
+    if command in ('get', 'has-gpu', 'has-usb') and len(args) != 1:
+        print_usage()
+        return 1
+
+    inventory = refresh()
+    if command == 'show':
+        if '--json' in args:
+            json.dump(inventory, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            print_inventory(inventory, sys.stdout)
+    elif command == 'summary':
+        print(summary(inventory))
+    elif command == 'get':
+        try:
+            value = get(inventory, args[0])
+        except KeyError:
+            print(f"Error: no such key: {args[0]}", file=sys.stderr)
+            return 1
+        print(json.dumps(value) if isinstance(value, (dict, list)) else value)
+    elif command == 'has-gpu':
+        return 0 if has_device(inventory['gpus'], args[0], 'device_id') else 1
+    else:
+        return 0 if has_device(inventory['usb'], args[0], 'product_id') else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
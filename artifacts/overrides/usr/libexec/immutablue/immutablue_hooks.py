@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+# immutablue_hooks.py
+#
+# Run history of the hook scripts started by immutablue-script-orchestrator.
+#
+# Every script the orchestrator runs appends one compact JSON line to a local
+# history store:
+#
+#   {"mode":"hourly","script":"/etc/immutablue/scripts/user/hourly/10-x.sh",
+#    "start":1760000000.12,"duration":1.234,"exit_code":0,"timed_out":false,
+#    "max_rss_kb":5120}
+#
+# The store lives in /var/lib/immutablue/hooks/ for the system units and in
+# ${XDG_STATE_HOME:-~/.local/state}/immutablue/hooks/ for the user units. Once
+# the file grows past MAX_BYTES it is rotated to history.jsonl.1, so the store
+# never holds more than twice that.
+#
+# `immutablue hooks stats` reads the store back and reports, per script, the
+# number of runs, the failure rate and the p50/p95 durations over a time window:
+#
+#   immutablue hooks stats [--since 7d] [--mode daily] [--system|--user] [--json]
+
+import os
+import re
+import sys
+import json
+import time
+import fcntl
+
+SYSTEM_HISTORY_FILE = '/var/lib/immutablue/hooks/history.jsonl'
+USER_HISTORY_FILE = os.path.join(
+    os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'),
+    'immutablue',
+    'hooks',
+    'history.jsonl',
+)
+
+# Rotate the store once it is larger than this
+MAX_BYTES = 1024 * 1024
+
+DEFAULT_SINCE = '7d'
+
+_DURATION_RE = re.compile(r'^(?P<value>\d+(?:\.\d+)?)(?P<unit>[smhdw]?)$')
+_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def history_file(system=None):
+    """Return the store for the system (root) or the current user.
+
+    Args:
+        system: True for the system store, False for the user store, None to
+            pick based on the current uid
+    """
+    if system is None:
+        system = os.getuid() == 0
+    return SYSTEM_HISTORY_FILE if system else USER_HISTORY_FILE
+
+
+def append_record(mode, result, path=None):
+    """Append one orchestrator result to the history store.
+
+    Args:
+        mode: Orchestrator mode the script ran in (on_boot, hourly, ...)
+        result: Result dict from immutablue_orchestrator.run()
+        path: Store to append to, defaults to history_file()
+    """
+    path = path or history_file()
+    record = {
+        'mode': mode,
+        'script': result['script'],
+        'start': round(result['start'], 3),
+        'duration': result['duration'],
+        'exit_code': result['exit_code'],
+        'timed_out': result.get('timed_out', False),
+        'max_rss_kb': result.get('max_rss_kb'),
+    }
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    while True:
+        with open(path, 'a') as f:
+            # Parallel scripts finish concurrently and several orchestrators
+            # (hourly and daily, say) may share a store
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Another writer may have rotated the store while this one
+                # waited for the lock, leaving f on what is now the .1 file
+                opened = os.fstat(f.fileno())
+                try:
+                    current = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if (opened.st_dev, opened.st_ino) != (current.st_dev, current.st_ino):
+                    continue
+                if opened.st_size >= MAX_BYTES:
+                    os.replace(path, path + '.1')
+                    continue
+                f.write(line)
+                f.flush()
+                return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_records(path, since=None, mode=None):
+    """Yield the records of a store, oldest first.
+
+    Args:
+        path: Store to read, its rotated file is read first
+        since: Only yield records that started at or after this epoch time
+        mode: Only yield records of this mode
+    """
+    for candidate in (path + '.1', path):
+        try:
+            f = open(candidate, 'r')
+        except OSError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or 'script' not in record:
+                    continue
+                if since is not None and record.get('start', 0) < since:
+                    continue
+                if mode is not None and record.get('mode') != mode:
+                    continue
+                yield record
+
+
+def parse_since(value):
+    """Parse a window like `90m`, `24h`, `7d` or `3600` into seconds."""
+    match = _DURATION_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"invalid time window: {value}")
+    return float(match.group('value')) * _UNITS[match.group('unit')]
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def stats(records):
+    """Aggregate records per (mode, script).
+
+    Returns a list of dicts sorted by mode and script with runs, failures,
+    failure_rate, p50, p95 and max duration, and the peak RSS seen.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record.get('mode', ''), record['script']), []).append(record)
+
+    rows = []
+    for (mode, script), runs in sorted(groups.items()):
+        durations = [float(r.get('duration') or 0) for r in runs]
+        failures = sum(1 for r in runs if r.get('exit_code') != 0)
+        rss = [r['max_rss_kb'] for r in runs if isinstance(r.get('max_rss_kb'), int)]
+        rows.append({
+            'mode': mode,
+            'script': script,
+            'runs': len(runs),
+            'failures': failures,
+            'failure_rate': round(failures / len(runs), 4),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'max': max(durations),
+            'max_rss_kb': max(rss) if rss else None,
+        })
+    return rows
+
+
+def print_table(rows, out):
+    """Print stats rows as a plain text table."""
+    if not rows:
+        out.write("No hook runs recorded in this window\n")
+        return
+
+    header = ('MODE', 'SCRIPT', 'RUNS', 'FAIL%', 'P50', 'P95', 'MAX', 'PEAK RSS')
+    lines = [header]
+    for row in rows:
+        lines.append((
+            row['mode'],
+            row['script'],
+            str(row['runs']),
+            f"{row['failure_rate'] * 100:.1f}",
+            f"{row['p50']:.2f}s",
+            f"{row['p95']:.2f}s",
+            f"{row['max']:.2f}s",
+            f"{row['max_rss_kb'] // 1024}M" if row['max_rss_kb'] is not None else '-',
+        ))
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    for line in lines:
+        out.write('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() + '\n')
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: immutablue hooks stats [--since WINDOW] [--mode MODE] [--system|--user] [--json]")
+    print("\nOptions:")
+    print(f"  --since WINDOW   Only runs started in the last WINDOW (e.g. 90m, 24h, 7d; default {DEFAULT_SINCE})")
+    print("  --mode MODE      Only runs of one mode (on_boot, hourly, daily, ...)")
+    print("  --system         Read the system hook history (default as root)")
+    print("  --user           Read the current user's hook history (default otherwise)")
+    print("  --json           Print the statistics as JSON")
+
+
+def main(argv):
+    """Command line entry point."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0 if argv else 1
+
+    if argv[0] != 'stats':
+        print(f"Unknown command: {argv[0]}", file=sys.stderr)
+        print_usage()
+        return 1
+
+    since = DEFAULT_SINCE
+    mode = None
+    system = None
+    as_json = False
+    args = list(argv[1:])
+    while args:
+        arg = args.pop(0)
+        if arg in ('--since', '--mode') and args:
+            value = args.pop(0)
+            if arg == '--since':
+                since = value
+            else:
+                mode = value
+        elif arg == '--system':
+            system = True
+        elif arg == '--user':
+            system = False
+        elif arg == '--json':
+            as_json = True
+        else:
+            print(f"Unknown option: {arg}", file=sys.stderr)
+            print_usage()
+            return 1
+
+    try:
+        window = parse_since(since)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    rows = stats(read_records(history_file(system), since=time.time() - window, mode=mode))
+    if as_json:
+        json.dump(rows, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_table(rows, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
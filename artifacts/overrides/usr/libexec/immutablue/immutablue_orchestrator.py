@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+# immutablue_orchestrator.py
+#
+# Engine behind /usr/bin/immutablue-script-orchestrator.
+#
+# Runs the hook scripts of a mode (on_boot, on_shutdown, hourly, daily, weekly,
+# monthly) from, in order:
+# - /usr/libexec/immutablue/{system,user}/<mode>/
+# - /etc/immutablue/scripts/{system,user}/<mode>/
+# - ${HOME}/.config/immutablue/scripts/<mode>/ (users only)
+#
+# Scripts run one after another in file name order by default. With
+# .immutablue.scripts.max_jobs above 1, scripts that do not depend on each
+# other run in parallel, up to that many at a time. A script declares its
+# ordering and time limit in its leading comment block:
+#
+#   #!/bin/bash
+#   # immutablue-after: 00-on_boot.sh 10-network.sh
+#   # immutablue-timeout: 300
+#
+# `immutablue-after` names scripts (by file name) of the same mode that have to
+# finish before this one starts, whether they succeed or not. `immutablue-timeout`
+# is the wall time limit in seconds (0 disables it) and defaults to
+# .immutablue.scripts.timeout, which is off by default. A script that runs out of
+# time is terminated, so a hung hook cannot stall the systemd unit or timer that
+# started it.
+#
+# Script output is prefixed with the script name and the wall time and exit code
+# of every script are reported once it finishes. Failures never fail the run.
+# Every result is also appended to the hook history (see immutablue_hooks.py),
+# which `immutablue hooks stats` summarizes.
+
+import os
+import re
+import sys
+import glob
+import time
+import signal
+import threading
+import subprocess
+
+MODES = ['on_boot', 'on_shutdown', 'hourly', 'daily', 'weekly', 'monthly']
+
+LIBEXEC_DIR = '/usr/libexec/immutablue'
+ETC_DIR = '/etc/immutablue/scripts'
+USER_DIR = os.path.expanduser('~/.config/immutablue/scripts')
+
+# Used when settings.yaml does not say otherwise. Parallelism and time limits
+# are opt-in, so existing hooks keep their NN- prefix order and run to the end.
+DEFAULT_MAX_JOBS = 1
+DEFAULT_TIMEOUT = 0
+
+# Seconds between SIGTERM and SIGKILL for a script that ran out of time
+KILL_GRACE = 10
+
+# How often the scheduler polls for finished scripts and expired timeouts
+POLL_INTERVAL = 0.05
+
+# Same pattern the shell orchestrator used to skip scripts
+_IGNORE_RE = re.compile(r'\.ignore')
+
+_DIRECTIVE_RE = re.compile(r'^#\s*immutablue-(?P<key>after|timeout)\s*:\s*(?P<value>.*?)\s*$')
+
+_output_lock = threading.Lock()
+
+
+class Script:
+    """A hook script and the directives from its header."""
+
+    def __init__(self, path, after=None, timeout=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.after = after or []
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"Script({self.path!r})"
+
+
+def parse_header(path):
+    """Read the orchestrator directives from a script's leading comment block.
+
+    Args:
+        path: Path to the script
+
+    Returns:
+        (after, timeout) where after is a list of script names and timeout is the
+        declared limit in seconds, or None when the script does not declare one
+    """
+    after = []
+    timeout = None
+    try:
+        with open(path, 'r', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    break
+                match = _DIRECTIVE_RE.match(line)
+                if not match:
+                    continue
+                if match.group('key') == 'after':
+                    after.extend(match.group('value').replace(',', ' ').split())
+                else:
+                    try:
+                        timeout = max(0, int(match.group('value')))
+                    except ValueError:
+                        print(f"Ignoring invalid timeout in {path}: {match.group('value')}")
+    except OSError:
+        pass
+    return after, timeout
+
+
+def script_dirs(mode, is_root):
+    """Return the directories holding the scripts of a mode, in run order."""
+    scope = 'system' if is_root else 'user'
+    dirs = [
+        os.path.join(LIBEXEC_DIR, scope, mode),
+        os.path.join(ETC_DIR, scope, mode),
+    ]
+    if not is_root:
+        dirs.append(os.path.join(USER_DIR, mode))
+    return dirs
+
+
+def discover(dirs):
+    """Return the scripts to run from `dirs`, in the order the shell loop used.
+
+    Args:
+        dirs: Directories to list, each one sorted by file name
+    """
+    scripts = []
+    for directory in dirs:
+        for path in sorted(glob.glob(os.path.join(directory, '*'))):
+            if _IGNORE_RE.search(path):
+                print(f"Ignoring script {path} as it matched ignore pattern")
+                continue
+            if not os.path.isfile(path):
+                continue
+            after, timeout = parse_header(path)
+            scripts.append(Script(path, after, timeout))
+    return scripts
+
+
+def dependencies(scripts):
+    """Map each script index to the set of indices it has to wait for."""
+    by_name = {}
+    for index, script in enumerate(scripts):
+        by_name.setdefault(script.name, []).append(index)
+
+    deps = {}
+    for index, script in enumerate(scripts):
+        deps[index] = set()
+        for name in script.after:
+            if name not in by_name:
+                print(f"{script.name}: ignoring unknown dependency {name}")
+                continue
+            deps[index].update(other for other in by_name[name] if other != index)
+    return deps
+
+
+def relay_output(name, stream):
+    """Copy a script's output to stdout, prefixing every line with its name."""
+    for line in iter(stream.readline, b''):
+        text = line.decode('utf-8', errors='replace').rstrip('\n')
+        with _output_lock:
+            sys.stdout.write(f"[{name}] {text}\n")
+            sys.stdout.flush()
+    stream.close()
+
+
+def log(message):
+    """Print an orchestrator message without interleaving with script output."""
+    with _output_lock:
+        sys.stdout.write(message + '\n')
+        sys.stdout.flush()
+
+
+class Job:
+    """A running script."""
+
+    def __init__(self, index, script, timeout):
+        self.index = index
+        self.script = script
+        self.timeout = timeout
+        self.start = time.time()
+        self.started = time.monotonic()
+        self.killed_at = None
+        self.timed_out = False
+
+        stdin = open(script.path, 'rb')
+        try:
+            # Same invocation as the shell orchestrator: `bash - < script`
+            self.proc = subprocess.Popen(
+                ['bash', '-'],
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        finally:
+            stdin.close()
+        self.relay = threading.Thread(target=relay_output, args=(script.name, self.proc.stdout), daemon=True)
+        self.relay.start()
+
+    def check_timeout(self, now):
+        """Terminate the script once its time is up, then kill it after a grace period."""
+        if not self.timeout:
+            return
+        elapsed = now - self.started
+        if self.killed_at is None and elapsed > self.timeout:
+            log(f"{self.script.path} timed out after {self.timeout}s, terminating")
+            self.timed_out = True
+            self.killed_at = now
+            self.signal(signal.SIGTERM)
+        elif self.killed_at is not None and now - self.killed_at > KILL_GRACE:
+            self.signal(signal.SIGKILL)
+
+    def signal(self, signum):
+        """Signal the script's whole process group."""
+        try:
+            os.killpg(self.proc.pid, signum)
+        except OSError:
+            pass
+
+
+def run(scripts, max_jobs=DEFAULT_MAX_JOBS, default_timeout=DEFAULT_TIMEOUT, on_result=None):
+    """Run scripts in dependency order with at most `max_jobs` at a time.
+
+    Scripts start in their listed order as soon as everything they declared
+    with `immutablue-after` has finished. Dependency cycles are broken by
+    starting the first blocked script.
+
+    Args:
+        scripts: Scripts as returned by discover()
+        max_jobs: Maximum number of scripts running at the same time
+        default_timeout: Time limit for scripts that do not declare one (0 = none)
+        on_result: Optional callback invoked with each result dict
+
+    Returns:
+        A list of result dicts (script, start, duration, exit_code, timed_out,
+        max_rss_kb), in the order the scripts finished
+    """
+    max_jobs = max(1, int(max_jobs))
+    deps = dependencies(scripts)
+    pending = list(range(len(scripts)))
+    done = set()
+    running = {}
+    results = []
+
+    while pending or running:
+        for index in list(pending):
+            if len(running) >= max_jobs:
+                break
+            if deps[index] <= done:
+                pending.remove(index)
+                script = scripts[index]
+                timeout = default_timeout if script.timeout is None else script.timeout
+                try:
+                    job = Job(index, script, timeout)
+                except OSError as e:
+                    log(f"{script.path} could not be started: {e}")
+                    done.add(index)
+                    continue
+                running[job.proc.pid] = job
+
+        if not running:
+            if pending:
+                blocked = scripts[pending[0]]
+                log(f"Dependency cycle around {blocked.name}, starting it anyway")
+                deps[pending[0]] = set()
+            continue
+
+        pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        if pid == 0:
+            now = time.monotonic()
+            for job in running.values():
+                job.check_timeout(now)
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        job = running.pop(pid, None)
+        if job is None:
+            continue
+        # Let subprocess know the child is gone so it does not try to reap it
+        job.proc.returncode = os.waitstatus_to_exitcode(status)
+        job.relay.join(timeout=1)
+        done.add(job.index)
+
+        result = {
+            'script': job.script.path,
+            'start': job.start,
+            'duration': round(time.monotonic() - job.started, 3),
+            'exit_code': job.proc.returncode,
+            'timed_out': job.timed_out,
+            'max_rss_kb': rusage.ru_maxrss,
+        }
+        results.append(result)
+        if result['exit_code'] == 0:
+            log(f"{job.script.path} finished in {result['duration']:.2f}s")
+        else:
+            log(f"{job.script.path} failed with {result['exit_code']} after {result['duration']:.2f}s")
+        if on_result is not None:
+            on_result(result)
+
+    return results
+
+
+def load_settings():
+    """Return (max_jobs, timeout) from settings.yaml, falling back to the defaults."""
+    values = {}
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import immutablue_settings
+        values = dict(immutablue_settings.resolve([
+            '.immutablue.scripts.max_jobs',
+            '.immutablue.scripts.timeout',
+        ]))
+    except Exception as e:
+        print(f"Warning: could not read settings, using defaults: {e}", file=sys.stderr)
+
+    def as_int(expr, default):
+        try:
+            return max(0, int(values.get(expr)))
+        except (TypeError, ValueError):
+            return default
+
+    max_jobs = as_int('.immutablue.scripts.max_jobs', DEFAULT_MAX_JOBS) or DEFAULT_MAX_JOBS
+    timeout = as_int('.immutablue.scripts.timeout', DEFAULT_TIMEOUT)
+    return max_jobs, timeout
+
+
+def history_recorder(mode):
+    """Return an on_result callback that appends results to the hook history.
+
+    Recording is best effort: a missing module or an unwritable store only
+    produces a warning and never fails the run.
+    """
+    try:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import immutablue_hooks
+    except Exception as e:
+        print(f"Warning: hook history disabled: {e}", file=sys.stderr)
+        return None
+
+    def record(result):
+        try:
+            immutablue_hooks.append_record(mode, result)
+        except OSError as e:
+            print(f"Warning: could not record hook history: {e}", file=sys.stderr)
+
+    return record
+
+
+def print_usage():
+    """Print usage information."""
+    print("Use this corrently:")
+    print(f"\t{sys.argv[0]} <{'|'.join(MODES)}>")
+
+
+def main(argv):
+    """Command line entry point, compatible with the original shell script."""
+    if not argv:
+        print_usage()
+        return 1
+
+    mode = argv[0]
+    dirs = script_dirs(mode, os.getuid() == 0)
+
+    # The libexec and etc directories have to exist for a valid mode
+    for directory in dirs[:2]:
+        if not os.path.isdir(directory):
+            print(f"{directory} does not exist or it not a valid mode")
+            print_usage()
+            return 2
+
+    max_jobs, timeout = load_settings()
+    run(discover(dirs), max_jobs=max_jobs, default_timeout=timeout, on_result=history_recorder(mode))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,576 @@
+#!/usr/bin/python3
+# immutablue_packages.py
+#
+# Single pass resolver for packages.yaml.
+#
+# Every list in packages.yaml is split across all/version/architecture variants
+# and, optionally, per build option:
+#
+#   immutablue:
+#     rpm:                # <key>
+#       all: [...]
+#       43: [...]
+#       all_x86_64: [...]
+#       43_x86_64: [...]
+#     rpm_nucleus:        # <key>_<build option>
+#       all: [...]
+#
+# build/99-common.sh:get_yaml_array used to run one `yq` per variant per key. This
+# module loads packages.yaml once and expands every list for a given
+# (VERSION, MARCH, IMMUTABLUE_BUILD_OPTIONS) tuple in exactly the same order
+# get_yaml_array does, writing the result to a JSON manifest:
+#
+#   {
+#     "manifest_version": 1,
+#     "inputs": {"packages": "...", "sha256": "...", "version": "43", "march": "x86_64", "build_options": [...]},
+#     "lists": {".immutablue.rpm": ["pkg", ...], ".immutablue.rpm_rm": [...], ...}
+#   }
+#
+# The same loader also compiles the install plan used by scripts/packages.sh
+# (`immutablue install`): packages.yaml and every packages.custom-*.yaml are read
+# once into one normalized plan of distroboxes, flatpak repos, runtimes and
+# flatpak installs/removals, instead of one `yq` per field per container.
+#
+# Usage:
+#   immutablue_packages.py resolve [--packages FILE] [--version V] [--march M]
+#                                  [--build-options CSV] [--key .path ...]
+#                                  [--output FILE] [--if-stale]
+#   immutablue_packages.py plan [--version V] [--march M] [--output FILE]
+#                               [--if-stale] [--shell] <packages.yaml> [<custom.yaml>...]
+#
+# VERSION, MARCH and IMMUTABLUE_BUILD_OPTIONS default to the environment the
+# build stages run in. With --if-stale an existing manifest or plan is kept as
+# long as it was compiled from the same inputs, so callers can run this cheaply
+# and only the first one pays for parsing the YAML. `plan --shell` prints the
+# plan as bash assignments that scripts/packages.sh sources.
+
+import os
+import sys
+import json
+import hashlib
+import platform
+import shlex
+import subprocess
+import tempfile
+
+DEFAULT_PACKAGES_FILE = '/usr/immutablue/packages.yaml'
+
+# Bump whenever the manifest layout or the expansion order changes
+MANIFEST_VERSION = 1
+
+# Bump whenever the install plan layout changes
+PLAN_VERSION = 1
+
+# Lists the build stages read through get_yaml_array (see build/99-common.sh)
+DEFAULT_KEYS = [
+    '.immutablue.rpm',
+    '.immutablue.pip_packages',
+    '.immutablue.rpm_rm',
+    '.immutablue.rpm_url',
+    '.immutablue.rpm_post_url',
+    '.immutablue.file_rm',
+    '.immutablue.services_unmask_sys',
+    '.immutablue.services_disable_sys',
+    '.immutablue.services_enable_sys',
+    '.immutablue.services_mask_sys',
+    '.immutablue.services_unmask_user',
+    '.immutablue.services_disable_user',
+    '.immutablue.services_enable_user',
+    '.immutablue.services_mask_user',
+    '.immutablue.nix.install',
+]
+
+
+def load_packages(path):
+    """Load a packages YAML file into plain python data.
+
+    PyYAML is used when available. Early build stages may run before
+    python3-yaml is installed, in which case `yq` converts the file to JSON.
+    Keys are normalized to strings either way (e.g. `43:` becomes "43").
+
+    Args:
+        path: Path to the packages YAML file
+    """
+    try:
+        import yaml
+    except ImportError:
+        yaml = None
+
+    if yaml is not None:
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        with open(path, 'r') as f:
+            try:
+                data = yaml.load(f, Loader=loader)
+            except yaml.YAMLError as e:
+                raise ValueError(str(e)) from e
+    else:
+        with open(path, 'r') as f:
+            result = subprocess.run(['yq', '-o=json', '.'], stdin=f, stdout=subprocess.PIPE, text=True, check=True)
+        data = json.loads(result.stdout)
+
+    return json.loads(json.dumps(data or {}, default=str))
+
+
+def file_sha256(path):
+    """Return the hex sha256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_build_options(value):
+    """Split the IMMUTABLUE_BUILD_OPTIONS CSV into a list, dropping empty entries."""
+    return [option for option in (value or '').split(',') if option]
+
+
+def get_path(tree, path):
+    """Return the value at a dotted `.a.b.c` path, or None if any part is missing."""
+    node = tree
+    for part in path.strip('.').split('.'):
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def format_item(value):
+    """Format a list item the way `yq` prints it."""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return str(value)
+
+
+def iterate(value):
+    """Return the items `yq '.x[]'` would print for a value."""
+    if isinstance(value, list):
+        return [format_item(item) for item in value]
+    if isinstance(value, dict):
+        return [format_item(item) for item in value.values()]
+    return []
+
+
+def variants(version, march):
+    """Return the variant names of a list in resolution order."""
+    names = ['all']
+    if version:
+        names.append(str(version))
+    names.append(f'all_{march}')
+    if version:
+        names.append(f'{version}_{march}')
+    return names
+
+
+def expand(tree, key, version, march, build_options):
+    """Expand one list for a (version, march, build options) tuple.
+
+    The order matches get_yaml_array: the base key's variants first, then each
+    build option's `<key>_<option>` variants in the order the options are given.
+
+    Args:
+        tree: Parsed packages.yaml
+        key: Dotted path of the list, e.g. `.immutablue.rpm`
+        version: Fedora version (may be empty)
+        march: Machine architecture, e.g. `x86_64`
+        build_options: List of build options
+    """
+    items = []
+    for base in [key] + [f'{key}_{option}' for option in build_options]:
+        node = get_path(tree, base)
+        if not isinstance(node, dict):
+            continue
+        for name in variants(version, march):
+            items.extend(iterate(node.get(name)))
+    return items
+
+
+def resolve(tree, keys, version, march, build_options):
+    """Expand every key and return {key: [items]}."""
+    return {key: expand(tree, key, version, march, build_options) for key in keys}
+
+
+def build_manifest(packages_file, keys, version, march, build_options):
+    """Load packages.yaml once and build the resolved manifest for a tuple."""
+    tree = load_packages(packages_file)
+    return {
+        'manifest_version': MANIFEST_VERSION,
+        'inputs': manifest_inputs(packages_file, version, march, build_options),
+        'lists': resolve(tree, keys, version, march, build_options),
+    }
+
+
+def manifest_inputs(packages_file, version, march, build_options):
+    """Return the inputs a manifest was resolved from."""
+    return {
+        'packages': os.path.abspath(packages_file),
+        'sha256': file_sha256(packages_file),
+        'version': str(version or ''),
+        'march': march,
+        'build_options': list(build_options),
+    }
+
+
+def is_current(output, packages_file, keys, version, march, build_options):
+    """Return True if `output` is a manifest resolved from the same inputs."""
+    try:
+        with open(output, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(manifest, dict) or manifest.get('manifest_version') != MANIFEST_VERSION:
+        return False
+    try:
+        if manifest.get('inputs') != manifest_inputs(packages_file, version, march, build_options):
+            return False
+    except OSError:
+        return False
+    return all(key in manifest.get('lists', {}) for key in keys)
+
+
+# Per-distrobox lists that also have an `<name>_<arch>` variant
+DISTROBOX_LISTS = [
+    'additional_flags',
+    'packages',
+    'npm_packages',
+    'pip_packages',
+    'cargo_packages',
+    'bin_export',
+    'app_export',
+    'bin_symlink',
+]
+
+# Per-distrobox scalar settings
+DISTROBOX_SETTINGS = ['name', 'image', 'pkg_inst_cmd', 'pkg_updt_cmd', 'extra_commands']
+
+
+def section_items(tree, key, version, march=None):
+    """Return the items of a runtime section for a version and architecture.
+
+    Runtime sections (flatpaks, flatpak repos, ...) are read from
+    `<key>.all`, `<key>.<version>`, `<key>_<arch>.all` and
+    `<key>_<arch>.<version>`, in that order. Null and empty items are dropped.
+
+    Args:
+        tree: Parsed packages YAML file
+        key: Dotted path of the section, e.g. `.immutablue.flatpaks`
+        version: Fedora version (may be empty)
+        march: Machine architecture, None to skip the `<key>_<arch>` variants
+    """
+    names = ['all'] + ([str(version)] if version else [])
+    items = []
+    for base in [key] + ([f'{key}_{march}'] if march else []):
+        node = get_path(tree, base)
+        if not isinstance(node, dict):
+            continue
+        for name in names:
+            value = node.get(name)
+            if isinstance(value, list):
+                items.extend(item for item in value if item is not None and item != '')
+    return items
+
+
+def compile_distrobox(entry, march, source):
+    """Normalize one `.immutablue.distrobox.all[]` entry.
+
+    Args:
+        entry: The distrobox mapping from the packages file
+        march: Machine architecture, used for the `<list>_<arch>` variants
+        source: Packages file the entry came from
+    """
+    box = {'source': source}
+    for setting in DISTROBOX_SETTINGS:
+        value = entry.get(setting)
+        box[setting] = '' if value is None else format_item(value)
+    box['root'] = format_item(entry.get('root')) == 'true'
+    box['rm'] = format_item(entry.get('rm')) == 'true'
+    for name in DISTROBOX_LISTS:
+        box[name] = iterate(entry.get(name)) + iterate(entry.get(f'{name}_{march}'))
+    return box
+
+
+def compile_plan(files, version, march):
+    """Compile the install plan for a list of packages files.
+
+    Every file is parsed once. Distroboxes are kept in file order. Flatpak repos
+    are deduplicated by name (the first URL wins, like `remote-add
+    --if-not-exists`), and flatpak installs and removals are netted out so the
+    last file to mention a ref decides whether it is installed or removed, which
+    is the state the per-file install/uninstall passes ended in.
+
+    Args:
+        files: Packages files, lowest priority (packages.yaml) first
+        version: Fedora version (may be empty)
+        march: Machine architecture
+    """
+    distroboxes = []
+    repos = {}
+    runtimes = []
+    flatpaks = {}
+
+    for path in files:
+        tree = load_packages(path)
+
+        boxes = get_path(tree, '.immutablue.distrobox.all')
+        for entry in boxes if isinstance(boxes, list) else []:
+            if isinstance(entry, dict):
+                distroboxes.append(compile_distrobox(entry, march, path))
+
+        for repo in section_items(tree, '.immutablue.flatpak_repos', version, march):
+            if isinstance(repo, dict) and repo.get('name') and repo.get('url'):
+                repos.setdefault(str(repo['name']), str(repo['url']))
+
+        # Only the GNOME platform is installed up front, the rest are pulled in
+        # as dependencies of the apps
+        version_runtimes = [
+            runtime for runtime in section_items(tree, '.immutablue.flatpaks_runtime', version)
+            if 'org.gnome.platform' in str(runtime).lower()
+        ]
+        if version_runtimes and version_runtimes[0] not in runtimes:
+            runtimes.append(version_runtimes[0])
+
+        for ref in section_items(tree, '.immutablue.flatpaks', version, march):
+            flatpaks.pop(str(ref), None)
+            flatpaks[str(ref)] = True
+        for ref in section_items(tree, '.immutablue.flatpaks_rm', version, march):
+            flatpaks.pop(str(ref), None)
+            flatpaks[str(ref)] = False
+
+    return {
+        'plan_version': PLAN_VERSION,
+        'inputs': plan_inputs(files, version, march),
+        'distrobox': distroboxes,
+        'flatpak': {
+            'repos': [{'name': name, 'url': url} for name, url in repos.items()],
+            'runtimes': runtimes,
+            'install': [ref for ref, wanted in flatpaks.items() if wanted],
+            'uninstall': [ref for ref, wanted in flatpaks.items() if not wanted],
+        },
+    }
+
+
+def plan_inputs(files, version, march):
+    """Return the inputs a plan was compiled from."""
+    return {
+        'files': [{'path': os.path.abspath(path), 'sha256': file_sha256(path)} for path in files],
+        'version': str(version or ''),
+        'march': march,
+    }
+
+
+def read_current_plan(output, files, version, march):
+    """Return the plan stored in `output` if it was compiled from the same inputs."""
+    try:
+        with open(output, 'r') as f:
+            plan = json.load(f)
+        if not isinstance(plan, dict) or plan.get('plan_version') != PLAN_VERSION:
+            return None
+        if plan.get('inputs') != plan_inputs(files, version, march):
+            return None
+    except (OSError, ValueError):
+        return None
+    return plan
+
+
+def shell_array(values):
+    """Render a list as a bash array literal."""
+    return '(' + ' '.join(shlex.quote(str(value)) for value in values) + ')'
+
+
+def render_shell(plan):
+    """Render a plan as bash assignments for scripts/packages.sh.
+
+    Distroboxes become `PLAN_DBOX_<index>_<FIELD>` variables (lists as arrays)
+    next to `PLAN_DBOX_COUNT`, and the flatpak section becomes
+    `PLAN_FLATPAK_*` arrays. The output only needs bash to be consumed, so it
+    can be sourced inside a distrobox that has neither python nor yq.
+    """
+    lines = [f"PLAN_DBOX_COUNT={len(plan['distrobox'])}"]
+    for index, box in enumerate(plan['distrobox']):
+        prefix = f'PLAN_DBOX_{index}_'
+        for setting in ['source'] + DISTROBOX_SETTINGS:
+            lines.append(f"{prefix}{setting.upper()}={shlex.quote(box[setting])}")
+        lines.append(f"{prefix}ROOT={'true' if box['root'] else 'false'}")
+        lines.append(f"{prefix}RM={'true' if box['rm'] else 'false'}")
+        for name in DISTROBOX_LISTS:
+            lines.append(f"{prefix}{name.upper()}={shell_array(box[name])}")
+
+    flatpak = plan['flatpak']
+    lines.append(f"PLAN_FLATPAK_REPOS={shell_array(repo['name'] for repo in flatpak['repos'])}")
+    lines.append(f"PLAN_FLATPAK_REPO_URLS={shell_array(repo['url'] for repo in flatpak['repos'])}")
+    lines.append(f"PLAN_FLATPAK_RUNTIMES={shell_array(flatpak['runtimes'])}")
+    lines.append(f"PLAN_FLATPAK_INSTALL={shell_array(flatpak['install'])}")
+    lines.append(f"PLAN_FLATPAK_UNINSTALL={shell_array(flatpak['uninstall'])}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_manifest(output, manifest):
+    """Atomically write a manifest (or plan) to `output`."""
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.packages.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.write('\n')
+        os.replace(tmp, output)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def print_usage():
+    """Print usage information."""
+    prog_name = os.path.basename(sys.argv[0]) or 'immutablue_packages.py'
+    print(f"Usage: {prog_name} resolve [options]")
+    print(f"       {prog_name} plan [options] <packages.yaml> [<packages.custom-*.yaml>...]")
+    print("\nCommands:")
+    print("  resolve               Resolve the build lists of packages.yaml into a manifest")
+    print("  plan                  Compile the distrobox/flatpak install plan of packages files")
+    print("\nOptions:")
+    print("  --packages FILE       packages.yaml to resolve (default: $PACKAGES_YAML or /usr/immutablue/packages.yaml)")
+    print("  --version V           Fedora version (default: $VERSION or $FEDORA_VERSION)")
+    print("  --march M             Architecture (default: uname -m)")
+    print("  --build-options CSV   Build options (default: $IMMUTABLUE_BUILD_OPTIONS, resolve only)")
+    print("  --key .path           Resolve this list, may be repeated (default: every build list, resolve only)")
+    print("  --output FILE         Write the manifest/plan here instead of stdout")
+    print("  --if-stale            Keep an existing --output file compiled from the same inputs")
+    print("  --shell               Print the plan as bash assignments (plan only)")
+
+
+def parse_options(args, value_options, flag_options):
+    """Parse `--option value` and `--flag` arguments.
+
+    Returns (options, positionals), where options maps each given option name to
+    its value (a list for repeated value options) or True for flags. Raises
+    ValueError on unknown or incomplete options.
+    """
+    options = {}
+    positionals = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in flag_options:
+            options[arg] = True
+        elif arg in value_options:
+            if not args:
+                raise ValueError(f"Missing value for {arg}")
+            options.setdefault(arg, []).append(args.pop(0))
+        elif arg.startswith('-'):
+            raise ValueError(f"Unknown option: {arg}")
+        else:
+            positionals.append(arg)
+    return options, positionals
+
+
+def default_version():
+    """Return the version from the build environment."""
+    return os.environ.get('VERSION') or os.environ.get('FEDORA_VERSION') or ''
+
+
+def cmd_resolve(options):
+    """Handle the `resolve` command."""
+    packages_file = options.get('--packages', [os.environ.get('PACKAGES_YAML') or DEFAULT_PACKAGES_FILE])[-1]
+    version = options.get('--version', [default_version()])[-1]
+    march = options.get('--march', [platform.machine()])[-1]
+    build_options = split_build_options(options.get('--build-options', [os.environ.get('IMMUTABLUE_BUILD_OPTIONS')])[-1])
+    keys = options.get('--key') or DEFAULT_KEYS
+    output = options.get('--output', [None])[-1]
+
+    if output and options.get('--if-stale') and is_current(output, packages_file, keys, version, march, build_options):
+        return 0
+
+    try:
+        manifest = build_manifest(packages_file, keys, version, march, build_options)
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        print(f"Error: could not resolve {packages_file}: {e}", file=sys.stderr)
+        return 1
+
+    if output:
+        write_manifest(output, manifest)
+    else:
+        json.dump(manifest, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+def cmd_plan(options, files):
+    """Handle the `plan` command."""
+    if not files:
+        print("Error: plan needs at least one packages file", file=sys.stderr)
+        return 1
+
+    version = options.get('--version', [default_version()])[-1]
+    march = options.get('--march', [platform.machine()])[-1]
+    output = options.get('--output', [None])[-1]
+
+    plan = None
+    if output and options.get('--if-stale'):
+        plan = read_current_plan(output, files, version, march)
+
+    if plan is None:
+        try:
+            plan = compile_plan(files, version, march)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"Error: could not compile install plan: {e}", file=sys.stderr)
+            return 1
+        if output:
+            write_manifest(output, plan)
+
+    if options.get('--shell'):
+        sys.stdout.write(render_shell(plan))
+    elif not output:
+        json.dump(plan, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+def main(argv):
+    """Command line entry point."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0 if argv else 1
+
+    command = argv[0]
+    if command not in ('resolve', 'plan'):
+        print(f"Unknown command: {command}", file=sys.stderr)
+        print_usage()
+        return 1
+
+    if '-h' in argv[1:] or '--help' in argv[1:]:
+        print_usage()
+        return 0
+
+    try:
+        if command == 'resolve':
+            options, positionals = parse_options(
+                argv[1:],
+                ('--packages', '--version', '--march', '--build-options', '--key', '--output'),
+                ('--if-stale',),
+            )
+            if positionals:
+                raise ValueError(f"Unexpected argument: {positionals[0]}")
+        else:
+            options, positionals = parse_options(
+                argv[1:],
+                ('--version', '--march', '--output'),
+                ('--if-stale', '--shell'),
+            )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    if command == 'resolve':
+        return cmd_resolve(options)
+    return cmd_plan(options, positionals)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
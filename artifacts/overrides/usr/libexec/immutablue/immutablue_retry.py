@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# immutablue_retry.py
+#
+# Retry with exponential backoff, jitter and a deadline.
+#
+# This is the Python side of immutablue_retry in immutablue-header.sh and uses
+# the same policy: the delay doubles from `initial` up to `max_delay`, each one
+# randomized to between half and all of it, and no attempt starts once
+# `deadline` seconds have passed. With wait_online a delay ends early as soon
+# as NetworkManager reports the network online (what network-online.target
+# waits for), so work that needs the network resumes the moment it is up.
+#
+# From Python:
+#   sys.path.insert(0, '/usr/libexec/immutablue')
+#   from immutablue_retry import retry
+#   data = retry(fetch, deadline=60, wait_online=True, retry_on=(OSError,))
+#
+# From the command line (retries until COMMAND exits 0):
+#   immutablue_retry.py [--deadline S] [--initial S] [--max-delay S] [--wait-online] -- COMMAND [ARGS...]
+
+import sys
+import time
+import random
+import shutil
+import subprocess
+
+DEFAULT_DEADLINE = 300
+DEFAULT_INITIAL = 1
+DEFAULT_MAX_DELAY = 30
+
+
+def delays(initial=DEFAULT_INITIAL, max_delay=DEFAULT_MAX_DELAY, rand=random.uniform):
+    """Yield the jittered delays between attempts, forever.
+
+    Args:
+        initial: First (unjittered) delay in seconds
+        max_delay: Cap on the unjittered delay
+        rand: uniform(a, b) used for the jitter, replaceable in tests
+    """
+    delay = initial
+    while True:
+        yield rand(delay / 2, delay)
+        delay = min(delay * 2, max_delay)
+
+
+def network_online(timeout=0):
+    """Return whether NetworkManager reports the network online.
+
+    Waits up to `timeout` seconds for it to come online. Returns None when
+    nm-online is not available, so callers can fall back to sleeping.
+    """
+    if not shutil.which('nm-online'):
+        return None
+    try:
+        return subprocess.run(
+            ['nm-online', '-q', '-t', str(int(timeout))],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ).returncode == 0
+    except OSError:
+        return None
+
+
+def wait(seconds, wait_online=False, sleep=time.sleep, clock=time.monotonic):
+    """Sleep between attempts, ending early when the network comes online."""
+    if wait_online and network_online(0) is False:
+        started = clock()
+        if network_online(max(1, round(seconds))):
+            return
+        # nm-online gave up early (e.g. NetworkManager is not running)
+        seconds -= clock() - started
+    if seconds > 0:
+        sleep(seconds)
+
+
+def retry(func, deadline=DEFAULT_DEADLINE, initial=DEFAULT_INITIAL, max_delay=DEFAULT_MAX_DELAY,
+          wait_online=False, retry_on=(), clock=time.monotonic, sleep=time.sleep, rand=random.uniform):
+    """Call `func` until it returns a truthy value or the deadline passes.
+
+    Args:
+        func: Callable taking no arguments
+        deadline: Seconds after which no new attempt is started
+        initial: First delay in seconds
+        max_delay: Longest delay in seconds
+        wait_online: End delays early when the network comes online
+        retry_on: Exception types that count as a failed attempt
+        clock, sleep, rand: Replaceable in tests
+
+    Returns:
+        The first truthy result, or the last falsy one at the deadline. An
+        exception from `retry_on` raised by the last attempt is re-raised.
+    """
+    stop_at = clock() + deadline
+    for delay in delays(initial, max_delay, rand):
+        error = None
+        try:
+            result = func()
+            if result:
+                return result
+        except retry_on as e:
+            error = e
+            result = None
+
+        remaining = stop_at - clock()
+        if remaining <= 0:
+            if error is not None:
+                raise error
+            return result
+        wait(min(delay, remaining), wait_online, sleep=sleep, clock=clock)
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: immutablue_retry.py [--deadline S] [--initial S] [--max-delay S] [--wait-online] -- COMMAND [ARGS...]")
+    print("\nRuns COMMAND until it exits 0, backing off exponentially between attempts.")
+    print("\nOptions:")
+    print(f"  --deadline S   Do not start an attempt after S seconds (default {DEFAULT_DEADLINE})")
+    print(f"  --initial S    First delay in seconds (default {DEFAULT_INITIAL})")
+    print(f"  --max-delay S  Longest delay in seconds (default {DEFAULT_MAX_DELAY})")
+    print("  --wait-online  End delays early when the network comes online")
+
+
+def main(argv):
+    """Command line entry point, exits with the last attempt's status."""
+    options = {'deadline': DEFAULT_DEADLINE, 'initial': DEFAULT_INITIAL, 'max_delay': DEFAULT_MAX_DELAY}
+    wait_online = False
+    args = list(argv)
+    while args and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if arg in ('-h', '--help'):
+            print_usage()
+            return 0
+        if arg == '--wait-online':
+            wait_online = True
+        elif arg in ('--deadline', '--initial', '--max-delay') and args:
+            try:
+                options[arg[2:].replace('-', '_')] = float(args.pop(0))
+            except ValueError:
+                print(f"Error: {arg} needs a number of seconds", file=sys.stderr)
+                return 2
+        else:
+            print(f"Unknown option: {arg}", file=sys.stderr)
+            print_usage()
+            return 2
+
+    if not args:
+        print_usage()
+        return 2
+
+    status = {'code': 1}
+
+    def attempt():
+        try:
+            status['code'] = subprocess.run(args).returncode
+        except OSError as e:
+            print(f"Error: cannot run {args[0]}: {e}", file=sys.stderr)
+            status['code'] = 127
+        return status['code'] == 0
+
+    retry(attempt, wait_online=wait_online, **options)
+    return status['code']
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+# immutablue_settings.py
+#
+# Settings engine behind /usr/bin/immutablue-settings.
+#
+# The settings hierarchy is made of (up to) three YAML files, highest priority first:
+# - ${HOME}/.config/immutablue/settings.yaml
+# - /etc/immutablue/settings.yaml
+# - /usr/immutablue/settings.yaml
+#
+# Instead of running one `yq` per file for every single lookup, the hierarchy is
+# parsed once, deep-merged into a single resolved tree and serialized as compact
+# JSON into a per-user cache. The cache is keyed on the (device, inode, mtime,
+# size) of every file in the hierarchy, so editing any settings file invalidates
+# it on the next lookup. Any number of keys can be resolved in one invocation.
+#
+# Queries use the same yq-style paths as before (`.immutablue.profile.enable_starship`,
+# `.a.b[0]`, `.a.b[]`). Anything more elaborate than a plain path (pipes, select(),
+# ...) is handed to `yq` per file, exactly like the original shell implementation.
+#
+# Output modes:
+# - default:  print each resolved value on its own line (unset values print nothing)
+# - --shell:  print `NAME='value'` assignments for `eval`, one per query
+# - --null:   print every value (unset as empty) terminated by a NUL byte
+#
+# In --shell mode the variable name is derived from the path
+# (`.immutablue.run_bootc_update` -> IMMUTABLUE_RUN_BOOTC_UPDATE) or given
+# explicitly as `NAME=.path`:
+#
+#   eval "$(immutablue-settings --shell bootc=.immutablue.run_bootc_update .immutablue.run_brew_update)"
+#   echo "${bootc} ${IMMUTABLUE_RUN_BREW_UPDATE}"
+
+import os
+import sys
+import json
+import re
+import shlex
+import subprocess
+import tempfile
+
+# Settings files, highest priority first
+FILE_ORDER = [
+    os.path.expanduser('~/.config/immutablue/settings.yaml'),
+    '/etc/immutablue/settings.yaml',
+    '/usr/immutablue/settings.yaml',
+]
+
+# Resolved tree cache (one per user since the hierarchy includes ${HOME})
+CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'immutablue',
+    'settings.json',
+)
+
+# Bump whenever the cache layout or the merge semantics change
+CACHE_VERSION = 1
+
+# A single path segment: .key  ."quoted key"  ["quoted key"]  [N]  []
+_SEGMENT_RE = re.compile(
+    r'\.(?P<key>[A-Za-z0-9_\-]+)'
+    r'|\.?"(?P<dq>[^"]*)"'
+    r'|\.?\[\s*"(?P<bq>[^"]*)"\s*\]'
+    r'|\.?\[\s*(?P<index>-?\d+)\s*\]'
+    r'|\.?\[\s*\](?P<splat>)'
+)
+
+# `NAME=.path` query prefix used to name the variable in --shell mode
+_NAMED_QUERY_RE = re.compile(r'^(?P<name>[A-Za-z_][A-Za-z0-9_]*)=(?P<expr>\..*)$', re.DOTALL)
+
+
+class UnsupportedQuery(ValueError):
+    """Raised when a query is not a plain path and has to be handled by yq."""
+
+
+def is_unset(value):
+    """Return True for values the hierarchy treats as "not set" (null or empty)."""
+    return value is None or value == ''
+
+
+def deep_merge(base, override):
+    """Merge `override` on top of `base` and return the result.
+
+    Mappings are merged recursively. Any other value in `override` replaces the
+    one in `base`, unless it is unset (null or an empty string), in which case the
+    lower priority value is kept. This mirrors the "first non-null value wins"
+    lookup the shell implementation did per key.
+    """
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for key, value in override.items():
+            if key in merged:
+                merged[key] = deep_merge(merged[key], value)
+            elif not is_unset(value):
+                merged[key] = value
+        return merged
+
+    if is_unset(override):
+        return base
+    return override
+
+
+def file_signature(path):
+    """Return the identity of a settings file used to key the cache."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [path, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size]
+
+
+def cache_key():
+    """Return the cache key for the current state of the hierarchy."""
+    return [CACHE_VERSION] + [file_signature(path) for path in FILE_ORDER]
+
+
+def load_tree():
+    """Parse every settings file and merge them into one resolved tree."""
+    # Only pay for the yaml import when the cache is cold
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+    tree = {}
+    # Walk lowest priority first so higher priority files are merged on top
+    for path in reversed(FILE_ORDER):
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path, 'r') as f:
+                data = yaml.load(f, Loader=loader)
+        except (OSError, yaml.YAMLError) as e:
+            print(f"Warning: could not parse {path}: {e}", file=sys.stderr)
+            continue
+        if data is not None:
+            tree = deep_merge(tree, data)
+
+    # Round-trip through JSON so a freshly parsed tree and a cached tree are
+    # identical (e.g. integer keys like `42:` always become strings)
+    return json.loads(json.dumps(tree, default=str))
+
+
+def read_cache(key):
+    """Return the cached tree if it matches `key`, otherwise None."""
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    return cached.get('tree')
+
+
+def write_cache(key, tree):
+    """Atomically write the resolved tree to the cache. Failures are ignored."""
+    cache_dir = os.path.dirname(CACHE_FILE)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.settings.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'tree': tree}, f, separators=(',', ':'))
+            os.replace(tmp_path, CACHE_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+
+def get_tree(use_cache=True):
+    """Return the resolved settings tree, served from the cache when possible."""
+    if not use_cache:
+        return load_tree()
+
+    key = cache_key()
+    tree = read_cache(key)
+    if tree is None:
+        tree = load_tree()
+        write_cache(key, tree)
+    return tree
+
+
+def parse_path(expr):
+    """Split a yq-style path into segments.
+
+    Returns a list of ('key', str), ('index', int) or ('splat', None) tuples.
+    Raises UnsupportedQuery for anything that is not a plain path.
+    """
+    expr = expr.strip()
+    if not expr.startswith('.'):
+        raise UnsupportedQuery(expr)
+    if expr == '.':
+        return []
+
+    segments = []
+    pos = 0
+    while pos < len(expr):
+        match = _SEGMENT_RE.match(expr, pos)
+        if match is None or match.end() == pos:
+            raise UnsupportedQuery(expr)
+        if match.group('key') is not None:
+            segments.append(('key', match.group('key')))
+        elif match.group('dq') is not None:
+            segments.append(('key', match.group('dq')))
+        elif match.group('bq') is not None:
+            segments.append(('key', match.group('bq')))
+        elif match.group('index') is not None:
+            segments.append(('index', int(match.group('index'))))
+        else:
+            segments.append(('splat', None))
+        pos = match.end()
+    return segments
+
+
+def query(tree, expr):
+    """Evaluate a yq-style path against the tree and return the list of results."""
+    results = [tree]
+    for kind, arg in parse_path(expr):
+        next_results = []
+        for node in results:
+            if kind == 'key':
+                next_results.append(node.get(arg) if isinstance(node, dict) else None)
+            elif kind == 'index':
+                if isinstance(node, list) and -len(node) <= arg < len(node):
+                    next_results.append(node[arg])
+                else:
+                    next_results.append(None)
+            elif isinstance(node, dict):
+                next_results.extend(node.values())
+            elif isinstance(node, list):
+                next_results.extend(node)
+        results = next_results
+    return results
+
+
+def format_value(value):
+    """Format a value the way `yq` prints it."""
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        import yaml
+        return yaml.safe_dump(value, default_flow_style=False, sort_keys=False).rstrip('\n')
+    return str(value)
+
+
+def legacy_lookup(expr):
+    """Resolve a query by running yq against each file, first match wins."""
+    for path in FILE_ORDER:
+        if not os.path.isfile(path):
+            continue
+        try:
+            with open(path, 'r') as f:
+                result = subprocess.run(['yq', expr], stdin=f, stdout=subprocess.PIPE, text=True)
+        except OSError:
+            return None
+        value = result.stdout.rstrip('\n')
+        if value != '' and value != 'null':
+            return value
+    return None
+
+
+def lookup(tree, expr):
+    """Resolve a single query and return its printable value, or None if unset."""
+    try:
+        results = query(tree, expr)
+    except UnsupportedQuery:
+        return legacy_lookup(expr)
+
+    results = [value for value in results if not is_unset(value)]
+    if not results:
+        return None
+    return '\n'.join(format_value(value) for value in results)
+
+
+def resolve(exprs, use_cache=True):
+    """Resolve many queries against one parse of the hierarchy.
+
+    Returns a list of (expr, value) tuples where value is None when unset.
+    """
+    tree = get_tree(use_cache=use_cache)
+    return [(expr, lookup(tree, expr)) for expr in exprs]
+
+
+def split_query(arg):
+    """Split a `NAME=.path` argument into (name, expr).
+
+    Plain paths get a name derived from the path itself.
+    """
+    match = _NAMED_QUERY_RE.match(arg)
+    if match:
+        return match.group('name'), match.group('expr')
+    return shell_name(arg), arg
+
+
+def shell_name(expr):
+    """Derive a shell variable name from a path (`.a.b-c` -> `A_B_C`)."""
+    name = re.sub(r'[^A-Za-z0-9_]', '_', expr.lstrip('.')).upper()
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name
+
+
+def print_usage():
+    """Print usage information."""
+    prog_name = 'immutablue-settings'
+    print(f"Usage: {prog_name} [--no-cache] [--shell|--null] <setting> [<setting>...]")
+    print("\nOptions:")
+    print("  --shell, -s    Print NAME='value' assignments suitable for eval")
+    print("  --null, -0     Print each value terminated by a NUL byte")
+    print("  --no-cache     Ignore and do not update the resolved settings cache")
+    print("\nIn --shell mode a setting may be given as NAME=.path to pick the variable name.")
+
+
+def main(argv):
+    """Command line entry point, compatible with the original shell script."""
+    use_cache = True
+    mode = 'plain'
+    queries = []
+    for arg in argv:
+        if arg == '--no-cache':
+            use_cache = False
+        elif arg in ('-s', '--shell'):
+            mode = 'shell'
+        elif arg in ('-0', '--null'):
+            mode = 'null'
+        elif arg in ('-h', '--help'):
+            print_usage()
+            return 0
+        else:
+            queries.append(split_query(arg))
+
+    if not queries:
+        print_usage()
+        return 1
+
+    results = resolve([expr for _, expr in queries], use_cache=use_cache)
+    out = sys.stdout
+    for (name, _), (_, value) in zip(queries, results):
+        if mode == 'shell':
+            out.write(f"{name}={shlex.quote(value or '')}\n")
+        elif mode == 'null':
+            out.write(f"{value or ''}\0")
+        elif value is not None:
+            out.write(f"{value}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
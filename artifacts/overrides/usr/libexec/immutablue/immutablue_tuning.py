@@ -0,0 +1,463 @@
+#!/usr/bin/python3
+# immutablue_tuning.py
+#
+# Pick tuning profiles for this machine from its hardware inventory and apply
+# them, reversibly.
+#
+# Profiles are declared in /usr/immutablue/tuning.yaml (overridable by id in
+# /etc/immutablue/tuning.yaml) and matched against the inventory kept by
+# immutablue_hardware.py. Their settings become a handful of drop-in files
+# (sysctl.d, zram-generator.conf.d, udev rules, tmpfiles.d, modprobe.d) and
+# are also written to the running system through /proc/sys and /sys.
+#
+# Whatever a run changes is recorded in STATE_FILE first: the previous
+# contents of every file (or that it did not exist) and the previous value of
+# every live setting. `revert` puts all of it back, and `apply` reverts the
+# last run before applying again, so repeated runs never stack up.
+#
+# Usage:
+#   immutablue_tuning.py plan [--json]
+#   immutablue_tuning.py apply [--dry-run] [--json]
+#   immutablue_tuning.py revert [--dry-run]
+#   immutablue_tuning.py status
+#   immutablue_tuning.py value SETTING     (e.g. zfs_arc_max, cpu.epp)
+
+import os
+import sys
+import glob
+import json
+import tempfile
+from datetime import datetime, timezone
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import immutablue_hardware as hardware
+
+DEFAULT_PROFILES_FILE = '/usr/immutablue/tuning.yaml'
+SYSTEM_PROFILES_FILE = '/etc/immutablue/tuning.yaml'
+BUILD_OPTIONS_FILE = '/usr/immutablue/build_options'
+
+# What the last apply changed, so it can be reverted
+STATE_FILE = '/var/lib/immutablue/tuning.json'
+STATE_SCHEMA_VERSION = 1
+
+# Drop-in files written for each kind of setting
+SYSCTL_FILE = '/etc/sysctl.d/60-immutablue-tuning.conf'
+ZRAM_FILE = '/etc/systemd/zram-generator.conf.d/60-immutablue-tuning.conf'
+UDEV_FILE = '/etc/udev/rules.d/60-immutablue-tuning.rules'
+TMPFILES_FILE = '/etc/tmpfiles.d/60-immutablue-tuning.conf'
+MODPROBE_FILE = '/etc/modprobe.d/60-immutablue-tuning.conf'
+
+# Live settings
+PROC_SYS = '/proc/sys'
+SYS_BLOCK = '/sys/block'
+SYS_CPU = '/sys/devices/system/cpu'
+ZFS_ARC_MAX = '/sys/module/zfs/parameters/zfs_arc_max'
+
+SETTINGS = ('zram', 'sysctl', 'io_scheduler', 'cpu', 'zfs_arc_max')
+
+# udev matches for each disk type of io_scheduler (whole disks, partitions
+# have no queue of their own)
+UDEV_DISK = 'SUBSYSTEM=="block", ENV{DEVTYPE}=="disk"'
+UDEV_MATCHES = {
+    'nvme': f'{UDEV_DISK}, KERNEL=="nvme[0-9]*n[0-9]*"',
+    'ssd': f'{UDEV_DISK}, KERNEL=="sd[a-z]*|mmcblk[0-9]*|vd[a-z]*", ATTR{{queue/rotational}}=="0"',
+    'hdd': f'{UDEV_DISK}, KERNEL=="sd[a-z]*|vd[a-z]*", ATTR{{queue/rotational}}=="1"',
+}
+
+# cpufreq drivers in active mode, whose powersave governor still follows the
+# load as steered by the EPP. With any other driver powersave pins the CPUs
+# to their lowest frequency, so it is not set there.
+ACTIVE_PSTATE_DRIVERS = ('intel_pstate', 'amd-pstate-epp')
+
+HEADER = "# Written by immutablue_tuning.py from the tuning profiles: {profiles}\n" \
+         "# Undo with `immutablue tuning revert`\n"
+
+
+def load_profiles():
+    """Return the enabled profiles, system profiles replacing default ones by id."""
+    profiles = []
+    for path in (DEFAULT_PROFILES_FILE, SYSTEM_PROFILES_FILE):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            data = yaml.safe_load(f) or {}
+        for profile in data.get('profiles') or []:
+            if not isinstance(profile, dict) or 'id' not in profile:
+                continue
+            profiles = [p for p in profiles if p['id'] != profile['id']]
+            profiles.append(profile)
+    return [p for p in profiles if p.get('enabled', True)]
+
+
+def build_options():
+    """The options this image was built with."""
+    try:
+        with open(BUILD_OPTIONS_FILE, 'r') as f:
+            return {option.strip() for option in f.read().split(',') if option.strip()}
+    except OSError:
+        return set()
+
+
+def matches(when, inventory, options):
+    """Whether every condition of a profile's `when` holds.
+
+    Args:
+        when: The profile's conditions (None always matches)
+        inventory: A hardware inventory
+        options: The image's build options
+    """
+    when = when or {}
+    memory_gib = inventory['memory']['total_bytes'] / 1024 ** 3
+    for key, expected in when.items():
+        if key == 'chassis':
+            expected = expected if isinstance(expected, list) else [expected]
+            if inventory['system']['chassis'] not in expected:
+                return False
+        elif key == 'memory_gib_min':
+            if memory_gib < expected:
+                return False
+        elif key == 'memory_gib_max':
+            if memory_gib > expected:
+                return False
+        elif key == 'build_option':
+            if expected not in options:
+                return False
+        elif key == 'not_build_option':
+            if expected in options:
+                return False
+        else:
+            raise ValueError(f"unknown condition: {key}")
+    return True
+
+
+def select(profiles, inventory, options):
+    """Return (matching profile ids, merged settings)."""
+    selected = []
+    settings = {}
+    for profile in profiles:
+        if not matches(profile.get('when'), inventory, options):
+            continue
+        selected.append(profile['id'])
+        for kind, value in (profile.get('settings') or {}).items():
+            if kind not in SETTINGS:
+                raise ValueError(f"profile {profile['id']}: unknown setting: {kind}")
+            if isinstance(value, dict):
+                settings.setdefault(kind, {}).update(value)
+            else:
+                settings[kind] = value
+    return selected, settings
+
+
+def disk_type(disk):
+    """nvme, ssd or hdd for an inventory disk."""
+    if disk['transport'] == 'nvme':
+        return 'nvme'
+    return 'hdd' if disk['rotational'] else 'ssd'
+
+
+def active_pstate():
+    """Whether the CPUs are run by a cpufreq driver in active mode."""
+    driver = (_read(os.path.join(SYS_CPU, 'cpu0', 'cpufreq', 'scaling_driver')) or '').strip()
+    return driver in ACTIVE_PSTATE_DRIVERS
+
+
+def arc_max_bytes(value, inventory):
+    """Resolve zfs_arc_max, a byte count or a percentage of memory."""
+    value = str(value).strip()
+    if value.endswith('%'):
+        return int(inventory['memory']['total_bytes'] * float(value[:-1]) / 100)
+    return int(value)
+
+
+def plan(inventory=None, profiles=None, options=None):
+    """Work out what applying the matching profiles would change.
+
+    Returns:
+        A dict with the selected `profiles`, the merged `settings`, the
+        drop-in `files` ({path: contents}) and the `live` values
+        ({path: value}) to write to the running system
+    """
+    inventory = inventory or hardware.refresh()
+    profiles = load_profiles() if profiles is None else profiles
+    options = build_options() if options is None else options
+    selected, settings = select(profiles, inventory, options)
+    header = HEADER.format(profiles=', '.join(selected))
+    files = {}
+    live = {}
+
+    if settings.get('zram'):
+        lines = [f"{key} = {value}" for key, value in settings['zram'].items()]
+        files[ZRAM_FILE] = header + "[zram0]\n" + '\n'.join(lines) + "\n"
+
+    if settings.get('sysctl'):
+        files[SYSCTL_FILE] = header + ''.join(f"{key} = {value}\n" for key, value in settings['sysctl'].items())
+        for key, value in settings['sysctl'].items():
+            live[os.path.join(PROC_SYS, *key.split('.'))] = str(value)
+
+    if settings.get('io_scheduler'):
+        rules = []
+        for kind, scheduler in settings['io_scheduler'].items():
+            if kind in UDEV_MATCHES:
+                rules.append(f'ACTION=="add|change", {UDEV_MATCHES[kind]}, ATTR{{queue/scheduler}}="{scheduler}"')
+        files[UDEV_FILE] = header + '\n'.join(rules) + "\n"
+        for disk in inventory['disks']:
+            scheduler = settings['io_scheduler'].get(disk_type(disk))
+            if scheduler:
+                live[os.path.join(SYS_BLOCK, disk['name'], 'queue', 'scheduler')] = scheduler
+
+    if settings.get('cpu'):
+        entries = []
+        for key, attribute in (('governor', 'scaling_governor'), ('epp', 'energy_performance_preference')):
+            value = settings['cpu'].get(key)
+            if not value:
+                continue
+            if key == 'governor' and value == 'powersave' and not active_pstate():
+                continue
+            pattern = os.path.join(SYS_CPU, 'cpu[0-9]*', 'cpufreq', attribute)
+            entries.append(f"w {pattern} - - - - {value}")
+            for path in sorted(glob.glob(pattern)):
+                live[path] = str(value)
+        if entries:
+            files[TMPFILES_FILE] = header + '\n'.join(entries) + "\n"
+
+    if settings.get('zfs_arc_max') is not None:
+        arc_max = arc_max_bytes(settings['zfs_arc_max'], inventory)
+        files[MODPROBE_FILE] = header + f"options zfs zfs_arc_max={arc_max}\n"
+        if os.path.exists(ZFS_ARC_MAX):
+            live[ZFS_ARC_MAX] = str(arc_max)
+
+    return {'profiles': selected, 'settings': settings, 'files': files, 'live': live}
+
+
+def _read(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _current_live(path):
+    """Current value of a live setting, the selected one for [bracketed] lists."""
+    value = (_read(path) or '').strip()
+    if '[' in value and ']' in value:
+        return value[value.index('[') + 1:value.index(']')]
+    return value
+
+
+def _write_file(path, contents):
+    """Atomically write a file, creating its directory."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tuning-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(contents)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _write_live(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def load_state():
+    """The record of the last apply, or None."""
+    try:
+        with open(STATE_FILE, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) and state.get('schema_version') == STATE_SCHEMA_VERSION else None
+
+
+def revert(dry_run=False):
+    """Undo the last apply.
+
+    Returns:
+        A list of human readable actions (taken, or that would be taken)
+    """
+    state = load_state()
+    actions = []
+    if not state:
+        return actions
+
+    for path, previous in state['files'].items():
+        if previous is None:
+            actions.append(f"remove {path}")
+            if not dry_run and os.path.exists(path):
+                os.unlink(path)
+        else:
+            actions.append(f"restore {path}")
+            if not dry_run:
+                _write_file(path, previous)
+
+    for path, previous in state['live'].items():
+        actions.append(f"set {path} = {previous}")
+        if not dry_run:
+            try:
+                _write_live(path, previous)
+            except OSError:
+                pass
+
+    if not dry_run:
+        os.unlink(STATE_FILE)
+    return actions
+
+
+def apply(dry_run=False, inventory=None):
+    """Apply the matching profiles, reverting the previous apply first.
+
+    Returns:
+        A dict with the applied `profiles`, the `actions` taken and the live
+        settings that could not be written (`errors`)
+    """
+    planned = plan(inventory)
+    result = {'profiles': planned['profiles'], 'actions': [], 'errors': []}
+    if dry_run:
+        result['actions'] = [f"write {path}" for path in planned['files']] \
+            + [f"set {path} = {value}" for path, value in planned['live'].items()]
+        return result
+
+    revert()
+
+    # Record what is about to change before changing it
+    state = {
+        'schema_version': STATE_SCHEMA_VERSION,
+        'applied': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'profiles': planned['profiles'],
+        'files': {path: _read(path) for path in planned['files']},
+        'live': {path: _current_live(path) for path in planned['live'] if os.path.exists(path)},
+    }
+    _write_file(STATE_FILE, json.dumps(state, indent=2) + "\n")
+
+    for path, contents in planned['files'].items():
+        _write_file(path, contents)
+        result['actions'].append(f"write {path}")
+
+    for path, value in planned['live'].items():
+        if path not in state['live']:
+            continue
+        try:
+            _write_live(path, value)
+            result['actions'].append(f"set {path} = {value}")
+        except OSError as e:
+            # e.g. a governor or scheduler the hardware does not offer
+            result['errors'].append(f"{path}: {e.strerror or e}")
+            del state['live'][path]
+    _write_file(STATE_FILE, json.dumps(state, indent=2) + "\n")
+    return result
+
+
+def value(setting, inventory=None):
+    """The resolved value of one setting (`zfs_arc_max`, `cpu.epp`, ...) or None."""
+    inventory = inventory or hardware.refresh()
+    _, settings = select(load_profiles(), inventory, build_options())
+    kind, _, key = setting.partition('.')
+    resolved = settings.get(kind)
+    if key:
+        resolved = resolved.get(key) if isinstance(resolved, dict) else None
+    if kind == 'zfs_arc_max' and resolved is not None:
+        resolved = arc_max_bytes(resolved, inventory)
+    return resolved
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: immutablue_tuning.py COMMAND [OPTIONS]")
+    print("\nApply the hardware tuning profiles from tuning.yaml.")
+    print("\nCommands:")
+    print("  plan [--json]               Show the matching profiles and what they would change")
+    print("  apply [--dry-run] [--json]  Apply them (reverting the previous apply first)")
+    print("  revert [--dry-run]          Undo the last apply")
+    print("  status                      Show what is currently applied")
+    print("  value SETTING               Print one resolved setting, e.g. zfs_arc_max")
+    print("\nProfiles:")
+    print(f"  {SYSTEM_PROFILES_FILE} (overrides by id)")
+    print(f"  {DEFAULT_PROFILES_FILE}")
+
+
+def main(argv):
+    """Command line entry point."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0 if argv else 1
+
+    command, args = argv[0], argv[1:]
+    allowed = {'plan': {'--json'}, 'apply': {'--dry-run', '--json'}, 'revert': {'--dry-run'}, 'status': set()}
+    if command == 'value':
+        if len(args) != 1:
+            print_usage()
+            return 1
+        resolved = value(args[0])
+        if resolved is None:
+            return 1
+        print(json.dumps(resolved) if isinstance(resolved, dict) else resolved)
+        return 0
+    if command not in allowed:
+        print(f"Unknown command: {command}", file=sys.stderr)
+        print_usage()
+        return 1
+    unknown = [arg for arg in args if arg not in allowed[command]]
+    if unknown:
+        print(f"Unknown option: {unknown[0]}", file=sys.stderr)
+        return 1
+    as_json = '--json' in args
+    dry_run = '--dry-run' in args
+
+    try:
+        if command == 'plan':
+            planned = plan()
+            if as_json:
+                json.dump(planned, sys.stdout, indent=2)
+                sys.stdout.write('\n')
+                return 0
+            print(f"Profiles: {', '.join(planned['profiles']) or 'none'}")
+            for path, contents in planned['files'].items():
+                print(f"\n{path}:")
+                for line in contents.splitlines():
+                    if not line.startswith('#'):
+                        print(f"  {line}")
+            if planned['live']:
+                print("\nLive:")
+                for path, setting in planned['live'].items():
+                    print(f"  {path} = {setting}")
+        elif command == 'apply':
+            result = apply(dry_run=dry_run)
+            if as_json:
+                json.dump(result, sys.stdout, indent=2)
+                sys.stdout.write('\n')
+            else:
+                print(f"{'Would apply' if dry_run else 'Applied'} profiles: {', '.join(result['profiles']) or 'none'}")
+                for action in result['actions']:
+                    print(f"  {action}")
+                for error in result['errors']:
+                    print(f"Warning: could not set {error}", file=sys.stderr)
+        elif command == 'revert':
+            actions = revert(dry_run=dry_run)
+            if not actions:
+                print("Nothing to revert")
+            for action in actions:
+                print(f"{'Would ' if dry_run else ''}{action}")
+        else:
+            state = load_state()
+            if not state:
+                print("No tuning profiles applied")
+            else:
+                print(f"Applied {state['applied']}: {', '.join(state['profiles']) or 'none'}")
+                for path in state['files']:
+                    print(f"  {path}")
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -24,6 +24,25 @@ fi
 # Create required directories
 mkdir -p /etc/immutablue/setup
 
+# Answer file provisioned for unattended setup (kickstart, cloud-init, ...)
+ANSWERS_FILE=/etc/immutablue/setup/answers.yaml
+UNATTENDED_RESULT=/etc/immutablue/setup/unattended_result.json
+
+# With an answer file, run the setup headless on any build
+if [[ -f "${ANSWERS_FILE}" ]] && [[ "${SETUP_COMPLETED}" == "false" ]]; then
+    echo "Running unattended setup with ${ANSWERS_FILE}"
+    
+    # It creates the did_first_boot_setup flag only when every step succeeded.
+    # The selections go to /etc/immutablue/settings.yaml, so each user's
+    # first_login.sh installs the chosen flatpaks and distroboxes.
+    if /usr/libexec/immutablue/setup/immutablue_setup_tui.py --unattended --answers "${ANSWERS_FILE}" --no-reboot > "${UNATTENDED_RESULT}"; then
+        echo "Unattended setup completed successfully"
+        SETUP_COMPLETED=true
+    else
+        echo "Unattended setup failed (see ${UNATTENDED_RESULT}) - will try again on next boot"
+    fi
+fi
+
 # If we're a nucleus build (CLI-only), run the TUI setup
 if [[ "$(immutablue_build_is_nucleus)" == "${TRUE}" ]] && [[ "${SETUP_COMPLETED}" == "false" ]]; then
     echo "Running TUI setup for nucleus build"
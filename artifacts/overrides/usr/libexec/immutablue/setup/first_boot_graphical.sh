@@ -27,7 +27,8 @@ then
 fi
 
 # Check for internet connectivity - required for installations
-if [[ "$(immutablue_has_internet)" == "${FALSE}" ]]
+# The first login can race the network coming up, so give it a little while
+if ! immutablue_retry --deadline 30 --wait-online immutablue_has_internet fresh >/dev/null
 then
     # If nucleus we can't show a graphical indicator
     # If not we can show a terminal with the message
@@ -79,22 +79,31 @@ touch "${HOME}/.config/.immutablue_did_first_login"
 if [[ "${SETUP_COMPLETED}" == "true" ]]; then
     echo "Applying setup selections"
     
+    # Resolve both install flags with a single settings lookup
+    INSTALL_DISTROBOX="false"
+    INSTALL_FLATPAKS="false"
+    eval "$(immutablue-settings --shell \
+        INSTALL_DISTROBOX=.immutablue.setup.install_distrobox \
+        INSTALL_FLATPAKS=.immutablue.setup.install_flatpaks || true)"
+
     # Check if we need to install distroboxes based on settings
-    INSTALL_DISTROBOX=$(immutablue-settings .immutablue.setup.install_distrobox || echo "false")
     if [[ "${INSTALL_DISTROBOX}" == "true" ]]; then
         echo "Initiating distrobox installation based on setup selections"
         # The actual installation is handled by the 'immutablue install' command
     fi
     
     # Check if we need to install flatpaks based on settings
-    INSTALL_FLATPAKS=$(immutablue-settings .immutablue.setup.install_flatpaks || echo "false")
     if [[ "${INSTALL_FLATPAKS}" == "true" ]]; then
         echo "Initiating Flatpak installation based on setup selections"
         # The actual installation is handled by the 'immutablue install' command
     fi
     
-    # Run the immutablue install command to apply settings
-    immutablue install
+    # The setup wizard starts the Flatpak and distrobox installs in the
+    # background; run the ones that did not finish before the reboot (all of
+    # them if the wizard did not start any), then the rest of `immutablue install`
+    /usr/libexec/immutablue/setup/immutablue_setup_jobs.py resume
+    immutablue post_install
+    immutablue post_install_notes
 fi
 
 exit 0
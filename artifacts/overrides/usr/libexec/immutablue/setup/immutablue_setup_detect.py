@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+# immutablue_setup_detect.py
+#
+# Hardware and network detection shared by the first-boot setup TUI and GUI.
+#
+# What the kernel already exposes is read straight from /proc, /sys (through
+# immutablue_hardware.py) and statvfs() instead of spawning lscpu, free,
+# lspci, df or ip. Every probe runs concurrently under asyncio (the file
+# readers in worker threads, the connectivity pings as subprocesses) and each
+# result is handed to the caller as soon as it is ready, so a front-end can
+# draw it right away. The hardware sections collected on the way become the
+# hardware inventory (see immutablue_hardware.py).
+#
+# From a front-end:
+#   import immutablue_setup_detect as detect
+#   results = detect.run('hardware_detection', on_result)
+#   selections = detect.selections(results)
+#   detect.save_inventory(results)    # hardware_detection only
+#   tuning = detect.apply_tuning()     # then pick and apply tuning profiles
+#
+# From the command line (prints each result as it arrives):
+#   immutablue_setup_detect.py [hardware_detection|network_setup] [--json]
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import immutablue_hardware as hardware
+
+SYS_CLASS_NET = '/sys/class/net'
+
+# Filesystems reported by the storage probe, /var holds the writable data
+STORAGE_PATHS = ('/', '/var')
+
+# Same defaults as .immutablue.header.has_internet_host_v4/_v6 and _timeout
+INTERNET_HOSTS = ('9.9.9.9', '2620:fe::fe')
+INTERNET_TIMEOUT = 2
+
+# Upper bound for any single probe
+PROBE_TIMEOUT = 5
+
+# Applies the tuning profiles matching the hardware inventory
+TUNING_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'immutablue_tuning.py')
+TUNING_TIMEOUT = 30
+
+
+def _read_file(path):
+    """Return the stripped contents of a small file, or None."""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def probe_cpu():
+    """CPU model and thread count, also kept for the hardware inventory."""
+    cpu = hardware.collect_cpu()
+    threads = cpu['threads']
+    value = f"{cpu['model']} ({threads} thread{'s' if threads != 1 else ''})"
+    return value, [f"CPU: {value}"], {'cpu': cpu}
+
+
+def probe_memory():
+    """Total and available memory from /proc/meminfo."""
+    memory = hardware.collect_memory()
+    value = f"{hardware.format_bytes(memory['total_bytes'])} total"
+    with open(hardware.PROC_MEMINFO, 'r') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                value += f", {hardware.format_bytes(int(line.split()[1]) * 1024)} available"
+    return value, [f"Memory: {value}"], {'memory': memory}
+
+
+def probe_gpu():
+    """Display controllers with their PCI IDs."""
+    gpus = hardware.collect_gpus()
+    names = [f"{' '.join(filter(None, (gpu['vendor'], gpu['name']))) or 'Display controller'}"
+             f" [{gpu['vendor_id']}:{gpu['device_id']}]" for gpu in gpus]
+    return names, [f"GPU: {name}" for name in names] or ["GPU: no display controller found"], {'gpus': gpus}
+
+
+def probe_storage():
+    """Free space of each filesystem in STORAGE_PATHS via statvfs() and the disks."""
+    filesystems = []
+    seen = set()
+    for path in STORAGE_PATHS:
+        try:
+            device = os.stat(path).st_dev
+            stat = os.statvfs(path)
+        except OSError:
+            continue
+        if device in seen:
+            continue
+        seen.add(device)
+        size = stat.f_blocks * stat.f_frsize
+        free = stat.f_bavail * stat.f_frsize
+        filesystems.append(f"{path}: {hardware.format_bytes(free)} free of {hardware.format_bytes(size)}")
+    disks = hardware.collect_disks()
+    lines = [f"Storage {fs}" for fs in filesystems]
+    lines += [f"Disk: {disk['name']} {hardware.format_bytes(disk['size_bytes'])} {disk['transport']}"
+              f" {disk['model'] or ''}".rstrip() for disk in disks]
+    return filesystems, lines, {'disks': disks}
+
+
+def probe_interfaces():
+    """Network interfaces, their state and type from /sys/class/net."""
+    interfaces = []
+    lines = ["Network interfaces:"]
+    for name in sorted(os.listdir(SYS_CLASS_NET)):
+        if name == 'lo':
+            continue
+        base = os.path.join(SYS_CLASS_NET, name)
+        state = _read_file(os.path.join(base, 'operstate')) or 'unknown'
+        wireless = os.path.exists(os.path.join(base, 'wireless')) \
+            or os.path.exists(os.path.join(base, 'phy80211'))
+        interfaces.append(name)
+        lines.append(f"  - {name} ({state}{', wireless' if wireless else ''})")
+    return interfaces, lines if interfaces else ["No network interfaces found"]
+
+
+def probe_hostname():
+    """The system hostname."""
+    hostname = socket.gethostname()
+    return hostname, [f"Hostname: {hostname}"]
+
+
+async def _ping(host, timeout):
+    """Return whether one ping to `host` is answered."""
+    process = await asyncio.create_subprocess_exec(
+        'ping', '-c1', f'-W{timeout}', host,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        return await process.wait() == 0
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+async def probe_internet(hosts=INTERNET_HOSTS, timeout=INTERNET_TIMEOUT):
+    """Race a ping over IPv4 and IPv6, the first answer wins.
+
+    Mirrors immutablue_has_internet in immutablue-header.sh.
+    """
+    pending = {asyncio.ensure_future(_ping(host, timeout)) for host in hosts}
+    online = False
+    errors = []
+    try:
+        while pending and not online:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception():
+                    errors.append(task.exception())
+                elif task.result():
+                    online = True
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+    if not online and errors and len(errors) == len(hosts):
+        # ping itself could not be run
+        raise errors[0]
+    if online:
+        return True, ["✓ Internet connection available"]
+    return False, ["✗ No internet connection"]
+
+
+# The probes behind each setup action, in display order: (name, label, probe)
+PROBES = {
+    'hardware_detection': (
+        ('cpu', 'CPU', probe_cpu),
+        ('memory', 'Memory', probe_memory),
+        ('gpu', 'GPU', probe_gpu),
+        ('storage', 'Storage', probe_storage),
+    ),
+    'network_setup': (
+        ('internet', 'Internet connection', probe_internet),
+        ('interfaces', 'Network interfaces', probe_interfaces),
+        ('hostname', 'Hostname', probe_hostname),
+    ),
+}
+
+
+async def _run_probe(name, label, probe):
+    """Run one probe and wrap its outcome in a result dict."""
+    started = time.monotonic()
+    result = {'probe': name, 'label': label, 'value': None, 'lines': [], 'inventory': {}, 'error': None}
+    try:
+        if asyncio.iscoroutinefunction(probe):
+            outcome = await asyncio.wait_for(probe(), PROBE_TIMEOUT)
+        else:
+            outcome = await asyncio.wait_for(asyncio.to_thread(probe), PROBE_TIMEOUT)
+        # (value, display lines[, hardware inventory sections])
+        result['value'] = outcome[0]
+        result['lines'] = list(outcome[1])
+        if len(outcome) > 2:
+            result['inventory'] = outcome[2]
+    except asyncio.TimeoutError:
+        result['error'] = f"timed out after {PROBE_TIMEOUT}s"
+    except Exception as e:
+        result['error'] = str(e) or type(e).__name__
+    if result['error']:
+        result['lines'] = [f"Could not detect {label.lower()}: {result['error']}"]
+    result['duration'] = round(time.monotonic() - started, 3)
+    return result
+
+
+async def detect(action, on_result=None):
+    """Run all probes of an action concurrently.
+
+    Args:
+        action: A key of PROBES, e.g. 'hardware_detection'
+        on_result: Optional callable invoked with each result as it completes
+
+    Returns:
+        A dict of probe name to result, in display order
+    """
+    probes = PROBES[action]
+    tasks = [asyncio.ensure_future(_run_probe(*probe)) for probe in probes]
+    for next_done in asyncio.as_completed(tasks):
+        result = await next_done
+        if on_result:
+            on_result(result)
+    return {task.result()['probe']: task.result() for task in tasks}
+
+
+def run(action, on_result=None):
+    """Synchronous wrapper around detect() for the front-ends.
+
+    on_result is called from the calling thread, so the TUI can draw from it
+    directly and the GUI (which calls this from a worker thread) must hand
+    widget updates to GLib.idle_add.
+    """
+    return asyncio.run(detect(action, on_result))
+
+
+def selections(results):
+    """Reduce results to the values stored in the setup selections."""
+    return {name: result['value'] for name, result in results.items() if result['error'] is None}
+
+
+def save_inventory(results):
+    """Save the hardware inventory, reusing the sections detection collected.
+
+    Returns:
+        The inventory file, or None if it could not be written (the GUI runs
+        as the user, the on_boot hook writes it after the reboot instead)
+    """
+    collected = {}
+    for result in results.values():
+        collected.update(result.get('inventory') or {})
+    inventory = hardware.refresh(collected=collected, write=False)
+    try:
+        hardware.save(inventory)
+    except OSError:
+        return None
+    return hardware.INVENTORY_FILE
+
+
+def apply_tuning(dry_run=False):
+    """Apply the tuning profiles that match the hardware inventory.
+
+    Runs immutablue_tuning.py, through `sudo -n` when not root (the GUI runs
+    as the user), after save_inventory().
+
+    Returns:
+        A result shaped like the probe results, its value is the list of
+        applied profile ids
+    """
+    result = {'probe': 'tuning', 'label': 'Tuning', 'value': None, 'lines': [], 'inventory': {}, 'error': None}
+    command = [TUNING_SCRIPT, 'apply', '--json'] + (['--dry-run'] if dry_run else [])
+    if os.geteuid() != 0 and not dry_run:
+        command = ['sudo', '-n'] + command
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=TUNING_TIMEOUT)
+        if completed.returncode != 0:
+            raise RuntimeError((completed.stderr.strip().splitlines() or [f"exit status {completed.returncode}"])[-1])
+        applied = json.loads(completed.stdout)
+    except (OSError, ValueError, RuntimeError, subprocess.TimeoutExpired) as e:
+        result['error'] = str(e)
+        result['lines'] = [f"Tuning profiles not applied ({e}), run `immutablue tuning apply` later"]
+        return result
+
+    result['value'] = applied['profiles']
+    result['lines'] = [f"Tuning profiles{' (dry run)' if dry_run else ''}: {', '.join(applied['profiles']) or 'none'}"]
+    result['lines'] += [f"Could not set {error}" for error in applied['errors']]
+    return result
+
+
+def main(argv):
+    """Command line entry point."""
+    as_json = '--json' in argv
+    actions = [arg for arg in argv if not arg.startswith('-')] or list(PROBES)
+    for action in actions:
+        if action not in PROBES:
+            print(f"Unknown action: {action} (expected one of: {', '.join(PROBES)})", file=sys.stderr)
+            return 1
+
+    def show(result):
+        if not as_json:
+            for line in result['lines']:
+                print(line)
+
+    output = {action: run(action, show) for action in actions}
+    if as_json:
+        json.dump(output, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
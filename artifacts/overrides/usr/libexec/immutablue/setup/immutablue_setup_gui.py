@@ -28,6 +28,10 @@ from gi.repository import Gtk, GLib, Gdk, Gio
 from pathlib import Path
 import threading
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import immutablue_setup_detect as detect
+import immutablue_setup_jobs as jobs
+
 # Paths for configuration files
 DEFAULT_CONFIG_FILE = '/usr/immutablue/setup/first_boot_config.yaml'
 SYSTEM_CONFIG_FILE = '/etc/immutablue/setup/first_boot_config.yaml'
@@ -36,6 +40,11 @@ USER_CONFIG_FILE = os.path.expanduser('~/.config/immutablue/first_boot_config.ya
 # Flag file to track completion
 COMPLETED_FLAG = '/etc/immutablue/setup/did_first_boot_setup'
 
+# Settings the selections are saved to. Root runs (the first-boot service)
+# write the system file, which every user's first_login.sh reads.
+SYSTEM_SETTINGS_FILE = '/etc/immutablue/settings.yaml'
+USER_SETTINGS_FILE = os.path.expanduser('~/.config/immutablue/settings.yaml')
+
 class ImmutableSetupWindow(Gtk.ApplicationWindow):
     """Main window for the Immutablue setup application."""
     
@@ -62,6 +71,13 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
         self.user_selections = {}
         self.current_step = -1  # Start with welcome page
         
+        # Installs start as soon as they are chosen and run behind the wizard,
+        # where they can (otherwise first_login.sh runs them)
+        self.jobs = None
+        if jobs.can_run_in_background():
+            self.jobs = jobs.JobQueue(on_update=lambda job: GLib.idle_add(self.update_jobs_status))
+        self.jobs_wait_labels = None
+        
         # Create header bar
         self.header = Gtk.HeaderBar()
         self.set_titlebar(self.header)
@@ -78,6 +94,14 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
         self.content_box.set_margin_end(30)
         self.main_box.append(self.content_box)
         
+        # Background installs status, shown once one is started
+        self.jobs_label = Gtk.Label()
+        self.jobs_label.set_halign(Gtk.Align.START)
+        self.jobs_label.set_margin_start(30)
+        self.jobs_label.add_css_class("caption")
+        self.jobs_label.set_visible(False)
+        self.main_box.append(self.jobs_label)
+        
         # Button area at bottom
         self.button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         self.button_box.set_halign(Gtk.Align.END)
@@ -241,6 +265,10 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
     
     def on_next_clicked(self, button):
         """Handle next button clicks."""
+        # Start the installs chosen on an options step right away
+        if self.jobs and self.current_step >= 0 and self.config['steps'][self.current_step]['type'] == 'options':
+            self.jobs.submit_selected(self.user_selections)
+        
         if self.current_step == -1:
             # Moving from welcome to first step
             self.current_step = 0
@@ -437,116 +465,40 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
                 GLib.idle_add(results_box.append, label)
             
             # Perform the appropriate action
-            if action_type == 'hardware_detection':
-                # Hardware detection
-                update_progress(0.1, "Detecting CPU...")
-                update_status("Scanning hardware information...")
-                
-                try:
-                    # Get CPU info
-                    cpu_info = subprocess.check_output("lscpu | grep 'Model name'", 
-                                                      shell=True, text=True).strip()
-                    add_result(cpu_info)
-                    self.user_selections[step_id]['cpu'] = cpu_info
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error detecting CPU: {str(e)}")
-                
-                update_progress(0.3, "Detecting Memory...")
+            if action_type in detect.PROBES:
+                # Hardware or network detection, all probes run at once
+                probes = detect.PROBES[action_type]
+                title = self.config['steps'][self.current_step].get('title', 'Detection')
+                done = []
+                update_progress(0.1, "Detecting...")
+                update_status(f"Scanning {', '.join(label for _, label, _ in probes)}...")
                 
-                try:
-                    # Get memory info
-                    mem_info = subprocess.check_output("free -h | grep Mem:", 
-                                                     shell=True, text=True).strip()
-                    add_result(mem_info)
-                    self.user_selections[step_id]['memory'] = mem_info
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error detecting memory: {str(e)}")
-                
-                update_progress(0.5, "Detecting GPU...")
-                
-                try:
-                    # Get GPU info
-                    gpu_info = subprocess.check_output("lspci | grep -i vga", 
-                                                     shell=True, text=True).strip()
-                    add_result(gpu_info)
-                    self.user_selections[step_id]['gpu'] = gpu_info
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error detecting GPU: {str(e)}")
-                
-                update_progress(0.7, "Detecting Storage...")
-                
-                try:
-                    # Get disk info
-                    disk_info = subprocess.check_output("df -h / | tail -n 1", 
-                                                      shell=True, text=True).strip()
-                    add_result(f"Root filesystem: {disk_info}")
-                    self.user_selections[step_id]['storage'] = disk_info
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error detecting storage: {str(e)}")
+                def on_result(result):
+                    done.append(result['probe'])
+                    for line in result['lines']:
+                        add_result(line)
+                    update_progress(len(done) / len(probes), f"{result['label']} done")
                 
-                # Finalize hardware detection
-                update_progress(1.0, "Hardware detection complete")
-                update_status("Hardware detection completed successfully")
-                
-            elif action_type == 'network_setup':
-                # Network setup
-                update_progress(0.1, "Checking connectivity...")
-                update_status("Testing network connectivity...")
-                
-                try:
-                    # Check internet connectivity
-                    result = subprocess.run(["ping", "-c", "1", "-W", "2", "9.9.9.9"], 
-                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    
-                    if result.returncode == 0:
-                        add_result("✓ Internet connection available")
-                        self.user_selections[step_id]['internet'] = True
-                    else:
-                        add_result("✗ No internet connection")
-                        self.user_selections[step_id]['internet'] = False
-                    
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error checking connectivity: {str(e)}")
-                
-                update_progress(0.4, "Checking interfaces...")
-                
-                try:
-                    # Get network interfaces
-                    interfaces_output = subprocess.check_output(
-                        "ip -o link show | awk -F': ' '{print $2}'", 
-                        shell=True, text=True).strip()
-                    
-                    interfaces = interfaces_output.split('\n')
-                    add_result("Network interfaces:")
+                found = detect.run(action_type, on_result)
+                self.user_selections[step_id].update(detect.selections(found))
+                if action_type == 'hardware_detection':
+                    inventory = detect.save_inventory(found)
+                    self.user_selections[step_id]['inventory'] = inventory
+                    if inventory:
+                        add_result(f"Hardware inventory saved to {inventory}")
                     
-                    for interface in interfaces:
-                        if interface != 'lo':  # Skip loopback
-                            add_result(f"  - {interface}")
-                    
-                    self.user_selections[step_id]['interfaces'] = interfaces
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error detecting network interfaces: {str(e)}")
-                
-                update_progress(0.7, "Checking hostname...")
-                
-                try:
-                    # Get hostname
-                    hostname = subprocess.check_output("hostname", shell=True, text=True).strip()
-                    add_result(f"Hostname: {hostname}")
-                    self.user_selections[step_id]['hostname'] = hostname
-                    time.sleep(0.5)
-                except Exception as e:
-                    add_result(f"Error getting hostname: {str(e)}")
+                    # Pick and apply the tuning profiles for this hardware
+                    update_status("Applying tuning profiles...")
+                    tuning = detect.apply_tuning()
+                    for line in tuning['lines']:
+                        add_result(line)
+                    self.user_selections[step_id]['tuning'] = tuning['value']
+                if action_type == 'network_setup':
+                    self.user_selections[step_id].setdefault('internet', False)
                 
-                # Finalize network setup
-                update_progress(1.0, "Network setup complete")
-                update_status("Network configuration completed")
+                # Finalize detection
+                update_progress(1.0, f"{title} complete")
+                update_status(f"{title} completed successfully")
                 
             else:
                 # Generic action - just wait a bit to simulate work
@@ -571,14 +523,63 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
         GLib.idle_add(self.back_button.set_sensitive, True)
         GLib.idle_add(self.next_button.set_sensitive, True)
     
+    def update_jobs_status(self):
+        """Show the state of the background installs (runs on the GTK main loop)."""
+        submitted = self.jobs.jobs()
+        if submitted:
+            self.jobs_label.set_text("Installing in the background: "
+                                     + ", ".join(f"{job['label']} {job['state']}" for job in submitted))
+            self.jobs_label.set_visible(True)
+        
+        # The page waiting for the installs before the reboot shows every job
+        if self.jobs_wait_labels:
+            for job in submitted:
+                self.jobs_wait_labels[job['id']].set_text(jobs.describe(job))
+            if not self.jobs.pending():
+                self.jobs_wait_labels = None
+                self.show_completion_dialog()
+        return False
+    
+    def show_jobs_wait(self):
+        """Hold the reboot until the background installs finish."""
+        self.clear_content()
+        
+        title_label = Gtk.Label(label="Finishing Installs")
+        title_label.set_halign(Gtk.Align.START)
+        title_label.add_css_class("title-2")
+        self.content_box.append(title_label)
+        
+        desc_label = Gtk.Label(label="Finishing the installs started during setup before rebooting. "
+                                     "If you reboot now, unfinished installs resume after the reboot.")
+        desc_label.set_wrap(True)
+        desc_label.set_halign(Gtk.Align.START)
+        self.content_box.append(desc_label)
+        
+        self.jobs_wait_labels = {}
+        for job in self.jobs.jobs():
+            label = Gtk.Label(label=jobs.describe(job))
+            label.set_halign(Gtk.Align.START)
+            label.set_wrap(True)
+            self.content_box.append(label)
+            self.jobs_wait_labels[job['id']] = label
+        
+        self.jobs_label.set_visible(False)
+        self.back_button.set_sensitive(False)
+        self.next_button.set_label("Reboot Now")
+        self.next_button.disconnect_by_func(self.on_next_clicked)
+        self.next_button.connect("clicked", lambda button: self.show_completion_dialog())
+    
     def save_selections(self, dry_run=False):
         """Save user selections to the settings file.
         
+        The selections go to the user's settings, or to the system settings
+        when running as root, so that they reach every user and not only root.
+        
         Args:
             dry_run: If True, print actions instead of executing them
         """
-        user_settings_dir = os.path.expanduser('~/.config/immutablue')
-        user_settings_file = os.path.join(user_settings_dir, 'settings.yaml')
+        user_settings_file = SYSTEM_SETTINGS_FILE if os.geteuid() == 0 else USER_SETTINGS_FILE
+        user_settings_dir = os.path.dirname(user_settings_file)
         
         # Prepare the settings data
         settings = {}
@@ -604,15 +605,9 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
         settings['immutablue']['setup']['selections'] = self.user_selections
         
         # Add install flags based on selections
-        if 'dev_env' in self.user_selections:
-            for option in self.user_selections['dev_env']:
-                if option.startswith('devbox_') and self.user_selections['dev_env'][option]:
-                    settings['immutablue']['setup']['install_distrobox'] = True
-        
-        if 'applications' in self.user_selections:
-            for option in self.user_selections['applications']:
-                if option.startswith('app_') and self.user_selections['applications'][option]:
-                    settings['immutablue']['setup']['install_flatpaks'] = True
+        for flag, enabled in jobs.install_flags(self.user_selections).items():
+            if enabled:
+                settings['immutablue']['setup'][flag] = True
         
         if dry_run:
             # In dry-run mode, just print what would be saved
@@ -648,19 +643,27 @@ class ImmutableSetupWindow(Gtk.ApplicationWindow):
             with open(COMPLETED_FLAG, 'w') as f:
                 f.write(f"Setup completed by user {os.getenv('USER')} at {subprocess.check_output('date', shell=True, text=True).strip()}")
             
-            # Show completion dialog
-            dialog = Gtk.MessageDialog(
-                transient_for=self,
-                modal=True,
-                message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.OK,
-                text="Setup Complete"
-            )
-            dialog.format_secondary_text(
-                "Your Immutablue system has been configured successfully. The system will reboot to apply settings."
-            )
-            dialog.connect("response", self.on_completion_dialog_response)
-            dialog.show()
+            # The reboot waits for the background installs
+            if self.jobs and self.jobs.pending():
+                self.show_jobs_wait()
+            else:
+                self.show_completion_dialog()
+    
+    def show_completion_dialog(self):
+        """Tell the user setup is done, the response reboots."""
+        self.jobs_wait_labels = None
+        dialog = Gtk.MessageDialog(
+            transient_for=self,
+            modal=True,
+            message_type=Gtk.MessageType.INFO,
+            buttons=Gtk.ButtonsType.OK,
+            text="Setup Complete"
+        )
+        dialog.format_secondary_text(
+            "Your Immutablue system has been configured successfully. The system will reboot to apply settings."
+        )
+        dialog.connect("response", self.on_completion_dialog_response)
+        dialog.show()
     
     def on_completion_dialog_response(self, dialog, response):
         """Handle completion dialog response."""
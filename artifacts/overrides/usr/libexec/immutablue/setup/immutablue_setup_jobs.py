@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+# immutablue_setup_jobs.py
+#
+# Background queue for the installs chosen in the setup wizard.
+#
+# The TUI and GUI start the Flatpak and distrobox installs as soon as their
+# options step is answered, instead of leaving them to the next login, so the
+# multi-minute installs overlap with the rest of the wizard. Every job is a
+# supervised child process logging to LOG_DIR/<job>.log, and its progress (the
+# last line it printed) streams to the front-end through a callback.
+#
+# Jobs only start behind a wizard run by a user with cached sudo credentials
+# (see can_run_in_background), otherwise they are all left to `resume`.
+# The reboot at the end of the wizard waits for the jobs. Their state is
+# checkpointed to STATE_FILE on every change, so when the user reboots anyway
+# `resume` (run by first_login.sh) only re-runs the jobs that did not finish.
+#
+# Usage:
+#   can_run_in_background()                 # whether the wizard may start them
+#   queue = JobQueue(on_update=callback)    # callback(job) from worker threads
+#   queue.submit_selected(selections)       # jobs for the install flags
+#   queue.pending(), queue.jobs(), queue.wait(timeout)
+#
+#   immutablue_setup_jobs.py status [--json]
+#   immutablue_setup_jobs.py resume           # run unfinished jobs in the foreground
+
+import os
+import sys
+import json
+import threading
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+# (id, label, install flag in settings.yaml, command)
+JOBS = (
+    ('flatpak', 'Flatpaks', 'install_flatpaks', ('immutablue', 'install_flatpak')),
+    ('distrobox', 'Distroboxes', 'install_distrobox', ('immutablue', 'install_distrobox')),
+)
+
+# Setup options that turn on each install flag, by step id and option prefix
+FLAG_OPTIONS = {
+    'install_distrobox': ('dev_env', 'devbox_'),
+    'install_flatpaks': ('applications', 'app_'),
+}
+
+# Jobs run as the user, so their state lives in the user's state directory
+STATE_DIR = os.path.join(os.environ.get('XDG_STATE_HOME', os.path.expanduser('~/.local/state')), 'immutablue')
+STATE_FILE = os.path.join(STATE_DIR, 'setup_jobs.json')
+LOG_DIR = os.path.join(STATE_DIR, 'setup_jobs')
+SCHEMA_VERSION = 1
+
+# Jobs run at the same time
+WORKERS = len(JOBS)
+
+# Job states, finished ones are not re-run by resume
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def install_flags(selections):
+    """The install flags saved to settings.yaml for the setup selections.
+
+    Args:
+        selections: The wizard's selections keyed by step id
+
+    Returns:
+        A dict of flag name to bool
+    """
+    flags = {}
+    for flag, (step_id, prefix) in FLAG_OPTIONS.items():
+        chosen = selections.get(step_id) or {}
+        flags[flag] = any(option.startswith(prefix) and value for option, value in chosen.items())
+    return flags
+
+
+def load_state(path=None):
+    """Checkpointed job states ({job id: {'state': ...}}), empty when there are none."""
+    try:
+        with open(path or STATE_FILE, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get('schema_version') != SCHEMA_VERSION:
+        return {}
+    return state.get('jobs') or {}
+
+
+def can_run_in_background():
+    """Whether the wizard can start the jobs behind itself.
+
+    As root the jobs would install the Flatpaks and distroboxes for root and
+    checkpoint them in root's state directory, so the real user's `resume`
+    would do all of it again. Without cached sudo credentials the sudo calls
+    of the installs would prompt on top of the wizard. In both cases the jobs
+    are left to `resume`, as with the unattended setup.
+    """
+    if os.geteuid() == 0:
+        return False
+    try:
+        return subprocess.run(['sudo', '-n', 'true'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL, timeout=10).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+class JobQueue:
+    """Runs setup jobs in the background and checkpoints their state.
+
+    Jobs already recorded as done in the state file are not run again.
+    """
+
+    def __init__(self, on_update=None, state_file=None, log_dir=None, workers=None):
+        """Create an empty queue.
+
+        Args:
+            on_update: Optional callable taking a job snapshot, called from the
+                worker threads whenever a job prints a line or changes state
+            state_file: Checkpoint file (default STATE_FILE)
+            log_dir: Directory of the job logs (default LOG_DIR)
+            workers: Jobs run at the same time (default WORKERS)
+        """
+        self.on_update = on_update
+        self.state_file = state_file or STATE_FILE
+        self.log_dir = log_dir or LOG_DIR
+        self._slots = threading.Semaphore(workers or WORKERS)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._threads = []
+
+    def submit(self, job_id):
+        """Queue a job once; returns its snapshot."""
+        spec = next((job for job in JOBS if job[0] == job_id), None)
+        if spec is None:
+            raise KeyError(f"unknown job: {job_id}")
+        with self._lock:
+            if job_id in self._jobs:
+                return dict(self._jobs[job_id])
+            previous = load_state(self.state_file).get(job_id, {})
+            job = {
+                'id': job_id,
+                'label': spec[1],
+                'state': DONE if previous.get('state') == DONE else QUEUED,
+                'line': previous.get('line', '') if previous.get('state') == DONE else '',
+                'log': os.path.join(self.log_dir, f"{job_id}.log"),
+                'returncode': previous.get('returncode'),
+            }
+            self._jobs[job_id] = job
+            self._checkpoint()
+        self._notify(job)
+        if job['state'] == QUEUED:
+            thread = threading.Thread(target=self._run, args=(job_id, spec[3]), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return dict(job)
+
+    def submit_selected(self, selections):
+        """Queue the jobs whose install flag the selections turn on."""
+        flags = install_flags(selections)
+        return [self.submit(job_id) for job_id, _, flag, _ in JOBS if flags.get(flag)]
+
+    def jobs(self):
+        """Snapshots of the submitted jobs, in submission order."""
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def pending(self):
+        """Whether any job is still queued or running."""
+        return any(job['state'] in (QUEUED, RUNNING) for job in self.jobs())
+
+    def wait(self, timeout=None):
+        """Wait for the submitted jobs; returns False when the timeout ran out."""
+        for thread in list(self._threads):
+            thread.join(timeout)
+        return not self.pending()
+
+    def _set(self, job_id, **changes):
+        with self._lock:
+            self._jobs[job_id].update(changes)
+            # Output lines are only streamed, state changes are checkpointed
+            if 'state' in changes:
+                self._checkpoint()
+            job = dict(self._jobs[job_id])
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update:
+            self.on_update(dict(job))
+
+    def _checkpoint(self):
+        """Write the job states (the caller holds the lock)."""
+        state = {'schema_version': SCHEMA_VERSION, 'jobs': load_state(self.state_file)}
+        for job_id, job in self._jobs.items():
+            state['jobs'][job_id] = {
+                'state': job['state'],
+                'returncode': job['returncode'],
+                'line': job['line'],
+                'updated': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            }
+        try:
+            directory = os.path.dirname(self.state_file)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.setup_jobs-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp, self.state_file)
+        except OSError:
+            # Losing the checkpoint only means resume runs the job again
+            pass
+
+    def _run(self, job_id, command):
+        with self._slots:
+            self._set(job_id, state=RUNNING)
+            try:
+                os.makedirs(self.log_dir, exist_ok=True)
+                with open(os.path.join(self.log_dir, f"{job_id}.log"), 'w') as log:
+                    with subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                          stderr=subprocess.STDOUT, text=True, errors='replace') as process:
+                        # Text mode turns the \r of progress bars into line breaks too
+                        for line in process.stdout:
+                            log.write(line)
+                            log.flush()
+                            if line.strip():
+                                self._set(job_id, line=line.strip())
+                    returncode = process.returncode
+            except OSError as e:
+                self._set(job_id, state=FAILED, line=str(e), returncode=None)
+                return
+            self._set(job_id, state=DONE if returncode == 0 else FAILED, returncode=returncode)
+
+
+def describe(job):
+    """One line for a job: its label, state and latest output."""
+    text = f"{job['label']}: {job['state']}"
+    if job['state'] == FAILED:
+        text += f" (see {job['log']})"
+    elif job['line'] and job['state'] == RUNNING:
+        text += f" - {job['line']}"
+    return text
+
+
+def resume():
+    """Run every job that did not finish, printing its output.
+
+    Returns:
+        0 when all jobs are done, 1 when any failed
+    """
+    def show(job):
+        if job['state'] == RUNNING and job['line']:
+            print(f"[{job['label']}] {job['line']}", flush=True)
+        elif job['state'] != RUNNING:
+            print(describe(job), flush=True)
+
+    queue = JobQueue(on_update=show, workers=1)
+    for job_id, _, _, _ in JOBS:
+        queue.submit(job_id)
+    queue.wait()
+    return 1 if any(job['state'] == FAILED for job in queue.jobs()) else 0
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: immutablue_setup_jobs.py COMMAND")
+    print("\nThe installs started by the setup wizard.")
+    print("\nCommands:")
+    print("  status [--json]   Show the checkpointed state of every job")
+    print("  resume            Run the jobs that did not finish, in the foreground")
+    print(f"\nState: {STATE_FILE}")
+    print(f"Logs:  {LOG_DIR}")
+
+
+def main(argv):
+    """Command line entry point."""
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return 0 if argv else 1
+
+    command, args = argv[0], argv[1:]
+    if command == 'resume' and not args:
+        return resume()
+    if command == 'status' and args in ([], ['--json']):
+        state = load_state()
+        if args:
+            json.dump(state, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+            return 0
+        for job_id, label, _, _ in JOBS:
+            job = state.get(job_id, {})
+            print(f"{label}: {job.get('state', 'not started')}")
+        return 0
+
+    print_usage()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
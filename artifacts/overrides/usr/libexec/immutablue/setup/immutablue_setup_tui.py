@@ -14,6 +14,10 @@
 # - Application installation options
 #
 # Configuration options are drawn from and saved to the Immutablue settings.yaml hierarchy.
+#
+# With --unattended the same steps run without a UI: choices come from an
+# answer file (--answers FILE, see /usr/immutablue/setup/answers.example.yaml)
+# and a JSON result is printed, so kickstart or cloud-init can drive first boot.
 
 import os
 import sys
@@ -22,10 +26,17 @@ import json
 import yaml
 import curses
 import textwrap
+import threading
+import functools
+import contextlib
 import time
 from time import sleep
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import immutablue_setup_detect as detect
+import immutablue_setup_jobs as jobs
+
 # Paths for configuration files
 DEFAULT_CONFIG_FILE = '/usr/immutablue/setup/first_boot_config.yaml'
 SYSTEM_CONFIG_FILE = '/etc/immutablue/setup/first_boot_config.yaml'
@@ -34,6 +45,158 @@ USER_CONFIG_FILE = os.path.expanduser('~/.config/immutablue/first_boot_config.ya
 # Flag file to track completion
 COMPLETED_FLAG = '/etc/immutablue/setup/did_first_boot_setup'
 
+# Settings the selections are saved to. Root runs (the first-boot service)
+# write the system file, which every user's first_login.sh reads.
+SYSTEM_SETTINGS_FILE = '/etc/immutablue/settings.yaml'
+USER_SETTINGS_FILE = os.path.expanduser('~/.config/immutablue/settings.yaml')
+
+# How often the input loop wakes up to redraw background progress
+POLL_INTERVAL_MS = 100
+
+ENTER_KEYS = (curses.KEY_ENTER, 10, 13)
+
+# Exit codes of --unattended
+EXIT_FAILED = 1
+EXIT_INVALID = 2
+
+
+@functools.lru_cache(maxsize=256)
+def wrap(text, width):
+    """Wrap a paragraph, cached per text and terminal width."""
+    return tuple(textwrap.wrap(text, max(1, width)))
+
+
+def load_answers(path):
+    """Read an unattended answer file (YAML or JSON).
+    
+    Raises:
+        OSError: The file cannot be read
+        yaml.YAMLError: The file is not valid YAML
+    """
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def validate_answers(config, answers):
+    """Check an answer file against the steps in first_boot_config.yaml.
+    
+    Answers live under `steps`, keyed by step id. Options steps take a list
+    of the option ids to select or a mapping of option id to true/false,
+    action steps take true/false to run or skip them. Info steps take none.
+    
+    Args:
+        config: The first-boot configuration
+        answers: The parsed answer file
+    
+    Returns:
+        A list of error messages, empty when the answers are valid
+    """
+    if not isinstance(answers, dict):
+        return ["answer file must be a mapping"]
+    errors = [f"unknown key: {key}" for key in answers if key != 'steps']
+    answered = answers.get('steps') or {}
+    if not isinstance(answered, dict):
+        return errors + ["steps must be a mapping of step id to answer"]
+    
+    steps = {step.get('id', f'step_{i}'): step for i, step in enumerate(config.get('steps', []))}
+    for step_id, answer in answered.items():
+        step = steps.get(step_id)
+        if step is None:
+            errors.append(f"{step_id}: no such step (expected one of: {', '.join(steps)})")
+        elif step['type'] == 'options':
+            option_ids = [option['id'] for option in step.get('options', [])]
+            if isinstance(answer, list):
+                chosen = answer
+            elif isinstance(answer, dict):
+                chosen = list(answer)
+                errors += [f"{step_id}.{option}: expected true or false"
+                           for option, value in answer.items() if not isinstance(value, bool)]
+            else:
+                errors.append(f"{step_id}: expected a list of options or a mapping of option to true/false")
+                continue
+            errors += [f"{step_id}: no such option: {option}" for option in chosen if option not in option_ids]
+        elif step['type'] == 'action':
+            if not isinstance(answer, bool):
+                errors.append(f"{step_id}: expected true (run) or false (skip)")
+        else:
+            errors.append(f"{step_id}: {step['type']} steps take no answer")
+    return errors
+
+
+class Renderer:
+    """Draws screens as rows, writing only the rows that changed.
+    
+    A screen is a list of rows, one per line: (text, attr, x) or None for a
+    blank line. Rows are compared with what is already on the terminal and
+    the changes are flushed with a single doupdate(), which keeps redraws
+    cheap over serial consoles and IPMI/SOL links.
+    """
+    
+    def __init__(self, screen):
+        self.screen = screen
+        self.height, self.width = screen.getmaxyx()
+        self.drawn = {}
+    
+    def resize(self):
+        """Pick up a new terminal size and repaint everything on the next render."""
+        curses.update_lines_cols()
+        self.height, self.width = self.screen.getmaxyx()
+        self.drawn = {}
+        self.screen.clear()
+    
+    def render(self, rows):
+        """Draw the rows that differ from the last render."""
+        for y in range(self.height):
+            row = rows[y] if y < len(rows) else None
+            if self.drawn.get(y) == row:
+                continue
+            self.screen.move(y, 0)
+            self.screen.clrtoeol()
+            if row:
+                text, attr, x = row
+                # Stay off the last column, writing there fails on the bottom row
+                width = self.width - x - 1
+                if width > 0:
+                    self.screen.addnstr(y, x, text, width, attr)
+            self.drawn[y] = row
+        self.screen.noutrefresh()
+        curses.doupdate()
+
+
+class BackgroundAction:
+    """Runs a step action in a thread so the curses loop keeps handling keys.
+    
+    The action is called with a report(lines) callable for its progress, the
+    loop redraws whenever `changed` is set.
+    """
+    
+    def __init__(self, action):
+        self.lines = []
+        self.changed = threading.Event()
+        self.finished = False
+        self._thread = threading.Thread(target=self._run, args=(action,), daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def done(self):
+        return self.finished
+    
+    def report(self, lines):
+        self.lines = list(lines)
+        self.changed.set()
+    
+    def _run(self, action):
+        try:
+            action(self.report)
+        except Exception as e:
+            self.report(self.lines + [f"Action failed: {e}"])
+        finally:
+            self.finished = True
+            self.changed.set()
+
+
 class ImmutablueTUI:
     """Text-based user interface for Immutablue setup."""
     
@@ -44,6 +207,10 @@ class ImmutablueTUI:
             config_file: Optional path to a custom config file that overrides the default hierarchy
         """
         self.screen = None
+        self.renderer = None
+        self.scroll = 0
+        self.jobs = None
+        self.jobs_changed = threading.Event()
         self.max_y = 0
         self.max_x = 0
         self.current_step = 0
@@ -149,14 +316,20 @@ class ImmutablueTUI:
         
         return config
     
-    def save_selections(self, dry_run=False):
+    def save_selections(self, dry_run=False, system=False):
         """Save user selections to the settings file.
         
+        The selections go to the user's settings, or to the system settings
+        when running as root or when system is set, so that they reach every
+        user and not only root.
+        
         Args:
             dry_run: If True, print actions instead of executing them
+            system: Save to SYSTEM_SETTINGS_FILE (used by --unattended)
         """
-        user_settings_dir = os.path.expanduser('~/.config/immutablue')
-        user_settings_file = os.path.join(user_settings_dir, 'settings.yaml')
+        system = system or os.geteuid() == 0
+        user_settings_file = SYSTEM_SETTINGS_FILE if system else USER_SETTINGS_FILE
+        user_settings_dir = os.path.dirname(user_settings_file)
         
         # Prepare the settings data
         settings = {}
@@ -182,15 +355,9 @@ class ImmutablueTUI:
         settings['immutablue']['setup']['selections'] = self.user_selections
         
         # Add install flags based on selections
-        if 'dev_env' in self.user_selections:
-            for option in self.user_selections['dev_env']:
-                if option.startswith('devbox_') and self.user_selections['dev_env'][option]:
-                    settings['immutablue']['setup']['install_distrobox'] = True
-        
-        if 'applications' in self.user_selections:
-            for option in self.user_selections['applications']:
-                if option.startswith('app_') and self.user_selections['applications'][option]:
-                    settings['immutablue']['setup']['install_flatpaks'] = True
+        for flag, enabled in jobs.install_flags(self.user_selections).items():
+            if enabled:
+                settings['immutablue']['setup'][flag] = True
         
         if dry_run:
             # In dry-run mode, just print what would be saved
@@ -212,10 +379,16 @@ class ImmutablueTUI:
         """Main application loop with curses screen."""
         self.screen = screen
         curses.curs_set(0)  # Hide cursor
-        self.screen.clear()
+        self.renderer = Renderer(screen)
+        self.max_y, self.max_x = self.renderer.height, self.renderer.width
         
-        # Get screen dimensions
-        self.max_y, self.max_x = self.screen.getmaxyx()
+        # getch() wakes up regularly so background actions can be redrawn
+        self.screen.timeout(POLL_INTERVAL_MS)
+        
+        # Installs start as soon as they are chosen and run behind the wizard,
+        # where they can (otherwise first_login.sh runs them)
+        if jobs.can_run_in_background():
+            self.jobs = jobs.JobQueue(on_update=lambda job: self.jobs_changed.set())
         
         # Show welcome screen
         self._show_welcome()
@@ -228,6 +401,8 @@ class ImmutablueTUI:
                 self._show_info_step(step)
             elif step['type'] == 'options':
                 self._show_options_step(step)
+                if self.jobs:
+                    self.jobs.submit_selected(self.user_selections)
             elif step['type'] == 'action':
                 self._show_action_step(step)
             
@@ -239,74 +414,119 @@ class ImmutablueTUI:
                 # Mark setup as complete
                 self._mark_setup_complete()
                 
+                # The reboot waits for the background installs
+                self._wait_for_jobs()
+                
                 # Show completion message
                 self._show_completion()
                 break
             
             self.current_step += 1
     
-    def _show_welcome(self):
-        """Display the welcome screen."""
-        self.screen.clear()
-        welcome = self.config.get('welcome', {})
-        title = welcome.get('title', 'Welcome to Immutablue')
-        description = welcome.get('description', 'This setup will guide you through initial configuration.')
+    def _frame(self, title, body, footer, title_y=2, centered=False, focus=None, jobs_row=True):
+        """Lay out one screen: a bold title, a scrolling body and a footer.
         
-        # Draw title
-        title_y = int(self.max_y * 0.3)
-        title_x = (self.max_x - len(title)) // 2
-        self.screen.addstr(title_y, title_x, title, curses.A_BOLD)
+        Below the footer a row shows the background installs, if any.
         
-        # Draw description
-        wrapped_desc = textwrap.wrap(description, self.max_x - 10)
-        for i, line in enumerate(wrapped_desc):
-            desc_y = title_y + 2 + i
-            desc_x = (self.max_x - len(line)) // 2
-            self.screen.addstr(desc_y, desc_x, line)
-        
-        # Draw prompt
-        prompt = "Press Enter to continue..."
-        prompt_y = self.max_y - 3
-        prompt_x = (self.max_x - len(prompt)) // 2
-        self.screen.addstr(prompt_y, prompt_x, prompt)
+        Args:
+            title: Title drawn centered on row title_y
+            body: (text, attr) lines, already wrapped to the screen width
+            footer: Prompt drawn centered near the bottom
+            title_y: Row of the title
+            centered: Center the body lines instead of indenting them
+            focus: Optional body line index that must stay visible
+            jobs_row: Show the background installs row
+        
+        Returns:
+            The rows for Renderer.render
+        """
+        rows = [None] * self.max_y
+        
+        def put(y, text, attr=curses.A_NORMAL, x=None):
+            if 0 <= y < self.max_y:
+                rows[y] = (text, attr, max(0, (self.max_x - len(text)) // 2) if x is None else x)
+        
+        # The body scrolls between the title and the footer
+        top = title_y + 2
+        visible = max(0, self.max_y - 4 - top)
+        if focus is not None:
+            self.scroll = min(self.scroll, focus)
+            self.scroll = max(self.scroll, focus - visible + 1)
+        self.scroll = max(0, min(self.scroll, len(body) - visible))
+        
+        put(title_y, title, curses.A_BOLD)
+        for i, (text, attr) in enumerate(body[self.scroll:self.scroll + visible]):
+            put(top + i, text, attr, None if centered else 5)
+        put(self.max_y - 3, footer)
+        
+        submitted = self.jobs.jobs() if self.jobs and jobs_row else []
+        if submitted:
+            status = ', '.join(f"{job['label']} {job['state']}" for job in submitted)
+            put(self.max_y - 2, f"Installing in the background: {status}", curses.A_DIM, 5)
+        return rows
+    
+    def _paragraph(self, text, attr=curses.A_NORMAL):
+        """Body lines for a paragraph wrapped to the current width."""
+        return [(line, attr) for line in wrap(text, self.max_x - 10)]
+    
+    def _loop(self, view, on_key=None, action=None, until=None):
+        """Draw a view and handle keys until Enter.
         
-        self.screen.refresh()
+        The view is only rebuilt after a key press or progress from the
+        background action or installs, and only the rows that changed are
+        redrawn.
         
-        # Wait for Enter key
+        Args:
+            view: Callable returning the rows of the screen (see _frame)
+            on_key: Optional callable for other keys, returning True when handled
+            action: Optional BackgroundAction, Enter is ignored until it is done
+            until: Optional callable, the loop ends when it returns True
+                instead of on Enter
+        """
+        self.scroll = 0
+        dirty = True
         while True:
+            for changed in (action.changed if action else None, self.jobs_changed):
+                if changed and changed.is_set():
+                    changed.clear()
+                    dirty = True
+            if dirty:
+                self.renderer.render(view())
+                dirty = False
+            if until and until():
+                return
+            
             key = self.screen.getch()
-            if key in (curses.KEY_ENTER, 10, 13):
-                break
+            if key == -1:
+                continue
+            dirty = True
+            
+            if key == curses.KEY_RESIZE:
+                self.renderer.resize()
+                self.max_y, self.max_x = self.renderer.height, self.renderer.width
+            elif key in ENTER_KEYS and not until:
+                if action is None or action.done():
+                    return
+            elif on_key and on_key(key):
+                pass
+            elif key in (curses.KEY_UP, curses.KEY_PPAGE):
+                self.scroll -= 1 if key == curses.KEY_UP else max(1, self.max_y // 2)
+            elif key in (curses.KEY_DOWN, curses.KEY_NPAGE):
+                self.scroll += 1 if key == curses.KEY_DOWN else max(1, self.max_y // 2)
+    
+    def _show_welcome(self):
+        """Display the welcome screen."""
+        welcome = self.config.get('welcome', {})
+        title = welcome.get('title', 'Welcome to Immutablue')
+        description = welcome.get('description', 'This setup will guide you through initial configuration.')
+        
+        self._loop(lambda: self._frame(title, self._paragraph(description), "Press Enter to continue...",
+                                       title_y=int(self.max_y * 0.3), centered=True))
     
     def _show_info_step(self, step):
         """Display an informational step."""
-        self.screen.clear()
-        
-        # Draw title
-        title_y = 2
-        title_x = (self.max_x - len(step['title'])) // 2
-        self.screen.addstr(title_y, title_x, step['title'], curses.A_BOLD)
-        
-        # Draw description
-        wrapped_desc = textwrap.wrap(step['description'], self.max_x - 10)
-        for i, line in enumerate(wrapped_desc):
-            desc_y = title_y + 2 + i
-            desc_x = 5
-            self.screen.addstr(desc_y, desc_x, line)
-        
-        # Draw prompt
-        prompt = "Press Enter to continue..."
-        prompt_y = self.max_y - 3
-        prompt_x = (self.max_x - len(prompt)) // 2
-        self.screen.addstr(prompt_y, prompt_x, prompt)
-        
-        self.screen.refresh()
-        
-        # Wait for Enter key
-        while True:
-            key = self.screen.getch()
-            if key in (curses.KEY_ENTER, 10, 13):
-                break
+        self._loop(lambda: self._frame(step['title'], self._paragraph(step['description']),
+                                       "Press Enter to continue..."))
     
     def _show_options_step(self, step):
         """Display a step with selectable options."""
@@ -320,232 +540,232 @@ class ImmutablueTUI:
             for option in options:
                 self.user_selections[step_id][option['id']] = option.get('default', False)
         
-        selected_idx = 0
+        selected = {'idx': 0}
         
-        while True:
-            self.screen.clear()
-            
-            # Draw title
-            title_y = 2
-            title_x = (self.max_x - len(step['title'])) // 2
-            self.screen.addstr(title_y, title_x, step['title'], curses.A_BOLD)
-            
-            # Draw description
-            wrapped_desc = textwrap.wrap(step['description'], self.max_x - 10)
-            for i, line in enumerate(wrapped_desc):
-                desc_y = title_y + 2 + i
-                desc_x = 5
-                self.screen.addstr(desc_y, desc_x, line)
-            
-            # Draw options
-            options_start_y = desc_y + 2
+        def view():
+            body = self._paragraph(step['description']) + [('', curses.A_NORMAL)]
+            focus = None
             for i, option in enumerate(options):
-                is_selected = self.user_selections[step_id][option['id']]
-                
                 # Highlight the current selection
-                if i == selected_idx:
-                    attr = curses.A_REVERSE
-                else:
-                    attr = curses.A_NORMAL
+                attr = curses.A_REVERSE if i == selected['idx'] else curses.A_NORMAL
+                if i == selected['idx']:
+                    focus = len(body) + (1 if 'description' in option else 0)
                 
                 # Draw the checkbox
                 if option_type == 'checkbox':
-                    checkbox = '[X]' if is_selected else '[ ]'
-                    self.screen.addstr(options_start_y + i*2, 5, f"{checkbox} {option['label']}", attr)
+                    checkbox = '[X]' if self.user_selections[step_id][option['id']] else '[ ]'
+                    body.append((f"{checkbox} {option['label']}", attr))
                     
                     # Draw description if it exists
                     if 'description' in option:
-                        desc = f"   {option['description']}"
-                        self.screen.addstr(options_start_y + i*2 + 1, 5, desc[:self.max_x-10])
-            
-            # Draw instructions
-            instructions = "↑/↓: Navigate, Space: Toggle, Enter: Continue"
-            instructions_y = self.max_y - 3
-            instructions_x = (self.max_x - len(instructions)) // 2
-            self.screen.addstr(instructions_y, instructions_x, instructions)
-            
-            self.screen.refresh()
+                        body.append((f"   {option['description']}", curses.A_NORMAL))
             
-            # Handle key presses
-            key = self.screen.getch()
-            
-            if key == curses.KEY_UP and selected_idx > 0:
-                selected_idx -= 1
-            elif key == curses.KEY_DOWN and selected_idx < len(options) - 1:
-                selected_idx += 1
-            elif key == ord(' '):  # Space bar
+            return self._frame(step['title'], body, "↑/↓: Navigate, Space: Toggle, Enter: Continue", focus=focus)
+        
+        def on_key(key):
+            if key == curses.KEY_UP and selected['idx'] > 0:
+                selected['idx'] -= 1
+            elif key == curses.KEY_DOWN and selected['idx'] < len(options) - 1:
+                selected['idx'] += 1
+            elif key == ord(' ') and options:  # Space bar
                 # Toggle selection
-                option_id = options[selected_idx]['id']
+                option_id = options[selected['idx']]['id']
                 self.user_selections[step_id][option_id] = not self.user_selections[step_id][option_id]
-            elif key in (curses.KEY_ENTER, 10, 13):  # Enter key
-                break
-    
-    def _show_action_step(self, step):
-        """Execute an action step and show progress."""
-        self.screen.clear()
-        
-        # Draw title
-        title_y = 2
-        title_x = (self.max_x - len(step['title'])) // 2
-        self.screen.addstr(title_y, title_x, step['title'], curses.A_BOLD)
-        
-        # Draw description
-        wrapped_desc = textwrap.wrap(step['description'], self.max_x - 10)
-        for i, line in enumerate(wrapped_desc):
-            desc_y = title_y + 2 + i
-            desc_x = 5
-            self.screen.addstr(desc_y, desc_x, line)
-        
-        # Draw working message
-        msg = "Working, please wait..."
-        msg_y = desc_y + 3
-        msg_x = 5
-        self.screen.addstr(msg_y, msg_x, msg)
-        
-        # Execute the action based on action type
-        action_type = step.get('action', '')
-        result_y = msg_y + 2
-        
-        self.screen.refresh()
-        
-        # Execute appropriate action
-        if action_type == 'hardware_detection':
-            self._do_hardware_detection(result_y)
-        elif action_type == 'network_setup':
-            self._do_network_setup(result_y)
-        else:
-            # Generic action
-            self.screen.addstr(result_y, 5, "Action completed.")
-            self.screen.refresh()
-            sleep(2)
-        
-        # Draw completion
-        self.screen.addstr(self.max_y - 3, 5, "Press Enter to continue...")
-        self.screen.refresh()
+            return key in (curses.KEY_UP, curses.KEY_DOWN, ord(' '))
         
-        # Wait for Enter key
-        while True:
-            key = self.screen.getch()
-            if key in (curses.KEY_ENTER, 10, 13):
-                break
+        self._loop(view, on_key)
     
-    def _do_hardware_detection(self, start_y):
-        """Perform hardware detection and show results."""
-        self.screen.addstr(start_y, 5, "Detecting CPU...")
-        self.screen.refresh()
+    def _action_handler(self, action_type):
+        """The function running an action step, called with a report(lines) callable.
         
-        try:
-            cpu_info = subprocess.check_output("lscpu | grep 'Model name'", 
-                                              shell=True, text=True).strip()
-            self.screen.addstr(start_y + 1, 5, cpu_info)
-        except:
-            self.screen.addstr(start_y + 1, 5, "Could not detect CPU.")
-        
-        self.screen.refresh()
-        sleep(1)
-        
-        # Detect memory
-        self.screen.addstr(start_y + 3, 5, "Detecting Memory...")
-        self.screen.refresh()
-        
-        try:
-            mem_info = subprocess.check_output("free -h | grep Mem:", 
-                                              shell=True, text=True).strip()
-            self.screen.addstr(start_y + 4, 5, mem_info)
-        except:
-            self.screen.addstr(start_y + 4, 5, "Could not detect memory.")
+        Detection actions return their results keyed by probe name, other
+        actions return None.
+        """
+        handlers = {
+            'hardware_detection': self._do_hardware_detection,
+            'network_setup': self._do_network_setup,
+        }
+        # Generic action
+        return handlers.get(action_type, lambda report: report(["Action completed."]))
+    
+    def _show_action_step(self, step):
+        """Execute an action step in the background and show its progress."""
+        action = BackgroundAction(self._action_handler(step.get('action', ''))).start()
         
-        self.screen.refresh()
-        sleep(1)
+        def view():
+            body = self._paragraph(step['description']) + [('', curses.A_NORMAL)]
+            body += [(line, curses.A_NORMAL) for line in action.lines]
+            footer = "Press Enter to continue..." if action.done() else "Working, please wait..."
+            return self._frame(step['title'], body, footer)
         
-        # Detect GPU
-        self.screen.addstr(start_y + 6, 5, "Detecting GPU...")
-        self.screen.refresh()
+        self._loop(view, action=action)
+    
+    def _do_hardware_detection(self, report):
+        """Perform hardware detection and report the results."""
+        inventory = {}
         
-        try:
-            gpu_info = subprocess.check_output("lspci | grep -i vga", 
-                                              shell=True, text=True).strip()
-            self.screen.addstr(start_y + 7, 5, gpu_info[:self.max_x-10])
-        except:
-            self.screen.addstr(start_y + 7, 5, "Could not detect GPU.")
+        def tune(found):
+            # Persist the inventory, then apply the profiles matching it
+            inventory['path'] = detect.save_inventory(found)
+            return detect.apply_tuning()
         
-        self.screen.refresh()
-        sleep(1)
+        found = self._run_detection('hardware_detection', report, followup=tune)
         
         # Store hardware info in selections
         self.user_selections['hardware'] = {
             'detected': True,
-            'timestamp': subprocess.check_output("date", shell=True, text=True).strip()
+            'timestamp': time.strftime("%a %b %d %H:%M:%S %Z %Y"),
+            'inventory': inventory.get('path'),
+            **detect.selections(found)
         }
+        return found
+    
+    def _do_network_setup(self, report):
+        """Check network connectivity and report the status."""
+        found = self._run_detection('network_setup', report)
+        
+        network = detect.selections(found)
+        network.setdefault('internet', False)
+        self.user_selections['network'] = network
+        return found
     
-    def _do_network_setup(self, start_y):
-        """Check network connectivity and show status."""
-        self.screen.addstr(start_y, 5, "Checking network connectivity...")
-        self.screen.refresh()
+    def _run_detection(self, action, report, followup=None):
+        """Run the probes of a detection action, reporting each result as it arrives.
         
-        # Check internet connectivity
-        try:
-            result = subprocess.run(["ping", "-c", "1", "-W", "2", "9.9.9.9"], 
-                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        Args:
+            action: A detection action from immutablue_setup_detect.PROBES
+            report: Callable taking the result lines so far
+            followup: Optional callable taking the results once all probes are
+                done and returning one more result to report (e.g. tuning)
+        
+        Returns:
+            The probe results keyed by probe name
+        """
+        probes = detect.PROBES[action]
+        arrived = {}
+        
+        def update(result=None):
+            if result:
+                arrived[result['probe']] = result
             
-            if result.returncode == 0:
-                self.screen.addstr(start_y + 1, 5, "Internet connection: ✓")
-                self.user_selections['network'] = {'internet': True}
-            else:
-                self.screen.addstr(start_y + 1, 5, "Internet connection: ✗")
-                self.user_selections['network'] = {'internet': False}
-        except:
-            self.screen.addstr(start_y + 1, 5, "Could not check internet connectivity.")
-            self.user_selections['network'] = {'internet': False}
+            # Results in probe order, placeholders for those still running
+            lines = []
+            for name, label, _ in probes:
+                if name in arrived:
+                    lines.extend(arrived[name]['lines'])
+                else:
+                    lines.append(f"Detecting {label}...")
+            report(lines)
+        
+        update()
+        found = detect.run(action, update)
+        if followup:
+            extra = followup(found)
+            probes = probes + ((extra['probe'], extra['label'], None),)
+            found[extra['probe']] = extra
+            update(extra)
+        return found
+    
+    def run_unattended(self, answers, dry_run=False):
+        """Run every step without a UI, taking the choices from an answer file.
         
-        self.screen.refresh()
-        sleep(1)
+        Options steps start from their defaults like in the wizard, action
+        steps run unless answered false, and the selections are saved to the
+        system settings with save_selections(), where every user's first
+        login picks them up. An action fails when it raises or when one of its
+        probes (or the tuning) reports an error. Setup is only marked complete
+        when every action succeeded, so a failed node retries on the next boot.
         
-        # Get network interfaces
-        self.screen.addstr(start_y + 3, 5, "Detecting network interfaces...")
-        self.screen.refresh()
+        Args:
+            answers: The parsed answer file (see validate_answers)
+            dry_run: Validate the answers and report what would happen
         
-        try:
-            interfaces = subprocess.check_output("ip -o link show | awk -F': ' '{print $2}'", 
-                                               shell=True, text=True).strip().split('\n')
+        Returns:
+            A JSON serialisable result with the status of every step
+        """
+        result = {'status': 'ok', 'dry_run': dry_run, 'errors': validate_answers(self.config, answers), 'steps': []}
+        if result['errors']:
+            result['status'] = 'invalid'
+            return result
+        
+        answered = answers.get('steps') or {}
+        for index, step in enumerate(self.config.get('steps', [])):
+            self.current_step = index
+            step_id = step.get('id', f'step_{index}')
+            answer = answered.get(step_id)
+            entry = {'id': step_id, 'type': step['type'], 'status': 'ok', 'lines': []}
+            started = time.monotonic()
             
-            for i, interface in enumerate(interfaces[:3]):  # Show up to 3 interfaces
-                self.screen.addstr(start_y + 4 + i, 5, f"Interface: {interface}")
-                
-            self.user_selections.setdefault('network', {})['interfaces'] = interfaces
-        except:
-            self.screen.addstr(start_y + 4, 5, "Could not detect network interfaces.")
+            if step['type'] == 'options':
+                selections = {option['id']: option.get('default', False) for option in step.get('options', [])}
+                if isinstance(answer, list):
+                    selections = {option_id: option_id in answer for option_id in selections}
+                elif isinstance(answer, dict):
+                    selections.update(answer)
+                self.user_selections[step_id] = selections
+            elif step['type'] == 'action':
+                if answer is False:
+                    entry['status'] = 'skipped'
+                elif dry_run:
+                    entry['status'] = 'would run'
+                else:
+                    def report(lines, entry=entry):
+                        entry['lines'] = list(lines)
+                    try:
+                        found = self._action_handler(step.get('action', ''))(report) or {}
+                    except Exception as e:
+                        entry['status'] = 'failed'
+                        entry['lines'].append(f"Action failed: {e}")
+                        result['status'] = 'failed'
+                    else:
+                        errors = {name: probe['error'] for name, probe in found.items() if probe.get('error')}
+                        if errors:
+                            entry['status'] = 'failed'
+                            entry['errors'] = errors
+                            result['status'] = 'failed'
+            
+            entry['seconds'] = round(time.monotonic() - started, 3)
+            result['steps'].append(entry)
+        
+        result['selections'] = self.user_selections
+        if result['status'] == 'ok':
+            self.save_selections(dry_run=dry_run, system=True)
+            self._mark_setup_complete(dry_run=dry_run)
+        return result
+    
+    def _wait_for_jobs(self):
+        """Hold the reboot until the background installs finish, S skips the wait.
         
-        self.screen.refresh()
-        sleep(1)
+        Their state is checkpointed, so installs cut short by the reboot are
+        resumed by first_login.sh.
+        """
+        if not (self.jobs and self.jobs.pending()):
+            return
+        skipped = []
+        
+        def view():
+            body = self._paragraph("Finishing the installs started during setup before rebooting.")
+            body += [('', curses.A_NORMAL)] + [(jobs.describe(job), curses.A_NORMAL) for job in self.jobs.jobs()]
+            return self._frame("Finishing Installs", body, "S: Reboot now, unfinished installs resume after the reboot",
+                               jobs_row=False)
+        
+        def on_key(key):
+            if key in (ord('s'), ord('S')):
+                skipped.append(key)
+            return bool(skipped)
+        
+        self._loop(view, on_key, until=lambda: bool(skipped) or not self.jobs.pending())
     
     def _show_completion(self):
         """Display the completion screen."""
-        self.screen.clear()
-        
-        # Draw completion message
         title = "Setup Complete!"
-        title_y = int(self.max_y * 0.3)
-        title_x = (self.max_x - len(title)) // 2
-        self.screen.addstr(title_y, title_x, title, curses.A_BOLD)
-        
-        msg = "Your Immutablue system has been configured successfully."
-        msg_y = title_y + 2
-        msg_x = (self.max_x - len(msg)) // 2
-        self.screen.addstr(msg_y, msg_x, msg)
-        
-        reboot_msg = "The system will reboot in 5 seconds..."
-        reboot_y = msg_y + 2
-        reboot_x = (self.max_x - len(reboot_msg)) // 2
-        self.screen.addstr(reboot_y, reboot_x, reboot_msg)
-        
-        self.screen.refresh()
+        body = [("Your Immutablue system has been configured successfully.", curses.A_NORMAL),
+                ('', curses.A_NORMAL)]
         
         # Countdown
         for i in range(5, 0, -1):
-            countdown = f"Rebooting in {i} seconds..."
-            self.screen.addstr(reboot_y, reboot_x, countdown + " "*10)
-            self.screen.refresh()
+            countdown = [(f"Rebooting in {i} seconds...", curses.A_NORMAL)]
+            self.renderer.render(self._frame(title, body + countdown, "", title_y=int(self.max_y * 0.3), centered=True))
             sleep(1)
     
     def _mark_setup_complete(self, dry_run=False):
@@ -611,14 +831,50 @@ def print_help():
     print("  --force               Run the setup even if it has already been completed")
     print("  --no-reboot           Skip the automatic reboot at the end of setup")
     print("  --config FILE         Use a custom configuration file instead of the default hierarchy")
+    print("  --unattended          Run every step without a UI and print a JSON result")
+    print("  --answers FILE        Answer file for --unattended (YAML or JSON)")
     print("\nDefault configuration files (in priority order):")
     print(f"  1. {USER_CONFIG_FILE}")
     print(f"  2. {SYSTEM_CONFIG_FILE}")
     print(f"  3. {DEFAULT_CONFIG_FILE}")
     print("\nFlag file used to detect completed setup:")
     print(f"  {COMPLETED_FLAG}")
+    print("\nExit codes with --unattended:")
+    print(f"  0 completed, {EXIT_FAILED} an action failed, {EXIT_INVALID} invalid answer file")
     sys.exit(0)
 
+
+def run_unattended(config_file, answers_file, dry_run=False, no_reboot=False):
+    """Run the setup headless and print the JSON result.
+    
+    Returns:
+        The exit code
+    """
+    # load_config() announces a custom config on stdout, which is for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        app = ImmutablueTUI(config_file=config_file)
+    
+    try:
+        answers = load_answers(answers_file) if answers_file else {}
+    except (OSError, yaml.YAMLError) as e:
+        result = {'status': 'invalid', 'dry_run': dry_run, 'errors': [f"{answers_file}: {e}"], 'steps': []}
+    else:
+        # Dry-run output of save_selections goes to stderr, stdout is the result
+        with contextlib.redirect_stdout(sys.stderr):
+            result = app.run_unattended(answers, dry_run=dry_run)
+    
+    json.dump(result, sys.stdout, indent=2, default=str)
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+    
+    if result['status'] == 'invalid':
+        return EXIT_INVALID
+    if result['status'] != 'ok':
+        return EXIT_FAILED
+    if not dry_run and not no_reboot:
+        subprocess.call(["sudo", "reboot"])
+    return 0
+
 if __name__ == "__main__":
     # Check if help is requested
     if '--help' in sys.argv or '-h' in sys.argv:
@@ -629,17 +885,28 @@ if __name__ == "__main__":
     force = '--force' in sys.argv
     no_reboot = '--no-reboot' in sys.argv
     
-    # Check for custom config file
+    unattended = '--unattended' in sys.argv
+    
+    # Check for custom config and answer files
     config_file = None
+    answers_file = None
     for i, arg in enumerate(sys.argv):
         if arg == '--config' and i + 1 < len(sys.argv):
             config_file = sys.argv[i + 1]
+        elif arg == '--answers' and i + 1 < len(sys.argv):
+            answers_file = sys.argv[i + 1]
     
     # Check if we should skip (already completed)
     if os.path.exists(COMPLETED_FLAG) and not force:
-        print("Setup already completed. Use --force to run again.")
+        print("Setup already completed. Use --force to run again.", file=sys.stderr if unattended else sys.stdout)
+        if unattended:
+            json.dump({'status': 'skipped', 'dry_run': dry_run, 'errors': [], 'steps': []}, sys.stdout)
+            sys.stdout.write('\n')
         sys.exit(0)
     
+    if unattended:
+        sys.exit(run_unattended(config_file, answers_file, dry_run=dry_run, no_reboot=no_reboot))
+    
     if dry_run:
         print("Running in DRY RUN mode - No actions will be performed")
         print("Configuration will be loaded and steps will be simulated")
@@ -13,3 +13,6 @@ fi
 echo "Starting docs..."
 systemctl enable --now immutablue.container
 
+echo "Refreshing hardware inventory..."
+/usr/libexec/immutablue/immutablue_hardware.py refresh || echo "Could not refresh the hardware inventory"
+
@@ -1,4 +1,6 @@
 #!/bin/bash
+# immutablue-update can take longer than the default hook timeout
+# immutablue-timeout: 0
 source /usr/libexec/immutablue/immutablue-header.sh
 
 echo "weekly update time:"
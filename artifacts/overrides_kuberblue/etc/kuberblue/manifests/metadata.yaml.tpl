@@ -4,9 +4,22 @@ name:
 namespace: default
 # The name of the chart to deploy (e.g. cilium/cilium)
 chart:
+# Chart version to install (helm --version). Unset installs the latest on
+# every deploy. A pinned release is skipped while its metadata and values are
+# unchanged; run with KUBERBLUE_DEPLOY_FORCE=true to redeploy it anyway.
+# A live release running a newer chart than the pin is never downgraded
+# unless KUBERBLUE_DEPLOY_FORCE=true.
+# Pinned charts are vendored into kuberblue images with their container
+# images, and installed without the chart repo.
+version:
 create_namespace: true
 # Name of the chart repo
 repo_name:
 repo_url:
 # Arguments to be passed that are not set in values.yaml. Prefer values file.
 args:
+# Packages to deploy before this one, by metadata name or by path under the
+# manifest dir. Directories under a lower top-level prefix (00-infrastructure
+# before 10-networking) always deploy first; directories in the same top-level
+# directory deploy in parallel unless they depend on each other.
+depends_on: []
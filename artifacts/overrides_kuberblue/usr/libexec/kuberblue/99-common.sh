@@ -161,19 +161,16 @@ kubeadm_join_safe () {
 
 wait_for_node_ready_state () {
     local timeout="${1:-300}"
-    local elapsed=0
     local node_name
     node_name="$(hostname)"
 
-    until kubectl get nodes --no-headers 2>/dev/null | grep "^${node_name} " | grep -q " Ready "; do
-        elapsed=$((elapsed + 5))
-        if [[ ${elapsed} -ge ${timeout} ]]; then
-            echo "ERROR: Node ${node_name} did not become Ready within ${timeout}s"
-            kubectl get nodes 2>/dev/null || true
-            return 1
-        fi
-        echo "Waiting for node ${node_name} to become Ready (${elapsed}/${timeout}s)..."
-        sleep 5
-    done
+    # Watches the node instead of polling, so Ready is seen the moment it is
+    # reported, and a node object that does not exist yet is waited for too
+    echo "Waiting for node ${node_name} to become Ready (timeout ${timeout}s)..."
+    if ! python3 /usr/libexec/kuberblue/kube_setup/kube_wait.py --timeout "${timeout}" "node/${node_name}"; then
+        echo "ERROR: Node ${node_name} did not become Ready within ${timeout}s"
+        kubectl get nodes 2>/dev/null || true
+        return 1
+    fi
     echo "Node ${node_name} is Ready"
 }
@@ -34,3 +34,9 @@ fi
 mkdir -p "${STATE_DIR}"
 chmod 0750 "${STATE_DIR}"
 chown root:kuberblue "${STATE_DIR}"
+
+# kube_deploy.sh runs as kuberblue and records its deploy state markers and
+# manifest index cache here (kube_init.sh creates state/ as root)
+mkdir -p "${STATE_DIR}/state/deploy" "${STATE_DIR}/cache"
+chown -R kuberblue:kuberblue "${STATE_DIR}/state/deploy" "${STATE_DIR}/cache"
+chmod 0750 "${STATE_DIR}/state/deploy" "${STATE_DIR}/cache"
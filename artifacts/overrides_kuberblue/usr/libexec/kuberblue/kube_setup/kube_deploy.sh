@@ -3,10 +3,23 @@
 set -euxo pipefail
 
 source /usr/libexec/kuberblue/variables.sh
+source /usr/libexec/kuberblue/kube_setup/kube_state.sh
 
 # Check if manifests is empty
 manifest_dir="/etc/kuberblue/manifests/"
 HELM_TIMEOUT="${HELM_TIMEOUT:-15m}"
+# Packages of one deploy wave that are deployed at the same time
+KUBERBLUE_DEPLOY_JOBS="${KUBERBLUE_DEPLOY_JOBS:-4}"
+deploy_plan="/usr/libexec/kuberblue/kube_setup/kube_deploy_plan.py"
+manifest_index="/usr/libexec/kuberblue/kube_setup/kube_manifest_index.py"
+kube_wait="/usr/libexec/kuberblue/kube_setup/kube_wait.py"
+# Redeploy releases and manifests even when their desired state is unchanged
+KUBERBLUE_DEPLOY_FORCE="${KUBERBLUE_DEPLOY_FORCE:-false}"
+# Only a force from the caller lets a pinned chart replace a newer live
+# release, not the one deploy_manifest sets for an explicit deploy
+_kuberblue_allow_downgrade="${KUBERBLUE_DEPLOY_FORCE}"
+# Pinned chart tarballs vendored at image build (build/37-kuberblue-chart-cache.sh)
+KUBERBLUE_CHART_CACHE="${KUBERBLUE_CHART_CACHE:-/usr/share/kuberblue/charts}"
 
 # Track all SOPS temp files for cleanup
 _sops_tmpfiles=()
@@ -36,8 +49,8 @@ fi
 #   Tier 2 (optional) — only deploy when enabled: true
 #   Tier 3 (custom)   — user files not listed in packages.yaml deploy unconditionally
 
-declare -A _ENABLED_MANIFESTS
-declare -A _DISABLED_MANIFESTS
+declare -A _ENABLED_MANIFESTS=()
+declare -A _DISABLED_MANIFESTS=()
 _PACKAGES_LOADED="false"
 
 kuberblue_load_packages() {
@@ -156,6 +169,39 @@ kuberblue_sops_decrypt_if_needed() {
 }
 
 
+# --- Desired-state records ---
+# After a successful deploy the sha256 of its inputs (metadata and values
+# files for a Helm release, the file for a manifest) is recorded in the
+# deploy/ state markers. A later deploy_all skips a release whose inputs
+# hash the same and whose live revision is still the recorded one, and a
+# manifest whose inputs hash the same and whose objects all still exist.
+# Only releases with a pinned chart `version` are skipped: an unpinned
+# chart can change upstream without its inputs changing, so it is always
+# upgraded. Set KUBERBLUE_DEPLOY_FORCE=true to redeploy anyway.
+# The markers only save work: a failure to record one is a warning.
+
+# kuberblue_deploy_hash <file>...
+# Prints the sha256 of the concatenated files.
+kuberblue_deploy_hash() {
+    cat "$@" | sha256sum | cut -d' ' -f1
+}
+
+# kuberblue_version_newer <a> <b>
+# Succeeds when chart version a is newer than b (a leading v is ignored).
+kuberblue_version_newer() {
+    local a="${1#v}" b="${2#v}"
+    [[ "$a" != "$b" ]] && [[ "$(printf '%s\n' "$a" "$b" | sort -V | tail -n 1)" == "$a" ]]
+}
+
+# kuberblue_deploy_key <kind> <id>
+# Prints the state marker key of a release or manifest.
+kuberblue_deploy_key() {
+    local id="${2#"$manifest_dir"}"
+    id="${id#/}"
+    echo "deploy/${1}.${id//\//_}"
+}
+
+
 # --- Helm deploy with --wait, --timeout, and rollback on failure ---
 deploy_helm_repo_and_chart() {
     local filename="$1"
@@ -166,13 +212,14 @@ deploy_helm_repo_and_chart() {
         echo "Missing metadata.yaml with values file. Cannot continue."
         return 1
     fi
-    # Deployment info
-    local name chart namespace create_namespace args
-    name="$(yq ".name" "$metadata_file")"
-    chart="$(yq ".chart" "$metadata_file")"
-    namespace="$(yq ".namespace" "$metadata_file")"
-    create_namespace="$(yq ".create_namespace" "$metadata_file")"
-    args="$(yq ".args" "$metadata_file")"
+    # Deployment and repo info, one line per field (see kube_manifest_index.py)
+    local metadata
+    local -a fields
+    metadata="$(python3 "${manifest_index}" metadata "$metadata_file")"
+    mapfile -t fields <<< "$metadata"
+    local name="${fields[0]:-}" chart="${fields[1]:-}" version="${fields[2]:-}"
+    local namespace="${fields[3]:-}" create_namespace="${fields[4]:-}" args="${fields[5]:-}"
+    local repo_name="${fields[6]:-}" repo_url="${fields[7]:-}"
 
     # Validate required fields
     if [[ "$name" == "null" ]] || [[ -z "$name" ]]; then
@@ -184,29 +231,64 @@ deploy_helm_repo_and_chart() {
         return 1
     fi
 
-    # Repo info
-    local repo_name repo_url
-    repo_name="$(yq ".repo_name" "$metadata_file")"
-    repo_url="$(yq ".repo_url" "$metadata_file")"
-
     if [[ "$repo_name" == "null" ]] || [[ -z "$repo_name" ]] || \
        [[ "$repo_url" == "null" ]] || [[ -z "$repo_url" ]]; then
         echo "ERROR: .repo_name or .repo_url missing in $metadata_file"
         return 1
     fi
 
+    # Skip the release when its pinned chart is already deployed from the
+    # same inputs
+    local release_key desired_hash release_info release_status live_revision live_version
+    release_key="$(kuberblue_deploy_key helm "${namespace}/${name}")"
+    desired_hash="$(kuberblue_deploy_hash "$metadata_file" "$filename")"
+    release_info="$(helm status "${name}" --namespace "${namespace}" -o json 2>/dev/null \
+        | python3 -c "import json,sys; r=json.load(sys.stdin); print(r['info']['status'], r['version'], ((r.get('chart') or {}).get('metadata') or {}).get('version', ''))" 2>/dev/null)" || release_info=""
+    read -r release_status live_revision live_version <<< "$release_info"
+
+    # Never downgrade a release to its pin: clusters deployed before the core
+    # charts were pinned may run a newer chart, and cilium and cert-manager do
+    # not support going back a minor version (an older cert-manager chart also
+    # fights the newer CRDs). The release is left alone, still counting as
+    # deployed so the packages after it go ahead.
+    if [[ "$_kuberblue_allow_downgrade" != "true" ]] && [[ -n "$version" ]] && [[ "$version" != "null" ]] \
+        && [[ -n "$live_version" ]] && kuberblue_version_newer "$live_version" "$version"; then
+        echo "WARNING: Helm release ${name} runs chart ${live_version}, newer than the pinned ${version}." \
+            "Not downgrading it; set KUBERBLUE_DEPLOY_FORCE=true to deploy ${version} anyway."
+        return 0
+    fi
+    if [[ "$KUBERBLUE_DEPLOY_FORCE" != "true" ]] && [[ -n "$version" ]] && [[ "$version" != "null" ]] \
+        && [[ "$release_status" == "deployed" ]] \
+        && [[ "$(kuberblue_state_get "$release_key")" == "${desired_hash} ${live_revision}" ]]; then
+        echo "Helm release ${name} is up to date (revision ${live_revision}). Skipping."
+        return 0
+    fi
+
     # Decrypt values file if SOPS-encrypted
     local values_file
     values_file="$(kuberblue_sops_decrypt_if_needed "$filename")"
 
-    # Add and update helm repo
-    helm repo add "$repo_name" "$repo_url"
-    helm repo update "$repo_name"
+    # Install a pinned chart from the image's chart cache, so first boot needs
+    # no chart repo. On a miss, add and update the helm repo. Charts of one
+    # wave deploy concurrently, so serialize the writes to the shared
+    # repositories file.
+    local chart_ref="$chart"
+    local cached_chart="${KUBERBLUE_CHART_CACHE}/${chart##*/}-${version}.tgz"
+    if [[ -n "$version" ]] && [[ "$version" != "null" ]] && [[ -f "$cached_chart" ]]; then
+        echo "Using cached chart ${cached_chart}"
+        chart_ref="$cached_chart"
+    else
+        (
+            flock 9
+            helm repo add "$repo_name" "$repo_url"
+            helm repo update "$repo_name"
+        ) 9>"${TMPDIR:-/tmp}/kuberblue-helm-repo.lock"
+    fi
 
     # Build helm command WITHOUT --wait. We handle readiness checks manually
     # because helm --wait blocks forever on LoadBalancer services without an
     # external IP (e.g. Cilium ingress on bare metal before IP pool is configured).
-    local helm_cmd=(helm upgrade -i "${name}" "${chart}"
+    local helm_cmd=(helm upgrade -i "${name}" "${chart_ref}"
         --namespace "${namespace}"
         --timeout "${HELM_TIMEOUT}"
         -f "$values_file"
@@ -214,6 +296,9 @@ deploy_helm_repo_and_chart() {
     if [[ "$create_namespace" == "true" ]]; then
         helm_cmd+=(--create-namespace)
     fi
+    if [[ "$chart_ref" == "$chart" ]] && [[ -n "$version" ]] && [[ "$version" != "null" ]]; then
+        helm_cmd+=(--version "$version")
+    fi
     if [[ -n "$args" ]] && [[ "$args" != "null" ]]; then
         local -a extra_args
         read -ra extra_args <<< "$args"
@@ -223,9 +308,6 @@ deploy_helm_repo_and_chart() {
     # Clear stuck helm releases (pending-install/pending-upgrade) before attempting upgrade.
     # These states occur when a previous helm operation was interrupted or timed out,
     # leaving the release in an unrecoverable state that blocks all future operations.
-    local release_status
-    release_status="$(helm status "${name}" --namespace "${namespace}" -o json 2>/dev/null \
-        | python3 -c "import json,sys; print(json.load(sys.stdin)['info']['status'])" 2>/dev/null)" || release_status=""
     if [[ "$release_status" == "pending-install" ]] || [[ "$release_status" == "pending-upgrade" ]] || [[ "$release_status" == "pending-rollback" ]]; then
         echo "WARNING: Release ${name} is stuck in '${release_status}'. Cleaning up..."
         helm uninstall "${name}" --namespace "${namespace}" --no-hooks 2>/dev/null || true
@@ -245,35 +327,27 @@ deploy_helm_repo_and_chart() {
         return 1
     fi
 
-    # Wait for Deployments and DaemonSets to be ready (skip LoadBalancer IP checks).
+    # Wait for the Deployments and DaemonSets of the release to be ready (skip
+    # LoadBalancer IP checks), all watched at once under one deadline.
     echo "Waiting for ${name} workloads to become ready..."
     local wait_failed=0
-    while IFS= read -r deploy; do
-        [[ -z "$deploy" ]] && continue
-        echo "  Waiting for Deployment/${deploy}..."
-        if ! kubectl rollout status "deployment/${deploy}" \
-            --namespace "${namespace}" --timeout="${HELM_TIMEOUT}"; then
-            echo "  WARNING: Deployment/${deploy} not ready"
-            wait_failed=1
-        fi
-    done < <(kubectl get deploy -n "${namespace}" -l "app.kubernetes.io/part-of=${name}" \
-        -o jsonpath='{.items[*].metadata.name}' 2>/dev/null | tr ' ' '\n')
-
-    while IFS= read -r ds; do
-        [[ -z "$ds" ]] && continue
-        echo "  Waiting for DaemonSet/${ds}..."
-        if ! kubectl rollout status "daemonset/${ds}" \
-            --namespace "${namespace}" --timeout="${HELM_TIMEOUT}"; then
-            echo "  WARNING: DaemonSet/${ds} not ready"
-            wait_failed=1
-        fi
-    done < <(kubectl get ds -n "${namespace}" -l "app.kubernetes.io/part-of=${name}" \
-        -o jsonpath='{.items[*].metadata.name}' 2>/dev/null | tr ' ' '\n')
+    if ! python3 "${kube_wait}" --timeout "${HELM_TIMEOUT}" \
+        "deployment/${namespace}?app.kubernetes.io/part-of=${name}" \
+        "daemonset/${namespace}?app.kubernetes.io/part-of=${name}"; then
+        wait_failed=1
+    fi
 
     if [[ ${wait_failed} -ne 0 ]]; then
         echo "ERROR: Some workloads for ${name} did not become ready."
         return 1
     fi
+
+    live_revision="$(helm status "${name}" --namespace "${namespace}" -o json 2>/dev/null \
+        | python3 -c "import json,sys; print(json.load(sys.stdin)['version'])" 2>/dev/null)" || live_revision=""
+    if [[ -n "$live_revision" ]]; then
+        kuberblue_state_set "$release_key" "${desired_hash} ${live_revision}" \
+            || echo "WARNING: cannot record the deploy state of ${name}; it is redeployed next time"
+    fi
     echo "Helm deploy of ${name} succeeded."
 }
 
@@ -283,60 +357,52 @@ kubectl_apply_and_wait() {
     local file="$1"
     local rollout_failed=0
 
+    local manifest_key desired_hash
+    manifest_key="$(kuberblue_deploy_key manifest "$file")"
+    desired_hash="$(kuberblue_deploy_hash "$file")"
+
     # Decrypt if SOPS-encrypted
     local apply_file
     apply_file="$(kuberblue_sops_decrypt_if_needed "$file")"
 
+    # Skip the manifest when it was applied unchanged and its objects still exist
+    if [[ "$KUBERBLUE_DEPLOY_FORCE" != "true" ]] \
+        && [[ "$(kuberblue_state_get "$manifest_key")" == "$desired_hash" ]] \
+        && kubectl get -f "$apply_file" -o name >/dev/null 2>&1; then
+        echo "Manifest $file is up to date. Skipping."
+        return 0
+    fi
+
     echo "Deploying $apply_file via kubectl apply"
     kubectl apply -f "$apply_file"
 
-    # Extract per-resource name, namespace, and kind from each YAML document
-    # This handles multi-doc YAML correctly instead of using a single namespace
-    local doc_index=0
-    local doc_count
-    doc_count="$(yq 'document_index' "$apply_file" 2>/dev/null | tail -1)" || doc_count=0
-    doc_count=$((doc_count + 1))
-
-    while [[ ${doc_index} -lt ${doc_count} ]]; do
-        local kind res_name res_ns
-        kind="$(yq "select(document_index == ${doc_index}) | .kind" "$apply_file" 2>/dev/null)" || kind=""
-        res_name="$(yq "select(document_index == ${doc_index}) | .metadata.name" "$apply_file" 2>/dev/null)" || res_name=""
-        res_ns="$(yq "select(document_index == ${doc_index}) | .metadata.namespace // \"default\"" "$apply_file" 2>/dev/null)" || res_ns="default"
-
-        if [[ -z "$res_name" ]] || [[ "$res_name" == "null" ]]; then
-            doc_index=$((doc_index + 1))
-            continue
+    # Wait for the rollout of every Deployment, DaemonSet and StatefulSet in
+    # the file, each in its own namespace, watched together under one
+    # deadline. The file is parsed once, and not at all when its index is
+    # cached.
+    local objects kind res_name res_ns waitable
+    local targets=()
+    objects="$(python3 "${manifest_index}" objects "$apply_file" \
+        --cache-dir "${STATE_DIR:-/var/lib/kuberblue}/cache/manifest-index")" || {
+        echo "WARNING: cannot index $file; not waiting for its rollouts"
+        objects=""
+    }
+    while IFS=$'\t' read -r kind res_name res_ns waitable; do
+        [[ "$waitable" == "1" ]] || continue
+        targets+=("${kind,,}/${res_ns}/${res_name}")
+    done <<< "$objects"
+    if [[ ${#targets[@]} -gt 0 ]]; then
+        echo "Waiting for ${#targets[@]} rollouts of $file..."
+        if ! python3 "${kube_wait}" --timeout "${HELM_TIMEOUT}" "${targets[@]}"; then
+            echo "WARNING: rollout check failed for $file"
+            rollout_failed=1
         fi
+    fi
 
-        case "$kind" in
-            Deployment)
-                echo "Waiting for Deployment ${res_name} rollout in ${res_ns}..."
-                if ! kubectl rollout status deployment/"${res_name}" \
-                    --namespace "${res_ns}" --timeout="${HELM_TIMEOUT}"; then
-                    echo "WARNING: rollout check failed for Deployment/${res_name} in ${res_ns}"
-                    rollout_failed=1
-                fi
-                ;;
-            DaemonSet)
-                echo "Waiting for DaemonSet ${res_name} rollout in ${res_ns}..."
-                if ! kubectl rollout status daemonset/"${res_name}" \
-                    --namespace "${res_ns}" --timeout="${HELM_TIMEOUT}"; then
-                    echo "WARNING: rollout check failed for DaemonSet/${res_name} in ${res_ns}"
-                    rollout_failed=1
-                fi
-                ;;
-            StatefulSet)
-                echo "Waiting for StatefulSet ${res_name} rollout in ${res_ns}..."
-                if ! kubectl rollout status statefulset/"${res_name}" \
-                    --namespace "${res_ns}" --timeout="${HELM_TIMEOUT}"; then
-                    echo "WARNING: rollout check failed for StatefulSet/${res_name} in ${res_ns}"
-                    rollout_failed=1
-                fi
-                ;;
-        esac
-        doc_index=$((doc_index + 1))
-    done
-
+    if [[ ${rollout_failed} -eq 0 ]]; then
+        kuberblue_state_set "$manifest_key" "$desired_hash" \
+            || echo "WARNING: cannot record the deploy state of $file; it is applied again next time"
+    fi
     return "${rollout_failed}"
 }
 
@@ -401,30 +467,119 @@ determine_file_and_deploy(){
     return
 }
 
-deploy_all_manifests(){
-    # Load package tier configuration before deploying
-    kuberblue_load_packages
-
-    # First process manifests in the root directory (not under any package path)
-    if compgen -G "${manifest_dir}*.yaml" > /dev/null || compgen -G "${manifest_dir}*.json" > /dev/null; then
-        for f in "${manifest_dir}"*.yaml "${manifest_dir}"*.json; do
-            # Skip if the file doesn't exist (happens when no matches for one of the patterns)
-            [ -e "$f" ] || continue
-            if kuberblue_is_manifest_enabled "$f"; then
-                determine_file_and_deploy "$f"
-            fi
-        done
-    fi
+# deploy_unit <unit>
+# Deploys the manifests of one directory of the deploy plan in order
+# ("." being the manifest dir itself).
+deploy_unit() {
+    local unit="$1"
+    local dir="${manifest_dir}${unit}"
+    [[ "$unit" == "." ]] && dir="${manifest_dir}"
 
-    # Process manifests in subdirectories using find to handle any level of nesting
-    # Skip .tpl files from find as well
-    # Filter out disabled packages before deploying
+    local f
     while IFS= read -r f; do
         if kuberblue_is_manifest_enabled "$f"; then
             determine_file_and_deploy "$f"
         fi
-    done < <(find "${manifest_dir}" -mindepth 2 -type f \( -name "*.yaml" -o -name "*.json" \) \
-        ! -name "*.tpl" | sort)
+    done < <(find "${dir}" -mindepth 1 -maxdepth 1 -type f \( -name "*.yaml" -o -name "*.json" \) | sort)
+}
+
+# deploy_wave <wave> <unit>...
+# Deploys the units of one wave concurrently, at most KUBERBLUE_DEPLOY_JOBS
+# at a time, and waits for all of them. Output lines are prefixed with the
+# unit. Failed units are added to _deploy_failed.
+#
+# Must not be called as a condition (if/||/&&): bash then ignores set -e in
+# the background jobs too, and a unit would carry on after a failed step.
+_deploy_failed=()
+deploy_wave() {
+    local wave="$1"
+    shift
+    local -A running=()
+    local unit done_pid
+    local jobs="${KUBERBLUE_DEPLOY_JOBS}"
+    [[ "$jobs" =~ ^[1-9][0-9]*$ ]] || jobs=1
+
+    echo "=== Deploy wave ${wave}: $* ==="
+    for unit in "$@"; do
+        while [[ ${#running[@]} -ge ${jobs} ]]; do
+            _deploy_reap
+        done
+        (
+            set -eo pipefail
+            trap _sops_cleanup EXIT
+            deploy_unit "$unit"
+        ) 2>&1 | sed -u "s|^|[${unit}] |" &
+        running[$!]="$unit"
+    done
+    while [[ ${#running[@]} -gt 0 ]]; do
+        _deploy_reap
+    done
+}
+
+# Wait for any unit of the current wave (helper of deploy_wave)
+_deploy_reap() {
+    local rc=0
+    done_pid=""
+    wait -n -p done_pid "${!running[@]}" || rc=$?
+    if [[ -z "$done_pid" ]]; then
+        # No unit left to wait for
+        running=()
+        return
+    fi
+    if [[ $rc -eq 0 ]]; then
+        echo "Deployed ${running[$done_pid]}"
+    else
+        echo "ERROR: Deploying ${running[$done_pid]} failed (exit ${rc})"
+        _deploy_failed+=("${running[$done_pid]}")
+    fi
+    unset "running[$done_pid]"
+}
+
+# Print the deploy waves, one "<wave><TAB><unit>" line per manifest directory
+deploy_plan_waves() {
+    kuberblue_load_packages >&2
+
+    local -a plan_args=(waves "${manifest_dir}")
+    local mpath
+    for mpath in "${!_DISABLED_MANIFESTS[@]}"; do
+        echo "Skipping disabled package: ${_DISABLED_MANIFESTS[$mpath]} ($mpath)" >&2
+        plan_args+=(--skip "$mpath")
+    done
+    python3 "${deploy_plan}" "${plan_args[@]}" "$@"
+}
+
+deploy_all_manifests(){
+    # Order the manifest directories into waves: a directory only deploys
+    # after the directories it depends on (lower numeric prefix, depends_on
+    # in 00-metadata.yaml), and the directories of a wave deploy in parallel.
+    # Package tiers are loaded here so the units see the disabled packages.
+    kuberblue_load_packages
+    local plan
+    plan="$(deploy_plan_waves)"
+
+    local wave="" w unit
+    local -a units=()
+    _deploy_failed=()
+    while IFS=$'\t' read -r w unit; do
+        [[ -z "$unit" ]] && continue
+        if [[ "$w" != "$wave" ]] && [[ ${#units[@]} -gt 0 ]]; then
+            deploy_wave "$wave" "${units[@]}"
+            units=()
+            if [[ ${#_deploy_failed[@]} -gt 0 ]]; then
+                break
+            fi
+        fi
+        wave="$w"
+        units+=("$unit")
+    done <<< "$plan"
+    if [[ ${#units[@]} -gt 0 ]] && [[ ${#_deploy_failed[@]} -eq 0 ]]; then
+        deploy_wave "$wave" "${units[@]}"
+    fi
+
+    if [[ ${#_deploy_failed[@]} -gt 0 ]]; then
+        echo "ERROR: Deploy stopped after wave ${wave}, failed: ${_deploy_failed[*]}"
+        return 1
+    fi
 
     # Post-deploy validation: check for non-Running/non-Succeeded pods
     echo ""
@@ -449,13 +604,15 @@ deploy_manifest() {
         return 1
     fi
 
-    determine_file_and_deploy "$f"
+    # An explicit deploy always applies, even when the file is unchanged
+    KUBERBLUE_DEPLOY_FORCE=true determine_file_and_deploy "$f"
 }
 
 # --- Entry point for direct execution ---
 # When called as an executable (not sourced), dispatch subcommands:
 #   kube_deploy.sh deploy_all          - deploy all manifests
 #   kube_deploy.sh deploy <file>       - deploy a single manifest
+#   kube_deploy.sh plan [--json]       - show the deploy waves
 if [[ "${BASH_SOURCE[0]}" == "${0}" ]]; then
     set -euxo pipefail
     case "${1:-}" in
@@ -469,8 +626,11 @@ if [[ "${BASH_SOURCE[0]}" == "${0}" ]]; then
             fi
             deploy_manifest "$2"
             ;;
+        plan)
+            deploy_plan_waves "${@:2}"
+            ;;
         *)
-            echo "Usage: $0 {deploy_all|deploy <file>}"
+            echo "Usage: $0 {deploy_all|deploy <file>|plan [--json]}"
             exit 1
             ;;
     esac
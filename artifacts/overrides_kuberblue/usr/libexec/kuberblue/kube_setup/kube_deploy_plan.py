@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+# kube_deploy_plan.py
+#
+# Orders the manifest directories under /etc/kuberblue/manifests into deploy
+# waves for kube_deploy.sh.
+#
+# Every directory holding manifests (*.yaml or *.json files other than the
+# metadata and Chainsaw *_test.yaml files) is a unit, deployed as a whole by
+# kube_deploy.sh. A unit depends on:
+#   - every unit under a top-level directory with a lower numeric prefix
+#     (00-infrastructure before 10-networking before 50-backup/50-monitoring)
+#   - the units in its parent directories
+#   - the units listed in `depends_on` in its 00-metadata.yaml, by name
+#     (the metadata `name`, or the directory name without its prefix) or
+#     by path relative to the manifest dir
+# Manifests directly in the manifest dir deploy before everything else, and
+# top-level directories without a numeric prefix after everything else.
+#
+# Units in one wave do not depend on each other, so kube_deploy.sh deploys
+# them concurrently and waits for the whole wave before starting the next.
+#
+# Usage:
+#   kube_deploy_plan.py waves MANIFEST_DIR [--skip PATH]... [--json]
+#
+# Prints one "<wave><TAB><unit>" line per unit, "." being the manifest dir
+# itself. Exits 2 when a dependency is unknown or the dependencies loop.
+
+import os
+import re
+import sys
+import json
+
+import yaml
+
+METADATA_FILE = '00-metadata.yaml'
+MANIFEST_SUFFIXES = ('.yaml', '.json')
+ROOT = '.'
+
+EXIT_INVALID = 2
+
+_PREFIX = re.compile(r'^(\d+)-')
+
+
+def strip_prefix(name):
+    """The directory name without its numeric ordering prefix."""
+    return _PREFIX.sub('', name)
+
+
+def deployable(filename):
+    """Whether kube_deploy.sh deploys a file, rather than skipping it."""
+    return (filename.endswith(MANIFEST_SUFFIXES) and not filename.endswith('metadata.yaml')
+            and not filename.endswith('_test.yaml'))
+
+
+def tier(unit):
+    """Sort key of the top-level directory of a unit, lower tiers deploy first."""
+    if unit == ROOT:
+        return (0, 0)
+    match = _PREFIX.match(unit.split('/')[0])
+    return (1, int(match.group(1))) if match else (2, 0)
+
+
+def find_units(manifest_dir, skip=()):
+    """The units under a manifest dir with their metadata.
+
+    Args:
+        manifest_dir: Directory to scan
+        skip: Paths relative to manifest_dir whose units are left out of the
+            plan (disabled packages), units depending on them wait for their
+            dependencies instead
+
+    Returns:
+        A dict of unit path to {'name': ..., 'depends_on': [...], 'skip': bool}
+
+    Raises:
+        ValueError: A metadata file cannot be read
+    """
+    skip = [path.strip('/') for path in skip if path.strip('/')]
+    units = {}
+    for directory, subdirs, files in os.walk(manifest_dir):
+        subdirs.sort()
+        if not any(deployable(f) for f in files):
+            continue
+        unit = os.path.relpath(directory, manifest_dir)
+
+        metadata = {}
+        if METADATA_FILE in files:
+            try:
+                with open(os.path.join(directory, METADATA_FILE), 'r') as f:
+                    metadata = yaml.safe_load(f) or {}
+            except (OSError, yaml.YAMLError) as e:
+                raise ValueError(f"cannot read {os.path.join(unit, METADATA_FILE)}: {e}")
+            if not isinstance(metadata, dict):
+                raise ValueError(f"{os.path.join(unit, METADATA_FILE)} is not a mapping")
+
+        depends_on = metadata.get('depends_on') or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        units[unit] = {
+            'name': metadata.get('name') or strip_prefix(os.path.basename(directory)),
+            'depends_on': [str(dep).strip('/') for dep in depends_on],
+            'skip': any(unit == path or unit.startswith(path + '/') for path in skip),
+        }
+    return units
+
+
+def dependencies(units):
+    """Resolve what every unit that is not skipped waits for.
+
+    Args:
+        units: As returned by find_units
+
+    Returns:
+        A dict of unit path to the set of unit paths it depends on
+
+    Raises:
+        ValueError: A depends_on entry matches no unit
+    """
+    by_name = {}
+    for unit, info in units.items():
+        by_name.setdefault(info['name'], unit)
+        by_name.setdefault(strip_prefix(os.path.basename(unit)), unit)
+    planned = [unit for unit, info in units.items() if not info['skip']]
+
+    def resolve(unit, seen):
+        """The planned units named by depends_on, looking through skipped ones."""
+        found = set()
+        for dep in units[unit]['depends_on']:
+            target = dep if dep in units else by_name.get(dep)
+            if target is None:
+                raise ValueError(f"{unit}: unknown dependency '{dep}'")
+            if target in seen:
+                continue
+            seen.add(target)
+            found.update(resolve(target, seen) if units[target]['skip'] else {target})
+        return found
+
+    deps = {}
+    for unit in planned:
+        needs = {other for other in planned if tier(other) < tier(unit)}
+        needs.update(other for other in planned if other != ROOT and unit.startswith(other + '/'))
+        needs.update(resolve(unit, {unit}))
+        deps[unit] = needs
+    return deps
+
+
+def waves(units):
+    """Group units into waves, each only depending on earlier waves.
+
+    Returns:
+        A list of waves, each a sorted list of unit paths
+
+    Raises:
+        ValueError: A dependency is unknown or the dependencies form a cycle
+    """
+    deps = dependencies(units)
+    done = set()
+    result = []
+    while len(done) < len(deps):
+        wave = sorted(unit for unit, needs in deps.items() if unit not in done and needs <= done)
+        if not wave:
+            stuck = sorted(unit for unit in deps if unit not in done)
+            raise ValueError(f"dependency cycle between: {', '.join(stuck)}")
+        result.append(wave)
+        done.update(wave)
+    return result
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: kube_deploy_plan.py waves MANIFEST_DIR [--skip PATH]... [--json]")
+    print("\nPrint the deploy waves of the manifest directories, one '<wave>\\t<unit>' line each.")
+    print("Units in the same wave do not depend on each other.")
+
+
+def main(argv):
+    """Command line entry point."""
+    if len(argv) < 2 or argv[0] != 'waves':
+        print_usage()
+        return 1
+
+    manifest_dir, args = argv[1], argv[2:]
+    skip = []
+    as_json = False
+    while args:
+        if args[0] == '--json':
+            as_json = True
+            args = args[1:]
+        elif args[0] == '--skip' and len(args) > 1:
+            skip.append(args[1])
+            args = args[2:]
+        else:
+            print_usage()
+            return 1
+
+    try:
+        units = find_units(manifest_dir, skip)
+        plan = waves(units)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_INVALID
+
+    if as_json:
+        json.dump({'waves': [[{'unit': unit, 'name': units[unit]['name'], 'depends_on': units[unit]['depends_on']}
+                              for unit in wave] for wave in plan]},
+                  sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for number, wave in enumerate(plan):
+            for unit in wave:
+                print(f"{number}\t{unit}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+# kube_manifest_index.py
+#
+# Reads kuberblue manifests for kube_deploy.sh in one parse, instead of one
+# yq process per field and YAML document.
+#
+# `objects` lists the objects of a multi-document manifest, one
+# "<kind><TAB><name><TAB><namespace><TAB><waitable>" line each, waitable being
+# 1 for the kinds `kubectl rollout status` can wait for. The index is cached
+# by the sha256 of the file under CACHE_DIR, so redeploying an unchanged
+# manifest does not parse it again.
+#
+# `metadata` prints the fields of a Helm 00-metadata.yaml one per line, in
+# the order of METADATA_FIELDS, empty when unset, for bash to mapfile.
+#
+# `images` prints the container images of every pod template in a manifest,
+# such as the output of `helm template`, once each. The image build uses it
+# to preload the images of the vendored charts.
+#
+# Usage:
+#   kube_manifest_index.py objects FILE [--json] [--cache-dir DIR]
+#   kube_manifest_index.py metadata FILE
+#   kube_manifest_index.py images FILE
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+
+import yaml
+
+CACHE_DIR = '/var/lib/kuberblue/cache/manifest-index'
+# Cached indexes kept, the least recently written are removed first
+CACHE_MAX = 256
+INDEX_VERSION = 1
+
+# Kinds `kubectl rollout status` waits for
+ROLLOUT_KINDS = ('Deployment', 'DaemonSet', 'StatefulSet')
+
+METADATA_FIELDS = ('name', 'chart', 'version', 'namespace', 'create_namespace',
+                   'args', 'repo_name', 'repo_url')
+
+# Pod spec fields listing containers
+CONTAINER_FIELDS = ('initContainers', 'containers', 'ephemeralContainers')
+
+
+def index(documents):
+    """The objects of parsed manifest documents.
+
+    List kinds (v1 List, DeploymentList...) contribute their items.
+
+    Args:
+        documents: The parsed YAML documents
+
+    Returns:
+        A list of {'kind', 'name', 'namespace', 'waitable'} dicts, in document
+        order, leaving out documents without a name
+    """
+    objects = []
+    for doc in documents:
+        if not isinstance(doc, dict):
+            continue
+        if str(doc.get('kind') or '').endswith('List') and isinstance(doc.get('items'), list):
+            objects.extend(index(doc['items']))
+            continue
+        metadata = doc.get('metadata') or {}
+        if not isinstance(metadata, dict) or not metadata.get('name'):
+            continue
+        kind = str(doc.get('kind') or '')
+        objects.append({
+            'kind': kind,
+            'name': str(metadata['name']),
+            'namespace': str(metadata.get('namespace') or 'default'),
+            'waitable': kind in ROLLOUT_KINDS,
+        })
+    return objects
+
+
+def _cache_path(digest, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, f"{digest}.json")
+
+
+def _cache_write(path, objects):
+    """Save an index, dropping the oldest ones past CACHE_MAX."""
+    try:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.index-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'objects': objects}, f)
+        os.replace(tmp, path)
+
+        entries = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.json')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:-CACHE_MAX]:
+            os.unlink(entry.path)
+    except OSError:
+        # Without the cache the next deploy parses the file again
+        pass
+
+
+def objects(path, cache_dir=None):
+    """The index of a manifest file, from the cache when the file is unchanged.
+
+    Args:
+        path: Manifest file, one or more YAML (or JSON) documents
+        cache_dir: Index cache directory (default CACHE_DIR)
+
+    Returns:
+        As index()
+
+    Raises:
+        OSError: The file cannot be read
+        ValueError: The file is not valid YAML
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    cached = _cache_path(hashlib.sha256(content).hexdigest(), cache_dir)
+    try:
+        with open(cached, 'r') as f:
+            data = json.load(f)
+        if data.get('version') == INDEX_VERSION:
+            return data['objects']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    try:
+        documents = list(yaml.safe_load_all(content))
+    except yaml.YAMLError as e:
+        raise ValueError(f"{path}: {e}")
+    result = index(documents)
+    _cache_write(cached, result)
+    return result
+
+
+def metadata(path):
+    """The METADATA_FIELDS of a 00-metadata.yaml as strings, '' when unset.
+
+    Raises:
+        OSError: The file cannot be read
+        ValueError: The file is not a YAML mapping
+    """
+    with open(path, 'r') as f:
+        try:
+            data = yaml.safe_load(f) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(f"{path}: {e}")
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: not a mapping")
+
+    fields = []
+    for field in METADATA_FIELDS:
+        value = data.get(field)
+        if value is None:
+            value = ''
+        elif isinstance(value, bool):
+            value = 'true' if value else 'false'
+        # One line per field, as `read` consumes them
+        fields.append(' '.join(str(value).split('\n')).strip())
+    return fields
+
+
+def images(path):
+    """The container images of a manifest file, in order of appearance.
+
+    Every mapping with a container list counts as a pod spec, so images are
+    found in Pods, workload templates and CronJob job templates alike.
+
+    Raises:
+        OSError: The file cannot be read
+        ValueError: The file is not valid YAML
+    """
+    with open(path, 'r') as f:
+        try:
+            documents = list(yaml.safe_load_all(f))
+        except yaml.YAMLError as e:
+            raise ValueError(f"{path}: {e}")
+
+    found = []
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            for field in CONTAINER_FIELDS:
+                for container in node.get(field) or []:
+                    image = container.get('image') if isinstance(container, dict) else None
+                    if image and image not in found:
+                        found.append(str(image))
+            for value in node.values():
+                walk(value)
+
+    walk(documents)
+    return found
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: kube_manifest_index.py COMMAND FILE")
+    print("\nCommands:")
+    print("  objects FILE [--json] [--cache-dir DIR]")
+    print("                  List kind, name, namespace and rollout-waitable of every object")
+    print("  metadata FILE   Print the Helm metadata fields, one per line:")
+    print(f"                  {' '.join(METADATA_FIELDS)}")
+    print("  images FILE     List the container images of every pod template")
+    print(f"\nIndex cache: {CACHE_DIR}")
+
+
+def main(argv):
+    """Command line entry point."""
+    if len(argv) < 2 or argv[0] not in ('objects', 'metadata', 'images'):
+        print_usage()
+        return 1
+    command, path, args = argv[0], argv[1], argv[2:]
+    as_json = False
+    cache_dir = None
+    while args and command == 'objects':
+        if args[0] == '--json':
+            as_json = True
+            args = args[1:]
+        elif args[0] == '--cache-dir' and len(args) > 1:
+            cache_dir = args[1]
+            args = args[2:]
+        else:
+            break
+    if args:
+        print_usage()
+        return 1
+
+    try:
+        if command in ('metadata', 'images'):
+            for value in (metadata if command == 'metadata' else images)(path):
+                print(value)
+            return 0
+        found = objects(path, cache_dir)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    if as_json:
+        json.dump(found, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        for obj in found:
+            print(f"{obj['kind']}\t{obj['name']}\t{obj['namespace']}\t{1 if obj['waitable'] else 0}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -10,6 +10,8 @@
 #   flux-bootstrapped    — set after Flux CD bootstrap completes
 #   sops-configured      — set after SOPS+Age key generation
 #   tailscale-configured — set after Tailscale setup completes
+#   deploy/<release>     — desired-state hash of each deployed Helm release and
+#                          manifest, written by kube_deploy.sh (see there)
 #
 # Usage: source this file, then call kuberblue_state_* functions.
 #   source /usr/libexec/kuberblue/kube_setup/kube_state.sh
@@ -33,6 +35,9 @@ kuberblue_state_set () {
     fi
 
     kuberblue_state_init
+    if [[ "${key}" == */* ]]; then
+        mkdir -p "${KUBERBLUE_STATE_DIR}/${key%/*}"
+    fi
     printf '%s\n' "${value}" > "${KUBERBLUE_STATE_DIR}/${key}"
 }
 
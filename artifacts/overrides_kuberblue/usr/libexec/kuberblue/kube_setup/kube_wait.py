@@ -0,0 +1,514 @@
+#!/usr/bin/python3
+# kube_wait.py
+#
+# Waits for Kubernetes objects to become ready by watching the API server,
+# instead of polling `kubectl get` or running `kubectl rollout status` for
+# one object after another.
+#
+# Each kind of tracked object (nodes, deployments, daemonsets, statefulsets)
+# is listed once and then followed over one watch stream, scoped to the
+# namespace when all targets of the kind share one. Every object is reported
+# as soon as it is ready, and a single deadline covers all of them.
+#
+# Targets:
+#   node/NAME
+#   KIND/NAMESPACE/NAME         a deployment, daemonset or statefulset
+#   KIND/NAMESPACE?SELECTOR     every KIND in NAMESPACE matching the key=value
+#                               label selector when the wait starts
+#
+# The API server and credentials come from KUBECONFIG (or ~/.kube/config).
+# Client certificates, bearer tokens and the cluster CA are supported, exec
+# credential plugins are not.
+#
+# Usage:
+#   kube_wait.py [--timeout DURATION] TARGET...
+#
+# DURATION is seconds or a Go duration such as 15m (the HELM_TIMEOUT format).
+# Exits 0 when every target is ready, 1 when the deadline passed or a rollout
+# failed, 2 when the API server cannot be used.
+
+import os
+import re
+import ssl
+import sys
+import json
+import time
+import queue
+import base64
+import tempfile
+import threading
+import http.client
+import urllib.parse
+
+import yaml
+
+DEFAULT_TIMEOUT = 300
+# Seconds before a broken watch is opened again
+RETRY_DELAY = 1
+
+EXIT_NOT_READY = 1
+EXIT_API = 2
+
+# kind: (API group path, resource, namespaced)
+KINDS = {
+    'node': ('/api/v1', 'nodes', False),
+    'deployment': ('/apis/apps/v1', 'deployments', True),
+    'daemonset': ('/apis/apps/v1', 'daemonsets', True),
+    'statefulset': ('/apis/apps/v1', 'statefulsets', True),
+}
+
+READY = 'ready'
+WAITING = 'waiting'
+FAILED = 'failed'
+
+
+class ApiError(Exception):
+    """The API server answered with an error."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def parse_duration(text):
+    """Seconds of a duration given as seconds or like 1h30m, 15m or 90s.
+
+    Raises:
+        ValueError: The duration cannot be parsed
+    """
+    if text.isdigit():
+        return int(text)
+    match = re.fullmatch(r'(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?', text)
+    if not text or not match:
+        raise ValueError(f"invalid duration: {text}")
+    hours, minutes, seconds = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_target(text):
+    """Parse a TARGET argument.
+
+    Returns:
+        {'kind', 'namespace', 'name', 'selector'}, name or selector being None
+
+    Raises:
+        ValueError: The target is malformed
+    """
+    head, _, selector = text.partition('?')
+    parts = head.split('/')
+    kind = parts[0].lower()
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind in target: {text}")
+    namespaced = KINDS[kind][2]
+
+    if selector:
+        if not namespaced or len(parts) != 2 or not parts[1]:
+            raise ValueError(f"selector targets are KIND/NAMESPACE?SELECTOR: {text}")
+        labels = {}
+        for term in selector.split(','):
+            key, sep, value = term.partition('=')
+            if not sep or not key.strip() or key.endswith('!'):
+                raise ValueError(f"only key=value label selectors are supported: {text}")
+            labels[key.strip()] = value.lstrip('=').strip()
+        return {'kind': kind, 'namespace': parts[1], 'name': None, 'selector': labels}
+
+    expected = 3 if namespaced else 2
+    if len(parts) != expected or not all(parts[1:]):
+        raise ValueError(f"expected {'KIND/NAMESPACE/NAME' if namespaced else 'node/NAME'}: {text}")
+    return {'kind': kind, 'namespace': parts[1] if namespaced else None, 'name': parts[-1], 'selector': None}
+
+
+def readiness(kind, obj):
+    """Whether an object is ready, by the rules of `kubectl rollout status`.
+
+    Args:
+        kind: A KINDS key
+        obj: The object as returned by the API server
+
+    Returns:
+        (state, message), state being READY, WAITING or FAILED
+    """
+    metadata = obj.get('metadata') or {}
+    spec = obj.get('spec') or {}
+    status = obj.get('status') or {}
+
+    if kind == 'node':
+        for condition in status.get('conditions') or []:
+            if condition.get('type') == 'Ready':
+                if condition.get('status') == 'True':
+                    return READY, "Ready"
+                return WAITING, condition.get('message') or condition.get('reason') or "not Ready"
+        return WAITING, "no Ready condition yet"
+
+    if status.get('observedGeneration', 0) < metadata.get('generation', 0):
+        return WAITING, "waiting for the update to be observed"
+    strategy = spec.get('updateStrategy') or {}
+
+    if kind == 'deployment':
+        for condition in status.get('conditions') or []:
+            if condition.get('type') == 'Progressing' and condition.get('reason') == 'ProgressDeadlineExceeded':
+                return FAILED, "exceeded its progress deadline"
+        replicas = spec.get('replicas', 1)
+        updated = status.get('updatedReplicas', 0)
+        if updated < replicas:
+            return WAITING, f"{updated} of {replicas} replicas updated"
+        if status.get('replicas', 0) > updated:
+            return WAITING, f"{status['replicas'] - updated} old replicas pending termination"
+        available = status.get('availableReplicas', 0)
+        if available < updated:
+            return WAITING, f"{available} of {updated} updated replicas available"
+        return READY, "rolled out"
+
+    if kind == 'daemonset':
+        if strategy.get('type') == 'OnDelete':
+            return READY, "updated on delete"
+        desired = status.get('desiredNumberScheduled', 0)
+        updated = status.get('updatedNumberScheduled', 0)
+        if updated < desired:
+            return WAITING, f"{updated} of {desired} pods updated"
+        available = status.get('numberAvailable', 0)
+        if available < desired:
+            return WAITING, f"{available} of {desired} updated pods available"
+        return READY, "rolled out"
+
+    if strategy.get('type') == 'OnDelete':
+        return READY, "updated on delete"
+    replicas = spec.get('replicas', 1)
+    ready = status.get('readyReplicas', 0)
+    if ready < replicas:
+        return WAITING, f"{ready} of {replicas} pods ready"
+    partition = (strategy.get('rollingUpdate') or {}).get('partition', 0)
+    if partition:
+        updated = status.get('updatedReplicas', 0)
+        if updated < replicas - partition:
+            return WAITING, f"{updated} of {replicas - partition} partitioned pods updated"
+    elif status.get('updateRevision') != status.get('currentRevision'):
+        return WAITING, "waiting for the update to finish"
+    return READY, "rolled out"
+
+
+def load_kubeconfig(path=None):
+    """Connection settings of the current context of a kubeconfig.
+
+    Args:
+        path: Kubeconfig file (default the first KUBECONFIG entry, then
+            ~/.kube/config)
+
+    Returns:
+        {'server': URL, 'context': ssl context or None, 'headers': dict}
+
+    Raises:
+        ValueError: The kubeconfig cannot be read or is not supported
+    """
+    path = path or os.environ.get('KUBECONFIG', '').split(os.pathsep)[0] or os.path.expanduser('~/.kube/config')
+    try:
+        with open(path, 'r') as f:
+            config = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as e:
+        raise ValueError(f"cannot read kubeconfig {path}: {e}")
+
+    def named(section, name):
+        for entry in config.get(section) or []:
+            if entry.get('name') == name:
+                return entry.get(section[:-1]) or {}
+        raise ValueError(f"{path}: no {section[:-1]} named {name}")
+
+    def data(entry, key):
+        """Contents of a `<key>-data` field or of the file `<key>` names."""
+        if entry.get(f"{key}-data"):
+            return base64.b64decode(entry[f"{key}-data"]).decode()
+        if entry.get(key):
+            with open(os.path.join(os.path.dirname(os.path.abspath(path)), entry[key]), 'r') as f:
+                return f.read()
+        return None
+
+    context = named('contexts', config.get('current-context'))
+    cluster = named('clusters', context.get('cluster'))
+    user = named('users', context.get('user')) if context.get('user') else {}
+    server = cluster.get('server')
+    if not server:
+        raise ValueError(f"{path}: cluster {context.get('cluster')} has no server")
+
+    try:
+        headers = {'Accept': 'application/json'}
+        token = user.get('token') or data(user, 'tokenFile')
+        if token:
+            headers['Authorization'] = f"Bearer {token.strip()}"
+        cert, key = data(user, 'client-certificate'), data(user, 'client-key')
+        if not token and not cert and (user.get('exec') or user.get('auth-provider')):
+            raise ValueError(f"{path}: credential plugins are not supported")
+
+        ssl_context = None
+        if server.startswith('https://'):
+            ssl_context = ssl.create_default_context(cadata=data(cluster, 'certificate-authority'))
+            if cluster.get('insecure-skip-tls-verify'):
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+            if cert and key:
+                # ssl only loads client certificates from files
+                with tempfile.TemporaryDirectory(prefix='kube_wait-') as tmp:
+                    for name, content in (('cert.pem', cert), ('key.pem', key)):
+                        fd = os.open(os.path.join(tmp, name), os.O_WRONLY | os.O_CREAT, 0o600)
+                        with os.fdopen(fd, 'w') as f:
+                            f.write(content)
+                    ssl_context.load_cert_chain(os.path.join(tmp, 'cert.pem'), os.path.join(tmp, 'key.pem'))
+    except (OSError, ssl.SSLError, ValueError) as e:
+        raise ValueError(f"{path}: {e}" if not str(e).startswith(path) else str(e))
+    return {'server': server.rstrip('/'), 'context': ssl_context, 'headers': headers}
+
+
+class Client:
+    """Minimal API server client for list and watch requests."""
+
+    def __init__(self, config):
+        self.config = config
+        self.url = urllib.parse.urlsplit(config['server'])
+
+    def get(self, path, params, timeout):
+        """Send a GET request.
+
+        Returns:
+            (connection, response), the caller closes the connection
+
+        Raises:
+            ApiError: The answer is not 200 OK
+            OSError, http.client.HTTPException: The request failed
+        """
+        if self.url.scheme == 'https':
+            connection = http.client.HTTPSConnection(self.url.hostname, self.url.port, timeout=timeout,
+                                                     context=self.config['context'])
+        else:
+            connection = http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=timeout)
+        query = urllib.parse.urlencode(params)
+        connection.request('GET', f"{self.url.path}{path}{'?' + query if query else ''}",
+                           headers=self.config['headers'])
+        response = connection.getresponse()
+        if response.status != 200:
+            body = response.read(1000).decode(errors='replace')
+            connection.close()
+            try:
+                body = json.loads(body).get('message', body)
+            except ValueError:
+                pass
+            raise ApiError(response.status, body)
+        return connection, response
+
+
+class Watch(threading.Thread):
+    """Lists one kind, then watches it, putting what it sees on a queue.
+
+    Queue items are ('list', kind, items), ('event', kind, type, object) and
+    ('error', kind, message). An expired resource version lists again.
+    """
+
+    def __init__(self, client, kind, namespace, events, stop, deadline):
+        super().__init__(daemon=True)
+        self.client = client
+        self.kind = kind
+        self.events = events
+        self.stop = stop
+        self.deadline = deadline
+        group, resource, _ = KINDS[kind]
+        self.path = f"{group}/namespaces/{namespace}/{resource}" if namespace else f"{group}/{resource}"
+
+    def run(self):
+        version = None
+        while not self.stop.is_set():
+            remaining = self.deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                if version is None:
+                    version = self._list(remaining)
+                version = self._watch(version, remaining)
+            except ApiError as e:
+                if e.status == 410:
+                    version = None
+                    continue
+                self._error(e)
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                self._error(e)
+
+    def _error(self, error):
+        self.events.put(('error', self.kind, str(error) or type(error).__name__))
+        self.stop.wait(RETRY_DELAY)
+
+    def _list(self, remaining):
+        connection, response = self.client.get(self.path, {}, remaining)
+        try:
+            listed = json.loads(response.read())
+        finally:
+            connection.close()
+        self.events.put(('list', self.kind, listed.get('items') or []))
+        return (listed.get('metadata') or {}).get('resourceVersion', '')
+
+    def _watch(self, version, remaining):
+        params = {'watch': '1', 'resourceVersion': version, 'allowWatchBookmarks': 'true',
+                  'timeoutSeconds': max(1, int(remaining))}
+        # The server ends the stream after timeoutSeconds, the socket gets a margin
+        connection, response = self.client.get(self.path, params, remaining + 5)
+        try:
+            for line in response:
+                if self.stop.is_set():
+                    break
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                obj = event.get('object') or {}
+                if event.get('type') == 'ERROR':
+                    raise ApiError(obj.get('code', 500), obj.get('message', 'watch error'))
+                version = (obj.get('metadata') or {}).get('resourceVersion') or version
+                if event.get('type') != 'BOOKMARK':
+                    self.events.put(('event', self.kind, event.get('type'), obj))
+        finally:
+            connection.close()
+        return version
+
+
+def label(key):
+    """Display name of a tracked object key."""
+    kind, namespace, name = key
+    return f"{kind}/{namespace}/{name}" if namespace else f"{kind}/{name}"
+
+
+def wait(targets, timeout, client, report=None):
+    """Wait until every target is ready or the timeout passed.
+
+    Args:
+        targets: Parsed targets, see parse_target
+        timeout: Seconds for all targets together
+        client: A Client
+        report: Callable taking a progress line (default print)
+
+    Returns:
+        A dict of the objects that are not ready, label to (state, message),
+        empty when all are
+    """
+    report = report or (lambda line: print(line, flush=True))
+    deadline = time.monotonic() + timeout
+    events = queue.Queue()
+    stop = threading.Event()
+
+    by_kind = {}
+    for target in targets:
+        by_kind.setdefault(target['kind'], []).append(target)
+    tracked = {(t['kind'], t['namespace'], t['name']): (WAITING, "not found yet") for t in targets if t['name']}
+    synced = set()
+    errors = {}
+
+    def update(kind, obj):
+        metadata = obj.get('metadata') or {}
+        key = (kind, metadata.get('namespace') if KINDS[kind][2] else None, metadata.get('name'))
+        if key not in tracked or tracked[key][0] != WAITING:
+            return
+        state = readiness(kind, obj)
+        if state == tracked[key]:
+            return
+        tracked[key] = state
+        if state[0] == READY:
+            report(f"{label(key)} is ready")
+        elif state[0] == FAILED:
+            report(f"{label(key)} failed: {state[1]}")
+        else:
+            report(f"Waiting for {label(key)}: {state[1]}")
+
+    for kind, kind_targets in by_kind.items():
+        namespaces = {t['namespace'] for t in kind_targets}
+        Watch(client, kind, namespaces.pop() if len(namespaces) == 1 else None, events, stop, deadline).start()
+
+    try:
+        while len(synced) < len(by_kind) or any(state == WAITING for state, _ in tracked.values()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = events.get(timeout=remaining)
+            except queue.Empty:
+                break
+
+            kind = item[1]
+            if item[0] == 'error':
+                if errors.get(kind) != item[2]:
+                    report(f"WARNING: cannot watch {KINDS[kind][1]}: {item[2]}")
+                errors[kind] = item[2]
+            elif item[0] == 'list':
+                if kind not in synced:
+                    # Selector targets track what matches when the wait starts
+                    synced.add(kind)
+                    for obj in item[2]:
+                        metadata = obj.get('metadata') or {}
+                        labels = metadata.get('labels') or {}
+                        for target in by_kind[kind]:
+                            if target['selector'] is not None and metadata.get('namespace') == target['namespace'] \
+                                    and all(labels.get(k) == v for k, v in target['selector'].items()):
+                                tracked.setdefault((kind, target['namespace'], metadata.get('name')),
+                                                   (WAITING, "not observed yet"))
+                for obj in item[2]:
+                    update(kind, obj)
+            elif item[2] == 'DELETED':
+                metadata = item[3].get('metadata') or {}
+                key = (kind, metadata.get('namespace') if KINDS[kind][2] else None, metadata.get('name'))
+                if tracked.get(key, (None,))[0] == WAITING:
+                    tracked[key] = (WAITING, "deleted")
+            else:
+                update(kind, item[3])
+    finally:
+        stop.set()
+
+    not_ready = {label(key): state for key, state in tracked.items() if state[0] != READY}
+    for kind in by_kind:
+        if kind not in synced:
+            not_ready[f"{kind} (all)"] = (WAITING, errors.get(kind, "never listed"))
+    return not_ready
+
+
+def print_usage():
+    """Print usage information."""
+    print("Usage: kube_wait.py [--timeout DURATION] TARGET...")
+    print("\nWait for Kubernetes objects to become ready, watching the API server.")
+    print("\nTargets:")
+    print("  node/NAME")
+    print("  KIND/NAMESPACE/NAME       deployment, daemonset or statefulset")
+    print("  KIND/NAMESPACE?SELECTOR   every KIND matching a key=value label selector")
+    print(f"\nDURATION is seconds or like 15m (default {DEFAULT_TIMEOUT}s).")
+
+
+def main(argv):
+    """Command line entry point."""
+    timeout = DEFAULT_TIMEOUT
+    targets = []
+    try:
+        while argv:
+            if argv[0] in ('-h', '--help'):
+                print_usage()
+                return 0
+            if argv[0] == '--timeout' and len(argv) > 1:
+                timeout = parse_duration(argv[1])
+                argv = argv[2:]
+                continue
+            targets.append(parse_target(argv[0]))
+            argv = argv[1:]
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        targets = []
+    if not targets:
+        print_usage()
+        return 1
+
+    try:
+        client = Client(load_kubeconfig())
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_API
+
+    not_ready = wait(targets, timeout, client)
+    if not_ready:
+        print(f"ERROR: not ready after {timeout}s:")
+        for name, (state, message) in not_ready.items():
+            print(f"  {name}: {message}")
+        return EXIT_NOT_READY
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -56,7 +56,6 @@ cp_post_init () {
 
     # Now wait for the node to become Ready (Cilium makes this happen)
     echo "Waiting for node to become Ready..."
-    sleep 5
     wait_for_node_ready_state
 
     # SOPS+Age key setup (after cluster is ready)
@@ -0,0 +1,124 @@
+#!/bin/bash
+# 37-kuberblue-chart-cache.sh
+#
+# Bakes the pinned Helm charts of the kuberblue manifests, and the container
+# images they run, into kuberblue images. Without this every node fetches
+# the charts with `helm repo add/update` at first boot and pulls the
+# cilium/openebs/cert-manager images from the internet, so air-gapped or
+# bandwidth-constrained sites bootstrap slowly or not at all.
+#
+# For every 00-metadata.yaml under /etc/kuberblue/manifests with a chart and
+# a pinned `version`:
+#   - the chart tarball is vendored into CHART_CACHE, where kube_deploy.sh
+#     installs it from before falling back to the repo
+#   - the chart is rendered with its values file and every image it runs is
+#     pulled into IMAGE_STORE, a read-only additional image store of CRI-O,
+#     when the builder allows podman to run (see below)
+# Charts without a version are left to be fetched at deploy time, since what
+# they resolve to changes between the build and the deploy.
+#
+# Order:
+#   10-copy.sh copies the kuberblue manifests and helpers.
+#   30-install-packages.sh installs helm (packages.yaml :: rpm_kuberblue).
+#   --> this script then fills the caches.
+#
+# Skip with SKIP=kuberblue_cache.
+
+set -euxo pipefail
+if [[ -f "${INSTALL_DIR}/build/99-common.sh" ]]; then source "${INSTALL_DIR}/build/99-common.sh"; fi
+if [[ -f "./99-common.sh" ]]; then source "./99-common.sh"; fi
+
+CHART_CACHE="/usr/share/kuberblue/charts"
+IMAGE_STORE="/usr/lib/containers/storage"
+CRIO_IMAGE_STORE_CONF="/etc/crio/crio.conf.d/10-kuberblue-image-store.conf"
+MANIFEST_DIR="/etc/kuberblue/manifests"
+MANIFEST_INDEX="/usr/libexec/kuberblue/kube_setup/kube_manifest_index.py"
+
+if [[ "$(is_option_in_build_options kuberblue)" != "${TRUE}" ]]; then
+    exit 0
+fi
+if [[ "$(is_skipped kuberblue_cache)" == "${TRUE}" ]]; then
+    echo "=== Skipping kuberblue chart and image cache ==="
+    exit 0
+fi
+
+render_dir="$(mktemp -d)"
+trap 'rm -rf "${render_dir}"' EXIT
+mkdir -p "${CHART_CACHE}"
+
+# Render for the Kubernetes version the image installs, so kubeVersion
+# constraints and capability checks in the charts resolve as on the node
+template_args=()
+kube_version="$(kubeadm version -o short 2>/dev/null || true)"
+if [[ -n "${kube_version}" ]]; then
+    template_args+=(--kube-version "${kube_version}")
+fi
+
+images=()
+while IFS= read -r metadata_file; do
+    dir="$(dirname "${metadata_file}")"
+    mapfile -t fields < <(python3 "${MANIFEST_INDEX}" metadata "${metadata_file}")
+    name="${fields[0]:-}" chart="${fields[1]:-}" version="${fields[2]:-}" namespace="${fields[3]:-}"
+    repo_url="${fields[7]:-}"
+    if [[ -z "${chart}" ]] || [[ -z "${repo_url}" ]]; then
+        continue
+    fi
+    if [[ -z "${version}" ]]; then
+        echo "=== ${name}: no pinned version, not cached ==="
+        continue
+    fi
+
+    echo "=== Vendoring chart ${chart} ${version} ==="
+    helm pull "${chart##*/}" --repo "${repo_url}" --version "${version}" --destination "${CHART_CACHE}"
+    tarball="${CHART_CACHE}/${chart##*/}-${version}.tgz"
+
+    # Render with the values kube_deploy.sh installs with, to find the images
+    # the release actually runs. SOPS-encrypted values cannot be read here.
+    values=()
+    for values_file in "${dir}"/*values.yaml; do
+        [[ -f "${values_file}" ]] || continue
+        if grep -q '^sops:' "${values_file}"; then
+            echo "WARNING: ${values_file} is encrypted; rendering ${name} with the chart defaults"
+            continue
+        fi
+        values+=(-f "${values_file}")
+    done
+    helm template "${name}" "${tarball}" --namespace "${namespace:-default}" "${template_args[@]}" "${values[@]}" \
+        > "${render_dir}/${name}.yaml"
+    mapfile -t chart_images < <(python3 "${MANIFEST_INDEX}" images "${render_dir}/${name}.yaml")
+    images+=("${chart_images[@]}")
+done < <(find "${MANIFEST_DIR}" -name '00-metadata.yaml' | sort)
+
+# Preload the images into a store under /usr, which is updated with the
+# image, unlike /var/lib/containers. This runs podman inside the image build,
+# which needs the builder to allow nested overlay mounts (for example buildah
+# build --cap-add=SYS_ADMIN --device=/dev/fuse --security-opt=label=disable).
+# A builder without them only loses the image preload: the images are then
+# pulled at deploy time, and the charts above are still cached.
+if [[ ${#images[@]} -gt 0 ]]; then
+    preloaded="${TRUE}"
+    mkdir -p "${IMAGE_STORE}"
+    for image in $(printf '%s\n' "${images[@]}" | sort -u); do
+        echo "=== Preloading image ${image} ==="
+        if ! podman --root "${IMAGE_STORE}" pull "${image}"; then
+            echo "WARNING: cannot preload ${image} in this build; kuberblue images are pulled at deploy time"
+            preloaded="${FALSE}"
+            break
+        fi
+    done
+
+    if [[ "${preloaded}" == "${TRUE}" ]]; then
+        # CRI-O resolves images from the store before pulling them
+        mkdir -p "$(dirname "${CRIO_IMAGE_STORE_CONF}")"
+        cat > "${CRIO_IMAGE_STORE_CONF}" <<EOF
+# Written by 37-kuberblue-chart-cache.sh: images of the vendored Helm charts,
+# preloaded at image build time.
+[crio]
+storage_option = [
+    "overlay.imagestore=${IMAGE_STORE}",
+]
+EOF
+    else
+        rm -rf "${IMAGE_STORE}"
+    fi
+fi
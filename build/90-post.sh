@@ -78,3 +78,8 @@ find /boot -mindepth 1 -delete 2>/dev/null || true
 
 # rebuild font cache (picks up nerd-fonts and any other new fonts)
 fc-cache -fv
+
+# ship a package index so immutablue_build_has_package does not walk the rpmdb
+# on every call (see immutablue-header.sh). Images without an rpmdb skip this.
+bash -c 'source /usr/libexec/immutablue/immutablue-header.sh && immutablue_package_index_write "${IMMUTABLUE_PACKAGE_INDEX}"' \
+    || echo "Skipping package index (no rpmdb)"
@@ -1,6 +1,9 @@
 #!/bin/bash 
 if [[ -f "/usr/libexec/immutablue/immutablue-header.sh" ]]; then source "/usr/libexec/immutablue/immutablue-header.sh"; fi
 PACKAGES_YAML="${INSTALL_DIR}/packages.yaml"
+# packages.yaml resolved once per build for this VERSION/MARCH/build options
+PACKAGES_RESOLVER="/usr/libexec/immutablue/immutablue_packages.py"
+PACKAGES_MANIFEST="${INSTALL_DIR}/packages.resolved.json"
 MARCH="$(uname -m)"
 VERSION="${VERSION:-${FEDORA_VERSION}}"
 
@@ -93,9 +96,50 @@ is_skipped() {
     echo "${FALSE}"
 }
 
+# resolves every build list in packages.yaml in a single pass and writes
+# them to PACKAGES_MANIFEST. The manifest is only rewritten when packages.yaml,
+# the version, the architecture or the build options changed, so only the
+# first stage of a build pays for it.
+# returns: nothing, on failure get_yaml_array falls back to yq
+ensure_packages_manifest() {
+    if [[ ! -f "${PACKAGES_RESOLVER}" ]] || ! type python3 &>/dev/null
+    then
+        return 0
+    fi
+
+    PACKAGES_YAML="${PACKAGES_YAML}" VERSION="${VERSION}" IMMUTABLUE_BUILD_OPTIONS="${IMMUTABLUE_BUILD_OPTIONS:-}" \
+        python3 "${PACKAGES_RESOLVER}" resolve --march "${MARCH}" --output "${PACKAGES_MANIFEST}" --if-stale \
+        || rm -f "${PACKAGES_MANIFEST}"
+}
+
 # looks up entries in packages.yaml
 # takes into account the version, architecture and build options
+# reads the resolved manifest when available, otherwise queries packages.yaml
 get_yaml_array() {
+    local key="$1"
+    local resolved
+
+    if [[ -f "${PACKAGES_MANIFEST}" ]]
+    then
+        # first line tells whether the manifest has this key, the rest is the list
+        resolved="$(yq "(.lists | has(\"${key}\")), .lists[\"${key}\"][]" < "${PACKAGES_MANIFEST}" 2>/dev/null || true)"
+        if [[ "${resolved}" == "true" ]]
+        then
+            return 0
+        fi
+        if [[ "${resolved%%$'\n'*}" == "true" ]]
+        then
+            echo "${resolved#*$'\n'}"
+            return 0
+        fi
+    fi
+
+    get_yaml_array_from_packages "${key}"
+}
+
+# looks up entries in packages.yaml with one yq per variant
+# used when the resolved manifest is not available
+get_yaml_array_from_packages() {
     local key="$1"
     # Base all
     yq "${key}.all[]" < "${PACKAGES_YAML}" 2>/dev/null || true
@@ -201,3 +245,4 @@ get_nix_install_packages() {
     get_yaml_array '.immutablue.nix.install'
 }
 
+ensure_packages_manifest
@@ -81,7 +81,8 @@ STANDARD_TESTS := \
 	container|./tests/test_container.sh \
 	container_qemu|./tests/test_container_qemu.sh \
 	artifacts|./tests/test_artifacts.sh \
-	setup|./tests/test_setup.sh
+	setup|./tests/test_setup.sh \
+	libexec|./tests/test_libexec.sh
 
 KUBERBLUE_TESTS := \
 	kuberblue_container|./tests/kuberblue/test_kuberblue_container.sh \
@@ -4,7 +4,7 @@
 # This file contains all test targets with SKIP_TEST support.
 # ==============================================================================
 
-.PHONY: pre_test test test_container test_container_qemu test_artifacts test_setup \
+.PHONY: pre_test test test_container test_container_qemu test_artifacts test_setup test_libexec \
         run_all_tests test_kuberblue _run_kuberblue_suite \
         test_kuberblue_container _run_kuberblue_container_test \
         test_kuberblue_cluster _run_kuberblue_cluster_test \
@@ -32,7 +32,7 @@ pre_test:
 # ------------------------------------------------------------------------------
 test:
 	@if [ "$(SKIP_TEST)" = "0" ]; then \
-		$(MAKE) test_container test_container_qemu test_artifacts test_setup; \
+		$(MAKE) test_container test_container_qemu test_artifacts test_setup test_libexec; \
 		if [ "$(KUBERBLUE)" = "1" ]; then \
 			echo "Running Kuberblue-specific tests..."; \
 			$(MAKE) test_kuberblue_container test_kuberblue_components test_kuberblue_security; \
@@ -74,6 +74,15 @@ test_setup:
 		echo "Skipping setup tests (SKIP_TEST=1)"; \
 	fi
 
+test_libexec:
+	@if [ "$(SKIP_TEST)" = "0" ]; then \
+		echo "Running libexec tests..."; \
+		chmod +x ./tests/test_libexec.sh; \
+		./tests/test_libexec.sh; \
+	else \
+		echo "Skipping libexec tests (SKIP_TEST=1)"; \
+	fi
+
 run_all_tests:
 	@if [ "$(SKIP_TEST)" = "0" ]; then \
 		echo "Running all tests..."; \
@@ -30,7 +30,7 @@ ALL_PHONY_TARGETS := list tag-string all all_upgrade install update upgrade inst
 	build push iso iso-config raw raw-config ami ami-config gce gce-config vhd vhd-config vmdk vmdk-config anaconda-iso anaconda-iso-config \
 	upgrade rebase clean \
 	install_distrobox install_flatpak install_brew \
-	post_install_notes test test_container test_container_qemu test_artifacts test_shellcheck test_setup \
+	post_install_notes test test_container test_container_qemu test_artifacts test_shellcheck test_setup test_libexec \
 	test_kuberblue_container test_kuberblue_cluster test_kuberblue_components test_kuberblue_integration test_kuberblue_security test_kuberblue test_kuberblue_chainsaw test_chainsaw \
 	sbom qcow2 qcow2-config run_qcow2 lima lima-start lima-shell lima-stop lima-delete run_iso run_iso_qemu run_raw run_raw_qemu push_raw push_ami push_gce push_vhd push_vmdk \
 	_check_not_distroless distroless-img run-distroless-img distroless-qcow2 distroless-clean \
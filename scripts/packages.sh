@@ -17,6 +17,21 @@ else
     FLATPAK_REFS_FILE="/usr/flatpak_refs/flatpaks"
 fi
 
+# Compiles packages.yaml and the custom files into a single install plan
+# - /usr/libexec/immutablue/immutablue_packages.py
+if [[ -f /usr/libexec/immutablue/immutablue_packages.py ]]
+then
+    INSTALL_PLAN_COMPILER="/usr/libexec/immutablue/immutablue_packages.py"
+else
+    INSTALL_PLAN_COMPILER="./artifacts/overrides/usr/libexec/immutablue/immutablue_packages.py"
+fi
+# Lives in $HOME so it is also readable from inside the distroboxes
+INSTALL_PLAN_DIR="${XDG_CACHE_HOME:-${HOME}/.cache}/immutablue"
+INSTALL_PLAN_FILE="${INSTALL_PLAN_DIR}/install-plan.sh"
+
+# Per-container provisioning logs
+DBOX_LOG_DIR="${XDG_STATE_HOME:-${HOME}/.local/state}/immutablue/distrobox"
+
 # Source the common stuff
 source ./scripts/common.sh
 
@@ -38,6 +53,69 @@ post_install_notes() {
 }
 
 
+# Compiles packages.yaml and every packages.custom-*.yaml into one install plan
+# and loads it as PLAN_* variables (see immutablue_packages.py). The plan is
+# only recompiled when one of the files, the version or the architecture changed.
+# returns: 0 if the plan was loaded, 1 if the per-file yq lookups have to be used
+load_install_plan() {
+    if [[ ! -f "${INSTALL_PLAN_COMPILER}" ]] || ! type python3 &>/dev/null
+    then
+        return 1
+    fi
+
+    local files=("${PACKAGES_FILE}")
+    local f
+    for f in $PACKAGES_CUSTOM_FMT; do
+        if [[ -f "$f" ]]; then
+            files+=("$f")
+        fi
+    done
+
+    local version
+    version=$(immutablue_get_image_version 2>/dev/null || echo "")
+
+    mkdir -p "${INSTALL_PLAN_DIR}" || return 1
+    python3 "${INSTALL_PLAN_COMPILER}" plan \
+        --version "${version}" \
+        --output "${INSTALL_PLAN_DIR}/install-plan.json" \
+        --if-stale \
+        --shell \
+        "${files[@]}" > "${INSTALL_PLAN_FILE}" || return 1
+
+    source "${INSTALL_PLAN_FILE}"
+}
+
+
+# Loads the distrobox provisioning settings into DBOX_WORKERS and
+# DBOX_PULL_ATTEMPTS (see .immutablue.install in settings.yaml)
+load_install_settings() {
+    DBOX_WORKERS=""
+    DBOX_PULL_ATTEMPTS=""
+    if type immutablue-settings &>/dev/null
+    then
+        eval "$(immutablue-settings --shell \
+            DBOX_WORKERS=.immutablue.install.distrobox_workers \
+            DBOX_PULL_ATTEMPTS=.immutablue.install.distrobox_pull_attempts \
+            2>/dev/null)" || true
+    fi
+
+    if ! [[ "${DBOX_WORKERS}" =~ ^[0-9]+$ ]]; then DBOX_WORKERS=0; fi
+    if [[ ${DBOX_WORKERS} -eq 0 ]]; then DBOX_WORKERS="$(nproc 2>/dev/null || echo 1)"; fi
+    if ! [[ "${DBOX_PULL_ATTEMPTS}" =~ ^[0-9]+$ ]] || [[ ${DBOX_PULL_ATTEMPTS} -lt 1 ]]; then DBOX_PULL_ATTEMPTS=3; fi
+}
+
+
+# Prints a list from the loaded plan, one item per line
+# Arg 1 is the name of the PLAN_* array
+plan_list() {
+    local -n plan_list_ref="$1"
+    if [[ ${#plan_list_ref[@]} -gt 0 ]]
+    then
+        printf '%s\n' "${plan_list_ref[@]}"
+    fi
+}
+
+
 # Arg 1 is path to packages.yaml
 get_yaml_distrobox_length() {
     [ $# -ne 1 ] && echo "$0 <packages.yaml>" && exit 1
@@ -102,13 +180,67 @@ dbox_install_single() {
     local bin_symlink
     bin_symlink="$(cat <(yq "${key}.bin_symlink[]" < "$packages_yaml") <(yq "${key}.bin_symlink_$(uname -m)[]" < "$packages_yaml"))"
 
+    local extra_commands
+    extra_commands="$(yq "${key}.extra_commands" < "$packages_yaml")"
+
+    dbox_apply_install
+}
+
+
+# Installs a distrobox's packages from the loaded install plan
+# Arg 1 is the plan written by load_install_plan, Arg 2 is the distrobox index
+dbox_install_single_from_plan() {
+    [ ! -f /run/.containerenv ] && echo "This is not a container!" && exit 1
+    [ $# -ne 2 ] && echo "$0 <install-plan.sh> <index>" && exit 1
+
+    source "$1"
+    local prefix="PLAN_DBOX_${2}_"
+
+    local name="${prefix}NAME"
+    name="${!name}"
+    local remove="${prefix}RM"
+    remove="${!remove}"
+    local pkg_inst_cmd="${prefix}PKG_INST_CMD"
+    pkg_inst_cmd="${!pkg_inst_cmd}"
+    local pkg_updt_cmd="${prefix}PKG_UPDT_CMD"
+    pkg_updt_cmd="${!pkg_updt_cmd}"
+    local extra_commands="${prefix}EXTRA_COMMANDS"
+    extra_commands="${!extra_commands}"
+
+    local packages
+    packages="$(plan_list "${prefix}PACKAGES")"
+    local npm_packages
+    npm_packages="$(plan_list "${prefix}NPM_PACKAGES")"
+    local pip_packages
+    pip_packages="$(plan_list "${prefix}PIP_PACKAGES")"
+    local cargo_packages
+    cargo_packages="$(plan_list "${prefix}CARGO_PACKAGES")"
+    local bin_export
+    bin_export="$(plan_list "${prefix}BIN_EXPORT")"
+    local app_export
+    app_export="$(plan_list "${prefix}APP_EXPORT")"
+    local bin_symlink
+    bin_symlink="$(plan_list "${prefix}BIN_SYMLINK")"
+
+    dbox_apply_install
+}
+
+
+# Runs the install steps inside a distrobox
+# Uses the name, remove, pkg_inst_cmd, pkg_updt_cmd, extra_commands, packages,
+# npm_packages, pip_packages, cargo_packages, bin_export, app_export and
+# bin_symlink locals of the calling dbox_install_single* function
+dbox_apply_install() {
     if [[ "${remove}" == "true" ]]
     then 
         distrobox rm -f "${name}"
         return 0
     fi
 
-    bash <(yq "${key}.extra_commands" < $packages_yaml) || true
+    if [[ -n "${extra_commands}" ]] && [[ "${extra_commands}" != "null" ]]
+    then
+        bash <(printf '%s\n' "${extra_commands}") || true
+    fi
 
     sudo $pkg_updt_cmd || true
     sudo $pkg_inst_cmd $(for pkg in $packages; do printf ' %s' "$pkg"; done) || true
@@ -175,42 +307,219 @@ dbox_install_all_from_yaml() {
         local add_flag
         add_flag="$(cat <(yq "${key}.additional_flags[]" < "$packages_yaml") <(yq "${key}.additional_flags_$(uname -m)[]" < "$packages_yaml"))"
 
-        # Check for an empty line (new-line). If no image is specified
-        if [ 0 -eq "$(container_exists "${name}")" ]
-        then 
-            # Set this to an empty space if its nothing
-            # so distrobox-create doesn't hang wanting more params.
-            if [ "$add_flag" == "" ]
-            then 
-                add_flag=" "
-            fi 
-
-            if [ "true" == "$root_mode" ]
-            then
-                distrobox create --yes --root --additional-flags "$add_flag" -i "${image}" "${name}"
-            else 
-                distrobox create --yes --additional-flags "$add_flag" -i "${image}" "${name}"
-            fi
+        dbox_create_and_run "${name}" "${image}" "${root_mode}" "${add_flag}" "dbox_install_single ${packages_yaml} $i"
 
-            # If it failed to create, critically fail
-            [ 0 -ne $? ] && echo "distrobox create --yes -i ${image} ${name} failed" && exit 1
-        fi
+        (( i++ ))
+    done
 
-        if [ "true" == "$root_mode" ]
+}
+
+
+# Provisions every distrobox of the loaded install plan
+# Up to DBOX_WORKERS boxes are provisioned at the same time, each one logging
+# to DBOX_LOG_DIR/<name>.log, followed by a summary of every box.
+# Entries sharing a name (a box of packages.yaml extended by a custom file)
+# are provisioned one after the other by the same worker, in plan order.
+# When boxes run one at a time their output also goes to the terminal.
+# returns: 1 if any box could not be created
+dbox_install_all_from_plan() {
+    load_install_settings
+    mkdir -p "${DBOX_LOG_DIR}"
+
+    # Group the plan entries by distrobox name, keeping the plan order
+    local names=()
+    local -A entries=()
+    local root_boxes=0
+    local i=0
+    while [ $i -lt "${PLAN_DBOX_COUNT}" ]
+    do
+        local name="PLAN_DBOX_${i}_NAME"
+        name="${!name}"
+        [[ -n "${entries[${name}]+set}" ]] || names+=("${name}")
+        entries[${name}]+=" ${i}"
+        local root_mode="PLAN_DBOX_${i}_ROOT"
+        if [ "true" == "${!root_mode}" ]; then (( root_boxes++ )); fi
+        (( i++ ))
+    done
+
+    local name
+    if [[ ${DBOX_WORKERS} -le 1 ]] || [[ ${#names[@]} -le 1 ]]
+    then
+        for name in "${names[@]}"
+        do
+            dbox_install_group_from_plan "${name}" ${entries[${name}]} 2>&1 | tee "${DBOX_LOG_DIR}/${name}.log"
+        done
+        dbox_print_summary "${names[@]}"
+        return $?
+    fi
+
+    # Root boxes call sudo from background jobs whose output goes to their
+    # logs, so ask for the password once, before any of them starts
+    if [[ ${root_boxes} -gt 0 ]]
+    then
+        echo "Some distroboxes are root boxes, sudo is needed to create them"
+        sudo -v || echo "sudo failed, the root distroboxes will fail"
+    fi
+
+    echo "Provisioning ${#names[@]} distroboxes, ${DBOX_WORKERS} at a time (logs in ${DBOX_LOG_DIR})"
+
+    for name in "${names[@]}"
+    do
+        # Wait for a free worker
+        while [[ $(jobs -rp | wc -l) -ge ${DBOX_WORKERS} ]]
+        do
+            wait -n || true
+        done
+
+        echo "Starting ${name}"
+        dbox_install_group_from_plan "${name}" ${entries[${name}]} > "${DBOX_LOG_DIR}/${name}.log" 2>&1 &
+    done
+    wait
+
+    dbox_print_summary "${names[@]}"
+}
+
+
+# Provisions the plan entries of one distrobox in order, recording the result
+# in DBOX_LOG_DIR/<name>.status
+# Arg 1 is the distrobox name, the rest are the indexes of its entries
+dbox_install_group_from_plan() {
+    local name="$1"
+    shift
+    local status=0
+    local i
+
+    rm -f "${DBOX_LOG_DIR}/${name}.status"
+    for i in "$@"
+    do
+        # dbox_create_and_run exits when the box cannot be created
+        ( dbox_install_from_plan "$i" ) || status=1
+    done
+    echo "${status}" > "${DBOX_LOG_DIR}/${name}.status"
+}
+
+
+# Prints the result of every distrobox provisioned by dbox_install_all_from_plan
+# Args are the distrobox names
+# returns: 1 if any box failed
+dbox_print_summary() {
+    local failed=0
+    local name
+
+    echo "Distrobox summary:"
+    for name in "$@"
+    do
+        local status
+        status="$(cat "${DBOX_LOG_DIR}/${name}.status" 2>/dev/null || echo 1)"
+        if [[ "${status}" == "0" ]]
         then
-            distrobox enter --root "${name}" -- bash -x -c "source ./scripts/packages.sh && dbox_install_single ${packages_yaml} $i" || true
+            printf '  %-20s ok\n' "${name}"
         else
-            distrobox enter "${name}" -- bash -x -c "source ./scripts/packages.sh && dbox_install_single ${packages_yaml} $i" || true
+            printf '  %-20s FAILED (see %s)\n' "${name}" "${DBOX_LOG_DIR}/${name}.log"
+            failed=1
         fi
+    done
 
-        (( i++ ))
+    return ${failed}
+}
+
+
+# Creates and provisions one distrobox of the loaded install plan
+# Arg 1 is the distrobox index
+dbox_install_from_plan() {
+    local prefix="PLAN_DBOX_${1}_"
+
+    local name="${prefix}NAME"
+    name="${!name}"
+    local image="${prefix}IMAGE"
+    image="${!image}"
+    local root_mode="${prefix}ROOT"
+    root_mode="${!root_mode}"
+    local add_flag
+    add_flag="$(plan_list "${prefix}ADDITIONAL_FLAGS")"
+
+    dbox_create_and_run "${name}" "${image}" "${root_mode}" "${add_flag}" "dbox_install_single_from_plan ${INSTALL_PLAN_FILE} $1"
+}
+
+
+# Pulls a distrobox image if it is not present yet, retrying with a growing delay
+# Arg 1 is the image, Arg 2 the number of attempts, Arg 3 the root mode (true/false)
+dbox_pull_image() {
+    local image="$1"
+    local attempts="${2:-3}"
+    local podman_cmd=(podman)
+    if [ "true" == "$3" ]; then podman_cmd=(sudo podman); fi
+
+    # Leave it to distrobox when there is nothing we can pull ahead of time
+    if [[ -z "${image}" ]] || ! type podman &>/dev/null; then return 0; fi
+    if "${podman_cmd[@]}" image exists "${image}" 2>/dev/null; then return 0; fi
+
+    local attempt=1
+    while ! "${podman_cmd[@]}" pull "${image}"
+    do
+        if [[ ${attempt} -ge ${attempts} ]]
+        then
+            echo "Pulling ${image} failed after ${attempt} attempts"
+            return 1
+        fi
+        echo "Pulling ${image} failed (attempt ${attempt}/${attempts}), retrying"
+        sleep $(( attempt * 5 ))
+        (( attempt++ ))
     done
+}
+
 
+# Creates a distrobox if it does not exist yet and runs an install command in it
+# Arg 1 is the name, Arg 2 the image, Arg 3 the root mode (true/false),
+# Arg 4 the additional flags and Arg 5 the packages.sh function call to run
+dbox_create_and_run() {
+    local name="$1"
+    local image="$2"
+    local root_mode="$3"
+    local add_flag="$4"
+    local install_cmd="$5"
+
+    # Check for an empty line (new-line). If no image is specified
+    if [ 0 -eq "$(container_exists "${name}")" ]
+    then 
+        # Set this to an empty space if its nothing
+        # so distrobox-create doesn't hang wanting more params.
+        if [ "$add_flag" == "" ]
+        then 
+            add_flag=" "
+        fi 
+
+        # Pull ahead of distrobox so flaky registries get retried
+        dbox_pull_image "${image}" "${DBOX_PULL_ATTEMPTS:-3}" "${root_mode}" || exit 1
+
+        if [ "true" == "$root_mode" ]
+        then
+            distrobox create --yes --root --additional-flags "$add_flag" -i "${image}" "${name}"
+        else 
+            distrobox create --yes --additional-flags "$add_flag" -i "${image}" "${name}"
+        fi
+
+        # If it failed to create, critically fail
+        [ 0 -ne $? ] && echo "distrobox create --yes -i ${image} ${name} failed" && exit 1
+    fi
+
+    if [ "true" == "$root_mode" ]
+    then
+        distrobox enter --root "${name}" -- bash -x -c "source ./scripts/packages.sh && ${install_cmd}" || true
+    else
+        distrobox enter "${name}" -- bash -x -c "source ./scripts/packages.sh && ${install_cmd}" || true
+    fi
 }
 
 
 dbox_install_all() {
     if [ -d "$HOME/bin/export" ]; then rm "${HOME}"/bin/export/*; fi
+    if load_install_plan
+    then
+        dbox_install_all_from_plan
+        return $?
+    fi
+
     dbox_install_all_from_yaml $PACKAGES_FILE
     for f in $PACKAGES_CUSTOM_FMT; do
         if [[ -f "$f" ]]; then
@@ -235,13 +544,7 @@ flatpak_config() {
     local arch
     arch=$(uname -m)
 
-    # Remove flathub if its configured on system (suppress error if not present)
-    if flatpak remotes --system 2>/dev/null | grep -q "^flathub"; then
-        sudo flatpak remote-delete flathub --force || true
-    fi
-
-    # Enabling flathub (unfiltered) for --user
-    flatpak remote-add --user --if-not-exists flathub https://flathub.org/repo/flathub.flatpakrepo || true
+    flatpak_use_user_flathub
 
     # Add custom Flatpak Repositories
     # Query both .all[] and .${version}[] entries, plus arch-specific variants
@@ -279,22 +582,143 @@ flatpak_config() {
         flatpak install --user --noninteractive "$gnome_platform" || true
     fi
 
-    # Replace Fedora flatpaks with flathub ones (if any exist)
-    local fedora_apps
-    fedora_apps=$(flatpak list --app-runtime=org.fedoraproject.Platform --columns=application 2>/dev/null | grep -v '^$' || true)
-    if [[ -n "$fedora_apps" ]]; then
-        for app in $fedora_apps; do
-            flatpak install --user --noninteractive --reinstall flathub "$app" || true
-        done
+    flatpak_replace_fedora_flatpaks
+}
+
+
+# Moves flathub from the system to the user installation
+flatpak_use_user_flathub() {
+    flatpak_remove_system_remote flathub
+
+    # Enabling flathub (unfiltered) for --user
+    flatpak remote-add --user --if-not-exists flathub https://flathub.org/repo/flathub.flatpakrepo || true
+}
+
+
+# Removes a remote from the system installation if it is configured
+# Arg 1 is the remote name
+flatpak_remove_system_remote() {
+    # Suppress error if not present
+    if flatpak remotes --system 2>/dev/null | grep -q "^$1"; then
+        sudo flatpak remote-delete "$1" --force || true
     fi
+}
+
+
+# Replaces the Fedora flatpaks with flathub ones and drops the Fedora remote
+flatpak_replace_fedora_flatpaks() {
+    # Replace Fedora flatpaks with flathub ones (if any exist), in one transaction
+    local fedora_apps=()
+    mapfile -t fedora_apps < <(flatpak list --app-runtime=org.fedoraproject.Platform --columns=application 2>/dev/null | grep -v '^$' || true)
+    flatpak_transaction "install --reinstall" user flathub "${fedora_apps[@]}"
+
+    flatpak_remove_system_remote fedora
+}
+
 
-    # Remove Fedora flatpak repo (suppress error if not present)
-    if flatpak remotes --system 2>/dev/null | grep -q "^fedora"; then
-        sudo flatpak remote-delete fedora --force || true
+# Runs one flatpak transaction for many refs. If the batch fails (e.g. one of
+# the refs is not on any remote) every ref is retried on its own so a single
+# bad entry does not block the rest.
+# Arg 1 is the flatpak command and its options ("install", "install --reinstall",
+# "uninstall"), Arg 2 the scope (user/system), Arg 3 the remote (empty lets
+# flatpak pick) and the remaining args are the refs
+flatpak_transaction() {
+    local action=()
+    read -ra action <<< "$1"
+    local scope="$2"
+    local remote="$3"
+    shift 3
+    [[ $# -eq 0 ]] && return 0
+
+    local cmd=(flatpak "${action[@]}" "--${scope}" --noninteractive)
+    if [[ "${scope}" == "system" ]]; then cmd=(sudo "${cmd[@]}"); fi
+    if [[ -n "${remote}" ]]; then cmd+=("${remote}"); fi
+
+    if ! "${cmd[@]}" "$@"
+    then
+        local ref
+        for ref in "$@"; do
+            "${cmd[@]}" "$ref" || true
+        done
     fi
 }
 
 
+# Prints the refs of a list that are (or are not) installed in a scope,
+# checking against a single `flatpak list`. A ref matches either the
+# application ID or the full ref (e.g. org.gnome.Platform/x86_64/49).
+# Arg 1 is the scope (user/system), Arg 2 "installed" or "missing",
+# remaining args are the refs
+flatpak_filter_installed() {
+    local scope="$1"
+    local want="$2"
+    shift 2
+
+    local -A installed=()
+    local app ref
+    while read -r app ref; do
+        [[ -n "${app}" ]] && installed["${app}"]=1
+        [[ -n "${ref}" ]] && installed["${ref}"]=1
+    done < <(flatpak list "--${scope}" --columns=application,ref 2>/dev/null || true)
+
+    for ref in "$@"; do
+        if [[ -n "${installed[${ref}]:-}" ]]
+        then
+            [[ "${want}" == "installed" ]] && echo "${ref}"
+        else
+            [[ "${want}" == "missing" ]] && echo "${ref}"
+        fi
+    done
+    return 0
+}
+
+
+# Configures the user flatpak remotes and runtimes of the loaded install plan
+# The system installation is handled by flatpak_config_system_from_plan
+flatpak_config_from_plan() {
+    # Enabling flathub (unfiltered) for --user
+    flatpak remote-add --user --if-not-exists flathub https://flathub.org/repo/flathub.flatpakrepo || true
+
+    # Custom Flatpak Repositories (already deduplicated by name)
+    local i
+    for i in "${!PLAN_FLATPAK_REPOS[@]}"; do
+        flatpak remote-add --user --if-not-exists "${PLAN_FLATPAK_REPOS[$i]}" "${PLAN_FLATPAK_REPO_URLS[$i]}" || true
+    done
+
+    # GNOME Platform from the flatpaks_runtime sections
+    local runtimes=()
+    mapfile -t runtimes < <(flatpak_filter_installed user missing "${PLAN_FLATPAK_RUNTIMES[@]}")
+    flatpak_transaction install user "" "${runtimes[@]}"
+
+    # Replace Fedora flatpaks with flathub ones (if any exist)
+    local fedora_apps=()
+    mapfile -t fedora_apps < <(flatpak list --app-runtime=org.fedoraproject.Platform --columns=application 2>/dev/null | grep -v '^$' || true)
+    flatpak_transaction "install --reinstall" user flathub "${fedora_apps[@]}"
+}
+
+
+# Drops the flathub and Fedora remotes from the system installation
+flatpak_config_system_from_plan() {
+    flatpak_remove_system_remote flathub
+    flatpak_remove_system_remote fedora
+}
+
+
+# Installs the missing flatpaks and removes the installed ones of the loaded
+# install plan, each as a single transaction
+flatpak_install_all_from_plan() {
+    local add=()
+    mapfile -t add < <(flatpak_filter_installed user missing "${PLAN_FLATPAK_INSTALL[@]}")
+    echo "Flatpaks: ${#add[@]} of ${#PLAN_FLATPAK_INSTALL[@]} to install"
+    flatpak_transaction install user "" "${add[@]}"
+
+    local remove=()
+    mapfile -t remove < <(flatpak_filter_installed user installed "${PLAN_FLATPAK_UNINSTALL[@]}")
+    echo "Flatpaks: ${#remove[@]} of ${#PLAN_FLATPAK_UNINSTALL[@]} to remove"
+    flatpak_transaction uninstall user "" "${remove[@]}"
+}
+
+
 # Arg is yaml file
 flatpak_install_all_from_yaml() {
     [ $# -ne 1 ] && echo "flatpak_install_all_from_yaml <packages.yaml>" && exit 1
@@ -345,19 +769,44 @@ flatpak_install_all_from_yaml() {
 
 
 flatpak_install_all() {
+    local use_plan=0
+    if load_install_plan; then use_plan=1; fi
+
     if [ ! -f /opt/immutablue/did_initial_flatpak_install ]
     then
         echo "Doing initial flatpak config"
-        flatpak_config $PACKAGES_FILE
-        for f in $PACKAGES_CUSTOM_FMT; do
-            if [[ -f "$f" ]]; then
-                flatpak_config "$f"
-            fi
-        done
+        if [[ ${use_plan} -eq 1 ]]
+        then
+            # The system installation is only touched through sudo, so ask for
+            # the password up front and then work on both scopes concurrently
+            sudo -v || true
+            flatpak_config_system_from_plan &
+            local system_pid=$!
+            flatpak_config_from_plan
+            flatpak_install_all_from_plan
+            wait "${system_pid}" || true
+
+            sudo mkdir -p /opt/immutablue
+            sudo touch /opt/immutablue/did_initial_flatpak_install
+            return 0
+        else
+            flatpak_config $PACKAGES_FILE
+            for f in $PACKAGES_CUSTOM_FMT; do
+                if [[ -f "$f" ]]; then
+                    flatpak_config "$f"
+                fi
+            done
+        fi
         sudo mkdir -p /opt/immutablue
         sudo touch /opt/immutablue/did_initial_flatpak_install
     fi
 
+    if [[ ${use_plan} -eq 1 ]]
+    then
+        flatpak_install_all_from_plan
+        return 0
+    fi
+
     flatpak_install_all_from_yaml $PACKAGES_FILE
     for f in $PACKAGES_CUSTOM_FMT; do
         if [[ -f "$f" ]]; then
@@ -282,6 +282,9 @@ check_kuberblue_files(void)
         "/usr/libexec/kuberblue/variables.sh",
         "/usr/libexec/kuberblue/kube_setup/kube_init.sh",
         "/usr/libexec/kuberblue/kube_setup/kube_deploy.sh",
+        "/usr/libexec/kuberblue/kube_setup/kube_deploy_plan.py",
+        "/usr/libexec/kuberblue/kube_setup/kube_manifest_index.py",
+        "/usr/libexec/kuberblue/kube_setup/kube_wait.py",
         "/usr/libexec/kuberblue/kube_setup/kube_state.sh",
         "/usr/libexec/kuberblue/kube_setup/kube_reset.sh",
         "/usr/libexec/kuberblue/kube_setup/kube_add_kuberblue_user.sh",
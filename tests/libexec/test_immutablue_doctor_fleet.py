@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# test_immutablue_doctor_fleet.py
+#
+# Unit tests for the immutablue_doctor_fleet.py doctor report rollup.
+#
+# These tests feed small `immutablue-doctor --json` reports through files and
+# concatenated streams and check the per-check host counts, duplicate and
+# invalid report handling, and the trends against a saved rollup.
+
+import io
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_doctor_fleet",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_doctor_fleet.py')
+)
+immutablue_doctor_fleet = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_doctor_fleet)
+
+
+def report(host, failures=(), warnings=(), image="immutablue:43"):
+    """A doctor report with one passing check plus the given problems."""
+    results = [{"section": "Flatpak", "check": "Flatpak installed", "status": "pass", "message": "", "fix": ""}]
+    results += [{"section": "Network", "check": name, "status": "fail", "message": "", "fix": ""} for name in failures]
+    results += [{"section": "Homebrew", "check": name, "status": "warn", "message": "", "fix": ""} for name in warnings]
+    return {
+        "schema_version": 1,
+        "version": "1.0.0",
+        "hostname": host,
+        "image": image,
+        "timestamp": "2026-01-01T00:00:00+00:00",
+        "summary": {"passed": 1, "failed": len(failures), "warnings": len(warnings)},
+        "results": results,
+    }
+
+
+class TestImmutablueDoctorFleet(unittest.TestCase):
+    """Test cases for the fleet rollup."""
+
+    def setUp(self):
+        """Set up a temporary report directory."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def write(self, name, *reports, indent=2):
+        path = os.path.join(self.test_dir, name)
+        with open(path, "w") as f:
+            for item in reports:
+                f.write(json.dumps(item, indent=indent) + "\n")
+        return path
+
+    def test_iter_documents(self):
+        """Concatenated reports are split without reading the whole stream."""
+        stream = io.StringIO('{"a": 1}{"b": 2}\n\n  {"c": [3]}')
+        with patch.object(immutablue_doctor_fleet, 'CHUNK_SIZE', 4):
+            documents = list(immutablue_doctor_fleet.iter_documents(stream))
+        self.assertEqual(documents, [({"a": 1}, None), ({"b": 2}, None), ({"c": [3]}, None)])
+
+        documents = list(immutablue_doctor_fleet.iter_documents(io.StringIO('{"a": 1} nope')))
+        self.assertEqual(documents[0], ({"a": 1}, None))
+        self.assertIsNone(documents[1][0])
+        self.assertEqual(len(documents), 2)
+
+    def test_garbage_in_stream(self):
+        """Garbage between reports is skipped up to the next report."""
+        stream = io.StringIO('{"a":1}\nssh: connect to host c port 22: Connection timed out\n'
+                             '{"b":2}\n{"c":\n  {"d": 3}}\n{oops\n{"e":4}\n')
+        with patch.object(immutablue_doctor_fleet, 'CHUNK_SIZE', 4):
+            documents = list(immutablue_doctor_fleet.iter_documents(stream))
+        self.assertEqual([document for document, _ in documents],
+                         [{"a": 1}, None, {"b": 2}, {"c": {"d": 3}}, None, {"e": 4}])
+        self.assertTrue(documents[1][1].startswith("invalid JSON"))
+
+    def test_oversized_report(self):
+        """A report past the size limit is rejected instead of buffered."""
+        stream = io.StringIO('{"a": "' + "x" * 100)
+        documents = list(immutablue_doctor_fleet.iter_documents(stream, max_bytes=10))
+        self.assertEqual(len(documents), 1)
+        self.assertIn("larger than", documents[0][1])
+
+        # The limit is per report, the reports after it are still read
+        stream = io.StringIO('{"a": "' + "x" * 100 + '"}\n{"b": 1}\n')
+        with patch.object(immutablue_doctor_fleet, 'CHUNK_SIZE', 8):
+            documents = list(immutablue_doctor_fleet.iter_documents(stream, max_bytes=20))
+        self.assertEqual([document for document, _ in documents], [None, {"b": 1}])
+
+    def test_validate_report(self):
+        """Only doctor reports of a known schema are accepted."""
+        self.assertIsNone(immutablue_doctor_fleet.validate_report(report("a")))
+        self.assertIsNotNone(immutablue_doctor_fleet.validate_report([]))
+        self.assertIsNotNone(immutablue_doctor_fleet.validate_report(dict(report("a"), schema_version=99)))
+        self.assertIsNotNone(immutablue_doctor_fleet.validate_report(dict(report("a"), results=[{"check": "x"}])))
+
+    def test_aggregate(self):
+        """Checks are counted once per host, failures first."""
+        stream = self.write("stream.json",
+                            report("a", failures=["quay.io"], warnings=["brew"]),
+                            report("b", failures=["quay.io", "quay.io"]),
+                            report("a", failures=["other"]),
+                            indent=None)
+        directory = os.path.join(self.test_dir, "reports")
+        os.makedirs(directory)
+        with open(os.path.join(directory, "c.json"), "w") as f:
+            json.dump(report("c", warnings=["brew"], image="immutablue:42"), f)
+        with open(os.path.join(directory, "bad.json"), "w") as f:
+            f.write("[]")
+
+        rollup = immutablue_doctor_fleet.aggregate([stream, directory], sample=1).to_dict()
+        self.assertEqual((rollup["reports"], rollup["hosts"], rollup["duplicates"], rollup["invalid"]), (4, 3, 1, 1))
+        self.assertEqual((rollup["hosts_failing"], rollup["hosts_warning"]), (2, 2))
+        self.assertEqual(rollup["images"], {"immutablue:43": 2, "immutablue:42": 1})
+        self.assertEqual(
+            [(row["status"], row["check"], row["hosts"]) for row in rollup["checks"]],
+            [("fail", "quay.io", 2), ("warn", "brew", 2)],
+        )
+        self.assertEqual(rollup["checks"][0]["sample_hosts"], ["a"])
+
+    def test_trends(self):
+        """A saved rollup is the baseline for deltas and resolved checks."""
+        snapshot = os.path.join(self.test_dir, "snapshot.json")
+        first = self.write("first.json", report("a", failures=["quay.io", "dns"]))
+        second = self.write("second.json", report("a", failures=["quay.io"]), report("b", failures=["quay.io"]))
+
+        with patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(immutablue_doctor_fleet.main(["aggregate", "--save", snapshot, first]), 0)
+        with patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual(immutablue_doctor_fleet.main(["aggregate", "--previous", snapshot, "--json", second]), 0)
+        rollup = json.loads(out.getvalue())
+        self.assertEqual((rollup["checks"][0]["previous"], rollup["checks"][0]["delta"]), (1, 1))
+        self.assertEqual([row["check"] for row in rollup["resolved"]], ["dns"])
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_usage(self, mock_stdout, mock_stderr):
+        """Unknown commands and options, a missing baseline and an unwritable rollup are errors."""
+        self.assertEqual(immutablue_doctor_fleet.main([]), 1)
+        self.assertEqual(immutablue_doctor_fleet.main(["nope"]), 1)
+        self.assertEqual(immutablue_doctor_fleet.main(["aggregate", "--nope"]), 1)
+        missing = os.path.join(self.test_dir, "missing.json")
+        self.assertEqual(immutablue_doctor_fleet.main(["aggregate", "--previous", missing]), 1)
+
+        # An unwritable --save is a one-line error, not a traceback
+        blocker = os.path.join(self.test_dir, "file")
+        with open(blocker, "w") as f:
+            f.write("")
+        save = os.path.join(blocker, "rollup.json")
+        self.assertEqual(immutablue_doctor_fleet.main(["aggregate", "--save", save, self.test_dir]), 1)
+        self.assertTrue(mock_stderr.getvalue().splitlines()[-1].startswith(f"Error: cannot save rollup {save}: "))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# test_immutablue_hardware.py
+#
+# Unit tests for the immutablue_hardware.py hardware inventory.
+#
+# These tests build a fake /proc and /sys tree and check the collected
+# sections, that a refresh only collects the sections whose stamp changed,
+# and the queries used by the doctor and the hardware override recipes.
+
+import io
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_hardware",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_hardware.py')
+)
+immutablue_hardware = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_hardware)
+
+
+class TestImmutablueHardware(unittest.TestCase):
+    """Test cases for the hardware inventory."""
+
+    def setUp(self):
+        """Set up a fake /proc and /sys tree and point the module at it."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.inventory_file = os.path.join(self.test_dir, "var", "hardware.json")
+        self.write("proc/cmdline", "BOOT_IMAGE=/vmlinuz ostree=/ostree/boot.1/immutablue/abc/0 rw\n")
+        self.write("proc/cpuinfo",
+                   "processor\t: 0\nvendor_id\t: GenuineIntel\nmodel name\t: Test CPU\nphysical id\t: 0\n"
+                   "core id\t\t: 0\nflags\t\t: sse2 fpu avx2\n\n"
+                   "processor\t: 1\nvendor_id\t: GenuineIntel\nmodel name\t: Test CPU\nphysical id\t: 0\n"
+                   "core id\t\t: 0\nflags\t\t: sse2 fpu avx2\n")
+        self.write("proc/meminfo", "MemTotal:       16777216 kB\nMemAvailable:    8388608 kB\n")
+        self.write("sys/cpu/present", "0-1\n")
+        self.pci("0000:00:02.0", "0x030000", "0x8086", "0x46a6")
+        self.pci("0000:00:1f.0", "0x060100", "0x8086", "0x0001")
+        self.write("sys/block/nvme0n1/size", "2000409264\n")
+        self.write("sys/block/nvme0n1/queue/rotational", "0\n")
+        self.write("sys/block/nvme0n1/removable", "0\n")
+        self.write("sys/block/nvme0n1/device/model", "Test SSD\n")
+        self.write("sys/class/net/eth0/address", "52:54:00:12:34:56\n")
+        self.write("sys/usb/1-2/idVendor", "174c\n")
+        self.write("sys/usb/1-2/idProduct", "55aa\n")
+        self.write("sys/usb/1-2/product", "ASM1153E\n")
+        os.makedirs(os.path.join(self.test_dir, "sys/usb/1-2:1.0"))
+        self.write("sys/dmi/chassis_type", "3\n")
+        self.write("sys/dmi/sys_vendor", "Test Vendor\n")
+        self.write("pci.ids", "8086  Intel Corporation\n\t0001  Bridge\n\t46a6  Alder Lake-P GT2\n"
+                              "\t\t1234 5678  Subsystem\nC 00  Unclassified device\n")
+
+        paths = {
+            'PROC_CMDLINE': "proc/cmdline",
+            'PROC_CPUINFO': "proc/cpuinfo",
+            'PROC_MEMINFO': "proc/meminfo",
+            'SYS_CPU': "sys/cpu",
+            'SYS_BUS_PCI': "sys/pci",
+            'SYS_BUS_USB': "sys/usb",
+            'SYS_BLOCK': "sys/block",
+            'SYS_CLASS_NET': "sys/class/net",
+            'SYS_DMI': "sys/dmi",
+            'SYS_POWER_SUPPLY': "sys/power_supply",
+            'SYS_HYPERVISOR_TYPE': "sys/hypervisor/type",
+        }
+        self.patches = [patch.object(immutablue_hardware, name, os.path.join(self.test_dir, path))
+                        for name, path in paths.items()]
+        self.patches.append(patch.object(immutablue_hardware, 'PCI_IDS_FILES', (os.path.join(self.test_dir, "pci.ids"),)))
+        self.patches.append(patch.object(immutablue_hardware, 'INVENTORY_FILE', self.inventory_file))
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir)
+
+    def write(self, relpath, content):
+        path = os.path.join(self.test_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def pci(self, slot, pci_class, vendor, device):
+        self.write(f"sys/pci/{slot}/class", pci_class + "\n")
+        self.write(f"sys/pci/{slot}/vendor", vendor + "\n")
+        self.write(f"sys/pci/{slot}/device", device + "\n")
+
+    def test_collect(self):
+        """Every section is read from /proc and /sys."""
+        inventory = immutablue_hardware.refresh()
+        self.assertEqual(inventory["schema_version"], immutablue_hardware.SCHEMA_VERSION)
+        self.assertEqual(inventory["deployment"].split()[0], "/ostree/boot.1/immutablue/abc/0")
+        cpu = inventory["cpu"]
+        self.assertEqual((cpu["model"], cpu["vendor"], cpu["cores"], cpu["threads"]), ("Test CPU", "GenuineIntel", 1, 2))
+        self.assertEqual(cpu["flags"], ["avx2", "fpu", "sse2"])
+        self.assertEqual(inventory["memory"], {"total_bytes": 16 * 1024 ** 3})
+        self.assertEqual([(g["vendor_id"], g["device_id"], g["name"]) for g in inventory["gpus"]],
+                         [("8086", "46a6", "Alder Lake-P GT2")])
+        self.assertEqual(inventory["disks"][0]["transport"], "nvme")
+        self.assertFalse(inventory["disks"][0]["rotational"])
+        self.assertEqual(inventory["nics"][0]["mac"], "52:54:00:12:34:56")
+        self.assertEqual(inventory["usb"], [{"bus_id": "1-2", "vendor_id": "174c", "product_id": "55aa", "name": "ASM1153E"}])
+
+    def test_chassis(self):
+        """The form factor comes from DMI, a battery or a hypervisor."""
+        self.assertEqual(immutablue_hardware.collect_system()["chassis"], "desktop")
+        self.write("sys/dmi/chassis_type", "2\n")
+        self.write("sys/power_supply/BAT0/type", "Battery\n")
+        self.assertEqual(immutablue_hardware.collect_system()["chassis"], "laptop")
+        self.write("sys/hypervisor/type", "xen\n")
+        system = immutablue_hardware.collect_system()
+        self.assertEqual((system["chassis"], system["virtual"]), ("vm", True))
+
+    def test_incremental_refresh(self):
+        """Only changed sections are collected, an unchanged refresh does not write."""
+        first = immutablue_hardware.refresh()
+        self.assertEqual(first["changed"], list(immutablue_hardware.SECTIONS))
+        mtime = os.stat(self.inventory_file).st_mtime_ns
+
+        with patch.object(immutablue_hardware, 'collect_cpu', side_effect=AssertionError("collected")):
+            self.assertEqual(immutablue_hardware.refresh()["generated"], first["generated"])
+            self.assertEqual(os.stat(self.inventory_file).st_mtime_ns, mtime)
+
+            self.pci("0000:01:00.0", "0x030200", "0x10de", "0x2684")
+            second = immutablue_hardware.refresh()
+        self.assertEqual(second["changed"], ["gpus"])
+        self.assertEqual(len(second["gpus"]), 2)
+
+        # A new deployment collects everything again
+        self.write("proc/cmdline", "ostree=/ostree/boot.0/immutablue/def/0\n")
+        self.write("proc/cpuinfo", "processor\t: 0\nmodel name\t: New microcode\n")
+        self.assertEqual(immutablue_hardware.refresh()["cpu"]["model"], "New microcode")
+
+    def test_schema_mismatch(self):
+        """An inventory of another schema version is rebuilt."""
+        self.write("var/hardware.json", json.dumps({"schema_version": 99, "cpu": {}}))
+        self.assertIsNone(immutablue_hardware.load(self.inventory_file))
+        self.assertEqual(immutablue_hardware.refresh()["cpu"]["model"], "Test CPU")
+
+    def test_queries(self):
+        """Dotted keys and device matches answer the consumers' questions."""
+        inventory = immutablue_hardware.refresh()
+        self.assertEqual(immutablue_hardware.get(inventory, "gpus.0.vendor_id"), "8086")
+        with self.assertRaises(KeyError):
+            immutablue_hardware.get(inventory, "gpus.5")
+        self.assertTrue(immutablue_hardware.has_device(inventory["usb"], "174C:55AA", "product_id"))
+        self.assertFalse(immutablue_hardware.has_device(inventory["gpus"], "10de", "device_id"))
+        self.assertIn("Test CPU (1 cores, 2 threads), 16.0 GiB", immutablue_hardware.summary(inventory))
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main(self, mock_stdout):
+        """The command line refreshes, queries and matches devices."""
+        self.assertEqual(immutablue_hardware.main(["refresh"]), 0)
+        self.assertIn("Updated", mock_stdout.getvalue())
+        self.assertEqual(immutablue_hardware.main(["refresh"]), 0)
+        self.assertIn("up to date", mock_stdout.getvalue())
+        self.assertEqual(immutablue_hardware.main(["has-usb", "174c:55aa"]), 0)
+        self.assertEqual(immutablue_hardware.main(["has-gpu", "10de"]), 1)
+        mock_stdout.truncate(0)
+        mock_stdout.seek(0)
+        self.assertEqual(immutablue_hardware.main(["get", "memory.total_bytes"]), 0)
+        self.assertEqual(mock_stdout.getvalue(), f"{16 * 1024 ** 3}\n")
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_usage(self, mock_stdout, mock_stderr):
+        """Unknown commands, options and keys are errors."""
+        self.assertEqual(immutablue_hardware.main([]), 1)
+        self.assertEqual(immutablue_hardware.main(["nope"]), 1)
+        self.assertEqual(immutablue_hardware.main(["refresh", "--nope"]), 1)
+        self.assertEqual(immutablue_hardware.main(["get"]), 1)
+        self.assertEqual(immutablue_hardware.main(["get", "cpu.nope"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# test_immutablue_header.py
+#
+# Unit tests for the package index of immutablue-header.sh.
+#
+# These tests source the header in bash with the rpmdb, the index files and
+# the fingerprint cache moved into a throwaway directory, and a fake `rpm` on
+# PATH, and check that the index follows changes of the package set.
+
+import os
+import unittest
+import tempfile
+import shutil
+import subprocess
+
+HEADER = os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue-header.sh')
+
+
+class TestImmutablueHeader(unittest.TestCase):
+    """Test cases for the rpmdb fingerprint and package index."""
+
+    def setUp(self):
+        """Set up a fake rpmdb and rpm in a temporary directory."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        self.rpmdb = os.path.join(self.test_dir, "rpmdb.sqlite")
+        self.packages = os.path.join(self.test_dir, "packages")
+
+        bin_dir = os.path.join(self.test_dir, "bin")
+        os.makedirs(bin_dir)
+        with open(os.path.join(bin_dir, "rpm"), "w") as f:
+            f.write(f"#!/bin/bash\necho rpm >> '{self.test_dir}/rpm.calls'\ncat '{self.packages}'\n")
+        os.chmod(os.path.join(bin_dir, "rpm"), 0o755)
+        self.env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}")
+
+    def install(self, packages, rpmdb):
+        """Replace the rpmdb and package set, as a new deployment does."""
+        with open(self.packages, "w") as f:
+            f.write("".join(p + "\n" for p in packages))
+        with open(self.rpmdb + ".new", "wb") as f:
+            f.write(rpmdb)
+        os.utime(self.rpmdb + ".new", (0, 0))
+        os.replace(self.rpmdb + ".new", self.rpmdb)
+
+    def has_package(self, regex):
+        """Run immutablue_build_has_package against the fake rpmdb."""
+        d = self.test_dir
+        script = (f"source '{HEADER}'\n"
+                  f"IMMUTABLUE_RPMDB='{self.rpmdb}'\n"
+                  f"IMMUTABLUE_PACKAGE_INDEX='{d}/usr/packages.index'\n"
+                  f"IMMUTABLUE_RUNTIME_PACKAGE_INDEX='{d}/run/packages.index'\n"
+                  f"IMMUTABLUE_USER_PACKAGE_INDEX='{d}/user/packages.index'\n"
+                  f"IMMUTABLUE_RPMDB_STAMP='{d}/run/rpmdb.stamp'\n"
+                  f"IMMUTABLUE_USER_RPMDB_STAMP='{d}/user/rpmdb.stamp'\n"
+                  f"immutablue_build_has_package '{regex}' 'null'\n")
+        result = subprocess.run(["bash", "-c", script], env=self.env, capture_output=True, text=True, check=True)
+        return result.stdout.strip() == "1"
+
+    def rpm_calls(self):
+        path = os.path.join(self.test_dir, "rpm.calls")
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return len(f.readlines())
+
+    def test_index_reused(self):
+        """An unchanged rpmdb is answered from the index."""
+        self.install(["bash-5.2-1.x86_64"], b"A" * 4096)
+        self.assertTrue(self.has_package("^bash"))
+        self.assertFalse(self.has_package("^zfs"))
+        self.assertEqual(self.rpm_calls(), 1)
+
+    def test_same_size_change(self):
+        """A package set change that keeps the rpmdb size rebuilds the index."""
+        self.install(["bash-5.2-1.x86_64"], b"A" * 4096)
+        self.assertFalse(self.has_package("^zfs"))
+
+        self.install(["bash-5.2-1.x86_64", "zfs-2.3.0-1.x86_64"], b"B" * 4096)
+        self.assertTrue(self.has_package("^zfs"))
+        self.assertEqual(self.rpm_calls(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
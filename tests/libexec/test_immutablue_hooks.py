@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# test_immutablue_hooks.py
+#
+# Unit tests for the immutablue_hooks.py hook run history.
+#
+# These tests append orchestrator results to a throwaway store and check
+# rotation, window and mode filtering, and the per-script statistics behind
+# `immutablue hooks stats`.
+
+import io
+import os
+import json
+import time
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_hooks",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_hooks.py')
+)
+immutablue_hooks = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_hooks)
+
+
+class TestImmutablueHooks(unittest.TestCase):
+    """Test cases for the hook run history store."""
+
+    def setUp(self):
+        """Set up a temporary history store."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.store = os.path.join(self.test_dir, "hooks", "history.jsonl")
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def append(self, script, duration=1.0, exit_code=0, start=None, mode="hourly"):
+        immutablue_hooks.append_record(mode, {
+            'script': script,
+            'start': time.time() if start is None else start,
+            'duration': duration,
+            'exit_code': exit_code,
+            'timed_out': False,
+            'max_rss_kb': 2048,
+        }, path=self.store)
+
+    def test_append_record(self):
+        """Each result becomes one compact JSON line."""
+        self.append("/a.sh", duration=0.5, exit_code=3)
+        with open(self.store) as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record["mode"], "hourly")
+        self.assertEqual(record["exit_code"], 3)
+        self.assertEqual(record["max_rss_kb"], 2048)
+        self.assertNotIn(" ", lines[0])
+
+    def test_rotation(self):
+        """A full store is rotated and both generations are read back."""
+        with patch.object(immutablue_hooks, 'MAX_BYTES', 200):
+            for _ in range(10):
+                self.append("/a.sh")
+        self.assertTrue(os.path.exists(self.store + ".1"))
+        self.assertLess(os.path.getsize(self.store), 400)
+        records = list(immutablue_hooks.read_records(self.store))
+        self.assertGreater(len(records), 1)
+        self.assertLess(len(records), 10)
+
+    def test_rotated_while_waiting(self):
+        """A writer that waited for the lock on a store rotated meanwhile reopens it."""
+        self.append("/first.sh")
+        flock = immutablue_hooks.fcntl.flock
+        rotated = []
+
+        def rotate_then_lock(f, operation):
+            # Another writer rotates the store before this one gets the lock
+            if operation == immutablue_hooks.fcntl.LOCK_EX and not rotated:
+                os.replace(self.store, self.store + ".1")
+                rotated.append(True)
+            flock(f, operation)
+
+        with patch.object(immutablue_hooks.fcntl, 'flock', side_effect=rotate_then_lock):
+            self.append("/second.sh")
+        with open(self.store) as f:
+            self.assertEqual([json.loads(line)["script"] for line in f], ["/second.sh"])
+        with open(self.store + ".1") as f:
+            self.assertEqual([json.loads(line)["script"] for line in f], ["/first.sh"])
+
+    def test_read_filters(self):
+        """Records are filtered by window and mode, bad lines are skipped."""
+        self.append("/old.sh", start=time.time() - 3600)
+        self.append("/new.sh")
+        self.append("/daily.sh", mode="daily")
+        with open(self.store, "a") as f:
+            f.write("not json\n")
+
+        since = time.time() - 60
+        self.assertEqual([r["script"] for r in immutablue_hooks.read_records(self.store, since=since)],
+                         ["/new.sh", "/daily.sh"])
+        self.assertEqual([r["script"] for r in immutablue_hooks.read_records(self.store, mode="daily")],
+                         ["/daily.sh"])
+
+    def test_parse_since(self):
+        """Windows accept seconds or a unit suffix."""
+        self.assertEqual(immutablue_hooks.parse_since("90"), 90)
+        self.assertEqual(immutablue_hooks.parse_since("30m"), 1800)
+        self.assertEqual(immutablue_hooks.parse_since("7d"), 604800)
+        with self.assertRaises(ValueError):
+            immutablue_hooks.parse_since("soon")
+
+    def test_stats(self):
+        """Percentiles and failure rates are computed per script."""
+        for duration in range(1, 21):
+            self.append("/a.sh", duration=float(duration), exit_code=1 if duration <= 5 else 0)
+        self.append("/b.sh", duration=2.0)
+
+        rows = immutablue_hooks.stats(immutablue_hooks.read_records(self.store))
+        self.assertEqual([row["script"] for row in rows], ["/a.sh", "/b.sh"])
+        a, b = rows
+        self.assertEqual((a["runs"], a["failures"], a["failure_rate"]), (20, 5, 0.25))
+        self.assertEqual((a["p50"], a["p95"], a["max"]), (10.0, 19.0, 20.0))
+        self.assertEqual((b["p50"], b["p95"], b["failure_rate"]), (2.0, 2.0, 0.0))
+
+    def test_main_stats(self):
+        """The stats command reads the selected store."""
+        self.append("/a.sh")
+        with patch.object(immutablue_hooks, 'USER_HISTORY_FILE', self.store), \
+                patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual(immutablue_hooks.main(["stats", "--user", "--since", "1h", "--json"]), 0)
+        self.assertEqual(json.loads(out.getvalue())[0]["runs"], 1)
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_usage(self, mock_stdout, mock_stderr):
+        """Unknown commands, options and windows are usage errors."""
+        self.assertEqual(immutablue_hooks.main([]), 1)
+        self.assertEqual(immutablue_hooks.main(["nope"]), 1)
+        self.assertEqual(immutablue_hooks.main(["stats", "--nope"]), 1)
+        self.assertEqual(immutablue_hooks.main(["stats", "--since", "soon"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
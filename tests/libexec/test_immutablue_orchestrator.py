@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# test_immutablue_orchestrator.py
+#
+# Unit tests for the immutablue_orchestrator.py hook script engine.
+#
+# These tests write small hook scripts into a throwaway directory and check
+# header parsing, discovery order, dependency ordering, the concurrency cap and
+# per-script timeouts.
+
+import io
+import os
+import time
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_orchestrator",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_orchestrator.py')
+)
+immutablue_orchestrator = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_orchestrator)
+
+
+class TestImmutablueOrchestrator(unittest.TestCase):
+    """Test cases for hook script scheduling."""
+
+    def setUp(self):
+        """Set up a temporary scripts directory."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.scripts_dir = os.path.join(self.test_dir, "on_boot")
+        self.trace = os.path.join(self.test_dir, "trace")
+        os.makedirs(self.scripts_dir)
+
+        stdout = patch('sys.stdout', new_callable=io.StringIO)
+        self.stdout = stdout.start()
+        self.addCleanup(stdout.stop)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def script(self, name, body, header=""):
+        path = os.path.join(self.scripts_dir, name)
+        with open(path, "w") as f:
+            f.write(f"#!/bin/bash\n{header}\n{body}\n")
+        return path
+
+    def traced(self, name, sleep=0, header="", status=0):
+        """A script that records when it starts and ends."""
+        return self.script(name, "\n".join([
+            f"echo start {name} >> {self.trace}",
+            f"sleep {sleep}",
+            f"echo end {name} >> {self.trace}",
+            f"exit {status}",
+        ]), header)
+
+    def read_trace(self):
+        with open(self.trace) as f:
+            return f.read().split("\n")[:-1]
+
+    def run_scripts(self, **kwargs):
+        scripts = immutablue_orchestrator.discover([self.scripts_dir])
+        return immutablue_orchestrator.run(scripts, **kwargs)
+
+    def test_parse_header(self):
+        """Directives are read from the leading comment block only."""
+        path = self.script("a.sh", "true\n# immutablue-after: late.sh", "\n".join([
+            "# immutablue-after: b.sh, c.sh",
+            "#immutablue-after: d.sh",
+            "# immutablue-timeout: 30",
+        ]))
+        self.assertEqual(immutablue_orchestrator.parse_header(path), (["b.sh", "c.sh", "d.sh"], 30))
+
+        path = self.script("b.sh", "true", "# immutablue-timeout: soon")
+        self.assertEqual(immutablue_orchestrator.parse_header(path), ([], None))
+
+    def test_discover(self):
+        """Scripts are listed by name and ignore patterns are skipped."""
+        self.script("20-b.sh", "true")
+        self.script("10-a.sh", "true")
+        self.script("30-c.sh.ignore", "true")
+        self.script(".ignore", "")
+        names = [s.name for s in immutablue_orchestrator.discover([self.scripts_dir])]
+        self.assertEqual(names, ["10-a.sh", "20-b.sh"])
+
+    def test_sequential(self):
+        """By default scripts run one after another in name order, without a time limit."""
+        self.traced("10-a.sh", sleep=0.2)
+        self.traced("20-b.sh")
+        results = self.run_scripts()
+        self.assertEqual(self.read_trace(), ["start 10-a.sh", "end 10-a.sh", "start 20-b.sh", "end 20-b.sh"])
+        self.assertEqual(immutablue_orchestrator.DEFAULT_TIMEOUT, 0)
+        self.assertFalse(any(r["timed_out"] for r in results))
+
+    def test_parallel(self):
+        """Independent scripts overlap when more jobs are allowed."""
+        self.traced("10-a.sh", sleep=0.5)
+        self.traced("20-b.sh", sleep=0.5)
+        started = time.monotonic()
+        results = self.run_scripts(max_jobs=2)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual([r["exit_code"] for r in results], [0, 0])
+
+    def test_after(self):
+        """A script waits for the scripts it declared with immutablue-after."""
+        self.traced("10-a.sh", header="# immutablue-after: 20-b.sh")
+        self.traced("20-b.sh", sleep=0.2)
+        self.run_scripts(max_jobs=4)
+        self.assertEqual(self.read_trace(), ["start 20-b.sh", "end 20-b.sh", "start 10-a.sh", "end 10-a.sh"])
+
+    def test_after_failure_and_cycle(self):
+        """Failed dependencies still release dependents and cycles are broken."""
+        self.traced("10-a.sh", header="# immutablue-after: 20-b.sh")
+        self.traced("20-b.sh", header="# immutablue-after: 10-a.sh", status=3)
+        self.traced("30-c.sh", header="# immutablue-after: 20-b.sh missing.sh")
+        results = self.run_scripts(max_jobs=4)
+        codes = {os.path.basename(r["script"]): r["exit_code"] for r in results}
+        self.assertEqual(codes, {"10-a.sh": 0, "20-b.sh": 3, "30-c.sh": 0})
+        self.assertEqual(self.read_trace()[-2:], ["start 30-c.sh", "end 30-c.sh"])
+
+    def test_timeout(self):
+        """A script that runs out of time is terminated."""
+        self.traced("10-slow.sh", sleep=30, header="# immutablue-timeout: 1")
+        self.traced("20-fast.sh", sleep=30)
+        started = time.monotonic()
+        results = self.run_scripts(max_jobs=2, default_timeout=1)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertTrue(all(r["timed_out"] for r in results))
+        self.assertTrue(all(r["exit_code"] != 0 for r in results))
+
+    def test_result_record(self):
+        """Results carry wall time, exit code and peak RSS, output is prefixed."""
+        self.script("10-a.sh", "echo hello; exit 2")
+        seen = []
+        results = self.run_scripts(on_result=seen.append)
+        self.assertEqual(seen, results)
+        self.assertEqual(results[0]["exit_code"], 2)
+        self.assertGreaterEqual(results[0]["duration"], 0)
+        self.assertGreater(results[0]["max_rss_kb"], 0)
+        self.assertIn("[10-a.sh] hello", self.stdout.getvalue())
+
+    def test_main_invalid_mode(self):
+        """An unknown mode is rejected like the original script."""
+        with patch.object(immutablue_orchestrator, 'LIBEXEC_DIR', self.test_dir):
+            self.assertEqual(immutablue_orchestrator.main(["nope"]), 2)
+        self.assertEqual(immutablue_orchestrator.main([]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# test_immutablue_packages.py
+#
+# Unit tests for the immutablue_packages.py packages.yaml resolver.
+#
+# These tests resolve a small packages file and check that every list expands
+# in the same order build/99-common.sh:get_yaml_array used to produce with yq,
+# and that the manifest is only rewritten when its inputs change. They also
+# compile the distrobox/flatpak install plan scripts/packages.sh iterates over.
+
+import io
+import os
+import json
+import unittest
+import tempfile
+import shutil
+import subprocess
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_packages",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_packages.py')
+)
+immutablue_packages = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_packages)
+
+
+PACKAGES = """
+immutablue:
+  rpm:
+    all:
+    - base
+    43:
+    - fedora43
+    all_x86_64:
+    - amd64
+    43_x86_64:
+    - fedora43-amd64
+    43_aarch64:
+    - fedora43-arm64
+  rpm_nucleus:
+    all:
+    - nucleus
+    all_x86_64:
+    - nucleus-amd64
+  rpm_kuberblue:
+    43:
+    - kube
+  rpm_rm:
+    all:
+  services_enable_sys:
+    all:
+    - a.service
+  nix:
+    install:
+      all:
+      - hello
+    install_gui:
+      all:
+      - gimp
+"""
+
+
+class TestImmutabluePackages(unittest.TestCase):
+    """Test cases for list expansion and the resolved manifest."""
+
+    def setUp(self):
+        """Set up a temporary packages file."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.packages_file = os.path.join(self.test_dir, "packages.yaml")
+        self.output = os.path.join(self.test_dir, "out", "packages.resolved.json")
+        with open(self.packages_file, "w") as f:
+            f.write(PACKAGES)
+        self.tree = immutablue_packages.load_packages(self.packages_file)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def expand(self, key, version="43", march="x86_64", options=()):
+        return immutablue_packages.expand(self.tree, key, version, march, list(options))
+
+    def test_expand_order(self):
+        """Variants expand base first, then each build option in order."""
+        self.assertEqual(
+            self.expand(".immutablue.rpm", options=["kuberblue", "nucleus"]),
+            ["base", "fedora43", "amd64", "fedora43-amd64", "kube", "nucleus", "nucleus-amd64"],
+        )
+
+    def test_expand_arch_and_version(self):
+        """Other architectures and an empty version are filtered out."""
+        self.assertEqual(self.expand(".immutablue.rpm", march="aarch64"), ["base", "fedora43", "fedora43-arm64"])
+        self.assertEqual(self.expand(".immutablue.rpm", version=""), ["base", "amd64"])
+
+    def test_expand_missing(self):
+        """Missing and null lists expand to nothing."""
+        self.assertEqual(self.expand(".immutablue.rpm_rm"), [])
+        self.assertEqual(self.expand(".immutablue.does_not_exist"), [])
+        self.assertEqual(self.expand(".immutablue.nix.install", options=["gui"]), ["hello", "gimp"])
+
+    def test_split_build_options(self):
+        """The build options CSV ignores empty entries."""
+        self.assertEqual(immutablue_packages.split_build_options("a,,b"), ["a", "b"])
+        self.assertEqual(immutablue_packages.split_build_options(""), [])
+        self.assertEqual(immutablue_packages.split_build_options(None), [])
+
+    def run_resolve(self, *args):
+        argv = ["resolve", "--packages", self.packages_file, "--version", "43",
+                "--march", "x86_64", "--output", self.output] + list(args)
+        self.assertEqual(immutablue_packages.main(argv), 0)
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_manifest(self):
+        """The manifest holds every default list and the inputs it came from."""
+        manifest = self.run_resolve("--build-options", "nucleus")
+        self.assertEqual(manifest["manifest_version"], immutablue_packages.MANIFEST_VERSION)
+        self.assertEqual(manifest["inputs"]["build_options"], ["nucleus"])
+        self.assertEqual(set(manifest["lists"]), set(immutablue_packages.DEFAULT_KEYS))
+        self.assertEqual(manifest["lists"][".immutablue.services_enable_sys"], ["a.service"])
+        self.assertEqual(manifest["lists"][".immutablue.rpm"][-1], "nucleus-amd64")
+
+    def test_manifest_parsed_once(self):
+        """All lists are resolved from a single load of packages.yaml."""
+        with patch.object(immutablue_packages, 'load_packages', wraps=immutablue_packages.load_packages) as load:
+            self.run_resolve()
+        self.assertEqual(load.call_count, 1)
+
+    def test_if_stale(self):
+        """--if-stale keeps a current manifest and rebuilds a stale one."""
+        self.run_resolve("--if-stale")
+
+        with patch.object(immutablue_packages, 'load_packages') as load:
+            self.run_resolve("--if-stale")
+        load.assert_not_called()
+
+        manifest = self.run_resolve("--if-stale", "--build-options", "kuberblue")
+        self.assertIn("kube", manifest["lists"][".immutablue.rpm"])
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    def test_missing_packages_file(self, mock_stderr):
+        """A missing packages file is an error and writes no manifest."""
+        argv = ["resolve", "--packages", os.path.join(self.test_dir, "nope.yaml"), "--output", self.output]
+        self.assertEqual(immutablue_packages.main(argv), 1)
+        self.assertFalse(os.path.exists(self.output))
+
+    @patch('sys.stdout')
+    def test_main_usage(self, mock_stdout):
+        """No command is a usage error."""
+        self.assertEqual(immutablue_packages.main([]), 1)
+
+
+BASE_PLAN = """
+immutablue:
+  distrobox:
+    all:
+    - name: dev
+      image: quay.io/immutablue/dbox-fedora:43
+      root: false
+      additional_flags_x86_64:
+      - -v /home/linuxbrew:/home/linuxbrew
+      pkg_inst_cmd: dnf5 install -y
+      pkg_updt_cmd: dnf5 update -y
+      extra_commands: |
+        echo "it's set up"
+      packages:
+      - which
+      packages_aarch64:
+      - pandoc
+      packages_x86_64: null
+      bin_export:
+      - code
+  flatpak_repos:
+    all:
+    - name: extra
+      url: https://example.com/extra.flatpakrepo
+  flatpaks_runtime:
+    all:
+    - org.freedesktop.Platform/x86_64/23.08
+    - org.gnome.Platform/x86_64/49
+  flatpaks:
+    all:
+    - org.gnome.Calculator
+    - org.gnome.Maps
+  flatpaks_x86_64:
+    43:
+    - org.mozilla.firefox
+  flatpaks_rm:
+    all:
+    - org.gnome.Weather
+"""
+
+CUSTOM_PLAN = """
+immutablue:
+  distrobox:
+    all:
+    - name: old
+      rm: true
+  flatpak_repos:
+    all:
+    - name: extra
+      url: https://example.com/other.flatpakrepo
+  flatpaks:
+    all:
+    - org.gnome.Weather
+  flatpaks_rm:
+    all:
+    - org.gnome.Maps
+"""
+
+
+class TestInstallPlan(unittest.TestCase):
+    """Test cases for the distrobox/flatpak install plan."""
+
+    def setUp(self):
+        """Set up a packages.yaml and one custom file."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.base = os.path.join(self.test_dir, "packages.yaml")
+        self.custom = os.path.join(self.test_dir, "packages.custom-test.yaml")
+        self.output = os.path.join(self.test_dir, "install-plan.json")
+        with open(self.base, "w") as f:
+            f.write(BASE_PLAN)
+        with open(self.custom, "w") as f:
+            f.write(CUSTOM_PLAN)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def compile(self, version="43", march="x86_64"):
+        return immutablue_packages.compile_plan([self.base, self.custom], version, march)
+
+    def test_distrobox(self):
+        """Distroboxes are normalized and keep file order."""
+        boxes = self.compile()["distrobox"]
+        self.assertEqual([box["name"] for box in boxes], ["dev", "old"])
+        dev, old = boxes
+        self.assertFalse(dev["root"])
+        self.assertEqual(dev["additional_flags"], ["-v /home/linuxbrew:/home/linuxbrew"])
+        self.assertEqual(dev["packages"], ["which"])
+        self.assertEqual(dev["bin_export"], ["code"])
+        self.assertEqual(dev["npm_packages"], [])
+        self.assertTrue(old["rm"])
+        self.assertEqual(old["source"], self.custom)
+
+        arm = self.compile(march="aarch64")["distrobox"][0]
+        self.assertEqual(arm["packages"], ["which", "pandoc"])
+        self.assertEqual(arm["additional_flags"], [])
+
+    def test_flatpak(self):
+        """Repos dedupe by name and the last file decides installs/removals."""
+        flatpak = self.compile()["flatpak"]
+        self.assertEqual(flatpak["repos"], [{"name": "extra", "url": "https://example.com/extra.flatpakrepo"}])
+        self.assertEqual(flatpak["runtimes"], ["org.gnome.Platform/x86_64/49"])
+        self.assertEqual(flatpak["install"], ["org.gnome.Calculator", "org.mozilla.firefox", "org.gnome.Weather"])
+        self.assertEqual(flatpak["uninstall"], ["org.gnome.Maps"])
+
+        self.assertNotIn("org.mozilla.firefox", self.compile(version="42")["flatpak"]["install"])
+
+    def test_files_parsed_once(self):
+        """Each packages file is loaded exactly once."""
+        with patch.object(immutablue_packages, 'load_packages', wraps=immutablue_packages.load_packages) as load:
+            self.compile()
+        self.assertEqual([call.args[0] for call in load.call_args_list], [self.base, self.custom])
+
+    def run_plan(self, *args):
+        argv = ["plan", "--version", "43", "--march", "x86_64", "--output", self.output,
+                "--if-stale", "--shell"] + list(args) + [self.base, self.custom]
+        with patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual(immutablue_packages.main(argv), 0)
+        return out.getvalue()
+
+    def test_plan_cached(self):
+        """An unchanged plan is served without reparsing the YAML."""
+        first = self.run_plan()
+        with patch.object(immutablue_packages, 'load_packages') as load:
+            second = self.run_plan()
+        load.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_shell_rendering(self):
+        """The shell rendering round-trips through bash."""
+        script = self.run_plan() + "\n".join([
+            'echo "${PLAN_DBOX_COUNT}"',
+            'echo "${PLAN_DBOX_0_EXTRA_COMMANDS}"',
+            'printf "%s|" "${PLAN_DBOX_0_ADDITIONAL_FLAGS[@]}"; echo',
+            'echo "${PLAN_DBOX_1_RM} ${#PLAN_DBOX_1_PACKAGES[@]}"',
+            'echo "${PLAN_FLATPAK_REPOS[0]} ${PLAN_FLATPAK_REPO_URLS[0]}"',
+        ])
+        result = subprocess.run(["bash", "-c", script], stdout=subprocess.PIPE, text=True, check=True)
+        self.assertEqual(result.stdout.splitlines(), [
+            "2",
+            "echo \"it's set up\"",
+            "",
+            "-v /home/linuxbrew:/home/linuxbrew|",
+            "true 0",
+            "extra https://example.com/extra.flatpakrepo",
+        ])
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    def test_plan_needs_files(self, mock_stderr):
+        """The plan command needs at least one packages file."""
+        self.assertEqual(immutablue_packages.main(["plan"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
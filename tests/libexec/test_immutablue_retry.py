@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# test_immutablue_retry.py
+#
+# Unit tests for the immutablue_retry.py backoff helper.
+#
+# These tests drive retry() with a fake clock so the backoff schedule, the
+# deadline and the wake-on-network-online path run instantly.
+
+import io
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_retry",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_retry.py')
+)
+immutablue_retry = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_retry)
+
+
+class FakeClock:
+    """A monotonic clock that only moves when something sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestImmutablueRetry(unittest.TestCase):
+    """Test cases for retry with backoff."""
+
+    def setUp(self):
+        """Set up a fake clock and a jitter-free random source."""
+        self.clock = FakeClock()
+        self.upper = lambda low, high: high
+
+    def retry(self, func, **kwargs):
+        return immutablue_retry.retry(func, clock=self.clock, sleep=self.clock.sleep, rand=self.upper, **kwargs)
+
+    def test_delays(self):
+        """Delays double up to the cap and jitter stays within half to all."""
+        gen = immutablue_retry.delays(1, 5, rand=self.upper)
+        self.assertEqual([next(gen) for _ in range(5)], [1, 2, 4, 5, 5])
+        gen = immutablue_retry.delays(4, 4)
+        self.assertTrue(all(2 <= next(gen) <= 4 for _ in range(100)))
+
+    def test_success_after_failures(self):
+        """The first truthy result is returned without further waiting."""
+        results = iter([False, None, "ok"])
+        self.assertEqual(self.retry(lambda: next(results)), "ok")
+        self.assertEqual(self.clock.sleeps, [1, 2])
+
+    def test_deadline(self):
+        """No attempt starts after the deadline and the last wait is shortened."""
+        calls = []
+        self.assertFalse(self.retry(lambda: calls.append(self.clock.now), deadline=10))
+        self.assertEqual(calls, [0, 1, 3, 7, 10])
+        self.assertEqual(sum(self.clock.sleeps), 10)
+
+    def test_retry_on(self):
+        """Listed exceptions are retried and the last one is re-raised."""
+        def fail():
+            raise OSError("down")
+        with self.assertRaises(OSError):
+            self.retry(fail, deadline=3, retry_on=(OSError,))
+        self.assertEqual(self.clock.sleeps, [1, 2])
+
+        with self.assertRaises(ValueError):
+            self.retry(lambda: int("x"), retry_on=(OSError,))
+
+    def test_wait_online(self):
+        """A wait ends as soon as the network comes online."""
+        online = iter([False, True])
+        with patch.object(immutablue_retry, 'network_online', side_effect=lambda timeout=0: next(online)) as nm:
+            immutablue_retry.wait(30, wait_online=True, sleep=self.clock.sleep, clock=self.clock)
+        self.assertEqual(nm.call_args_list[1].args, (30,))
+        self.assertEqual(self.clock.sleeps, [])
+
+        with patch.object(immutablue_retry, 'network_online', return_value=None):
+            immutablue_retry.wait(3, wait_online=True, sleep=self.clock.sleep, clock=self.clock)
+        self.assertEqual(self.clock.sleeps, [3])
+
+    def test_main(self):
+        """The command line retries a command until it exits 0."""
+        command = [sys.executable, "-c", "raise SystemExit(0)"]
+        self.assertEqual(immutablue_retry.main(["--deadline", "1", "--"] + command), 0)
+        command = [sys.executable, "-c", "raise SystemExit(3)"]
+        self.assertEqual(immutablue_retry.main(["--deadline", "0", "--"] + command), 3)
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_usage(self, mock_stdout, mock_stderr):
+        """A missing command or a bad option is a usage error."""
+        self.assertEqual(immutablue_retry.main([]), 2)
+        self.assertEqual(immutablue_retry.main(["--deadline", "soon", "true"]), 2)
+        self.assertEqual(immutablue_retry.main(["--nope", "true"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# test_immutablue_settings.py
+#
+# Unit tests for the immutablue_settings.py settings engine.
+#
+# These tests build a throwaway three-level settings hierarchy and check that
+# lookups resolve with the same precedence as the original yq-based script,
+# and that the resolved tree cache is reused and invalidated correctly.
+
+import io
+import os
+import sys
+import time
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_settings",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_settings.py')
+)
+immutablue_settings = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_settings)
+
+
+class TestImmutablueSettings(unittest.TestCase):
+    """Test cases for settings resolution and caching."""
+
+    def setUp(self):
+        """Set up a temporary settings hierarchy."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.user_file = os.path.join(self.test_dir, "user.yaml")
+        self.etc_file = os.path.join(self.test_dir, "etc.yaml")
+        self.usr_file = os.path.join(self.test_dir, "usr.yaml")
+
+        self.write(self.usr_file, """
+immutablue:
+  run_bootc_update: true
+  header:
+    has_internet_host_v4: "9.9.9.9"
+    has_internet_host_v6: "2620:fe::fe"
+  profile:
+    ulimit_nofile: 524288
+    enable_starship: true
+  lts_version:
+    42: "6.12"
+  list:
+  - a
+  - b
+""")
+        self.write(self.etc_file, """
+immutablue:
+  header:
+    has_internet_host_v4: "1.1.1.1"
+""")
+        self.write(self.user_file, """
+immutablue:
+  run_bootc_update: null
+  profile:
+    enable_starship: false
+    ulimit_nofile: ""
+""")
+
+        self.original_file_order = immutablue_settings.FILE_ORDER
+        self.original_cache_file = immutablue_settings.CACHE_FILE
+        immutablue_settings.FILE_ORDER = [self.user_file, self.etc_file, self.usr_file]
+        immutablue_settings.CACHE_FILE = os.path.join(self.test_dir, "cache", "settings.json")
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+        immutablue_settings.FILE_ORDER = self.original_file_order
+        immutablue_settings.CACHE_FILE = self.original_cache_file
+
+    def write(self, path, content):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def get(self, expr):
+        return dict(immutablue_settings.resolve([expr]))[expr]
+
+    def test_precedence(self):
+        """Higher priority files win, unset values fall through."""
+        self.assertEqual(self.get(".immutablue.profile.enable_starship"), "false")
+        self.assertEqual(self.get(".immutablue.header.has_internet_host_v4"), "1.1.1.1")
+        self.assertEqual(self.get(".immutablue.header.has_internet_host_v6"), "2620:fe::fe")
+        self.assertEqual(self.get(".immutablue.run_bootc_update"), "true")
+        self.assertEqual(self.get(".immutablue.profile.ulimit_nofile"), "524288")
+
+    def test_missing_key(self):
+        """Keys that are not set anywhere resolve to None."""
+        self.assertIsNone(self.get(".immutablue.does_not_exist"))
+        self.assertIsNone(self.get(".immutablue.list[5]"))
+
+    def test_paths(self):
+        """Indexing, splatting and numeric keys behave like yq."""
+        self.assertEqual(self.get(".immutablue.list[0]"), "a")
+        self.assertEqual(self.get(".immutablue.list[]"), "a\nb")
+        self.assertEqual(self.get(".immutablue.lts_version.42"), "6.12")
+        self.assertEqual(self.get('.immutablue["lts_version"]."42"'), "6.12")
+
+    def test_batch(self):
+        """Many keys resolve from one parse of the hierarchy."""
+        exprs = [".immutablue.profile.enable_starship", ".immutablue.header.has_internet_host_v4"]
+        with patch.object(immutablue_settings, 'load_tree', wraps=immutablue_settings.load_tree) as load:
+            results = immutablue_settings.resolve(exprs)
+        self.assertEqual(load.call_count, 1)
+        self.assertEqual([value for _, value in results], ["false", "1.1.1.1"])
+
+    def test_cache_reused(self):
+        """A warm cache is served without reparsing the YAML files."""
+        immutablue_settings.resolve([".immutablue.run_bootc_update"])
+        self.assertTrue(os.path.exists(immutablue_settings.CACHE_FILE))
+
+        with patch.object(immutablue_settings, 'load_tree') as load:
+            value = self.get(".immutablue.header.has_internet_host_v4")
+        load.assert_not_called()
+        self.assertEqual(value, "1.1.1.1")
+
+    def test_cache_invalidated(self):
+        """Changing a settings file invalidates the cache."""
+        self.assertEqual(self.get(".immutablue.header.has_internet_host_v4"), "1.1.1.1")
+
+        self.write(self.etc_file, """
+immutablue:
+  header:
+    has_internet_host_v4: "8.8.8.8"
+""")
+        # Make sure the mtime moves even on coarse grained filesystems
+        future = time.time() + 10
+        os.utime(self.etc_file, (future, future))
+
+        self.assertEqual(self.get(".immutablue.header.has_internet_host_v4"), "8.8.8.8")
+
+    def test_unsupported_query_uses_yq(self):
+        """Non-path queries fall back to the per-file yq lookup."""
+        with patch.object(immutablue_settings, 'legacy_lookup', return_value="x") as legacy:
+            value = self.get(".immutablue.list[] | select(. == \"a\")")
+        legacy.assert_called_once()
+        self.assertEqual(value, "x")
+
+    def run_main(self, argv):
+        with patch('sys.stdout', new_callable=io.StringIO) as out:
+            self.assertEqual(immutablue_settings.main(argv), 0)
+        return out.getvalue()
+
+    def test_main_plain(self):
+        """Plain mode prints resolved values and skips unset ones."""
+        output = self.run_main([".immutablue.profile.enable_starship", ".nope", ".immutablue.run_bootc_update"])
+        self.assertEqual(output, "false\ntrue\n")
+
+    def test_main_shell(self):
+        """Shell mode emits one eval-able assignment per query."""
+        output = self.run_main([
+            "--shell",
+            ".immutablue.profile.enable_starship",
+            "host=.immutablue.header.has_internet_host_v4",
+            ".nope",
+        ])
+        self.assertEqual(output.splitlines(), [
+            "IMMUTABLUE_PROFILE_ENABLE_STARSHIP=false",
+            "host=1.1.1.1",
+            "NOPE=''",
+        ])
+
+    def test_main_null(self):
+        """Null mode keeps positions for unset values."""
+        output = self.run_main(["-0", ".immutablue.list[]", ".nope", ".immutablue.run_bootc_update"])
+        self.assertEqual(output.split("\0"), ["a\nb", "", "true", ""])
+
+    def test_shell_name(self):
+        """Variable names are derived from the path."""
+        self.assertEqual(immutablue_settings.shell_name(".a.b-c[0]"), "A_B_C_0_")
+        self.assertEqual(immutablue_settings.split_query("x=.a.b"), ("x", ".a.b"))
+        self.assertEqual(immutablue_settings.split_query(".a.b"), ("A_B", ".a.b"))
+
+    @patch('sys.stdout')
+    def test_main_usage(self, mock_stdout):
+        """No arguments is a usage error, like the original script."""
+        self.assertEqual(immutablue_settings.main([]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# test_immutablue_tuning.py
+#
+# Unit tests for the immutablue_tuning.py hardware tuning profiles.
+#
+# These tests match the shipped tuning.yaml against fake inventories, and
+# apply and revert a plan on a temporary tree to check that every file and
+# live setting is put back the way it was.
+
+import io
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_tuning",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/immutablue_tuning.py')
+)
+immutablue_tuning = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_tuning)
+
+DEFAULT_PROFILES = os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/immutablue/tuning.yaml')
+
+
+def inventory(chassis="desktop", memory_gib=16, disks=(("nvme0n1", "nvme", False),)):
+    return {
+        'system': {'chassis': chassis},
+        'memory': {'total_bytes': memory_gib * 1024 ** 3},
+        'disks': [{'name': name, 'transport': transport, 'rotational': rotational}
+                  for name, transport, rotational in disks],
+    }
+
+
+class TestImmutablueTuning(unittest.TestCase):
+    """Test cases for the tuning profiles."""
+
+    def setUp(self):
+        """Point every file and live path at a temporary tree."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.write("proc/sys/vm/swappiness", "60\n")
+        self.write("proc/sys/vm/watermark_boost_factor", "15000\n")
+        self.write("proc/sys/vm/watermark_scale_factor", "10\n")
+        self.write("proc/sys/vm/page-cluster", "3\n")
+        self.write("sys/block/nvme0n1/queue/scheduler", "[none] mq-deadline kyber\n")
+        self.write("sys/cpu/cpu0/cpufreq/energy_performance_preference", "performance\n")
+        self.write("sysctl.d/60-immutablue-tuning.conf", "# mine\n")
+        self.write("build_options", "gui,silverblue\n")
+
+        paths = {
+            'SYSTEM_PROFILES_FILE': "etc/tuning.yaml",
+            'BUILD_OPTIONS_FILE': "build_options",
+            'STATE_FILE': "var/tuning.json",
+            'SYSCTL_FILE': "sysctl.d/60-immutablue-tuning.conf",
+            'ZRAM_FILE': "zram/60-immutablue-tuning.conf",
+            'UDEV_FILE': "udev/60-immutablue-tuning.rules",
+            'TMPFILES_FILE': "tmpfiles/60-immutablue-tuning.conf",
+            'MODPROBE_FILE': "modprobe/60-immutablue-tuning.conf",
+            'PROC_SYS': "proc/sys",
+            'SYS_BLOCK': "sys/block",
+            'SYS_CPU': "sys/cpu",
+            'ZFS_ARC_MAX': "sys/zfs_arc_max",
+        }
+        self.patches = [patch.object(immutablue_tuning, name, self.path(path)) for name, path in paths.items()]
+        self.patches.append(patch.object(immutablue_tuning, 'DEFAULT_PROFILES_FILE', DEFAULT_PROFILES))
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir)
+
+    def path(self, relpath):
+        return os.path.join(self.test_dir, relpath)
+
+    def write(self, relpath, content):
+        path = self.path(relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def read(self, relpath):
+        with open(self.path(relpath)) as f:
+            return f.read()
+
+    def test_select(self):
+        """Profiles are picked by chassis, memory and build options."""
+        profiles = immutablue_tuning.load_profiles()
+        selected, settings = immutablue_tuning.select(profiles, inventory("laptop", 8), set())
+        self.assertEqual(selected, ["zram", "low_memory", "io_scheduler", "laptop"])
+        self.assertEqual(settings["zram"]["zram-size"], "ram * 1.5")
+        self.assertEqual(settings["cpu"], {"epp": "balance_power"})
+
+        selected, settings = immutablue_tuning.select(profiles, inventory("vm", 32), {"kuberblue"})
+        self.assertEqual(selected, ["io_scheduler", "vm"])
+        self.assertEqual(settings["io_scheduler"], {"nvme": "none", "ssd": "none", "hdd": "none"})
+
+        selected, _ = immutablue_tuning.select(profiles, inventory("server"), {"trueblue"})
+        self.assertIn("trueblue_zfs", selected)
+
+        with self.assertRaises(ValueError):
+            immutablue_tuning.matches({"moon_phase": "full"}, inventory(), set())
+
+    def test_system_overrides(self):
+        """/etc profiles replace shipped ones by id and can disable them."""
+        self.write("etc/tuning.yaml", "profiles:\n"
+                                      "  - id: zram\n    enabled: false\n"
+                                      "  - id: desktop\n    when: {chassis: desktop}\n"
+                                      "    settings: {cpu: {governor: schedutil}}\n")
+        selected, settings = immutablue_tuning.select(immutablue_tuning.load_profiles(), inventory(), set())
+        self.assertNotIn("zram", selected)
+        self.assertEqual(settings["cpu"], {"governor": "schedutil"})
+
+    def test_plan(self):
+        """A plan lists the drop-in files and the live values."""
+        planned = immutablue_tuning.plan(inventory(), options=set())
+        self.assertIn("vm.swappiness = 180\n", planned["files"][self.path("sysctl.d/60-immutablue-tuning.conf")])
+        self.assertIn('ATTR{queue/scheduler}="bfq"', planned["files"][self.path("udev/60-immutablue-tuning.rules")])
+        self.assertEqual(planned["live"][self.path("sys/block/nvme0n1/queue/scheduler")], "none")
+        self.assertEqual(planned["live"][self.path("sys/cpu/cpu0/cpufreq/energy_performance_preference")],
+                         "balance_performance")
+
+        planned = immutablue_tuning.plan(inventory(memory_gib=64), options={"trueblue"})
+        self.assertIn("zfs_arc_max=34359738368", planned["files"][self.path("modprobe/60-immutablue-tuning.conf")])
+
+    def test_udev_whole_disks(self):
+        """Scheduler rules only match whole disks, not their partitions."""
+        planned = immutablue_tuning.plan(inventory(), options=set())
+        rules = planned["files"][self.path("udev/60-immutablue-tuning.rules")].splitlines()[2:]
+        self.assertEqual(len(rules), 3)
+        for rule in rules:
+            self.assertIn('SUBSYSTEM=="block", ENV{DEVTYPE}=="disk"', rule)
+
+    def test_powersave_governor(self):
+        """powersave is only set with a cpufreq driver in active mode."""
+        self.write("etc/tuning.yaml", "profiles:\n"
+                                      "  - id: desktop\n    when: {chassis: desktop}\n"
+                                      "    settings: {cpu: {governor: powersave}}\n")
+        self.write("sys/cpu/cpu0/cpufreq/scaling_governor", "performance\n")
+        governor = self.path("sys/cpu/cpu0/cpufreq/scaling_governor")
+        for driver, expected in (("acpi-cpufreq", False), ("intel_cpufreq", False),
+                                 ("intel_pstate", True), ("amd-pstate-epp", True)):
+            self.write("sys/cpu/cpu0/cpufreq/scaling_driver", driver + "\n")
+            planned = immutablue_tuning.plan(inventory(), options=set())
+            self.assertEqual(governor in planned["live"], expected, driver)
+            self.assertEqual(self.path("tmpfiles/60-immutablue-tuning.conf") in planned["files"], expected, driver)
+
+    def test_apply_revert(self):
+        """Apply records what it changes, revert restores all of it."""
+        result = immutablue_tuning.apply(inventory=inventory())
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(self.read("proc/sys/vm/swappiness"), "180")
+        self.assertIn("zram-size = min(ram, 8192)", self.read("zram/60-immutablue-tuning.conf"))
+        state = immutablue_tuning.load_state()
+        self.assertEqual(state["files"][self.path("sysctl.d/60-immutablue-tuning.conf")], "# mine\n")
+        self.assertIsNone(state["files"][self.path("zram/60-immutablue-tuning.conf")])
+        self.assertEqual(state["live"][self.path("sys/block/nvme0n1/queue/scheduler")], "none")
+
+        # Applying again does not record its own changes as the previous state
+        immutablue_tuning.apply(inventory=inventory())
+        self.assertEqual(immutablue_tuning.load_state()["live"][self.path("proc/sys/vm/swappiness")], "60")
+
+        immutablue_tuning.revert()
+        self.assertEqual(self.read("proc/sys/vm/swappiness"), "60")
+        self.assertEqual(self.read("sysctl.d/60-immutablue-tuning.conf"), "# mine\n")
+        self.assertFalse(os.path.exists(self.path("zram/60-immutablue-tuning.conf")))
+        self.assertIsNone(immutablue_tuning.load_state())
+        self.assertEqual(immutablue_tuning.revert(), [])
+
+    def test_dry_run(self):
+        """A dry run changes nothing."""
+        result = immutablue_tuning.apply(dry_run=True, inventory=inventory())
+        self.assertIn(f"set {self.path('proc/sys/vm/swappiness')} = 180", result["actions"])
+        self.assertEqual(self.read("proc/sys/vm/swappiness"), "60\n")
+        self.assertIsNone(immutablue_tuning.load_state())
+
+    def test_value(self):
+        """Single settings resolve for the scripts that consume them."""
+        self.write("build_options", "trueblue\n")
+        self.assertEqual(immutablue_tuning.value("zfs_arc_max", inventory(memory_gib=16)), 8 * 1024 ** 3)
+        self.assertEqual(immutablue_tuning.value("cpu.epp", inventory()), "balance_performance")
+        self.assertIsNone(immutablue_tuning.value("cpu.governor", inventory()))
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main(self, mock_stdout, mock_stderr):
+        """The command line applies as JSON and rejects unknown input."""
+        with patch.object(immutablue_tuning.hardware, 'refresh', return_value=inventory()):
+            self.assertEqual(immutablue_tuning.main(["apply", "--dry-run", "--json"]), 0)
+            self.assertIn("io_scheduler", json.loads(mock_stdout.getvalue())["profiles"])
+        self.assertEqual(immutablue_tuning.main([]), 1)
+        self.assertEqual(immutablue_tuning.main(["nope"]), 1)
+        self.assertEqual(immutablue_tuning.main(["revert", "--json"]), 1)
+        self.assertEqual(immutablue_tuning.main(["value"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
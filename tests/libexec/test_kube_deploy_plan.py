@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# test_kube_deploy_plan.py
+#
+# Unit tests for the kuberblue kube_deploy_plan.py deploy planner.
+#
+# These tests build small manifest trees and check the waves they are split
+# into, and plan the shipped manifests to check that cilium deploys alone.
+
+import io
+import os
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "kube_deploy_plan",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides_kuberblue/usr/libexec/kuberblue/kube_setup/kube_deploy_plan.py')
+)
+kube_deploy_plan = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(kube_deploy_plan)
+
+SHIPPED_MANIFESTS = os.path.join(os.path.dirname(__file__), '../../artifacts/overrides_kuberblue/etc/kuberblue/manifests')
+
+
+class TestKubeDeployPlan(unittest.TestCase):
+    """Test cases for the deploy planner."""
+
+    def setUp(self):
+        """Set up a temporary manifest dir."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def write(self, relpath, content="kind: ConfigMap\n"):
+        path = os.path.join(self.test_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def plan(self, skip=()):
+        return kube_deploy_plan.waves(kube_deploy_plan.find_units(self.test_dir, skip))
+
+    def test_waves(self):
+        """Top-level prefixes order the waves, siblings deploy together."""
+        self.write("cluster.yaml")
+        self.write("00-base/00-cni/10-values.yaml")
+        self.write("00-base/10-storage/10-values.yaml")
+        self.write("00-base/10-storage/extra/20-class.yaml")
+        self.write("00-base/20-docs/README.md")
+        self.write("00-base/30-tests/thing_test.yaml")
+        self.write("10-apps/00-web/10-values.yaml")
+        self.write("10-apps/10-api/10-deployment.yaml")
+        self.write("mine/app.json", "{}")
+        self.assertEqual(self.plan(), [
+            ["."],
+            ["00-base/00-cni", "00-base/10-storage"],
+            ["00-base/10-storage/extra"],
+            ["10-apps/00-web", "10-apps/10-api"],
+            ["mine"],
+        ])
+
+    def test_depends_on(self):
+        """depends_on names a package by metadata name, directory name or path."""
+        self.write("00-base/00-cni/00-metadata.yaml", "name: cilium\n")
+        self.write("00-base/00-cni/10-values.yaml")
+        self.write("00-base/10-storage/00-metadata.yaml", "depends_on: [cilium]\n")
+        self.write("00-base/10-storage/10-values.yaml")
+        self.write("00-base/20-metrics/00-metadata.yaml", "depends_on: storage\n")
+        self.write("00-base/20-metrics/10-values.yaml")
+        self.write("00-base/30-certs/00-metadata.yaml", "depends_on: [00-base/00-cni]\n")
+        self.write("00-base/30-certs/10-values.yaml")
+        self.assertEqual(self.plan(), [
+            ["00-base/00-cni"],
+            ["00-base/10-storage", "00-base/30-certs"],
+            ["00-base/20-metrics"],
+        ])
+
+        # Disabled packages drop out, their dependents wait for what they needed
+        self.assertEqual(self.plan(skip=["00-base/10-storage"]), [
+            ["00-base/00-cni"],
+            ["00-base/20-metrics", "00-base/30-certs"],
+        ])
+
+    def test_invalid(self):
+        """Unknown dependencies and cycles are errors."""
+        self.write("00-base/00-a/00-metadata.yaml", "depends_on: [nope]\n")
+        self.write("00-base/00-a/10-values.yaml")
+        with self.assertRaisesRegex(ValueError, "unknown dependency 'nope'"):
+            self.plan()
+
+        self.write("00-base/00-a/00-metadata.yaml", "depends_on: [b]\n")
+        self.write("00-base/10-b/00-metadata.yaml", "depends_on: [a]\n")
+        self.write("00-base/10-b/10-values.yaml")
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            self.plan()
+
+        # A dependency on a later tier loops back through the prefix order
+        self.write("00-base/00-a/00-metadata.yaml", "depends_on: [c]\n")
+        self.write("00-base/10-b/00-metadata.yaml", "name: b\n")
+        self.write("10-apps/00-c/10-values.yaml")
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            self.plan()
+
+    def test_shipped_manifests(self):
+        """The CNI deploys on its own, the other core packages right after it."""
+        plan = kube_deploy_plan.waves(kube_deploy_plan.find_units(SHIPPED_MANIFESTS))
+        self.assertEqual(plan[0], ["00-infrastructure/00-cilium"])
+        self.assertIn("00-infrastructure/10-openebs", plan[1])
+        self.assertIn("00-infrastructure/20-metrics-server", plan[1])
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main(self, mock_stdout, mock_stderr):
+        """The command line prints tab separated waves."""
+        self.write("00-base/00-cni/10-values.yaml")
+        self.write("10-apps/00-web/10-values.yaml")
+        self.assertEqual(kube_deploy_plan.main(["waves", self.test_dir, "--skip", "10-apps"]), 0)
+        self.assertEqual(mock_stdout.getvalue(), "0\t00-base/00-cni\n")
+
+        self.write("10-apps/00-web/00-metadata.yaml", "depends_on: [nope]\n")
+        self.assertEqual(kube_deploy_plan.main(["waves", self.test_dir]), kube_deploy_plan.EXIT_INVALID)
+        self.assertIn("unknown dependency", mock_stderr.getvalue())
+        self.assertEqual(kube_deploy_plan.main(["waves"]), 1)
+        self.assertEqual(kube_deploy_plan.main(["waves", self.test_dir, "--nope"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# test_kube_manifest_index.py
+#
+# Unit tests for the kuberblue kube_manifest_index.py manifest reader.
+#
+# These tests index multi-document manifests, check that an unchanged file
+# is answered from the cache without parsing it, read Helm metadata and list
+# the images of rendered charts.
+
+import io
+import os
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "kube_manifest_index",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides_kuberblue/usr/libexec/kuberblue/kube_setup/kube_manifest_index.py')
+)
+kube_manifest_index = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(kube_manifest_index)
+
+MANIFEST = """\
+apiVersion: v1
+kind: Namespace
+metadata:
+  name: apps
+---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: web
+  namespace: apps
+---
+# only a comment
+---
+apiVersion: v1
+kind: List
+items:
+  - kind: DaemonSet
+    metadata:
+      name: agent
+  - kind: ConfigMap
+    metadata: {}
+"""
+
+
+class TestKubeManifestIndex(unittest.TestCase):
+    """Test cases for the manifest index."""
+
+    def setUp(self):
+        """Point the index cache at a temporary directory."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.cache_dir = os.path.join(self.test_dir, "cache")
+        self.patch = patch.object(kube_manifest_index, 'CACHE_DIR', self.cache_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        self.patch.stop()
+        shutil.rmtree(self.test_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.test_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_objects(self):
+        """Every named object is listed once with its namespace."""
+        found = kube_manifest_index.objects(self.write("app.yaml", MANIFEST))
+        self.assertEqual([(o['kind'], o['name'], o['namespace'], o['waitable']) for o in found], [
+            ("Namespace", "apps", "default", False),
+            ("Deployment", "web", "apps", True),
+            ("DaemonSet", "agent", "default", True),
+        ])
+
+        with self.assertRaises(ValueError):
+            kube_manifest_index.objects(self.write("bad.yaml", "kind: [\n"))
+
+    def test_cache(self):
+        """An unchanged file is not parsed again, a changed one is."""
+        path = self.write("app.yaml", MANIFEST)
+        first = kube_manifest_index.objects(path)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        with patch.object(kube_manifest_index.yaml, 'safe_load_all', side_effect=AssertionError("parsed")):
+            self.assertEqual(kube_manifest_index.objects(path), first)
+            self.write("app.yaml", MANIFEST + "---\nkind: Secret\nmetadata:\n  name: s\n")
+            with self.assertRaises(AssertionError):
+                kube_manifest_index.objects(path)
+
+        with patch.object(kube_manifest_index, 'CACHE_MAX', 1):
+            kube_manifest_index.objects(path)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_metadata(self):
+        """Helm metadata fields come out as strings, empty when unset."""
+        path = self.write("00-metadata.yaml", "name: cilium\nchart: cilium/cilium\nnamespace: kube-system\n"
+                                              "create_namespace: true\nargs:\nrepo_name: cilium\n"
+                                              "repo_url: https://helm.cilium.io/\n")
+        self.assertEqual(kube_manifest_index.metadata(path),
+                         ["cilium", "cilium/cilium", "", "kube-system", "true", "", "cilium", "https://helm.cilium.io/"])
+
+    def test_images(self):
+        """Images of every pod template are listed once, init containers first."""
+        path = self.write("rendered.yaml", """\
+kind: Deployment
+spec:
+  template:
+    spec:
+      initContainers:
+        - name: init
+          image: quay.io/cilium/cilium:v1.17.4
+      containers:
+        - name: agent
+          image: quay.io/cilium/cilium:v1.17.4
+        - name: envoy
+          image: quay.io/cilium/cilium-envoy:v1.32.6
+---
+kind: CronJob
+spec:
+  jobTemplate:
+    spec:
+      template:
+        spec:
+          containers:
+            - name: gc
+              image: busybox:1.37
+---
+kind: ConfigMap
+data:
+  image: not-a-container
+""")
+        self.assertEqual(kube_manifest_index.images(path), [
+            "quay.io/cilium/cilium:v1.17.4", "quay.io/cilium/cilium-envoy:v1.32.6", "busybox:1.37",
+        ])
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main(self, mock_stdout, mock_stderr):
+        """The command line prints one tab separated line per object."""
+        path = self.write("app.yaml", MANIFEST)
+        self.assertEqual(kube_manifest_index.main(["objects", path, "--cache-dir", self.test_dir]), 0)
+        self.assertEqual(mock_stdout.getvalue().splitlines()[1], "Deployment\tweb\tapps\t1")
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+        self.assertEqual(kube_manifest_index.main(["objects", os.path.join(self.test_dir, "nope")]), 1)
+        self.assertEqual(kube_manifest_index.main(["metadata", path, "--json"]), 1)
+        self.assertEqual(kube_manifest_index.main(["nope", path]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# test_kube_wait.py
+#
+# Unit tests for the kuberblue kube_wait.py readiness waiter.
+#
+# These tests run a fake API server on localhost that answers list requests
+# and streams scripted watch events, and check that objects are reported as
+# soon as they are ready, that one deadline covers every target, and that an
+# expired watch lists again.
+
+import io
+import os
+import json
+import time
+import base64
+import unittest
+import tempfile
+import shutil
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "kube_wait",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides_kuberblue/usr/libexec/kuberblue/kube_setup/kube_wait.py')
+)
+kube_wait = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(kube_wait)
+
+TOKEN = "test-token"
+
+
+def deployment(name, namespace="apps", available=0, labels=None):
+    return {
+        "metadata": {"name": name, "namespace": namespace, "generation": 1, "labels": labels or {}},
+        "spec": {"replicas": 1},
+        "status": {"observedGeneration": 1, "replicas": 1, "updatedReplicas": 1, "availableReplicas": available},
+    }
+
+
+def node(name, ready):
+    return {"metadata": {"name": name},
+            "status": {"conditions": [{"type": "Ready", "status": "True" if ready else "False"}]}}
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Serves `lists` for list requests and streams `watches` for watches.
+
+    lists maps a request path to the items of successive list requests, the
+    last repeating. watches likewise maps a path to successive watch streams,
+    each a list of (delay, event) pairs; without one the watch stays open
+    until it times out.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeApiHandler)
+        self.lists = {}
+        self.watches = {}
+        self.requests = []
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        self.server.requests.append(self.path)
+        if self.headers.get('Authorization') != f"Bearer {TOKEN}":
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        if 'watch=1' not in query:
+            lists = self.server.lists.get(path) or [[]]
+            items = lists.pop(0) if len(lists) > 1 else lists[0]
+            body = json.dumps({"metadata": {"resourceVersion": "1"}, "items": items}).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        streams = self.server.watches.get(path) or [[(30, None)]]
+        stream = streams.pop(0) if len(streams) > 1 else streams[0]
+        self.send_response(200)
+        self.end_headers()
+        for delay, event in stream:
+            time.sleep(delay)
+            if event is None:
+                return
+            self.wfile.write(json.dumps(event).encode() + b"\n")
+            self.wfile.flush()
+
+
+class TestKubeWait(unittest.TestCase):
+    """Test cases for the readiness waiter."""
+
+    def setUp(self):
+        """Start a fake API server."""
+        self.server = FakeApiServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = kube_wait.Client({'server': f"http://127.0.0.1:{self.server.server_port}",
+                                        'context': None,
+                                        'headers': {'Authorization': f"Bearer {TOKEN}"}})
+        self.reported = []
+
+    def tearDown(self):
+        """Stop the fake API server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait(self, targets, timeout=5):
+        start = time.monotonic()
+        not_ready = kube_wait.wait([kube_wait.parse_target(t) for t in targets], timeout, self.client,
+                                   lambda line: self.reported.append((time.monotonic() - start, line)))
+        return not_ready, time.monotonic() - start
+
+    def test_reports_as_ready(self):
+        """Objects are reported when their watch event arrives, not at the end."""
+        self.server.lists["/apis/apps/v1/namespaces/apps/deployments"] = [[deployment("web"), deployment("api")]]
+        self.server.watches["/apis/apps/v1/namespaces/apps/deployments"] = [[
+            (0.4, {"type": "MODIFIED", "object": deployment("web", available=1)}),
+            (0.4, {"type": "MODIFIED", "object": deployment("api", available=1)}),
+            (30, None),
+        ]]
+        self.server.watches["/api/v1/nodes"] = [[
+            (0.05, {"type": "ADDED", "object": node("cp", False)}),
+            (0.05, {"type": "MODIFIED", "object": node("cp", True)}),
+            (30, None),
+        ]]
+
+        not_ready, elapsed = self.wait(["deployment/apps/web", "deployment/apps/api", "node/cp"])
+        self.assertEqual(not_ready, {})
+        self.assertLess(elapsed, 2)
+        ready = [(at, line) for at, line in self.reported if line.endswith("is ready")]
+        self.assertEqual([line for _, line in ready],
+                         ["node/cp is ready", "deployment/apps/web is ready", "deployment/apps/api is ready"])
+        self.assertLess(ready[1][0], ready[2][0] - 0.2)
+
+        # One list and one watch per kind
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_deadline(self):
+        """One deadline covers all targets, what is left is returned."""
+        self.server.lists["/apis/apps/v1/deployments"] = [[deployment("web"),
+                                                           deployment("db", namespace="data", available=1)]]
+        not_ready, elapsed = self.wait(["deployment/apps/web", "deployment/data/db", "daemonset/apps/agent"],
+                                       timeout=1)
+        self.assertLess(elapsed, 3)
+        self.assertEqual(set(not_ready), {"deployment/apps/web", "daemonset/apps/agent"})
+        self.assertEqual(not_ready["daemonset/apps/agent"][1], "not found yet")
+
+    def test_selector_and_relist(self):
+        """Selector targets track what matches, an expired watch lists again."""
+        path = "/apis/apps/v1/namespaces/apps/deployments"
+        part_of = {"app.kubernetes.io/part-of": "web"}
+        self.server.lists[path] = [
+            [deployment("web", labels=part_of), deployment("other")],
+            [deployment("web", labels=part_of, available=1), deployment("other"), deployment("new", labels=part_of)],
+        ]
+        self.server.watches[path] = [
+            [(0.1, {"type": "ERROR", "object": {"code": 410, "message": "too old resource version"}})],
+            [(30, None)],
+        ]
+
+        not_ready, elapsed = self.wait(["deployment/apps?app.kubernetes.io/part-of=web"])
+        self.assertEqual(not_ready, {})
+        self.assertLess(elapsed, 2)
+        # Listed, watched until the 410, listed again; "new" matched too late to be tracked
+        self.assertEqual(['watch=1' in r for r in self.server.requests[:3]], [False, True, False])
+
+    def test_readiness(self):
+        """Rollout rules follow kubectl rollout status."""
+        ready = kube_wait.readiness
+        self.assertEqual(ready("deployment", deployment("web", available=1))[0], kube_wait.READY)
+        stale = deployment("web", available=1)
+        stale["metadata"]["generation"] = 2
+        self.assertEqual(ready("deployment", stale)[0], kube_wait.WAITING)
+        stuck = deployment("web")
+        stuck["status"]["conditions"] = [{"type": "Progressing", "reason": "ProgressDeadlineExceeded"}]
+        self.assertEqual(ready("deployment", stuck)[0], kube_wait.FAILED)
+
+        daemonset = {"status": {"desiredNumberScheduled": 2, "updatedNumberScheduled": 2, "numberAvailable": 1}}
+        self.assertEqual(ready("daemonset", daemonset), (kube_wait.WAITING, "1 of 2 updated pods available"))
+        daemonset["status"]["numberAvailable"] = 2
+        self.assertEqual(ready("daemonset", daemonset)[0], kube_wait.READY)
+
+        statefulset = {"spec": {"replicas": 2},
+                       "status": {"readyReplicas": 2, "currentRevision": "a", "updateRevision": "b"}}
+        self.assertEqual(ready("statefulset", statefulset)[0], kube_wait.WAITING)
+        statefulset["status"]["currentRevision"] = "b"
+        self.assertEqual(ready("statefulset", statefulset)[0], kube_wait.READY)
+
+        self.assertEqual(ready("node", {"status": {}})[0], kube_wait.WAITING)
+
+    def test_parse(self):
+        """Targets and durations."""
+        self.assertEqual(kube_wait.parse_target("Deployment/apps/web"),
+                         {'kind': 'deployment', 'namespace': 'apps', 'name': 'web', 'selector': None})
+        self.assertEqual(kube_wait.parse_target("daemonset/kube-system?a/b=c,d==e")['selector'],
+                         {'a/b': 'c', 'd': 'e'})
+        for bad in ("pod/apps/web", "deployment/web", "node/a/b", "node/x?a=b", "deployment/apps?a!=b"):
+            with self.assertRaises(ValueError, msg=bad):
+                kube_wait.parse_target(bad)
+
+        self.assertEqual(kube_wait.parse_duration("300"), 300)
+        self.assertEqual(kube_wait.parse_duration("15m"), 900)
+        self.assertEqual(kube_wait.parse_duration("1h0m30s"), 3630)
+        with self.assertRaises(ValueError):
+            kube_wait.parse_duration("soon")
+
+    def test_kubeconfig(self):
+        """The current context gives the server and credentials."""
+        test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.addCleanup(shutil.rmtree, test_dir)
+        path = os.path.join(test_dir, "config")
+        with open(os.path.join(test_dir, "token"), "w") as f:
+            f.write(TOKEN + "\n")
+        with open(path, "w") as f:
+            f.write("current-context: admin\n"
+                    "contexts:\n"
+                    "  - name: admin\n    context: {cluster: local, user: admin}\n"
+                    "clusters:\n"
+                    f"  - name: local\n    cluster: {{server: 'http://127.0.0.1:{self.server.server_port}/'}}\n"
+                    "users:\n"
+                    "  - name: admin\n    user: {tokenFile: token}\n")
+        config = kube_wait.load_kubeconfig(path)
+        self.assertEqual(config['headers']['Authorization'], f"Bearer {TOKEN}")
+        self.assertIsNone(config['context'])
+
+        with patch.dict(os.environ, {'KUBECONFIG': path}), \
+                patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.server.lists["/api/v1/nodes"] = [[node("cp", True)]]
+            self.assertEqual(kube_wait.main(["--timeout", "5", "node/cp"]), 0)
+            self.assertIn("node/cp is ready", stdout.getvalue())
+
+        with open(path, "w") as f:
+            f.write("current-context: admin\n"
+                    "contexts:\n  - name: admin\n    context: {cluster: local, user: admin}\n"
+                    "clusters:\n  - name: local\n    cluster:\n      server: https://127.0.0.1:6443\n"
+                    f"      certificate-authority-data: {base64.b64encode(b'not a cert').decode()}\n"
+                    "users:\n  - name: admin\n    user: {exec: {command: kubelogin}}\n")
+        with self.assertRaisesRegex(ValueError, "credential plugins"):
+            kube_wait.load_kubeconfig(path)
+
+    @patch('sys.stderr', new_callable=io.StringIO)
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main(self, mock_stdout, mock_stderr):
+        """Bad arguments and kubeconfigs are reported with their exit codes."""
+        self.assertEqual(kube_wait.main([]), 1)
+        self.assertEqual(kube_wait.main(["pod/apps/web"]), 1)
+        self.assertEqual(kube_wait.main(["--timeout", "soon", "node/cp"]), 1)
+        with patch.dict(os.environ, {'KUBECONFIG': os.path.join(tempfile.gettempdir(), "kube_wait-nope")}):
+            self.assertEqual(kube_wait.main(["node/cp"]), kube_wait.EXIT_API)
+        self.assertIn("cannot read kubeconfig", mock_stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
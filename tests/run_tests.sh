@@ -13,6 +13,7 @@
 # - test_container_qemu.sh: QEMU boot tests
 # - test_artifacts.sh: Artifacts and file integrity tests
 # - test_setup.sh: Enhanced first-boot setup tests
+# - test_libexec.sh: Unit tests for the python helpers in /usr/libexec/immutablue
 #
 # SKIP_TEST=1 environment variable can be used to skip all tests
 #
@@ -81,6 +82,13 @@ if [[ $? -ne 0 ]]; then
   EXIT_CODE=1
 fi
 
+# Run libexec helper tests
+echo -e "\n>> Running Libexec Tests"
+bash "$TEST_DIR/test_libexec.sh"
+if [[ $? -ne 0 ]]; then
+  EXIT_CODE=1
+fi
+
 # Run Kuberblue-specific tests if this is a Kuberblue variant
 if [[ $IS_KUBERBLUE -eq 1 ]]; then
     echo -e "\n>> Running Kuberblue Container Tests"
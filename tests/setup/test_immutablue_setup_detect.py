@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# test_immutablue_setup_detect.py
+#
+# Unit tests for the immutablue_setup_detect.py detection engine shared by the
+# setup TUI and GUI.
+#
+# These tests point the probes at a fake /sys tree and a fake ping, and check
+# that results stream in as they complete, that a failing or slow probe does
+# not hold up the others and that the hardware inventory is saved.
+
+import os
+import time
+import asyncio
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_setup_detect",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/setup/immutablue_setup_detect.py')
+)
+immutablue_setup_detect = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_setup_detect)
+
+
+class TestImmutablueSetupDetect(unittest.TestCase):
+    """Test cases for the setup detection engine."""
+
+    def setUp(self):
+        """Set up a temporary fake system tree."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.test_dir)
+
+    def write(self, relpath, content):
+        path = os.path.join(self.test_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_interfaces(self):
+        """Interfaces come from /sys/class/net, loopback is skipped."""
+        self.write("net/lo/operstate", "unknown\n")
+        self.write("net/eth0/operstate", "up\n")
+        self.write("net/wlan0/operstate", "down\n")
+        os.makedirs(os.path.join(self.test_dir, "net/wlan0/wireless"))
+        with patch.object(immutablue_setup_detect, 'SYS_CLASS_NET', os.path.join(self.test_dir, "net")):
+            interfaces, lines = immutablue_setup_detect.probe_interfaces()
+        self.assertEqual(interfaces, ["eth0", "wlan0"])
+        self.assertEqual(lines[1:], ["  - eth0 (up)", "  - wlan0 (down, wireless)"])
+
+    def test_internet_race(self):
+        """The first answered ping wins without waiting for the other."""
+        self.write("bin/ping", '#!/bin/sh\ncase "$3" in slow) sleep 5 ;; up) exit 0 ;; esac\nexit 1\n')
+        os.chmod(os.path.join(self.test_dir, "bin/ping"), 0o755)
+        path = os.path.join(self.test_dir, "bin") + os.pathsep + os.environ.get("PATH", "")
+        with patch.dict(os.environ, {"PATH": path}):
+            started = time.monotonic()
+            self.assertTrue(asyncio.run(immutablue_setup_detect.probe_internet(("slow", "up")))[0])
+            self.assertLess(time.monotonic() - started, 2)
+            self.assertFalse(asyncio.run(immutablue_setup_detect.probe_internet(("down", "down")))[0])
+
+    def test_run_streams_results(self):
+        """Results arrive as they complete, errors do not stop other probes."""
+        async def slow():
+            await asyncio.sleep(0.2)
+            return "slow", ["slow line"]
+
+        def broken():
+            raise OSError("no such file")
+
+        probes = {'test': (('slow', 'Slow', slow), ('fast', 'Fast', lambda: ("fast", ["fast line"])),
+                           ('broken', 'Broken', broken))}
+        arrived = []
+        with patch.object(immutablue_setup_detect, 'PROBES', probes):
+            results = immutablue_setup_detect.run('test', lambda result: arrived.append(result['probe']))
+        self.assertEqual(arrived[-1], "slow")
+        self.assertEqual(list(results), ["slow", "fast", "broken"])
+        self.assertEqual(results["broken"]["lines"], ["Could not detect broken: no such file"])
+        self.assertEqual(immutablue_setup_detect.selections(results), {"slow": "slow", "fast": "fast"})
+
+    def test_probe_timeout(self):
+        """A hung probe is reported as timed out."""
+        async def hang():
+            await asyncio.sleep(10)
+
+        with patch.object(immutablue_setup_detect, 'PROBES', {'test': (('hang', 'Hang', hang),)}), \
+                patch.object(immutablue_setup_detect, 'PROBE_TIMEOUT', 0.1):
+            results = immutablue_setup_detect.run('test')
+        self.assertIn("timed out", results["hang"]["error"])
+
+    def test_save_inventory(self):
+        """Sections collected by detection are saved as the hardware inventory."""
+        inventory_file = os.path.join(self.test_dir, "hardware.json")
+        results = {'cpu': {'probe': 'cpu', 'inventory': {'cpu': {'model': 'Seen by setup'}}},
+                   'hostname': {'probe': 'hostname'}}
+        with patch.object(immutablue_setup_detect.hardware, 'INVENTORY_FILE', inventory_file):
+            self.assertEqual(immutablue_setup_detect.save_inventory(results), inventory_file)
+            self.assertEqual(immutablue_setup_detect.hardware.load(inventory_file)['cpu'], {'model': 'Seen by setup'})
+
+        with patch.object(immutablue_setup_detect.hardware, 'INVENTORY_FILE', os.path.join(inventory_file, "nope")):
+            self.assertIsNone(immutablue_setup_detect.save_inventory(results))
+
+    def test_apply_tuning(self):
+        """Applied tuning profiles become a result, a failure only says so."""
+        script = self.write("tuning.py", '#!/bin/sh\n[ "$3" = --dry-run ] || exit 1\n'
+                                         'echo \'{"profiles": ["zram", "laptop"], "actions": [], "errors": []}\'\n')
+        os.chmod(script, 0o755)
+        with patch.object(immutablue_setup_detect, 'TUNING_SCRIPT', script):
+            result = immutablue_setup_detect.apply_tuning(dry_run=True)
+            self.assertEqual(result['value'], ["zram", "laptop"])
+            self.assertEqual(result['lines'], ["Tuning profiles (dry run): zram, laptop"])
+
+            with patch.object(immutablue_setup_detect.os, 'geteuid', return_value=0):
+                result = immutablue_setup_detect.apply_tuning()
+            self.assertIsNone(result['value'])
+            self.assertIn("immutablue tuning apply", result['lines'][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
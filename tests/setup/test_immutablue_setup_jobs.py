@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# test_immutablue_setup_jobs.py
+#
+# Unit tests for the immutablue_setup_jobs.py background install queue used by
+# the setup TUI and GUI.
+#
+# These tests replace the install commands with small shell scripts and check
+# that output streams to the callback, that job states are checkpointed and
+# that a later run only resumes the jobs that did not finish.
+
+import io
+import os
+import json
+import unittest
+import tempfile
+import shutil
+from unittest.mock import patch
+
+import importlib.util
+spec = importlib.util.spec_from_file_location(
+    "immutablue_setup_jobs",
+    os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/setup/immutablue_setup_jobs.py')
+)
+immutablue_setup_jobs = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(immutablue_setup_jobs)
+
+
+class TestImmutablueSetupJobs(unittest.TestCase):
+    """Test cases for the setup job queue."""
+
+    def setUp(self):
+        """Point the state and logs at a temporary directory and fake the jobs."""
+        self.test_dir = tempfile.mkdtemp(prefix="immutablue_test_")
+        self.state_file = os.path.join(self.test_dir, "state", "setup_jobs.json")
+        self.log_dir = os.path.join(self.test_dir, "logs")
+        jobs = (
+            ('flatpak', 'Flatpaks', 'install_flatpaks', ('sh', '-c', 'echo installing; printf "50%%\\r100%%\\n"')),
+            ('distrobox', 'Distroboxes', 'install_distrobox', ('sh', '-c', 'echo broken; exit 3')),
+        )
+        self.patches = [
+            patch.object(immutablue_setup_jobs, 'JOBS', jobs),
+            patch.object(immutablue_setup_jobs, 'STATE_FILE', self.state_file),
+            patch.object(immutablue_setup_jobs, 'LOG_DIR', self.log_dir),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir)
+
+    def test_install_flags(self):
+        """Any chosen devbox or app option turns on its install flag."""
+        flags = immutablue_setup_jobs.install_flags({'dev_env': {'devbox_base': False}, 'applications': {'app_vlc': True}})
+        self.assertEqual(flags, {'install_distrobox': False, 'install_flatpaks': True})
+        self.assertEqual(immutablue_setup_jobs.install_flags({}), {'install_distrobox': False, 'install_flatpaks': False})
+
+    def test_can_run_in_background(self):
+        """Jobs only start behind a wizard run by a user with cached sudo credentials."""
+        module = immutablue_setup_jobs
+        with patch.object(module.os, 'geteuid', return_value=0), \
+                patch.object(module.subprocess, 'run') as mock_run:
+            self.assertFalse(module.can_run_in_background())
+            mock_run.assert_not_called()
+
+        with patch.object(module.os, 'geteuid', return_value=1000):
+            for returncode, expected in ((0, True), (1, False)):
+                with patch.object(module.subprocess, 'run') as mock_run:
+                    mock_run.return_value.returncode = returncode
+                    self.assertEqual(module.can_run_in_background(), expected)
+                    self.assertEqual(mock_run.call_args[0][0], ['sudo', '-n', 'true'])
+            with patch.object(module.subprocess, 'run', side_effect=FileNotFoundError("sudo")):
+                self.assertFalse(module.can_run_in_background())
+
+    def test_queue_streams_and_checkpoints(self):
+        """Output lines stream to the callback and finished states are saved."""
+        updates = []
+        queue = immutablue_setup_jobs.JobQueue(on_update=updates.append)
+        submitted = queue.submit_selected({'applications': {'app_vlc': True}, 'dev_env': {'devbox_base': True}})
+        self.assertEqual([job['id'] for job in submitted], ["flatpak", "distrobox"])
+        self.assertEqual(queue.submit('flatpak')['id'], "flatpak")
+        self.assertTrue(queue.wait(10))
+
+        lines = [u['line'] for u in updates if u['id'] == 'flatpak' and u['state'] == 'running' and u['line']]
+        self.assertEqual(lines, ["installing", "50%", "100%"])
+        states = {job['id']: (job['state'], job['returncode']) for job in queue.jobs()}
+        self.assertEqual(states, {'flatpak': ('done', 0), 'distrobox': ('failed', 3)})
+        with open(os.path.join(self.log_dir, "distrobox.log")) as f:
+            self.assertEqual(f.read(), "broken\n")
+
+        saved = immutablue_setup_jobs.load_state(self.state_file)
+        self.assertEqual({job_id: job['state'] for job_id, job in saved.items()}, {'flatpak': 'done', 'distrobox': 'failed'})
+        self.assertIn("see", immutablue_setup_jobs.describe(queue.jobs()[1]))
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_resume(self, mock_stdout):
+        """Resume skips finished jobs and re-runs the others."""
+        os.makedirs(os.path.dirname(self.state_file))
+        with open(self.state_file, "w") as f:
+            json.dump({'schema_version': 1, 'jobs': {'flatpak': {'state': 'done', 'returncode': 0}}}, f)
+
+        self.assertEqual(immutablue_setup_jobs.main(["resume"]), 1)
+        output = mock_stdout.getvalue()
+        self.assertNotIn("[Flatpaks]", output)
+        self.assertIn("[Distroboxes] broken", output)
+        self.assertFalse(os.path.exists(os.path.join(self.log_dir, "flatpak.log")))
+
+        mock_stdout.truncate(0)
+        mock_stdout.seek(0)
+        self.assertEqual(immutablue_setup_jobs.main(["status"]), 0)
+        self.assertEqual(mock_stdout.getvalue(), "Flatpaks: done\nDistroboxes: failed\n")
+
+    @patch('sys.stdout', new_callable=io.StringIO)
+    def test_main_usage(self, mock_stdout):
+        """Unknown commands are errors."""
+        self.assertEqual(immutablue_setup_jobs.main([]), 1)
+        self.assertEqual(immutablue_setup_jobs.main(["nope"]), 1)
+        self.assertEqual(immutablue_setup_jobs.main(["resume", "--now"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
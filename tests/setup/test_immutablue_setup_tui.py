@@ -9,10 +9,12 @@
 
 import os
 import sys
+import json
 import unittest
 import tempfile
 import shutil
 import subprocess
+import threading
 import time
 from unittest.mock import patch, MagicMock, call
 
@@ -61,12 +63,16 @@ steps:
         self.original_system_config = immutablue_setup_tui.SYSTEM_CONFIG_FILE
         self.original_user_config = immutablue_setup_tui.USER_CONFIG_FILE
         self.original_flag = immutablue_setup_tui.COMPLETED_FLAG
+        self.original_system_settings = immutablue_setup_tui.SYSTEM_SETTINGS_FILE
+        self.original_user_settings = immutablue_setup_tui.USER_SETTINGS_FILE
         
         # Override paths for testing
         immutablue_setup_tui.DEFAULT_CONFIG_FILE = self.config_file
         immutablue_setup_tui.SYSTEM_CONFIG_FILE = os.path.join(self.config_dir, "system_config.yaml")
         immutablue_setup_tui.USER_CONFIG_FILE = os.path.join(self.config_dir, "user_config.yaml")
         immutablue_setup_tui.COMPLETED_FLAG = os.path.join(self.test_dir, "did_first_boot_setup")
+        immutablue_setup_tui.SYSTEM_SETTINGS_FILE = os.path.join(self.test_dir, "etc/settings.yaml")
+        immutablue_setup_tui.USER_SETTINGS_FILE = os.path.join(self.test_dir, "home/settings.yaml")
     
     def tearDown(self):
         """Clean up test environment."""
@@ -78,6 +84,8 @@ steps:
         immutablue_setup_tui.SYSTEM_CONFIG_FILE = self.original_system_config
         immutablue_setup_tui.USER_CONFIG_FILE = self.original_user_config
         immutablue_setup_tui.COMPLETED_FLAG = self.original_flag
+        immutablue_setup_tui.SYSTEM_SETTINGS_FILE = self.original_system_settings
+        immutablue_setup_tui.USER_SETTINGS_FILE = self.original_user_settings
     
     @patch('sys.stdout')
     def test_save_selections_dry_run(self, mock_stdout):
@@ -90,22 +98,28 @@ steps:
             }
         }
         
-        # File that would be created
-        settings_dir = os.path.expanduser('~/.config/immutablue')
-        settings_file = os.path.join(settings_dir, 'settings.yaml')
-        
-        # Check if file exists before test
-        if os.path.exists(settings_file):
-            old_mtime = os.path.getmtime(settings_file)
-        else:
-            old_mtime = 0
-            
         # Call save_selections with dry_run=True
         app.save_selections(dry_run=True)
         
-        # Verify that the file was not modified
-        if os.path.exists(settings_file):
-            self.assertGreaterEqual(old_mtime, os.path.getmtime(settings_file))
+        # Verify that no settings file was written
+        self.assertFalse(os.path.exists(immutablue_setup_tui.USER_SETTINGS_FILE))
+        self.assertFalse(os.path.exists(immutablue_setup_tui.SYSTEM_SETTINGS_FILE))
+    
+    def test_save_selections_as_root(self):
+        """Root saves to the system settings, which every user reads."""
+        app = immutablue_setup_tui.ImmutablueTUI()
+        app.user_selections = {'applications': {'app_firefox': True}}
+        
+        with patch.object(immutablue_setup_tui.os, 'geteuid', return_value=1000):
+            app.save_selections()
+        self.assertTrue(os.path.exists(immutablue_setup_tui.USER_SETTINGS_FILE))
+        self.assertFalse(os.path.exists(immutablue_setup_tui.SYSTEM_SETTINGS_FILE))
+        
+        with patch.object(immutablue_setup_tui.os, 'geteuid', return_value=0):
+            app.save_selections()
+        with open(immutablue_setup_tui.SYSTEM_SETTINGS_FILE) as f:
+            settings = immutablue_setup_tui.yaml.safe_load(f)
+        self.assertTrue(settings['immutablue']['setup']['install_flatpaks'])
     
     @patch('sys.stdout')
     def test_mark_setup_complete_dry_run(self, mock_stdout):
@@ -172,6 +186,232 @@ steps:
         self.assertIn("Running in DRY RUN mode", output)
         self.assertIn("Configuration will be loaded", output)
 
+    def test_detection_reports_results(self):
+        """Detection results replace their placeholders and fill the selections."""
+        probes = {'network_setup': (('hostname', 'Hostname', lambda: ("testhost", ["Hostname: testhost"])),)}
+        app = immutablue_setup_tui.ImmutablueTUI()
+        reports = []
+        with patch.object(immutablue_setup_tui.detect, 'PROBES', probes):
+            app._do_network_setup(reports.append)
+        
+        self.assertEqual(reports, [["Detecting Hostname..."], ["Hostname: testhost"]])
+        self.assertEqual(app.user_selections['network'], {'hostname': 'testhost', 'internet': False})
+    
+    @patch.object(immutablue_setup_tui.curses, 'doupdate')
+    def test_renderer_redraws_changed_rows(self, mock_doupdate):
+        """Only rows that differ from the last render are written."""
+        screen = MagicMock()
+        screen.getmaxyx.return_value = (5, 40)
+        renderer = immutablue_setup_tui.Renderer(screen)
+        renderer.render([("title", 0, 2), None, ("one", 0, 5)])
+        self.assertEqual(screen.move.call_count, 2)
+        
+        screen.reset_mock()
+        renderer.render([("title", 0, 2), None, ("two", 0, 5)])
+        screen.move.assert_called_once_with(2, 0)
+        screen.addnstr.assert_called_once_with(2, 5, "two", 34, 0)
+        screen.noutrefresh.assert_called_once()
+        self.assertEqual(mock_doupdate.call_count, 2)
+    
+    def test_wrap_is_cached_per_width(self):
+        """Wrapped paragraphs are reused until the width changes."""
+        text = "a paragraph long enough to wrap " * 4
+        self.assertIs(immutablue_setup_tui.wrap(text, 30), immutablue_setup_tui.wrap(text, 30))
+        self.assertNotEqual(immutablue_setup_tui.wrap(text, 30), immutablue_setup_tui.wrap(text, 60))
+    
+    def test_background_action(self):
+        """Actions run in a thread, report progress and never raise into the loop."""
+        release = threading.Event()
+        
+        def work(report):
+            report(["started"])
+            release.wait(5)
+            raise OSError("gone")
+        
+        action = immutablue_setup_tui.BackgroundAction(work).start()
+        self.assertTrue(action.changed.wait(5))
+        self.assertFalse(action.done())
+        release.set()
+        action._thread.join(5)
+        self.assertTrue(action.done())
+        self.assertEqual(action.lines, ["started", "Action failed: gone"])
+    
+    @patch.object(immutablue_setup_tui.curses, 'doupdate')
+    @patch.object(immutablue_setup_tui.curses, 'update_lines_cols', create=True)
+    def test_options_step_keys(self, mock_update, mock_doupdate):
+        """Keys move and toggle without repainting the whole screen, resize repaints."""
+        step = {'id': 'apps', 'title': 'Apps', 'description': 'Pick apps.', 'type': 'options',
+                'options': [{'id': 'a', 'label': 'A', 'default': True}, {'id': 'b', 'label': 'B'}]}
+        app = immutablue_setup_tui.ImmutablueTUI()
+        app.screen = MagicMock()
+        app.screen.getmaxyx.return_value = (24, 80)
+        app.renderer = immutablue_setup_tui.Renderer(app.screen)
+        app.max_y, app.max_x = 24, 80
+        curses = immutablue_setup_tui.curses
+        
+        writes = []
+        app.screen.getch.side_effect = [-1, curses.KEY_DOWN, ord(' '), curses.KEY_RESIZE, 10]
+        app.screen.move.side_effect = lambda y, x: writes.append(y)
+        app._show_options_step(step)
+        
+        self.assertEqual(app.user_selections['apps'], {'a': True, 'b': True})
+        # Title, description, blank, options and footer; then only the rows
+        # that changed; then everything again after the resize
+        painted = [2, 4, 5, 6, 7, 21]
+        self.assertEqual(writes, painted + [6, 7] + [7] + painted)
+        app.screen.clear.assert_called_once()
+    
+    @patch('sys.stdout')
+    def test_validate_answers(self, mock_stdout):
+        """Answer files are checked against the configured steps."""
+        setup_dir = os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/immutablue/setup')
+        app = immutablue_setup_tui.ImmutablueTUI(config_file=os.path.join(setup_dir, "first_boot_config.yaml"))
+        example = immutablue_setup_tui.load_answers(os.path.join(setup_dir, "answers.example.yaml"))
+        self.assertEqual(immutablue_setup_tui.validate_answers(app.config, example), [])
+        
+        errors = immutablue_setup_tui.validate_answers(app.config, {
+            'steps': {'nope': True, 'intro': True, 'network': 'yes',
+                      'dev_env': ['devbox_cobol'], 'applications': {'app_vlc': 'on'}},
+            'extra': 1,
+        })
+        self.assertEqual(errors, [
+            "unknown key: extra",
+            "nope: no such step (expected one of: intro, hardware, network, dev_env, applications, finish)",
+            "intro: info steps take no answer",
+            "network: expected true (run) or false (skip)",
+            "dev_env: no such option: devbox_cobol",
+            "applications.app_vlc: expected true or false",
+        ])
+        self.assertEqual(immutablue_setup_tui.validate_answers(app.config, ["a"]), ["answer file must be a mapping"])
+    
+    def unattended_app(self):
+        with open(self.config_file, "a") as f:
+            f.write("""
+  - id: "network"
+    title: "Network"
+    description: "Network"
+    type: "action"
+    action: "network_setup"
+  - id: "applications"
+    title: "Apps"
+    description: "Apps"
+    type: "options"
+    options:
+      - {id: "app_a", label: "A", default: true}
+      - {id: "app_b", label: "B"}
+            """)
+        return immutablue_setup_tui.ImmutablueTUI()
+    
+    def test_run_unattended(self):
+        """Headless runs take the answers, run actions and save like the wizard."""
+        app = self.unattended_app()
+        probes = {'network_setup': (('hostname', 'Hostname', lambda: ("testhost", ["Hostname: testhost"])),)}
+        with patch.object(immutablue_setup_tui.detect, 'PROBES', probes), \
+                patch.dict(os.environ, {'HOME': self.test_dir}):
+            result = app.run_unattended({'steps': {'applications': ['app_b']}})
+        
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual([(step['id'], step['status']) for step in result['steps']],
+                         [("test_step", "ok"), ("network", "ok"), ("applications", "ok")])
+        self.assertEqual(result['steps'][1]['lines'], ["Hostname: testhost"])
+        self.assertEqual(result['selections']['applications'], {'app_a': False, 'app_b': True})
+        self.assertTrue(os.path.exists(immutablue_setup_tui.COMPLETED_FLAG))
+        # The first-boot service runs as root, every user's first login reads these
+        self.assertEqual(immutablue_setup_tui.SYSTEM_SETTINGS_FILE, os.path.join(self.test_dir, "etc/settings.yaml"))
+        self.assertFalse(os.path.exists(immutablue_setup_tui.USER_SETTINGS_FILE))
+        with open(immutablue_setup_tui.SYSTEM_SETTINGS_FILE) as f:
+            settings = immutablue_setup_tui.yaml.safe_load(f)
+        self.assertTrue(settings['immutablue']['setup']['install_flatpaks'])
+        self.assertEqual(settings['immutablue']['setup']['selections']['network'],
+                         {'hostname': 'testhost', 'internet': False})
+    
+    def test_run_unattended_failure(self):
+        """A failed action leaves setup incomplete so the next boot retries."""
+        app = self.unattended_app()
+        
+        def broken(report):
+            raise OSError("no network")
+        
+        with patch.object(app, '_action_handler', return_value=broken), \
+                patch.dict(os.environ, {'HOME': self.test_dir}):
+            result = app.run_unattended({'steps': {}})
+            self.assertEqual(result['status'], 'failed')
+            self.assertEqual(result['steps'][1]['lines'], ["Action failed: no network"])
+            self.assertFalse(os.path.exists(immutablue_setup_tui.COMPLETED_FLAG))
+            
+            # Skipped actions do not run at all
+            self.assertEqual(app.run_unattended({'steps': {'network': False}})['steps'][1]['status'], 'skipped')
+    
+    def test_run_unattended_tuning_failure(self):
+        """A probe or tuning error fails the action even though nothing raised."""
+        with open(self.config_file, "a") as f:
+            f.write("""
+  - id: "hardware"
+    title: "Hardware"
+    description: "Hardware"
+    type: "action"
+    action: "hardware_detection"
+            """)
+        app = immutablue_setup_tui.ImmutablueTUI()
+        probes = {'hardware_detection': (('cpu', 'CPU', lambda: ("x86", ["CPU: x86"])),)}
+        tuning = MagicMock(returncode=1, stdout="", stderr="Error: no inventory\n")
+        with patch.object(immutablue_setup_tui.detect, 'PROBES', probes), \
+                patch.object(immutablue_setup_tui.detect, 'save_inventory', return_value=None), \
+                patch.object(immutablue_setup_tui.detect.subprocess, 'run', return_value=tuning), \
+                patch.dict(os.environ, {'HOME': self.test_dir}):
+            result = app.run_unattended({'steps': {}})
+        
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['steps'][1]['status'], 'failed')
+        self.assertEqual(result['steps'][1]['errors'], {'tuning': "Error: no inventory"})
+        self.assertIn("CPU: x86", result['steps'][1]['lines'])
+        self.assertFalse(os.path.exists(immutablue_setup_tui.COMPLETED_FLAG))
+        self.assertFalse(os.path.exists(immutablue_setup_tui.SYSTEM_SETTINGS_FILE))
+    
+    def test_unattended_command_line(self):
+        """--unattended prints a JSON result and exits 2 on an invalid answer file."""
+        self.unattended_app()
+        answers = os.path.join(self.test_dir, "answers.yaml")
+        script = os.path.join(os.path.dirname(__file__), '../../artifacts/overrides/usr/libexec/immutablue/setup/immutablue_setup_tui.py')
+        command = [sys.executable, script, '--unattended', '--dry-run', '--force', '--config', self.config_file,
+                   '--answers', answers]
+        
+        with open(answers, "w") as f:
+            f.write("steps:\n  applications: [app_c]\n")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        self.assertEqual(completed.returncode, immutablue_setup_tui.EXIT_INVALID)
+        self.assertEqual(json.loads(completed.stdout)['errors'], ["applications: no such option: app_c"])
+        
+        with open(answers, "w") as f:
+            f.write("steps:\n  applications: [app_b]\n")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        result = json.loads(completed.stdout)
+        self.assertEqual([step['status'] for step in result['steps']], ["ok", "would run", "ok"])
+        self.assertIn("[DRY RUN] Would save settings", completed.stderr)
+    
+    @patch.object(immutablue_setup_tui.curses, 'doupdate')
+    def test_reboot_waits_for_jobs(self, mock_doupdate):
+        """The completion waits for the background installs and shows their progress."""
+        app = immutablue_setup_tui.ImmutablueTUI()
+        app.screen = MagicMock()
+        app.screen.getmaxyx.return_value = (24, 80)
+        app.screen.getch.return_value = 10
+        app.renderer = immutablue_setup_tui.Renderer(app.screen)
+        app.max_y, app.max_x = 24, 80
+        
+        fake_jobs = (('flatpak', 'Flatpaks', 'install_flatpaks', ('sh', '-c', 'echo step one; sleep 0.3')),)
+        with patch.object(immutablue_setup_tui.jobs, 'JOBS', fake_jobs), \
+                patch.object(immutablue_setup_tui.jobs, 'STATE_FILE', os.path.join(self.test_dir, "jobs.json")), \
+                patch.object(immutablue_setup_tui.jobs, 'LOG_DIR', os.path.join(self.test_dir, "logs")):
+            app.jobs = immutablue_setup_tui.jobs.JobQueue(on_update=lambda job: app.jobs_changed.set())
+            app.jobs.submit_selected({'applications': {'app_firefox': True}})
+            # Enter does not skip the wait, only the installs finishing ends it
+            app._wait_for_jobs()
+        
+        self.assertEqual([job['state'] for job in app.jobs.jobs()], ["done"])
+        drawn = [c.args[2] for c in app.screen.addnstr.call_args_list]
+        self.assertIn("Flatpaks: running - step one", drawn)
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
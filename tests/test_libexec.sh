@@ -0,0 +1,47 @@
+#!/bin/bash
+# test_libexec.sh
+#
+# Run unit tests for the python helpers shipped under /usr/libexec/immutablue
+# (and /usr/libexec/kuberblue)
+set -euo pipefail
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+PROJECT_ROOT="$(dirname "$SCRIPT_DIR")"
+
+print_header() {
+    echo -e "\n==========================================="
+    echo "  $1"
+    echo -e "===========================================\n"
+}
+
+# Main function to run all tests
+main() {
+    local failed=0
+    local test_file
+
+    # Ensure Python dependencies are available
+    if ! python3 -c "import yaml" &>/dev/null; then
+        echo "SKIP: Python yaml module not found (install with: pip install pyyaml)"
+        return 0
+    fi
+
+    for test_file in "${SCRIPT_DIR}"/libexec/test_*.py
+    do
+        print_header "Running $(basename "${test_file}")"
+        if ! python3 "${test_file}" -v; then
+            echo "$(basename "${test_file}") failed"
+            failed=1
+        fi
+    done
+
+    if [ $failed -eq 0 ]; then
+        print_header "All libexec tests passed!"
+        return 0
+    else
+        print_header "Some libexec tests failed"
+        return 1
+    fi
+}
+
+# Run main function
+main "$@"
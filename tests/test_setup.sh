@@ -20,6 +20,20 @@ run_tui_tests() {
     return $?
 }
 
+# Run tests for the shared detection engine
+run_detect_tests() {
+    print_header "Running Setup Detection Tests"
+    python3 "${SCRIPT_DIR}/setup/test_immutablue_setup_detect.py" -v
+    return $?
+}
+
+# Run tests for the background install queue
+run_jobs_tests() {
+    print_header "Running Setup Jobs Tests"
+    python3 "${SCRIPT_DIR}/setup/test_immutablue_setup_jobs.py" -v
+    return $?
+}
+
 # Run tests for GUI setup
 run_gui_tests() {
     print_header "Running GUI Setup Tests"
@@ -43,6 +57,18 @@ main() {
         failed=1
     fi
     
+    # Run detection tests
+    if ! run_detect_tests; then
+        echo "Detection tests failed"
+        failed=1
+    fi
+    
+    # Run job queue tests
+    if ! run_jobs_tests; then
+        echo "Jobs tests failed"
+        failed=1
+    fi
+    
     # Run GUI tests
     if ! run_gui_tests; then
         echo "GUI tests failed"